@@ -0,0 +1,4 @@
+"""
+AWS Advanced Networking Lab - Python tooling
+Topology model and helpers shared by the diagram generators and lab tools
+"""
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Flow Path Annotation
+Tags every record of a flow-log store with its source and destination VPC
+and subnet and the route it took, e.g. subnet-shared-private-0 >
+rtb-shared-private > tgw-rtb-core > tgw-attach-app > App VPC. Addresses are
+located with sorted range lookups over whole columns (subnets and VPC CIDRs;
+VPN prefixes, which may nest, by longest prefix), and each record gets a
+"place" code. A
+path is resolved once per (source place, destination place) pair through
+the reachability route indexes and memoised in a dense table, so after the
+first chunk annotation is pure array indexing. Results are written next to
+the store as extra memory-mapped columns.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from advnet.reachability import (NOT_ATTACHED, PrefixIndex, Reachability, TARGET_BLACKHOLE, TARGET_IGW, TARGET_LOCAL,
+                                 TARGET_TGW)
+from advnet.topology import cidr_range, int_to_ip
+
+# Bump whenever the annotation columns or path format change
+ANNOTATION_VERSION = 2
+
+# Records annotated per step
+CHUNK_ROWS = 4 << 20
+
+# Annotation columns and their dtypes; codes index the names in meta.json
+ANNOTATION_COLUMNS = {
+    'src_vpc': np.int16,
+    'dst_vpc': np.int16,
+    'src_subnet': np.int32,
+    'dst_subnet': np.int32,
+    'route': np.int32,
+}
+
+# Dense (src place, dst place) memo tables up to this many cells
+DENSE_LIMIT = 1 << 24
+
+# Any public address stands in for "external" so default routes are exercised
+EXTERNAL_ADDRESS = 0x08080808
+
+
+class RangeIndex:
+    """Sorted, non-overlapping address ranges; lookup() returns the index of
+    the range holding each address, or -1"""
+
+    def __init__(self, cidrs):
+        ranges = sorted((cidr_range(cidr) + (n,) for n, cidr in enumerate(cidrs)))
+        self.low = np.array([r[0] for r in ranges], dtype=np.int64)
+        self.high = np.array([r[1] for r in ranges], dtype=np.int64)
+        self.values = np.array([r[2] for r in ranges] + [-1], dtype=np.int64)
+
+    def lookup(self, addresses):
+        if not len(self.low):
+            return np.full(len(addresses), -1, dtype=np.int64)
+        slot = np.searchsorted(self.low, addresses, side='right') - 1
+        inside = (slot >= 0) & (addresses <= self.high[np.maximum(slot, 0)])
+        return self.values[np.where(inside, slot, -1)]
+
+
+class Annotator:
+    """Places and memoised routes for one topology"""
+
+    def __init__(self, topology, vpn_routes=None):
+        self.topology = topology
+        self.routing = Reachability(topology, (), vpn_routes, evaluate=False)
+        self.vpcs = list(topology.vpcs)
+        self.subnets = [(vpc, subnet) for vpc in self.vpcs for subnet in vpc.subnets]
+        self.sites = [(vpn, cidr) for vpn in topology.vpn_connections
+                      for cidr in list(vpn.routes) + list((vpn_routes or {}).get(vpn.id, []))]
+
+        # Places: every subnet, then every VPC (addresses outside its
+        # subnets), then every VPN prefix, then "external"
+        self.subnet_index = RangeIndex([subnet.cidr for _, subnet in self.subnets])
+        self.vpc_index = RangeIndex([vpc.cidr for vpc in self.vpcs])
+        self.site_index = PrefixIndex([cidr for _, cidr in self.sites])
+        self.places = ([('subnet', vpc, subnet) for vpc, subnet in self.subnets] +
+                       [('vpc', vpc, None) for vpc in self.vpcs] +
+                       [('vpn', vpn, cidr) for vpn, cidr in self.sites] +
+                       [('external', None, None)])
+        count = len(self.places)
+        vpc_code = {vpc.id: n for n, vpc in enumerate(self.vpcs)}
+        self.place_vpc = np.array([vpc_code[p[1].id] if p[0] in ('subnet', 'vpc') else -1
+                                   for p in self.places], dtype=np.int16)
+        self.place_subnet = np.array(list(range(len(self.subnets))) + [-1] * (count - len(self.subnets)),
+                                     dtype=np.int32)
+        self.labels = [self._label(place) for place in range(count)]
+        # Address a place's traffic is routed as
+        self.place_low = np.array([cidr_range(self._cidr(place))[0] for place in range(count - 1)] +
+                                  [EXTERNAL_ADDRESS], dtype=np.int64)
+        # Places sharing a route table share an origin
+        origin_code = {}
+        self.place_origin = np.array([origin_code.setdefault(self._origin(place), len(origin_code))
+                                      for place in range(count)], dtype=np.int64)
+        self.origin_of = list(origin_code)
+
+        self.routes = []
+        self._route_codes = {}
+        self._dense = np.full(count * count, -1, dtype=np.int32) if count * count <= DENSE_LIMIT else None
+        self._sparse = {}
+
+    # --- Places ---
+
+    def locate(self, addresses):
+        """Place code of each address"""
+        addresses = np.asarray(addresses, dtype=np.int64)
+        subnets = len(self.subnets)
+        place = self.subnet_index.lookup(addresses)
+        rest = place < 0
+        if rest.any():
+            vpc = self.vpc_index.lookup(addresses[rest])
+            site = self.site_index.lookup(addresses[rest])
+            place[rest] = np.where(vpc >= 0, subnets + vpc,
+                                   np.where(site >= 0, subnets + len(self.vpcs) + site, len(self.places) - 1))
+        return place
+
+    def _origin(self, place):
+        kind, owner, detail = self.places[place]
+        routing = self.routing
+        if kind == 'subnet':
+            return 'vpc', owner.id, routing.subnet_tables.get(detail.id, 'main:' + owner.id)
+        if kind == 'vpc':
+            return 'vpc', owner.id, 'main:' + owner.id
+        if kind == 'vpn':
+            return 'tgw', routing.vpn_tgw(owner.attachment_id), owner.attachment_id
+        return None
+
+    def _label(self, place):
+        kind, owner, detail = self.places[place]
+        if kind == 'subnet':
+            return detail.name or detail.id
+        if kind == 'vpc':
+            return owner.name or owner.key
+        if kind == 'vpn':
+            return '%s %s' % (owner.id, detail)
+        return 'internet'
+
+    def _cidr(self, place):
+        kind, owner, detail = self.places[place]
+        return detail.cidr if kind == 'subnet' else owner.cidr if kind == 'vpc' else detail
+
+    # --- Routes ---
+
+    def _matches(self, origin, addresses):
+        """(VPC route, TGW route) matched by each address from an origin;
+        every address sharing both takes the same path"""
+        routing = self.routing
+        kind, owner, table_id = origin
+        second = np.full(len(addresses), -1, dtype=np.int64)
+        if kind == 'tgw':
+            first = second.copy()
+            tgw_table = routing.tgw_tables.get(routing.associated.get(table_id))
+            if tgw_table is not None:
+                second = tgw_table.lookup(addresses)
+            return first, second
+        table = routing.tables[table_id]
+        first = table.lookup(addresses)
+        for match in np.unique(first[first >= 0]).tolist():
+            _, target_kind, target = table.routes[match]
+            if target_kind != TARGET_TGW:
+                continue
+            tgw_table = routing.tgw_tables.get(routing.associated.get(routing.vpc_attachment.get((target, owner))))
+            if tgw_table is not None:
+                rows = first == match
+                second[rows] = tgw_table.lookup(addresses[rows])
+        return first, second
+
+    def _hops(self, origin, address, external):
+        """Hops after the source label, and whether the route reaches the
+        destination"""
+        hops = []
+        for table_id, cidr, target, kind in self.routing.trace(origin, address):
+            if table_id is None:
+                hops.append('%s (%s)' % (target, 'not attached' if kind == NOT_ATTACHED else 'no association'))
+                return hops + ['dropped'], False
+            hops.append(table_id)
+            if cidr is None:
+                return hops + ['no route'], False
+            if kind == TARGET_LOCAL:
+                return hops + ['local'], True
+            if kind == TARGET_BLACKHOLE:
+                return hops + ['blackhole'], False
+            if kind == TARGET_IGW:
+                hops.append(target if target.startswith('igw-') else 'internet gateway')
+                return (hops, True) if external else (hops + ['dropped'], False)
+            hops.append(target)
+        return hops, True
+
+    def _inbound(self, place):
+        """Hops of traffic from the internet to a place, and whether it
+        arrives: through the VPC's internet gateway when the place's route
+        table sends replies back out through one"""
+        kind, owner, _ = self.places[place]
+        if kind not in ('subnet', 'vpc'):
+            return ['no route'], False
+        _, _, target, target_kind = self.routing.trace(self._origin(place), EXTERNAL_ADDRESS)[0]
+        if target_kind == TARGET_IGW:
+            return [target if target.startswith('igw-') else 'internet gateway'], True
+        if owner.internet_gateway_id:
+            return [owner.internet_gateway_id, 'dropped'], False
+        return ['no route'], False
+
+    def resolve(self, src, dst):
+        """Routes, as strings, for arrays of source and destination places;
+        addresses are matched against route tables in bulk per origin and
+        each distinct match is traced once"""
+        external = len(self.places) - 1
+        routes = [None] * len(src)
+        origins = self.place_origin[src]
+        order = np.argsort(origins, kind='stable')
+        bounds = np.flatnonzero(np.diff(origins[order])) + 1
+        for rows in np.split(order, bounds):
+            origin = self.origin_of[origins[rows[0]]]
+            if origin is None:
+                for row in rows.tolist():
+                    tail, arrived = self._inbound(dst[row])
+                    route = [self.labels[src[row]]] + tail
+                    routes[row] = ' > '.join(route + [self.labels[dst[row]]] if arrived else route)
+                continue
+            addresses = self.place_low[dst[rows]]
+            first, second = self._matches(origin, addresses)
+            keys = (first * (second.max() + 2) + second + 1) * 2 + (dst[rows] == external)
+            _, index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            hops = [self._hops(origin, addresses[i], dst[rows[i]] == external) for i in index.tolist()]
+            for row, n in zip(rows.tolist(), inverse.ravel().tolist()):
+                tail, arrived = hops[n]
+                route = [self.labels[src[row]]] + tail
+                routes[row] = ' > '.join(route + [self.labels[dst[row]]] if arrived else route)
+        return routes
+
+    def _code(self, route):
+        if route not in self._route_codes:
+            self._route_codes[route] = len(self.routes)
+            self.routes.append(route)
+        return self._route_codes[route]
+
+    def route_codes(self, src_place, dst_place):
+        """Route code for each (source, destination) place pair, resolving
+        only pairs never seen before"""
+        count = len(self.places)
+        keys = src_place.astype(np.int64) * count + dst_place
+        if self._dense is not None:
+            codes = self._dense[keys]
+            unseen = np.unique(keys[codes < 0])
+            if not len(unseen):
+                return codes
+            src, dst = np.divmod(unseen, count)
+            self._dense[unseen] = [self._code(route) for route in self.resolve(src, dst)]
+            return self._dense[keys]
+        unique, inverse = np.unique(keys, return_inverse=True)
+        unseen = np.array([key for key in unique.tolist() if key not in self._sparse], dtype=np.int64)
+        if len(unseen):
+            src, dst = np.divmod(unseen, count)
+            for key, route in zip(unseen.tolist(), self.resolve(src, dst)):
+                self._sparse[key] = self._code(route)
+        table = np.array([self._sparse[key] for key in unique.tolist()], dtype=np.int32)
+        return table[inverse.ravel()]
+
+    def annotate(self, srcaddr, dstaddr):
+        """Annotation columns for arrays of source and destination addresses"""
+        src, dst = self.locate(srcaddr), self.locate(dstaddr)
+        return {
+            'src_vpc': self.place_vpc[src],
+            'dst_vpc': self.place_vpc[dst],
+            'src_subnet': self.place_subnet[src],
+            'dst_subnet': self.place_subnet[dst],
+            'route': self.route_codes(src, dst),
+        }
+
+    def names(self):
+        return {
+            'vpcs': [vpc.name or vpc.key for vpc in self.vpcs],
+            'subnets': [subnet.name or subnet.id for _, subnet in self.subnets],
+        }
+
+
+def topology_key(topology, vpn_routes=None):
+    digest = hashlib.sha256(b'advnet-annotation-%d' % ANNOTATION_VERSION)
+    digest.update(repr(topology).encode())
+    digest.update(json.dumps(vpn_routes or {}, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+class Annotations:
+    """Memory-mapped annotation columns of a flow-log store"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as handle:
+            self.meta = json.load(handle)
+        self.rows = self.meta['rows']
+        self.routes = self.meta['routes']
+        self.vpcs = self.meta['vpcs']
+        self.subnets = self.meta['subnets']
+        self._columns = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in ANNOTATION_COLUMNS:
+            raise AttributeError(name)
+        return self.column(name)
+
+    def column(self, name):
+        if name not in self._columns:
+            if self.rows:
+                self._columns[name] = np.memmap(os.path.join(self.path, name + '.bin'),
+                                                dtype=ANNOTATION_COLUMNS[name], mode='r', shape=(self.rows,))
+            else:
+                self._columns[name] = np.zeros(0, dtype=ANNOTATION_COLUMNS[name])
+        return self._columns[name]
+
+    def vpc_name(self, code):
+        return self.vpcs[code] if code >= 0 else 'external'
+
+    def subnet_name(self, code):
+        return self.subnets[code] if code >= 0 else '-'
+
+
+def annotate_store(store, topology, vpn_routes=None, use_cache=True, chunk_rows=CHUNK_ROWS):
+    """Annotate every record of a FlowLogStore, reusing earlier results for
+    the same topology"""
+    target = os.path.join(store.path, 'annotations-%s' % topology_key(topology, vpn_routes))
+    if use_cache and os.path.exists(os.path.join(target, 'meta.json')):
+        return Annotations(target)
+
+    annotator = Annotator(topology, vpn_routes)
+    work = tempfile.mkdtemp(prefix='annotations-', dir=store.path)
+    try:
+        handles = {name: open(os.path.join(work, name + '.bin'), 'wb') for name in ANNOTATION_COLUMNS}
+        try:
+            for start in range(0, len(store), chunk_rows):
+                end = min(start + chunk_rows, len(store))
+                columns = annotator.annotate(store.srcaddr[start:end], store.dstaddr[start:end])
+                for name, handle in handles.items():
+                    handle.write(np.ascontiguousarray(columns[name], dtype=ANNOTATION_COLUMNS[name]).tobytes())
+        finally:
+            for handle in handles.values():
+                handle.close()
+        meta = dict(annotator.names(), version=ANNOTATION_VERSION, rows=len(store), routes=annotator.routes)
+        with open(os.path.join(work, 'meta.json'), 'w') as handle:
+            json.dump(meta, handle, indent=2)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(work, target)
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    return Annotations(target)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from advnet.flowlogs import ingest
+    from advnet.topology import add_source_arguments, add_vpn_route_argument, topology_from_args, vpn_routes_from_args
+
+    parser = argparse.ArgumentParser(description='Tag flow-log records with VPCs, subnets and route paths')
+    parser.add_argument('files', nargs='+', metavar='FLOW_LOG',
+                        help='flow-log exports (v2 default format, optionally gzipped)')
+    add_source_arguments(parser, positional=False)
+    add_vpn_route_argument(parser)
+    parser.add_argument('--reannotate', action='store_true', help='ignore existing annotations')
+    parser.add_argument('--top', type=int, default=10, help='routes to list (default: %(default)s)')
+    parser.add_argument('--sample', type=int, default=0, help='print this many annotated records')
+    args = parser.parse_args()
+
+    topology = topology_from_args(args)
+    vpn_routes = vpn_routes_from_args(parser, args, topology)
+
+    store = ingest(args.files, args.cache_dir)
+    start = time.perf_counter()
+    notes = annotate_store(store, topology, vpn_routes, use_cache=not args.reannotate)
+    elapsed = time.perf_counter() - start
+    print("%d records annotated in %.2fs (%s)" % (len(notes), elapsed, notes.path), file=sys.stderr)
+
+    totals = np.bincount(notes.route, weights=np.asarray(store.bytes, dtype=np.float64),
+                         minlength=len(notes.routes)) if len(notes) else np.zeros(0)
+    records = np.bincount(notes.route, minlength=len(notes.routes)) if len(notes) else np.zeros(0)
+    print("Top routes by bytes:")
+    for code in np.argsort(totals)[::-1][:args.top]:
+        print("  %14d bytes %9d records  %s" % (totals[code], records[code], notes.routes[code]))
+    for i in range(min(args.sample, len(notes))):
+        print("%s -> %s  [%s/%s -> %s/%s]  %s" % (
+            int_to_ip(store.srcaddr[i]), int_to_ip(store.dstaddr[i]),
+            notes.vpc_name(notes.src_vpc[i]), notes.subnet_name(notes.src_subnet[i]),
+            notes.vpc_name(notes.dst_vpc[i]), notes.subnet_name(notes.dst_subnet[i]),
+            notes.routes[notes.route[i]]))
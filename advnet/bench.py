@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Diagram Benchmarks
+Generates seeded synthetic estates of any size (VPCs, subnets per AZ,
+interface endpoints, TGW and VPN attachments) and times the diagram
+pipeline on them: layout, drawing, and every export format, for both
+diagram styles. Each case runs in a fresh process so peak RSS is its own.
+Reports are JSON and can be compared against a baseline to catch
+regressions in review.
+"""
+
+import ipaddress
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from advnet.export import STYLES, load_generator, use_agg
+from advnet.profiling import artist_counts
+from advnet.topology import (Endpoint, Instance, Route, RouteTable, SecurityGroup, SecurityGroupRule,
+                             Subnet, TgwAttachment, TgwRouteTable, Topology, TransitGateway, Vpc,
+                             VpnConnection, cidrsubnet)
+
+# Bump whenever the report layout or the synthetic generator changes
+BENCH_VERSION = 1
+
+DEFAULT_SCALES = (3, 30, 300, 3000)
+DEFAULT_FORMATS = ('png', 'svg', 'pdf')
+
+# Agg cannot allocate canvases past 2**16 pixels a side; raster exports of
+# huge estates are scaled down to this and the effective dpi is reported
+MAX_PIXELS = 16384
+
+# Interface endpoint services handed out to synthetic VPCs
+SERVICES = ('ssm', 'ssmmessages', 'ec2messages', 's3', 'logs', 'kms', 'sts', 'ecr.api',
+            'ecr.dkr', 'secretsmanager', 'monitoring', 'sqs')
+
+# Relative slowdown, and absolute floor in seconds / MB, before a change
+# counts as a regression
+DEFAULT_THRESHOLD = 0.2
+TIME_FLOOR = 0.1
+RSS_FLOOR = 16.0
+
+# Runs per case; the best of a few keeps one slow run (a busy machine, a
+# cold disk cache) from reading as a regression
+DEFAULT_REPEAT = 3
+
+
+# --- Synthetic topologies ---
+
+def synthetic_topology(vpcs=3, subnets_per_az=1, azs=2, endpoints=3, vpns=1, seed=0,
+                       region='us-east-1'):
+    """A hub-and-spoke estate shaped like the lab: every VPC attached to one
+    Transit Gateway, public and private subnets per AZ, interface endpoints
+    and instances, plus VPN attachments with static on-premises routes.
+    The same arguments always produce the same topology."""
+    rng = random.Random(seed)
+
+    def hex_id(prefix):
+        return '%s-%017x' % (prefix, rng.getrandbits(68))
+
+    topo = Topology(region=region, project='bench-%d' % vpcs,
+                    flow_log_group='/aws/vpc/flow-logs/bench-%d' % vpcs)
+    tgw = TransitGateway(id=hex_id('tgw'), name='bench-tgw')
+    core = TgwRouteTable(id=hex_id('tgw-rtb'), name='tgw-core-rt')
+    tgw.route_tables.append(core)
+    zones = [region + chr(ord('a') + n) for n in range(azs)]
+    on_prem = ['192.168.%d.0/24' % (n % 256) for n in range(vpns)]
+
+    # /16 per VPC while 10.0.0.0/8 has room, smaller blocks past that
+    prefix = 16 if vpcs <= 256 else 8 + max(8, math.ceil(math.log2(vpcs)))
+    per_vpc = 2 * azs * subnets_per_az
+    newbits = max(24 - prefix, math.ceil(math.log2(max(per_vpc, 1))))
+    if prefix + newbits > 28:
+        raise ValueError('%d VPCs with %d subnets each do not fit in 10.0.0.0/8' % (vpcs, per_vpc))
+
+    for i in range(vpcs):
+        cidr = str(ipaddress.ip_network(((10 << 24) + (i << (32 - prefix)), prefix)))
+        vpc = Vpc(id=hex_id('vpc'), key='spoke%d' % i, name='Spoke %d VPC' % i, cidr=cidr,
+                  internet_gateway_id=hex_id('igw'))
+        public_rt = RouteTable(hex_id('rtb'), vpc.id, 'spoke%d-public' % i,
+                               [Route(cidr, 'local', 'local'),
+                                Route('0.0.0.0/0', 'gateway', vpc.internet_gateway_id)])
+        private_rt = RouteTable(hex_id('rtb'), vpc.id, 'spoke%d-private' % i,
+                                [Route(cidr, 'local', 'local'),
+                                 Route('10.0.0.0/8', 'transit_gateway', tgw.id)] +
+                                [Route(site, 'transit_gateway', tgw.id) for site in on_prem])
+        netnum = 0
+        for tier, table in (('public', public_rt), ('private', private_rt)):
+            for zone in zones:
+                for _ in range(subnets_per_az):
+                    subnet = Subnet(hex_id('subnet'), vpc.id, cidrsubnet(cidr, newbits, netnum), zone, tier,
+                                    'spoke%d-%s-%s' % (i, tier, zone[-1]), table.id)
+                    table.subnet_ids.append(subnet.id)
+                    vpc.subnets.append(subnet)
+                    netnum += 1
+        vpc.route_tables = [public_rt, private_rt]
+        group = SecurityGroup(hex_id('sg'), vpc.id, 'spoke%d-sg' % i, [
+            SecurityGroupRule('ingress', 'icmp', -1, -1, ['10.0.0.0/8']),
+            SecurityGroupRule('ingress', 'tcp', 443, 443, [cidr], description='HTTPS'),
+            SecurityGroupRule('egress', '-1', 0, 65535, ['0.0.0.0/0'])])
+        vpc.security_groups.append(group)
+
+        private = vpc.subnets_in('private')
+        for n in range(rng.randint(0, 2)):
+            subnet = private[n % len(private)] if private else None
+            address = ipaddress.ip_network(subnet.cidr)[10 + n] if subnet else None
+            vpc.instances.append(Instance(hex_id('i'), 'app%d' % n, 'App %d' % n,
+                                          subnet.id if subnet else None, str(address) if address else None,
+                                          security_group_ids=[group.id]))
+        for service in rng.sample(SERVICES, min(endpoints, len(SERVICES))):
+            vpc.endpoints.append(Endpoint(hex_id('vpce'), vpc.id, 'com.amazonaws.%s.%s' % (region, service)))
+        topo.vpcs.append(vpc)
+
+        # One attachment subnet per AZ, as the lab does
+        attachment = TgwAttachment(hex_id('tgw-attach'), 'vpc', vpc.id, 'spoke%d-attach' % i,
+                                   [s.id for s in private[::subnets_per_az]])
+        tgw.attachments.append(attachment)
+        core.associations.append(attachment.id)
+        core.propagations.append(attachment.id)
+
+    for n, site in enumerate(on_prem):
+        vpn = VpnConnection(hex_id('vpn'), tgw.id, hex_id('tgw-attach'), hex_id('cgw'),
+                            '203.0.113.%d' % (n % 254 + 1), static_routes_only=True, routes=[site])
+        tgw.attachments.append(TgwAttachment(vpn.attachment_id, 'vpn', vpn.id, 'vpn%d-attach' % n))
+        core.associations.append(vpn.attachment_id)
+        core.propagations.append(vpn.attachment_id)
+        topo.vpn_connections.append(vpn)
+    topo.transit_gateways.append(tgw)
+    return topo
+
+
+# --- Measurement ---
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def _phase(start):
+    return {'seconds': round(time.perf_counter() - start, 4), 'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+
+def run_case(style, vpcs, params, formats, layout='auto', batched=None, dpi=100):
+    """Benchmark one style at one scale; runs inside a fresh worker process"""
+    use_agg()
+    import matplotlib.pyplot as plt
+    from advnet.layout import compute_layout
+
+    phases = {'baseline': {'seconds': 0.0, 'peak_rss_mb': round(peak_rss_mb(), 1)}}
+    start = time.perf_counter()
+    topology = synthetic_topology(vpcs, **params)
+    phases['generate'] = _phase(start)
+    generator = load_generator(style)
+
+    start = time.perf_counter()
+    diagram = compute_layout(topology, style, layout)
+    phases['layout'] = dict(_phase(start), mode=diagram.mode)
+
+    # The generators lay out again themselves; drawing time includes it
+    start = time.perf_counter()
+    fig = generator(topology, layout, batched)
+    phases['draw'] = _phase(start)
+    phases['draw']['artists'], phases['draw']['items'] = artist_counts(fig)
+
+    width, height = fig.get_size_inches()
+    with tempfile.TemporaryDirectory(prefix='advnet-bench-') as scratch:
+        for fmt in formats:
+            save = dict(format=fmt, bbox_inches='tight', facecolor='white', edgecolor='none')
+            if fmt in ('png', 'jpg', 'jpeg', 'tif', 'tiff', 'webp'):
+                save['dpi'] = min(dpi, MAX_PIXELS / max(width, height))
+            path = os.path.join(scratch, 'diagram.' + fmt)
+            start = time.perf_counter()
+            fig.savefig(path, **save)
+            phases[fmt] = dict(_phase(start), bytes=os.path.getsize(path))
+            if 'dpi' in save:
+                phases[fmt]['dpi'] = round(save['dpi'], 2)
+    plt.close(fig)
+    return {'style': style, 'vpcs': vpcs, 'size_inches': [round(width, 2), round(height, 2)],
+            'phases': phases}
+
+
+def _merge(best, case):
+    """Keep the fastest time and the highest RSS of repeated runs"""
+    if best is None:
+        return case
+    for name, phase in case['phases'].items():
+        kept = best['phases'][name]
+        kept['seconds'] = min(kept['seconds'], phase['seconds'])
+        kept['peak_rss_mb'] = max(kept['peak_rss_mb'], phase['peak_rss_mb'])
+    return best
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, styles=tuple(STYLES), formats=DEFAULT_FORMATS,
+                   params=None, layout='auto', batched=None, dpi=100, repeat=DEFAULT_REPEAT, progress=None):
+    """Run every style x scale, each in its own process, and return the report"""
+    import matplotlib
+    import numpy as np
+
+    params = dict(params or {})
+    cases = []
+    for vpcs in scales:
+        for style in styles:
+            best = None
+            for _ in range(repeat):
+                # A fresh process per run keeps RSS and import state independent
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    case = pool.submit(run_case, style, vpcs, params, list(formats),
+                                       layout, batched, dpi).result()
+                best = _merge(best, case)
+            cases.append(best)
+            if progress:
+                progress(best)
+    return {
+        'version': BENCH_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': {'python': platform.python_version(), 'matplotlib': matplotlib.__version__,
+                        'numpy': np.__version__, 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'options': {'params': params, 'layout': layout, 'batched': batched, 'dpi': dpi,
+                    'formats': list(formats), 'repeat': repeat},
+        'cases': cases,
+    }
+
+
+# --- Comparison ---
+
+def compare_reports(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Rows of (case, phase, metric, before, after, regressed) for every
+    measurement present in both reports"""
+    before = {(c['style'], c['vpcs']): c for c in baseline.get('cases', [])}
+    rows = []
+    for case in current['cases']:
+        old = before.get((case['style'], case['vpcs']))
+        if old is None:
+            continue
+        for name, phase in case['phases'].items():
+            if name == 'baseline' or name not in old['phases']:
+                continue
+            for metric, floor in (('seconds', TIME_FLOOR), ('peak_rss_mb', RSS_FLOOR),
+                                  ('artists', 0), ('items', 0)):
+                if metric not in phase or metric not in old['phases'][name]:
+                    continue
+                a, b = old['phases'][name][metric], phase[metric]
+                regressed = b > a * (1 + threshold) and b - a > floor
+                rows.append(('%s/%d' % (case['style'], case['vpcs']), name, metric, a, b, regressed))
+    return rows
+
+
+def _print_case(case):
+    phases = case['phases']
+    timings = '  '.join('%s %.2fs' % (name, phase['seconds']) for name, phase in phases.items()
+                        if name != 'baseline')
+    print("%-12s %5d VPCs  %s  artists %d/%d  peak %.0f MB" % (
+        case['style'], case['vpcs'], timings, phases['draw']['artists'], phases['draw']['items'],
+        max(phase['peak_rss_mb'] for phase in phases.values())), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the diagram pipeline on synthetic estates')
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)),
+                        help='comma-separated VPC counts (default: %(default)s)')
+    parser.add_argument('-s', '--styles', default=','.join(STYLES),
+                        help='comma-separated diagram styles (default: %(default)s)')
+    parser.add_argument('-f', '--formats', default=','.join(DEFAULT_FORMATS),
+                        help='comma-separated export formats (default: %(default)s)')
+    parser.add_argument('--subnets-per-az', type=int, default=1)
+    parser.add_argument('--azs', type=int, default=2)
+    parser.add_argument('--endpoints', type=int, default=3, help='interface endpoints per VPC')
+    parser.add_argument('--vpns', type=int, default=1, help='VPN attachments on the Transit Gateway')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--layout', choices=['auto', 'grid', 'radial'], default='auto',
+                        help='VPC placement (default: grid, radial for large estates)')
+    parser.add_argument('--batched', action=argparse.BooleanOptionalAction, default=None,
+                        help='draw shapes as collections, or one artist per shape with --no-batched '
+                             '(default: collections for large estates)')
+    parser.add_argument('--dpi', type=int, default=100,
+                        help='raster resolution, capped at %d pixels a side (default: 100)' % MAX_PIXELS)
+    parser.add_argument('-r', '--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='runs per case; the fastest time and highest RSS are kept (default: %(default)s)')
+    parser.add_argument('-o', '--output', default=None, help='write the JSON report here (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare with an earlier report; exits 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative increase that counts as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    styles = [s.strip() for s in args.styles.split(',') if s.strip()]
+    unknown = [s for s in styles if s not in STYLES]
+    if unknown:
+        parser.error('unknown style(s): %s (choose from %s)' % (', '.join(unknown), ', '.join(STYLES)))
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    scales = [int(n) for n in args.scales.split(',') if n.strip()]
+    formats = [f.strip().lower().lstrip('.') for f in args.formats.split(',') if f.strip()]
+    params = {'subnets_per_az': args.subnets_per_az, 'azs': args.azs, 'endpoints': args.endpoints,
+              'vpns': args.vpns, 'seed': args.seed}
+
+    report = run_benchmarks(scales, styles, formats, params, args.layout, args.batched, args.dpi,
+                            args.repeat, progress=_print_case)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        tmp = args.output + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as handle:
+            handle.write(text + '\n')
+        os.replace(tmp, args.output)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            rows = compare_reports(json.load(handle), report, args.threshold)
+        regressions = [row for row in rows if row[-1]]
+        for case, phase, metric, a, b, regressed in rows:
+            # Only what moved past the threshold either way
+            if regressed or (b < a * (1 - args.threshold) and a - b > (TIME_FLOOR if metric == 'seconds' else
+                                                                       RSS_FLOOR if metric == 'peak_rss_mb' else 0)):
+                print("%s %-18s %-8s %-12s %10.2f -> %10.2f  %+6.1f%%" % (
+                    '!' if regressed else ' ', case, phase, metric, a, b,
+                    100.0 * (b - a) / a if a else 0.0), file=sys.stderr)
+        print("%d regression(s) over %d%%" % (len(regressions), round(100 * args.threshold)), file=sys.stderr)
+        sys.exit(1 if regressions else 0)
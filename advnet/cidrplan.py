@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - CIDR Address Planner
+Indexes every declared prefix (VPCs, subnets, VPN-advertised on-premises
+ranges, tunnel inside CIDRs, reserved blocks for future spokes) and checks
+them in one sorted sweep. Two CIDR blocks either nest or are disjoint, so
+the prefixes still open at each point of the sweep are exactly the ones
+containing it; overlaps, next free /16 or /24 blocks and utilization all
+come out in O(n log n). Prefixes are read from a plan/state, or straight
+from the Terraform configuration so the check can run before `terraform plan`.
+"""
+
+import bisect
+import glob
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass
+
+from advnet.topology import cidr_range, int_to_ip
+
+DEFAULT_POOL = '10.0.0.0/8'
+
+# Exit status when the plan has overlapping prefixes (1 is any other failure)
+EXIT_CONFLICTS = 3
+
+# Overlaps between these kinds (sorted pairs) are errors, any others
+# (reserved blocks, tunnels against VPCs) warnings
+ERROR_KINDS = {('vpc', 'vpc'), ('subnet', 'vpc'), ('subnet', 'subnet'), ('vpc', 'vpn'),
+               ('subnet', 'vpn'), ('tunnel', 'tunnel')}
+
+
+@dataclass
+class Prefix:
+    cidr: str
+    kind: str  # vpc, subnet, vpn, tunnel or reserved
+    owner: str = ''  # VPC (or VPN) the prefix belongs to
+    label: str = ''
+    host: str = ''  # for VPN ranges: VPC simulating the on-premises side
+
+    def __post_init__(self):
+        self.low, self.high = cidr_range(self.cidr)
+        self.bits = int(self.cidr.partition('/')[2] or 32)
+
+
+@dataclass
+class Conflict:
+    severity: str  # error, warning or note
+    outer: Prefix
+    inner: Prefix
+    reason: str
+
+
+def block_cidr(low, bits):
+    return '%s/%d' % (int_to_ip(low), bits)
+
+
+# --- Index ---
+
+class PrefixIndex:
+    """Prefixes sorted by (start, size descending), so every prefix comes
+    after all the prefixes containing it"""
+
+    def __init__(self, prefixes):
+        self.prefixes = sorted(prefixes, key=lambda p: (p.low, p.bits, p.kind, p.owner))
+        self.lows = [p.low for p in self.prefixes]
+
+    def ancestors(self):
+        """(prefix, [containing prefixes, outermost first]) for every prefix"""
+        stack = []
+        for prefix in self.prefixes:
+            while stack and stack[-1].high < prefix.low:
+                stack.pop()
+            yield prefix, list(stack)
+            stack.append(prefix)
+
+    def conflicts(self):
+        """Every overlapping pair that is not a subnet inside its own VPC,
+        plus subnets that lie outside their VPC"""
+        found = []
+        for prefix, containing in self.ancestors():
+            if prefix.kind == 'subnet' and not any(p.kind == 'vpc' and p.owner == prefix.owner
+                                                   for p in containing):
+                found.append(Conflict('error', prefix, prefix, 'subnet lies outside its VPC %s' % prefix.owner))
+            nested = {p.owner for p in containing if p.kind == 'vpc'}
+            for outer in containing:
+                if (prefix.kind == 'subnet' and outer.kind == 'vpc' and outer.owner != prefix.owner
+                        and prefix.owner in nested):
+                    # Its own VPC already overlaps this one, which is reported
+                    continue
+                conflict = self._classify(outer, prefix)
+                if conflict:
+                    found.append(conflict)
+        return found
+
+    @staticmethod
+    def _classify(outer, inner):
+        kinds = tuple(sorted((outer.kind, inner.kind)))
+        if kinds == ('subnet', 'vpc') and outer.kind == 'vpc' and outer.owner == inner.owner:
+            return None
+        if kinds == ('subnet', 'subnet') and outer.cidr != inner.cidr and outer.owner != inner.owner:
+            # Already reported through the VPCs they sit in
+            return None
+        if 'vpn' in kinds and {outer.kind, inner.kind} & {'vpc', 'subnet'}:
+            vpn, other = (outer, inner) if outer.kind == 'vpn' else (inner, outer)
+            if vpn.host and vpn.host == other.owner:
+                # One note for the VPC, not one per subnet
+                return (Conflict('note', outer, inner, 'on-premises range %s is simulated by VPC %s' %
+                                 (vpn.cidr, vpn.host)) if other.kind == 'vpc' else None)
+        severity = 'error' if kinds in ERROR_KINDS else 'warning'
+        how = 'duplicates' if outer.cidr == inner.cidr else 'contains'
+        return Conflict(severity, outer, inner, '%s %s %s' % (_describe(outer), how, _describe(inner)))
+
+    def within(self, pool):
+        """Prefixes strictly inside pool (a CIDR), in order"""
+        low, high = cidr_range(pool)
+        bits = int(pool.partition('/')[2])
+        start = bisect.bisect_left(self.lows, low)
+        end = bisect.bisect_right(self.lows, high)
+        return [p for p in self.prefixes[start:end] if p.high <= high and (p.bits > bits)]
+
+    def _merged(self, pool, kinds=None):
+        """Covered (low, high) runs inside pool"""
+        runs = []
+        for prefix in self.within(pool):
+            if kinds and prefix.kind not in kinds:
+                continue
+            if runs and prefix.low <= runs[-1][1] + 1:
+                runs[-1][1] = max(runs[-1][1], prefix.high)
+            else:
+                runs.append([prefix.low, prefix.high])
+        return runs
+
+    def free_blocks(self, pool, bits, count=1, kinds=None):
+        """The first count aligned /bits blocks in pool that overlap nothing"""
+        low, high = cidr_range(pool)
+        size = 1 << (32 - bits)
+        blocks = []
+        cursor = low
+        for run_low, run_high in self._merged(pool, kinds) + [[high + 1, high + 1]]:
+            cursor = (cursor + size - 1) // size * size
+            while cursor + size - 1 < run_low and cursor + size - 1 <= high and len(blocks) < count:
+                blocks.append(block_cidr(cursor, bits))
+                cursor += size
+            if len(blocks) >= count:
+                break
+            cursor = max(cursor, run_high + 1)
+        return blocks
+
+    def utilization(self, pool, kinds=None):
+        """(used addresses, pool size, largest free aligned block length)"""
+        low, high = cidr_range(pool)
+        runs = self._merged(pool, kinds)
+        used = sum(b - a + 1 for a, b in runs)
+        largest = None
+        for gap_low, gap_high in _gaps(runs, low, high):
+            bits = _largest_aligned(gap_low, gap_high)
+            if bits is not None and (largest is None or bits < largest):
+                largest = bits
+        return used, high - low + 1, largest
+
+
+def _gaps(runs, low, high):
+    cursor = low
+    for a, b in runs:
+        if a > cursor:
+            yield cursor, a - 1
+        cursor = max(cursor, b + 1)
+    if cursor <= high:
+        yield cursor, high
+
+
+def _largest_aligned(low, high):
+    """Prefix length of the largest aligned block inside [low, high]"""
+    for bits in range(0, 33):
+        size = 1 << (32 - bits)
+        start = (low + size - 1) // size * size
+        if start + size - 1 <= high:
+            return bits
+    return None
+
+
+def _describe(prefix):
+    name = prefix.label or prefix.owner
+    return '%s %s%s' % (prefix.kind, prefix.cidr, ' (%s)' % name if name else '')
+
+
+# --- Sources ---
+
+def topology_prefixes(topology, vpn_routes=None):
+    """Prefixes declared by a parsed plan or state"""
+    prefixes = []
+    hosts = {}
+    for vpc in topology.vpcs:
+        prefixes.append(Prefix(vpc.cidr, 'vpc', vpc.key or vpc.id, vpc.name))
+        for subnet in vpc.subnets:
+            prefixes.append(Prefix(subnet.cidr, 'subnet', vpc.key or vpc.id, subnet.name or subnet.id))
+        for instance in vpc.instances:
+            if instance.public_ip:
+                hosts[instance.public_ip] = vpc.key or vpc.id
+    for vpn in topology.vpn_connections:
+        for cidr in list(vpn.routes) + list((vpn_routes or {}).get(vpn.id, [])):
+            prefixes.append(Prefix(cidr, 'vpn', vpn.id, 'on-premises', hosts.get(vpn.customer_gateway_ip, '')))
+    return prefixes
+
+
+_BLOCK = re.compile(r'^(variable|module|resource)\s+"([^"]+)"(?:\s+"([^"]+)")?\s*\{', re.M)
+_ATTRIBUTE = re.compile(r'^\s*(\w+)\s*=\s*(.+?)\s*(?:#.*)?$', re.M)
+_CARVE = re.compile(r'cidrsubnet\(\s*var\.(\w+)\s*,\s*(\d+)\s*,\s*each\.key\s*(?:\+\s*(\d+))?\s*\)')
+
+
+def _blocks(text):
+    """(kind, labels, body) for the top-level HCL blocks of a file"""
+    for match in _BLOCK.finditer(text):
+        depth, position = 1, match.end()
+        while depth and position < len(text):
+            depth += {'{': 1, '}': -1}.get(text[position], 0)
+            position += 1
+        yield match.group(1), (match.group(2), match.group(3)), text[match.end():position - 1]
+
+
+def _attributes(body):
+    return {name: value for name, value in _ATTRIBUTE.findall(body)}
+
+
+def _value(expression, variables):
+    expression = expression.strip().rstrip(',')
+    if expression.startswith('var.'):
+        return variables.get(expression[4:])
+    if expression.startswith('"') and expression.endswith('"') and '${' not in expression:
+        return expression[1:-1]
+    try:
+        return int(expression)
+    except ValueError:
+        return None
+
+
+def _literal(value):
+    """A TF_VAR_* or --var value: digits are a number, anything else a string"""
+    return int(value) if isinstance(value, str) and value.isdigit() else value
+
+
+def _read_tf(directory):
+    return {path: open(path).read() for path in sorted(glob.glob(os.path.join(directory, '*.tf')))}
+
+
+def config_variables(directory, overrides=None):
+    """Variable values as `terraform plan` would see them: defaults, then
+    terraform.tfvars and *.auto.tfvars, then TF_VAR_* and explicit overrides"""
+    variables = {}
+    for text in _read_tf(directory).values():
+        for kind, (name, _), body in _blocks(text):
+            if kind == 'variable':
+                default = _attributes(body).get('default')
+                if default is not None:
+                    variables[name] = _value(default, {})
+    files = [os.path.join(directory, 'terraform.tfvars')] + sorted(
+        glob.glob(os.path.join(directory, '*.auto.tfvars')))
+    for path in files:
+        if os.path.exists(path):
+            with open(path) as handle:
+                for name, value in _ATTRIBUTE.findall(handle.read()):
+                    variables[name] = _value(value, {})
+    for key, value in os.environ.items():
+        if key.startswith('TF_VAR_'):
+            variables[key[7:]] = _literal(value)
+    variables.update((name, _literal(value)) for name, value in (overrides or {}).items())
+    return variables
+
+
+def config_prefixes(directory='.', overrides=None):
+    """Prefixes the configuration will create, without running Terraform:
+    module CIDR arguments, subnets carved with cidrsubnet(var.cidr, N,
+    each.key [+ K]) over the AZs (as modules/vpc does), ranges handed to
+    VPN modules, tunnel inside CIDRs and literal cidr_block resources"""
+    variables = config_variables(directory, overrides)
+    azs = int(variables.get('az_count') or 2)
+    prefixes = []
+    for text in _read_tf(directory).values():
+        for kind, (name, label), body in _blocks(text):
+            if kind == 'resource':
+                prefix = _resource_prefix(name, label, body, variables)
+                if prefix:
+                    prefixes.append(prefix)
+                continue
+            if kind != 'module':
+                continue
+            arguments = _attributes(body)
+            source = (_value(arguments.get('source', '""'), {}) or '').strip()
+            module_dir = os.path.normpath(os.path.join(directory, source))
+            module_text = '\n'.join(_read_tf(module_dir).values()) if os.path.isdir(module_dir) else ''
+            inputs = {key: _value(value, variables) for key, value in arguments.items()}
+            carves = _CARVE.findall(module_text)
+            if 'aws_vpc' in module_text and isinstance(inputs.get('cidr'), str):
+                cidr = inputs['cidr']
+                prefixes.append(Prefix(cidr, 'vpc', name, (inputs.get('name') or name)))
+                for variable, newbits, offset in carves:
+                    base = inputs.get(variable) if variable != 'cidr' else cidr
+                    if not isinstance(base, str):
+                        continue
+                    for az in range(azs):
+                        prefixes.append(_carve(base, int(newbits), az + int(offset or 0), name))
+                continue
+            host = re.search(r'vpc_id\s*=\s*module\.(\w+)\.', body)
+            for key, value in inputs.items():
+                if key.endswith('cidr') and isinstance(value, str) and 'aws_vpn_connection' in module_text:
+                    prefixes.append(Prefix(value, 'vpn', name, key, host.group(1) if host else ''))
+            for key, value in re.findall(r'(tunnel\d_inside_cidr)\s*=\s*"([^"]+)"', module_text):
+                prefixes.append(Prefix(value, 'tunnel', name, key))
+    return prefixes
+
+
+def _resource_prefix(resource_type, name, body, variables):
+    """Prefix of an aws_vpc or aws_subnet declared outside a module, when its
+    cidr_block is a literal or a variable"""
+    if resource_type not in ('aws_vpc', 'aws_subnet'):
+        return None
+    cidr = _value(_attributes(body).get('cidr_block', ''), variables)
+    if not isinstance(cidr, str):
+        return None
+    if resource_type == 'aws_vpc':
+        return Prefix(cidr, 'vpc', name, name)
+    vpc = re.search(r'vpc_id\s*=\s*(?:aws_vpc|module)\.(\w+)\.', body)
+    return Prefix(cidr, 'subnet', vpc.group(1) if vpc else '', name)
+
+
+def _carve(base, newbits, netnum, owner):
+    from advnet.topology import cidrsubnet
+    cidr = cidrsubnet(base, newbits, netnum)
+    return Prefix(cidr, 'subnet', owner, '%s subnet %d' % (owner, netnum))
+
+
+# --- Report ---
+
+def plan_report(index, pool=DEFAULT_POOL, next_bits=(), count=1, inside=None):
+    """Conflicts, per-VPC and pool utilization and free-block suggestions"""
+    conflicts = index.conflicts()
+    vpcs = [p for p in index.prefixes if p.kind == 'vpc']
+    used, size, largest = index.utilization(pool, kinds={'vpc', 'vpn', 'reserved'})
+    report = {
+        'prefixes': len(index.prefixes),
+        'conflicts': [{'severity': c.severity, 'reason': c.reason, 'outer': c.outer.cidr, 'inner': c.inner.cidr}
+                      for c in conflicts],
+        'pool': {'cidr': pool, 'used': used, 'size': size, 'largest_free': largest},
+        'vpcs': [],
+        'suggestions': {},
+    }
+    for vpc in vpcs:
+        used, size, largest = index.utilization(vpc.cidr, kinds={'subnet'})
+        report['vpcs'].append({'owner': vpc.owner, 'cidr': vpc.cidr, 'used': used, 'size': size,
+                               'largest_free': largest,
+                               'subnets': sum(1 for p in index.within(vpc.cidr)
+                                              if p.kind == 'subnet' and p.owner == vpc.owner)})
+    for bits in next_bits:
+        # Sizes that fit inside --in are looked for there, larger ones in the pool
+        target = inside if inside and bits > int(inside.partition('/')[2]) else pool
+        report['suggestions']['/%d' % bits] = {'within': target,
+                                               'blocks': index.free_blocks(target, bits, count)}
+    return report
+
+
+def _resolve_inside(value, prefixes):
+    """--in accepts a CIDR, or a VPC key/id/name"""
+    if '/' in value:
+        return value
+    for prefix in prefixes:
+        if prefix.kind == 'vpc' and value in (prefix.owner, prefix.label):
+            return prefix.cidr
+    raise KeyError(value)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from advnet.topology import (add_source_arguments, add_vpn_route_argument, topology_from_args,
+                                 vpn_routes_from_args)
+
+    parser = argparse.ArgumentParser(description='Check the address plan for overlaps and suggest free blocks')
+    add_source_arguments(parser)
+    parser.add_argument('--config', nargs='?', const='.', default=None, metavar='DIR',
+                        help='read prefixes from the Terraform configuration in DIR instead of a plan '
+                             '(pre-plan check; default DIR: .)')
+    parser.add_argument('--var', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a Terraform variable (with --config)')
+    add_vpn_route_argument(parser, 'extra on-premises prefix advertised over a VPN')
+    parser.add_argument('--reserve', action='append', default=[], metavar='CIDR[=LABEL]',
+                        help='block held for future spokes; overlaps with it are warnings')
+    parser.add_argument('--pool', default=DEFAULT_POOL,
+                        help='address pool VPCs are allocated from (default: %(default)s)')
+    parser.add_argument('--next', type=int, action='append', default=[], metavar='BITS',
+                        help='suggest free /BITS blocks (e.g. 16 for a VPC, 24 for a subnet)')
+    parser.add_argument('--in', dest='inside', default=None, metavar='VPC_OR_CIDR',
+                        help='look for blocks smaller than this VPC or CIDR inside it instead of the pool')
+    parser.add_argument('-n', '--count', type=int, default=1, help='blocks to suggest per size')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.config is not None:
+        overrides = {}
+        for item in args.var:
+            name, equals, value = item.partition('=')
+            if not equals or not name:
+                parser.error('--var %s: expected NAME=VALUE' % item)
+            overrides[name] = value
+        prefixes = config_prefixes(args.config, overrides)
+        source = 'configuration in %s' % os.path.abspath(args.config)
+    else:
+        topology = topology_from_args(args)
+        prefixes = topology_prefixes(topology, vpn_routes_from_args(parser, args, topology))
+        source = ', '.join(args.terraform) or 'lab topology'
+    for item in args.reserve:
+        cidr, _, label = item.partition('=')
+        prefixes.append(Prefix(cidr, 'reserved', '', label or 'reserved'))
+
+    index = PrefixIndex(prefixes)
+    try:
+        inside = _resolve_inside(args.inside, prefixes) if args.inside else None
+    except KeyError:
+        parser.error('--in %s: no such VPC' % args.inside)
+    report = plan_report(index, args.pool, args.next, args.count, inside)
+    elapsed = time.perf_counter() - start
+    errors = [c for c in report['conflicts'] if c['severity'] == 'error']
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("%d prefixes from %s" % (report['prefixes'], source))
+        for conflict in report['conflicts']:
+            print("  %-7s %s" % (conflict['severity'].upper(), conflict['reason']))
+        pool = report['pool']
+        print("Pool %s: %.2f%% allocated, largest free block /%s" % (
+            pool['cidr'], 100.0 * pool['used'] / pool['size'], pool['largest_free']))
+        for vpc in report['vpcs'][:50]:
+            print("  %-24s %-18s %3d subnets  %6.2f%% used  largest free /%s" % (
+                vpc['owner'], vpc['cidr'], vpc['subnets'], 100.0 * vpc['used'] / vpc['size'],
+                vpc['largest_free']))
+        if len(report['vpcs']) > 50:
+            print("  ... %d more VPCs (see --json)" % (len(report['vpcs']) - 50))
+        for size, suggestion in report['suggestions'].items():
+            print("Next free %s in %s: %s" % (size, suggestion['within'],
+                                              ', '.join(suggestion['blocks']) or 'none'))
+        print("%d error(s), %d warning(s) in %.3fs" % (
+            len(errors), sum(1 for c in report['conflicts'] if c['severity'] == 'warning'), elapsed),
+            file=sys.stderr)
+    sys.exit(EXIT_CONFLICTS if errors else 0)
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Connectivity Tests
+Runs the lab's connectivity checks concurrently. SSM commands for every
+check are sent at once, then tracked together: each polling round is one
+paginated ListCommands call for all outstanding commands, with exponential
+backoff and an overall deadline, and output is fetched once per finished
+command. The API checks (VPN tunnel telemetry, TGW routes) run alongside
+them. All calls share one boto3 session whose clients pool connections up
+to the concurrency. Results are printed as they finish and can be written
+as JUnit XML or JSON; AWS_ENDPOINT_URL / --endpoint-url point the runner
+at a local AWS stand-in such as moto.
+"""
+
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+# Terminal SSM command states and the result they map to
+_FINISHED = {
+    'Success': 'passed',
+    'Failed': 'failed',
+    'Cancelled': 'error',
+    'TimedOut': 'timeout',
+    'Undeliverable': 'error',
+    'Terminated': 'error',
+}
+
+# Marker lines printed by multi-target commands, one per target
+_MARKER = 'advnet-check'
+
+
+@dataclass
+class Check:
+    """One connectivity test: an SSM shell command on an instance, or an API call"""
+    name: str
+    instance_id: str = None
+    commands: list = field(default_factory=list)
+    # async callable(runner) -> (status, message) for API checks
+    api: object = None
+    # marker target -> result name, for commands that test several targets
+    targets: dict = field(default_factory=dict)
+
+
+@dataclass
+class Result:
+    name: str
+    status: str
+    seconds: float
+    message: str = ''
+    output: str = ''
+
+    @property
+    def ok(self):
+        return self.status == 'passed'
+
+
+class Runner:
+    """Shared AWS clients plus the concurrent send / batched-poll loop"""
+
+    def __init__(self, region=None, endpoint_url=None, session=None, concurrency=32,
+                 deadline=120.0, poll=0.5, max_poll=5.0, command_timeout=60):
+        import boto3
+        from botocore.config import Config
+
+        session = session or boto3.session.Session(region_name=region)
+        config = Config(max_pool_connections=concurrency,
+                        retries={'mode': 'adaptive', 'max_attempts': 8})
+        self.ssm = session.client('ssm', region_name=region, endpoint_url=endpoint_url, config=config)
+        self.ec2 = session.client('ec2', region_name=region, endpoint_url=endpoint_url, config=config)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.deadline, self.poll, self.max_poll = deadline, poll, max_poll
+        self.command_timeout = command_timeout
+
+    async def call(self, client, method, **kwargs):
+        """Run a blocking boto3 call on the shared pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(getattr(client, method), **kwargs))
+
+    async def run(self, checks):
+        """Yield Results as checks finish"""
+        start = time.monotonic()
+        queue = asyncio.Queue()
+        pending = {}
+        expected = sum(max(len(c.targets), 1) for c in checks)
+
+        def finish(check, status, message='', output=''):
+            seconds = time.monotonic() - start
+            if check.targets:
+                for result in _split(check, status, message, output, seconds):
+                    queue.put_nowait(result)
+            else:
+                queue.put_nowait(Result(check.name, status, seconds, message, output))
+
+        async def send(check):
+            try:
+                response = await self.call(
+                    self.ssm, 'send_command', InstanceIds=[check.instance_id],
+                    DocumentName='AWS-RunShellScript', Comment=check.name[:100],
+                    TimeoutSeconds=max(30, self.command_timeout),
+                    Parameters={'commands': check.commands, 'executionTimeout': [str(self.command_timeout)]})
+                pending[response['Command']['CommandId']] = check
+            except Exception as error:  # reported as the check's result
+                finish(check, 'error', 'send-command failed: %s' % error)
+
+        async def api(check):
+            try:
+                status, message = await check.api(self)
+            except Exception as error:
+                status, message = 'error', str(error)
+            finish(check, status, message)
+
+        sent_at = datetime.now(timezone.utc) - timedelta(minutes=1)
+        tasks = [asyncio.ensure_future(api(c)) for c in checks if c.api]
+        await asyncio.gather(*(send(c) for c in checks if not c.api))
+        tasks.append(asyncio.ensure_future(self._track(pending, finish, start, sent_at)))
+
+        for _ in range(expected):
+            yield await queue.get()
+        await asyncio.gather(*tasks)
+
+    async def _track(self, pending, finish, start, sent_at):
+        interval = self.poll
+        while pending:
+            remaining = self.deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                for command_id, check in list(pending.items()):
+                    finish(check, 'timeout', 'no result within %.0fs' % self.deadline)
+                    await self._cancel(command_id)
+                pending.clear()
+                return
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 1.6, self.max_poll)
+            done = [(command_id, _FINISHED[status])
+                    for command_id, status in (await self._statuses(pending, sent_at)).items()
+                    if status in _FINISHED and command_id in pending]
+            # Output is only fetched once per finished command
+            outputs = await asyncio.gather(*(self._output(command_id, pending[command_id])
+                                             for command_id, _ in done))
+            for (command_id, status), (details, output) in zip(done, outputs):
+                finish(pending.pop(command_id), status, details, output)
+
+    async def _statuses(self, pending, sent_at):
+        """Status of every outstanding command from one paginated ListCommands
+        listing; commands the listing misses are asked for individually"""
+        found = {}
+        try:
+            token = None
+            while True:
+                kwargs = dict(MaxResults=50, Filters=[{'key': 'InvokedAfter',
+                                                       'value': sent_at.strftime('%Y-%m-%dT%H:%M:%SZ')}])
+                if token:
+                    kwargs['NextToken'] = token
+                response = await self.call(self.ssm, 'list_commands', **kwargs)
+                for command in response.get('Commands', []):
+                    if command.get('CommandId') in pending:
+                        found[command['CommandId']] = command.get('Status')
+                token = response.get('NextToken')
+                if not token or len(found) == len(pending):
+                    break
+        except Exception:  # fall back to per-command listing below
+            pass
+        missing = [command_id for command_id in pending if command_id not in found]
+        if missing:
+            responses = await asyncio.gather(
+                *(self.call(self.ssm, 'list_commands', CommandId=command_id) for command_id in missing),
+                return_exceptions=True)
+            for command_id, response in zip(missing, responses):
+                if isinstance(response, dict) and response.get('Commands'):
+                    found[command_id] = response['Commands'][0].get('Status')
+        return found
+
+    async def _output(self, command_id, check):
+        try:
+            invocation = await self.call(self.ssm, 'get_command_invocation', CommandId=command_id,
+                                         InstanceId=check.instance_id)
+        except Exception as error:
+            return 'get-command-invocation failed: %s' % error, ''
+        output = invocation.get('StandardOutputContent') or ''
+        if invocation.get('StandardErrorContent'):
+            output += invocation['StandardErrorContent']
+        return invocation.get('StatusDetails', ''), output
+
+    async def _cancel(self, command_id):
+        try:
+            await self.call(self.ssm, 'cancel_command', CommandId=command_id)
+        except Exception:  # best effort
+            pass
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def _split(check, status, message, output, seconds):
+    """Per-target results from a command that printed marker lines"""
+    verdicts = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and parts[0] == _MARKER:
+            verdicts[parts[1]] = parts[2]
+    for target, name in check.targets.items():
+        verdict = verdicts.get(target)
+        if verdict == 'ok':
+            yield Result(name, 'passed', seconds)
+        elif verdict:
+            yield Result(name, 'failed', seconds, '%s unreachable from %s' % (target, check.instance_id))
+        else:
+            yield Result(name, status if status != 'passed' else 'error', seconds,
+                         'no result for %s (%s)' % (target, message or status), output)
+
+
+# --- Checks ---
+
+def ping_check(name, instance_id, address, http=False):
+    commands = ['set -e', 'ping -c 3 -W 2 %s' % address, 'ip route get %s' % address]
+    if http:
+        commands.insert(2, 'curl -sS -f -m 10 -o /dev/null -w "HTTP %%{http_code}\\n" http://%s' % address)
+    return Check(name, instance_id, commands)
+
+
+def fan_out_check(source, targets):
+    """One command per source instance pinging every target in parallel"""
+    commands = ['for ip in %s; do (ping -c 2 -W 2 "$ip" >/dev/null 2>&1 && echo "%s $ip ok" '
+                '|| echo "%s $ip fail") & done; wait' % (' '.join(targets), _MARKER, _MARKER)]
+    return Check('%s fan-out' % source.name, source.id, commands,
+                 targets={address: '%s -> %s icmp' % (source.name, name) for address, name in targets.items()})
+
+
+def vpn_check(vpn_id):
+    async def check(runner):
+        response = await runner.call(runner.ec2, 'describe_vpn_connections', VpnConnectionIds=[vpn_id])
+        connections = response.get('VpnConnections', [])
+        if not connections:
+            return 'failed', '%s not found' % vpn_id
+        tunnels = connections[0].get('VgwTelemetry', [])
+        up = [t for t in tunnels if t.get('Status') == 'UP']
+        summary = ', '.join('%s %s' % (t.get('OutsideIpAddress'), t.get('Status')) for t in tunnels)
+        if connections[0].get('State') != 'available':
+            return 'failed', '%s is %s' % (vpn_id, connections[0].get('State'))
+        return ('passed' if up else 'failed'), '%d/%d tunnels up (%s)' % (len(up), len(tunnels), summary)
+    return Check('VPN %s tunnels' % vpn_id, api=check)
+
+
+def tgw_routes_check(tgw_id, expected_cidrs):
+    async def check(runner):
+        tables = await runner.call(runner.ec2, 'describe_transit_gateway_route_tables',
+                                   Filters=[{'Name': 'transit-gateway-id', 'Values': [tgw_id]}])
+        table_ids = [t['TransitGatewayRouteTableId'] for t in tables.get('TransitGatewayRouteTables', [])]
+        if not table_ids:
+            return 'failed', 'no route tables on %s' % tgw_id
+        responses = await asyncio.gather(*(
+            runner.call(runner.ec2, 'search_transit_gateway_routes', TransitGatewayRouteTableId=table_id,
+                        Filters=[{'Name': 'state', 'Values': ['active']}]) for table_id in table_ids))
+        active = {r.get('DestinationCidrBlock') for response in responses for r in response.get('Routes', [])}
+        missing = [cidr for cidr in expected_cidrs if cidr not in active]
+        if missing:
+            return 'failed', 'no active route for %s' % ', '.join(missing)
+        return 'passed', '%d active routes' % len(active)
+    return Check('TGW %s routes' % tgw_id, api=check)
+
+
+def lab_checks(topology, fleet=False):
+    """The checks of test-connectivity.sh, or every instance pair with fleet"""
+    instances = {i.key: i for vpc in topology.vpcs for i in vpc.instances}
+    checks = []
+    if fleet:
+        for source in instances.values():
+            targets = {i.private_ip: i.name for i in instances.values() if i is not source and i.private_ip}
+            if targets:
+                checks.append(fan_out_check(source, targets))
+    else:
+        bastion, app, strongswan = (instances.get(k) for k in ('bastion', 'app_server', 'strongswan'))
+        if bastion and app:
+            checks.append(ping_check('Bastion -> App Server (ping, HTTP)', bastion.id, app.private_ip, http=True))
+        if bastion and strongswan:
+            checks.append(ping_check('Bastion -> StrongSwan (ping)', bastion.id, strongswan.private_ip))
+    if topology.vpn:
+        checks.append(vpn_check(topology.vpn.id))
+    if topology.transit_gateway:
+        checks.append(tgw_routes_check(topology.transit_gateway.id, [v.cidr for v in topology.vpcs]))
+    return checks
+
+
+# --- Reports ---
+
+def junit_xml(results, seconds, suite='advnet-connectivity'):
+    from xml.etree import ElementTree
+
+    root = ElementTree.Element('testsuite', name=suite, tests=str(len(results)),
+                               failures=str(sum(r.status == 'failed' for r in results)),
+                               errors=str(sum(r.status in ('error', 'timeout') for r in results)),
+                               time='%.3f' % seconds)
+    for result in results:
+        case = ElementTree.SubElement(root, 'testcase', classname=suite, name=result.name,
+                                      time='%.3f' % result.seconds)
+        if not result.ok:
+            tag = 'failure' if result.status == 'failed' else 'error'
+            element = ElementTree.SubElement(case, tag, message=result.message or result.status,
+                                             type=result.status)
+            element.text = result.output
+        elif result.output:
+            ElementTree.SubElement(case, 'system-out').text = result.output
+    return ElementTree.tostring(root, encoding='unicode')
+
+
+def json_report(results, seconds):
+    return json.dumps({'seconds': seconds, 'results': [asdict(r) for r in results]}, indent=2)
+
+
+def run_checks(checks, on_result=None, **runner_options):
+    """Run checks to completion; returns (results, seconds)"""
+    async def main():
+        runner = Runner(**runner_options)
+        results = []
+        try:
+            async for result in runner.run(checks):
+                results.append(result)
+                if on_result:
+                    on_result(result)
+        finally:
+            runner.close()
+        return results
+
+    start = time.monotonic()
+    results = asyncio.run(main())
+    return results, time.monotonic() - start
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from advnet.topology import add_source_arguments, topology_from_args
+
+    parser = argparse.ArgumentParser(description='Run the lab connectivity tests concurrently')
+    add_source_arguments(parser)
+    parser.add_argument('--fleet', action='store_true',
+                        help='ping every instance from every other instance')
+    parser.add_argument('--region', default=None, help='AWS region (default: the topology region)')
+    parser.add_argument('--endpoint-url', default=None, help='AWS API endpoint, e.g. a local moto server')
+    parser.add_argument('--deadline', type=float, default=120.0,
+                        help='overall time limit in seconds (default: %(default)s)')
+    parser.add_argument('-j', '--concurrency', type=int, default=32,
+                        help='concurrent API calls / pooled connections (default: %(default)s)')
+    parser.add_argument('--junit', metavar='PATH', help='write JUnit XML results')
+    parser.add_argument('--json', metavar='PATH', help="write JSON results ('-' for stdout)")
+    args = parser.parse_args()
+
+    topology = topology_from_args(args)
+    checks = lab_checks(topology, args.fleet)
+    marks = {'passed': 'PASS', 'failed': 'FAIL', 'error': 'ERROR', 'timeout': 'TIMEOUT'}
+
+    def show(result):
+        print("[%-7s] %-45s %5.1fs  %s" % (marks.get(result.status, result.status.upper()), result.name,
+                                           result.seconds, result.message), file=sys.stderr, flush=True)
+
+    try:
+        results, seconds = run_checks(checks, show, region=args.region or topology.region,
+                                      endpoint_url=args.endpoint_url, concurrency=args.concurrency,
+                                      deadline=args.deadline)
+    except ImportError:
+        sys.exit('boto3 is required: pip3 install boto3')
+
+    passed = sum(r.ok for r in results)
+    print("%d/%d checks passed in %.1fs" % (passed, len(results), seconds), file=sys.stderr)
+    if args.junit:
+        with open(args.junit, 'w') as handle:
+            handle.write(junit_xml(results, seconds) + '\n')
+    if args.json:
+        document = json_report(results, seconds)
+        if args.json == '-':
+            print(document)
+        else:
+            with open(args.json, 'w') as handle:
+                handle.write(document + '\n')
+    sys.exit(0 if passed == len(results) else 1)
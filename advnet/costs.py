@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Cost Projection
+Derives the billable inventory from the plan (Transit Gateway attachments,
+VPN connections, interface endpoint ENIs, instances by type, public IPv4
+addresses, flow-log volume) and prices it from a local table. What-if
+scenarios - other endpoint or AZ counts, stop/start schedules, flow-log
+volumes - are columns of one array, so a grid of thousands is priced in a
+single vectorized pass and ranked by monthly total.
+"""
+
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+
+HOURS_PER_MONTH = 730
+
+# us-east-1 on-demand list prices in USD; --prices reads a JSON file with
+# any of these keys to override them
+PRICES = {
+    'tgw_attachment_hour': 0.05,
+    'vpn_connection_hour': 0.05,
+    'endpoint_eni_hour': 0.01,
+    'public_ipv4_hour': 0.005,
+    # CloudWatch Logs ingestion of vended logs (first 10 TB)
+    'flow_logs_gb': 0.50,
+    'instance_hour': {
+        't2.nano': 0.0058, 't2.micro': 0.0116, 't2.small': 0.023, 't2.medium': 0.0464,
+        't3.nano': 0.0052, 't3.micro': 0.0104, 't3.small': 0.0208, 't3.medium': 0.0416,
+        't3a.nano': 0.0047, 't3a.micro': 0.0094, 't3a.small': 0.0188,
+        't4g.nano': 0.0042, 't4g.micro': 0.0084, 't4g.small': 0.0168,
+    },
+}
+
+# variables.tf default, for instances whose type the inputs do not give
+DEFAULT_INSTANCE_TYPE = 't2.micro'
+DEFAULT_FLOW_LOG_GB = 2.0
+
+# Scenario parameters: one column each; unset ones keep the plan's value.
+# Coupled resources follow the parameter they depend on: a VPN on a Transit
+# Gateway brings its attachment, and public IPs never outnumber instances.
+PARAMETERS = {
+    'vpc_attachments': 'Transit Gateway attachments other than VPNs (VPCs)',
+    'vpns': 'Site-to-Site VPN connections, each with its TGW attachment',
+    'endpoints': 'interface VPC endpoints',
+    'az_count': 'AZs (ENIs) per interface endpoint',
+    'instances': 'EC2 instances',
+    'instance_hours': 'instance running hours per day (stop/start schedule)',
+    'days': 'instance running days per week',
+    'public_ips': 'public IPv4 addresses on instances (released while stopped; at most one each)',
+    'flow_log_gb': 'flow-log GB ingested per month',
+}
+
+COMPONENTS = ('transit_gateway', 'vpn', 'endpoints', 'instances', 'public_ipv4', 'flow_logs')
+
+
+@dataclass
+class Inventory:
+    # Transit Gateway attachments of VPCs (anything but a VPN)
+    vpc_attachments: int = 0
+    vpns: int = 0
+    # VPN connections terminating on a Transit Gateway (with an attachment)
+    tgw_vpns: int = 0
+    endpoints: int = 0
+    az_count: float = 0
+    instances: int = 0
+    # Summed hourly price of the instances in the plan
+    instance_rate: float = 0.0
+    public_ips: int = 0
+    flow_log_gb: float = DEFAULT_FLOW_LOG_GB
+    # Instance types missing from the price table (priced at zero)
+    unpriced: list = field(default_factory=list)
+
+    @property
+    def empty(self):
+        return not (self.vpc_attachments or self.vpns or self.endpoints or self.instances)
+
+    @property
+    def attachments(self):
+        return self.vpc_attachments + self.tgw_vpns
+
+    def baseline(self):
+        """The plan as a scenario: instances running around the clock"""
+        return {'vpc_attachments': self.vpc_attachments, 'vpns': self.vpns, 'endpoints': self.endpoints,
+                'az_count': self.az_count, 'instances': self.instances, 'instance_hours': 24,
+                'days': 7, 'public_ips': self.public_ips, 'flow_log_gb': self.flow_log_gb}
+
+
+def load_prices(path=None):
+    prices = dict(PRICES, instance_hour=dict(PRICES['instance_hour']))
+    if path:
+        with open(path) as handle:
+            overrides = json.load(handle)
+        prices['instance_hour'].update(overrides.pop('instance_hour', {}))
+        unknown = set(overrides) - set(prices)
+        if unknown:
+            raise ValueError('unknown price keys: %s' % ', '.join(sorted(unknown)))
+        prices.update(overrides)
+    return prices
+
+
+def inventory(topology, prices=PRICES, flow_log_gb=DEFAULT_FLOW_LOG_GB):
+    """Billable resources of a topology model"""
+    inv = Inventory(flow_log_gb=flow_log_gb)
+    attached = {a.id for tgw in topology.transit_gateways for a in tgw.attachments}
+    inv.vpns = len(topology.vpn_connections)
+    inv.tgw_vpns = sum(1 for vpn in topology.vpn_connections if vpn.attachment_id in attached)
+    inv.vpc_attachments = len(attached) - inv.tgw_vpns
+    enis = 0
+    for vpc in topology.vpcs:
+        # An endpoint without resolved subnets spans its VPC's private AZs
+        zones = len({s.az for s in vpc.subnets_in('private')}) or 1
+        for endpoint in vpc.interface_endpoints:
+            inv.endpoints += 1
+            enis += len(endpoint.subnet_ids) or zones
+        for instance in vpc.instances:
+            kind = instance.instance_type or DEFAULT_INSTANCE_TYPE
+            if kind not in prices['instance_hour'] and kind not in inv.unpriced:
+                inv.unpriced.append(kind)
+            inv.instances += 1
+            inv.instance_rate += prices['instance_hour'].get(kind, 0.0)
+            inv.public_ips += bool(instance.public_ip)
+    inv.az_count = enis / inv.endpoints if inv.endpoints else 0
+    return inv
+
+
+# --- Scenarios ---
+
+def parse_values(text):
+    """'1,2,4' or an inclusive range 'start:stop[:step]'"""
+    if ':' in text:
+        parts = [float(p) for p in text.split(':')]
+        start, stop, step = (parts + [1.0])[:3]
+        if step <= 0 or len(parts) > 3:
+            raise ValueError('bad range %r' % text)
+        return np.arange(start, stop + step / 2, step)
+    return np.array([float(v) for v in text.split(',') if v.strip()])
+
+
+def scenario_grid(ranges):
+    """Every combination of the given parameter values, one column each"""
+    names = list(ranges)
+    grids = np.meshgrid(*[np.asarray(ranges[name], dtype=float) for name in names], indexing='ij')
+    return {name: grid.ravel() for name, grid in zip(names, grids)}
+
+
+def sample_scenarios(ranges, count, seed=0):
+    """count scenarios drawn uniformly from the given parameter values"""
+    rng = np.random.default_rng(seed)
+    return {name: rng.choice(np.asarray(values, dtype=float), count) for name, values in ranges.items()}
+
+
+def evaluate(inv, scenarios, prices=PRICES):
+    """Monthly cost per scenario and component: an (n, len(COMPONENTS))
+    array. Parameters missing from scenarios keep the plan's value"""
+    columns = dict(inv.baseline(), **scenarios)
+    n = max([len(np.atleast_1d(v)) for v in scenarios.values()] or [1])
+    p = {name: np.broadcast_to(np.asarray(columns[name], dtype=float), (n,)) for name in PARAMETERS}
+    duty = p['instance_hours'] / 24 * p['days'] / 7
+    # VPNs bring their TGW attachment in the plan's proportion (all of them
+    # when the plan has no VPN to go by)
+    vpn_attachments = p['vpns'] * (inv.tgw_vpns / inv.vpns if inv.vpns else 1.0)
+    units = np.column_stack([
+        p['vpc_attachments'] + vpn_attachments,
+        p['vpns'],
+        p['endpoints'] * p['az_count'],
+        p['instances'] * duty,
+        np.minimum(p['public_ips'], p['instances']) * duty,
+        p['flow_log_gb'],
+    ])
+    # Instances are priced at the plan's mean rate per instance
+    instance_rate = inv.instance_rate / inv.instances if inv.instances else prices['instance_hour'].get(
+        DEFAULT_INSTANCE_TYPE, 0.0)
+    hourly = [prices['tgw_attachment_hour'], prices['vpn_connection_hour'], prices['endpoint_eni_hour'],
+              instance_rate, prices['public_ipv4_hour']]
+    return units * np.array([rate * HOURS_PER_MONTH for rate in hourly] + [prices['flow_logs_gb']])
+
+
+def rank(costs, top=10, descending=False):
+    """Indices of the top cheapest (or dearest) scenarios by monthly total"""
+    totals = costs.sum(axis=1)
+    keys = -totals if descending else totals
+    top = min(top, len(keys))
+    if top < len(keys):
+        picked = np.argpartition(keys, top - 1)[:top]
+    else:
+        picked = np.arange(len(keys))
+    return picked[np.argsort(keys[picked], kind='stable')]
+
+
+# --- Reports ---
+
+def _amount(value):
+    return '$%.2f' % value
+
+
+def print_breakdown(inv, costs, file=sys.stdout):
+    labels = {
+        'transit_gateway': 'Transit Gateway (%d attachments)' % inv.attachments,
+        'vpn': 'VPN connections (%d)' % inv.vpns,
+        'endpoints': 'Interface endpoints (%d x %g AZ)' % (inv.endpoints, inv.az_count),
+        'instances': 'EC2 instances (%d, 24/7)' % inv.instances,
+        'public_ipv4': 'Public IPv4 addresses (%d)' % inv.public_ips,
+        'flow_logs': 'VPC Flow Logs (%g GB)' % inv.flow_log_gb,
+    }
+    for name, cost in zip(COMPONENTS, costs):
+        print("  - %-40s %10s/month" % (labels[name], _amount(cost)), file=file)
+    print("  %-42s %10s/month" % ('Total', _amount(costs.sum())), file=file)
+    if inv.unpriced:
+        print("  (no price for %s; counted as $0)" % ', '.join(inv.unpriced), file=file)
+
+
+def print_ranking(scenarios, costs, picked, baseline_total, file=sys.stdout):
+    names = list(scenarios)
+    print("%4s " % 'rank' + ' '.join('%14s' % n for n in names) + " %11s %11s" % ('monthly', 'vs plan'),
+          file=file)
+    totals = costs.sum(axis=1)
+    for position, row in enumerate(picked, 1):
+        print("%4d " % position + ' '.join('%14g' % scenarios[n][row] for n in names) +
+              " %11s %+11.2f" % (_amount(totals[row]), totals[row] - baseline_total), file=file)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from advnet.topology import add_source_arguments, topology_from_args
+
+    parser = argparse.ArgumentParser(
+        description='Monthly cost of the planned lab, and of what-if scenarios around it',
+        epilog='parameters: ' + '; '.join('%s = %s' % item for item in PARAMETERS.items()))
+    add_source_arguments(parser)
+    parser.add_argument('--prices', metavar='JSON', default=None,
+                        help='price table overriding the built-in us-east-1 list prices')
+    parser.add_argument('--flow-log-gb', type=float, default=DEFAULT_FLOW_LOG_GB,
+                        help='flow-log GB ingested per month in the plan (default: %(default)s)')
+    parser.add_argument('--vary', action='append', default=[], metavar='PARAM=VALUES',
+                        help="scenario values, e.g. az_count=1:3, endpoints=0,2,6, instance_hours=0:24:4 "
+                             "(repeatable; every combination is priced)")
+    parser.add_argument('--sample', type=int, default=None, metavar='N',
+                        help='price N random combinations instead of the full grid')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for --sample')
+    parser.add_argument('--top', type=int, default=10, help='scenarios to list (default: %(default)s)')
+    parser.add_argument('--descending', action='store_true', help='list the most expensive first')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    try:
+        prices = load_prices(args.prices)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    ranges = {}
+    for item in args.vary:
+        name, _, values = item.partition('=')
+        if name not in PARAMETERS:
+            parser.error('unknown parameter %r (choose from %s)' % (name, ', '.join(PARAMETERS)))
+        try:
+            ranges[name] = parse_values(values)
+        except ValueError:
+            parser.error('bad values for %s: %r' % (name, values))
+
+    topology = topology_from_args(args)
+    if topology.lab and args.terraform:
+        # The lab stands in for inputs without resources (a plan read without
+        # terraform); its 1-AZ endpoints are not what the plan would bill
+        sys.exit('%s: no resources to price; run without inputs to price the built-in lab model'
+                 % ', '.join(args.terraform))
+    source = 'the built-in lab model' if topology.lab else ', '.join(args.terraform)
+    inv = inventory(topology, prices, args.flow_log_gb)
+    if inv.empty:
+        sys.exit('no billable resources in the inputs')
+    baseline = evaluate(inv, {}, prices)[0]
+
+    if not ranges:
+        if args.json:
+            print(json.dumps({'source': source, 'inventory': asdict(inv),
+                              'costs': dict(zip(COMPONENTS, baseline.round(2).tolist())),
+                              'total': round(float(baseline.sum()), 2)}, indent=2))
+        else:
+            print("Estimated monthly costs of %s (%d hours/month):" % (source, HOURS_PER_MONTH))
+            print_breakdown(inv, baseline)
+        sys.exit(0)
+
+    scenarios = sample_scenarios(ranges, args.sample, args.seed) if args.sample else scenario_grid(ranges)
+    start = time.perf_counter()
+    costs = evaluate(inv, scenarios, prices)
+    picked = rank(costs, args.top, args.descending)
+    seconds = time.perf_counter() - start
+    count = len(costs)
+    if args.json:
+        totals = costs.sum(axis=1)
+        print(json.dumps({
+            'source': source, 'scenarios': count, 'seconds': round(seconds, 6),
+            'plan_total': round(float(baseline.sum()), 2),
+            'ranked': [dict({name: float(scenarios[name][row]) for name in scenarios},
+                            total=round(float(totals[row]), 2),
+                            costs=dict(zip(COMPONENTS, costs[row].round(2).tolist()))) for row in picked]},
+            indent=2))
+    else:
+        print("%s: %s/month; %d scenarios priced and ranked in %.1f ms" % (
+            source, _amount(baseline.sum()), count, seconds * 1e3), file=sys.stderr)
+        print_ranking(scenarios, costs, picked, baseline.sum())
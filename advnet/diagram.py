@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Text Diagram Renderer
+Renders the topology as the ASCII/Markdown overview kept in
+architecture-diagram.md, a Mermaid flowchart or a Graphviz DOT graph.
+Output is produced line by line from generators and written as it goes,
+so large estates never hold the whole document in memory. matplotlib and
+NumPy are only imported when a raster or vector format is requested.
+"""
+
+import os
+import sys
+import textwrap
+from itertools import zip_longest
+
+from advnet.topology import add_source_arguments, topology_from_args
+
+# Text formats handled here; anything else is rendered by advnet.export
+TEXT_FORMATS = {'markdown': 'md', 'mermaid': 'mmd', 'dot': 'dot'}
+
+# Diagram titles for the lab VPCs and instances; others use their Name tag
+VPC_TITLES = {
+    'shared': 'Shared Services VPC',
+    'app': 'Application VPC',
+    'onprem': 'On-Premises Simulation VPC',
+}
+INSTANCE_TITLES = {'bastion': 'Bastion Host', 'app_server': 'App Server', 'strongswan': 'StrongSwan'}
+
+COST_NOTES = ['• No NAT Gateways', '• VPC Endpoints Only', '• t2.micro Instances']
+
+# Markers delimiting the generated part of a hand-maintained Markdown file
+BEGIN_MARKER = '<!-- advnet:diagram:begin -->'
+END_MARKER = '<!-- advnet:diagram:end -->'
+
+# ASCII canvas: outer width, region interior, VPC boxes per row
+WIDTH = 91
+INNER = WIDTH - 6
+COLUMNS = 3
+GAP = 3
+VPC_BOX = (INNER - GAP * (COLUMNS - 1)) // COLUMNS
+TRUNK = INNER // 2
+
+
+def vpc_title(vpc):
+    return VPC_TITLES.get(vpc.key, vpc.name or vpc.id)
+
+
+def instance_title(instance):
+    return INSTANCE_TITLES.get(instance.key, instance.name or instance.id)
+
+
+def customer_gateway_ips(topology):
+    return {vpn.customer_gateway_ip for vpn in topology.vpn_connections if vpn.customer_gateway_ip}
+
+
+def attached_vpcs(topology):
+    """VPCs with a transit gateway attachment (all VPCs if none are recorded)"""
+    tgw = topology.transit_gateway
+    if tgw is None:
+        return []
+    attached = {a.resource_id for a in tgw.attachments if a.type == 'vpc'}
+    if not attached:
+        return list(topology.vpcs)
+    return [vpc for vpc in topology.vpcs if vpc.id in attached]
+
+
+def internet_vpcs(topology):
+    """VPCs with an internet gateway (public subnets imply the module's IGW)"""
+    return [vpc for vpc in topology.vpcs if vpc.internet_gateway_id or vpc.subnets_in('public')]
+
+
+# --- ASCII / Markdown ---
+
+def _fit(text, width):
+    text = str(text)
+    return text if len(text) <= width else text[:width - 1] + '…'
+
+
+def _box(lines, width, height=None):
+    """Yield a box of the given outer width around lines (padded to height)"""
+    inner = width - 4
+    yield '┌' + '─' * (width - 2) + '┐'
+    count = 0
+    for line in lines:
+        yield '│ ' + _fit(line, inner).ljust(inner) + ' │'
+        count += 1
+    for _ in range((height or 0) - count):
+        yield '│ ' + ' ' * inner + ' │'
+    yield '└' + '─' * (width - 2) + '┘'
+
+
+def _centered(lines, width):
+    return [_fit(line, width - 4).center(width - 4).rstrip() for line in lines]
+
+
+def _vpc_lines(vpc, cgw_ips, multi_az):
+    width = VPC_BOX - 4
+    lines = textwrap.wrap(vpc_title(vpc), width) + [vpc.cidr, '']
+    by_subnet = {}
+    for instance in vpc.instances:
+        by_subnet.setdefault(instance.subnet_id, []).append(instance)
+    for subnet in sorted(vpc.subnets, key=lambda s: (s.az, s.tier != 'public', s.cidr)):
+        label = '%-4s %s' % ('Pub' if subnet.tier == 'public' else 'Priv', subnet.cidr)
+        if multi_az and subnet.az:
+            label += ' ' + subnet.az[-1]
+        lines.append(label)
+        for instance in by_subnet.get(subnet.id, []):
+            tag = '[CGW]' if instance.public_ip in cgw_ips else '[EC2]'
+            lines.append(' %s %s' % (tag, instance_title(instance)))
+    for tag, kind in (('[VE]', 'Interface'), ('[GW]', 'Gateway')):
+        labels = list(dict.fromkeys(e.label for e in vpc.endpoints if e.type == kind))
+        line = ' ' + tag
+        for label in labels:
+            if len(line) + len(label) + 1 > width:
+                lines.append(line)
+                line = ' ' * (len(tag) + 1)
+            line += ' ' + label
+        if labels:
+            lines.append(line)
+    return lines
+
+
+def _row(boxes):
+    """Place rendered boxes side by side across the region interior"""
+    for parts in zip(*boxes):
+        yield (' ' * GAP).join(parts)
+
+
+def _bus(count, final):
+    """Connector lines from a row of VPC boxes down to the trunk"""
+    centers = [i * (VPC_BOX + GAP) + VPC_BOX // 2 for i in range(count)]
+    drop = [' '] * INNER
+    for c in centers:
+        drop[c] = '│'
+    yield ''.join(drop)
+    lo, hi = min(centers + [TRUNK]), max(centers + [TRUNK])
+    if lo < hi:
+        bus = [' '] * INNER
+        for x in range(lo, hi + 1):
+            bus[x] = '─'
+        for x in set(centers + [TRUNK]):
+            up, down = x in centers, x == TRUNK
+            if x == lo:
+                bus[x] = {(True, True): '├', (True, False): '└', (False, True): '┌'}[up, down]
+            elif x == hi:
+                bus[x] = {(True, True): '┤', (True, False): '┘', (False, True): '┐'}[up, down]
+            else:
+                bus[x] = {(True, True): '┼', (True, False): '┴', (False, True): '┬'}[up, down]
+        yield ''.join(bus)
+    yield ' ' * TRUNK + '│' + ('' if final else '  (continues to Transit Gateway)')
+
+
+def _hub(topology):
+    """Transit gateway box with the VPN connections stacked to its right"""
+    tgw = topology.transit_gateway
+    tgw_width = 28
+    left = TRUNK - tgw_width // 2
+    attachments = tgw.attachments if tgw else []
+    tgw_box = list(_box(_centered(['Transit Gateway', tgw.id if tgw else '',
+                                   '%d attachments' % len(attachments)], tgw_width), tgw_width))
+    vpn_width = INNER - (left + tgw_width + 4)
+    vpn_boxes = []
+    for vpn in topology.vpn_connections:
+        detail = 'Tunnel 1 & 2' if len(vpn.tunnel_addresses) != 1 else '1 tunnel'
+        vpn_boxes.extend(_box(_centered(['Site-to-Site VPN', vpn.id, detail], vpn_width), vpn_width))
+    mids = [5 * i + 2 for i in range(len(topology.vpn_connections))]
+    for r, (hub, vpn) in enumerate(zip_longest(tgw_box, vpn_boxes)):
+        # Below the gateway box the trunk carries on down to the internet gateway
+        hub = hub or ' ' * (tgw_width // 2) + '│'
+        if not mids or r > mids[-1]:
+            link = '    '
+        elif r == 2:
+            link = '◄──►' if len(mids) == 1 else '◄─┬►'
+        elif r in mids:
+            link = '  ' + ('└►' if r == mids[-1] else '├►')
+        elif r > 2:
+            link = '  │ '
+        else:
+            link = '    '
+        line = ' ' * left + hub.ljust(tgw_width) + link + (vpn or '')
+        yield line.rstrip()
+
+
+def _edge(topology):
+    """Internet gateway and the internet below the hub"""
+    lines = []
+    if internet_vpcs(topology):
+        lines.extend([' ' * TRUNK + '│'])
+        lines.extend(' ' * (TRUNK - 12) + part for part in _box(_centered(['Internet Gateway'], 24), 24))
+        lines.extend([' ' * TRUNK + '│'])
+        lines.extend(' ' * (TRUNK - 6) + part for part in _box(['Internet'], 12))
+    return lines
+
+
+def _footer(topology):
+    """CloudWatch flow-log box beside the cost callout, equal heights"""
+    width = (INNER - GAP) // 2
+    vpcs = topology.vpcs
+
+    def logs():
+        yield 'CloudWatch Logs'
+        yield ''
+        yield 'VPC Flow Logs'
+        yield topology.flow_log_group or '(no flow log group)'
+        yield ''
+        for i, vpc in enumerate(vpcs):
+            branch = '└─' if i == len(vpcs) - 1 else ('┌─' if i == 0 else '├─')
+            yield '%s %s' % (branch, vpc_title(vpc))
+
+    height = max(5 + len(vpcs), 2 + len(COST_NOTES))
+    cost = _box(['Cost Optimized', ''] + COST_NOTES, width, height)
+    for left, right in zip(_box(logs(), width, height), cost):
+        yield left + ' ' * GAP + right
+
+
+def ascii_lines(topology):
+    """The overview diagram, one line at a time (without fences)"""
+    yield '┌' + '─' * (WIDTH - 2) + '┐'
+    for line in ('AWS Advanced Networking Lab Architecture',
+                 'Hub-and-Spoke with Transit Gateway and Site-to-Site VPN'):
+        yield '│' + line.center(WIDTH - 2) + '│'
+    yield '└' + '─' * (WIDTH - 2) + '┘'
+    yield ''
+
+    def region():
+        yield 'AWS Region: %s' % topology.region
+        azs = sorted({s.az for vpc in topology.vpcs for s in vpc.subnets if s.az}) or [topology.region + 'a']
+        label = 'Availability Zone%s: %s' % ('s' if len(azs) > 1 else '', ', '.join(azs))
+        yield from _box(_centered([label], INNER), INNER)
+        yield ''
+
+        cgw_ips = customer_gateway_ips(topology)
+        multi_az = len(azs) > 1
+        vpcs = topology.vpcs
+        for start in range(0, len(vpcs), COLUMNS):
+            row = vpcs[start:start + COLUMNS]
+            contents = [_vpc_lines(vpc, cgw_ips, multi_az) for vpc in row]
+            height = max(len(lines) for lines in contents)
+            yield from _row([list(_box(lines, VPC_BOX, height)) for lines in contents])
+            if topology.transit_gateway:
+                yield from _bus(len(row), start + COLUMNS >= len(vpcs))
+            else:
+                yield ''
+        if topology.transit_gateway:
+            yield from _hub(topology)
+        yield from _edge(topology)
+        yield ''
+        yield from _footer(topology)
+
+    yield '┌' + '─' * (WIDTH - 2) + '┐'
+    for line in region():
+        yield '│  ' + line.ljust(INNER) + '  │'
+    yield '└' + '─' * (WIDTH - 2) + '┘'
+
+
+def markdown_lines(topology):
+    """The generated part of architecture-diagram.md"""
+    cgw_ips = customer_gateway_ips(topology)
+    yield '## Professional Architecture Overview'
+    yield ''
+    yield '```'
+    yield from ascii_lines(topology)
+    yield '```'
+    yield ''
+    yield '## Component Details'
+    yield ''
+    yield '### **VPCs and Networking**'
+    for vpc in topology.vpcs:
+        yield '- **%s (%s)**' % (vpc_title(vpc), vpc.cidr)
+        by_subnet = {}
+        for instance in vpc.instances:
+            by_subnet.setdefault(instance.subnet_id, []).append(instance_title(instance))
+        for subnet in vpc.subnets:
+            hosts = by_subnet.get(subnet.id)
+            yield '  - %s Subnet: %s%s%s' % (subnet.tier.capitalize(), subnet.cidr,
+                                             ' [%s]' % subnet.az if subnet.az else '',
+                                             ' (%s)' % ', '.join(hosts) if hosts else '')
+        if vpc.endpoints:
+            yield '  - VPC Endpoints: %s' % ', '.join('%s (%s)' % (e.label, e.type) for e in vpc.endpoints)
+        for instance in vpc.instances:
+            addresses = ['IP: %s' % instance.private_ip] if instance.private_ip else []
+            if instance.public_ip:
+                addresses.append('Public IP: %s' % instance.public_ip)
+            yield '  - %s: `%s`%s' % (instance_title(instance), instance.id,
+                                      ' (%s)' % ', '.join(addresses) if addresses else '')
+        yield ''
+
+    tgw = topology.transit_gateway
+    if tgw:
+        vpc_count = sum(1 for a in tgw.attachments if a.type == 'vpc')
+        vpn_count = sum(1 for a in tgw.attachments if a.type == 'vpn')
+        yield '### **Transit Gateway Hub**'
+        yield '- **Transit Gateway**: `%s`' % tgw.id
+        for table in tgw.route_tables:
+            yield '- **Route Table** `%s`: %d associations, %d propagations' % (
+                table.name or table.id, len(table.associations), len(table.propagations))
+        yield '- **Attachments**: %d VPC attachment%s + %d VPN attachment%s' % (
+            vpc_count, '' if vpc_count == 1 else 's', vpn_count, '' if vpn_count == 1 else 's')
+        yield ''
+
+    for vpn in topology.vpn_connections:
+        yield '### **Site-to-Site VPN**'
+        yield '- **VPN Connection**: `%s`' % vpn.id
+        gateway = ['`%s`' % vpn.customer_gateway_id] if vpn.customer_gateway_id else []
+        if vpn.customer_gateway_ip:
+            gateway.append('IP: %s' % vpn.customer_gateway_ip)
+        if gateway:
+            yield '- **Customer Gateway**: %s' % ', '.join(gateway)
+        if vpn.tunnel_addresses:
+            yield '- **Tunnels**: %s' % ', '.join(vpn.tunnel_addresses)
+        yield '- **Routing**: %s' % ('Static routes' if vpn.static_routes_only else 'BGP-based dynamic routing')
+        yield ''
+
+
+# --- Mermaid ---
+
+def _mermaid_label(*parts):
+    return '"%s"' % '<br/>'.join(str(p).replace('"', '#quot;') for p in parts if p)
+
+
+def mermaid_lines(topology):
+    cgw_ips = customer_gateway_ips(topology)
+    cgw_nodes = {}
+    yield 'flowchart TB'
+    for v, vpc in enumerate(topology.vpcs):
+        yield '    subgraph vpc%d[%s]' % (v, _mermaid_label(vpc_title(vpc), vpc.cidr))
+        subnet_nodes = {}
+        for s, subnet in enumerate(vpc.subnets):
+            node = 'vpc%d_s%d' % (v, s)
+            subnet_nodes[subnet.id] = node
+            yield '        %s[%s]' % (node, _mermaid_label('%s Subnet' % subnet.tier.capitalize(), subnet.cidr))
+        for i, instance in enumerate(vpc.instances):
+            node = 'vpc%d_i%d' % (v, i)
+            if instance.public_ip in cgw_ips:
+                cgw_nodes[instance.public_ip] = node
+            yield '        %s([%s])' % (node, _mermaid_label(instance_title(instance), instance.id))
+            if instance.subnet_id in subnet_nodes:
+                yield '        %s -.- %s' % (subnet_nodes[instance.subnet_id], node)
+        if vpc.endpoints:
+            yield '        vpc%d_ep[%s]' % (v, _mermaid_label('VPC Endpoints',
+                                                               ', '.join(e.label for e in vpc.endpoints)))
+        yield '    end'
+
+    index = {vpc.id: v for v, vpc in enumerate(topology.vpcs)}
+    for vpc in internet_vpcs(topology):
+        v = index[vpc.id]
+        yield '    vpc%d --- igw%d[%s]' % (v, v, _mermaid_label('Internet Gateway', vpc.internet_gateway_id))
+        yield '    igw%d --- internet((Internet))' % v
+
+    tgw = topology.transit_gateway
+    if tgw:
+        yield '    tgw{{%s}}' % _mermaid_label('Transit Gateway', tgw.id)
+        for vpc in attached_vpcs(topology):
+            yield '    vpc%d <--> tgw' % index[vpc.id]
+    for n, vpn in enumerate(topology.vpn_connections):
+        yield '    vpn%d[/%s/]' % (n, _mermaid_label('Site-to-Site VPN', vpn.id))
+        if tgw:
+            yield '    tgw <--> vpn%d' % n
+        if vpn.customer_gateway_ip in cgw_nodes:
+            yield '    vpn%d --- %s' % (n, cgw_nodes[vpn.customer_gateway_ip])
+
+
+# --- Graphviz DOT ---
+
+def _dot_quote(text):
+    return '"%s"' % str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def dot_lines(topology):
+    cgw_ips = customer_gateway_ips(topology)
+    cgw_nodes = {}
+    yield 'digraph %s {' % _dot_quote(topology.project or 'topology')
+    yield '    graph [compound=true, rankdir=TB, fontname="Helvetica", label=%s];' % _dot_quote(
+        'AWS Region: %s' % topology.region)
+    yield '    node [fontname="Helvetica", shape=box, style="filled"];'
+    yield '    edge [dir=both, color="#232F3E"];'
+    for v, vpc in enumerate(topology.vpcs):
+        yield '    subgraph cluster_vpc%d {' % v
+        yield '        label=%s; style="rounded,filled"; fillcolor="#E1F5FE"; color="#4B92DB";' % _dot_quote(
+            '%s\n%s' % (vpc_title(vpc), vpc.cidr))
+        yield '        vpc%d [shape=point, style=invis];' % v
+        subnet_nodes = {}
+        for s, subnet in enumerate(vpc.subnets):
+            node = 'vpc%d_s%d' % (v, s)
+            subnet_nodes[subnet.id] = node
+            yield '        %s [label=%s, fillcolor="#B3E5FC"];' % (
+                node, _dot_quote('%s Subnet\n%s' % (subnet.tier.capitalize(), subnet.cidr)))
+        for i, instance in enumerate(vpc.instances):
+            node = 'vpc%d_i%d' % (v, i)
+            is_cgw = instance.public_ip in cgw_ips
+            if is_cgw:
+                cgw_nodes[instance.public_ip] = node
+            yield '        %s [label=%s, fillcolor="%s", fontcolor="white"];' % (
+                node, _dot_quote('%s\n%s' % (instance_title(instance), instance.id)),
+                '#E91E63' if is_cgw else '#FF9900')
+            if instance.subnet_id in subnet_nodes:
+                yield '        %s -> %s [dir=none, style=dotted];' % (subnet_nodes[instance.subnet_id], node)
+        if vpc.endpoints:
+            yield '        vpc%d_ep [label=%s, fillcolor="#9C27B0", fontcolor="white"];' % (
+                v, _dot_quote('VPC Endpoints\n' + ', '.join(e.label for e in vpc.endpoints)))
+        yield '    }'
+
+    index = {vpc.id: v for v, vpc in enumerate(topology.vpcs)}
+    gateways = internet_vpcs(topology)
+    if gateways:
+        yield '    internet [label="Internet", shape=ellipse, fillcolor="#E3F2FD"];'
+    for vpc in gateways:
+        v = index[vpc.id]
+        yield '    igw%d [label=%s, fillcolor="#4B92DB", fontcolor="white"];' % (
+            v, _dot_quote('\n'.join(filter(None, ['Internet Gateway', vpc.internet_gateway_id]))))
+        yield '    vpc%d -> igw%d [ltail=cluster_vpc%d];' % (v, v, v)
+        yield '    igw%d -> internet;' % v
+    tgw = topology.transit_gateway
+    if tgw:
+        yield '    tgw [label=%s, shape=circle, fillcolor="#FF9900", fontcolor="white"];' % _dot_quote(
+            'Transit Gateway\n%s' % tgw.id)
+        for vpc in attached_vpcs(topology):
+            v = index[vpc.id]
+            yield '    vpc%d -> tgw [ltail=cluster_vpc%d];' % (v, v)
+    for n, vpn in enumerate(topology.vpn_connections):
+        yield '    vpn%d [label=%s, fillcolor="#FF5722", fontcolor="white"];' % (
+            n, _dot_quote('Site-to-Site VPN\n%s' % vpn.id))
+        if tgw:
+            yield '    tgw -> vpn%d;' % n
+        if vpn.customer_gateway_ip in cgw_nodes:
+            yield '    vpn%d -> %s [dir=none];' % (n, cgw_nodes[vpn.customer_gateway_ip])
+    yield '}'
+
+
+RENDERERS = {'markdown': markdown_lines, 'mermaid': mermaid_lines, 'dot': dot_lines}
+
+
+def write_lines(lines, handle):
+    for line in lines:
+        handle.write(line)
+        handle.write('\n')
+
+
+def update_markdown(path, topology):
+    """Replace the marked block of a Markdown file with freshly generated
+    content, streaming the rest of the file through unchanged"""
+    tmp = path + '.%d.tmp' % os.getpid()
+    found = False
+    with open(path, encoding='utf-8') as source, open(tmp, 'w', encoding='utf-8') as target:
+        skipping = False
+        for line in source:
+            if line.strip() == BEGIN_MARKER:
+                found = skipping = True
+                target.write(line)
+                write_lines(markdown_lines(topology), target)
+            elif line.strip() == END_MARKER:
+                skipping = False
+                target.write(line)
+            elif not skipping:
+                target.write(line)
+    if not found:
+        os.remove(tmp)
+        raise ValueError('%s has no %s marker' % (path, BEGIN_MARKER))
+    os.replace(tmp, path)
+
+
+def render(topology, fmt, output=None, style='professional', options=None):
+    """Render to a path (or stdout for text formats); raster and vector
+    formats are delegated to the matplotlib generators"""
+    if fmt in RENDERERS:
+        if output in (None, '-'):
+            write_lines(RENDERERS[fmt](topology), sys.stdout)
+        else:
+            with open(output, 'w', encoding='utf-8') as handle:
+                write_lines(RENDERERS[fmt](topology), handle)
+        return output
+    if output in (None, '-'):
+        raise ValueError('an output path is required for %s' % fmt)
+    from advnet.export import render_output
+    return render_output(style, fmt, topology, output, options or {})[0]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Render the lab topology as text, Mermaid or DOT')
+    add_source_arguments(parser)
+    parser.add_argument('-f', '--format', default=None,
+                        help='markdown, mermaid, dot, or any matplotlib format such as png/svg/pdf '
+                             '(default: from the output extension, else markdown)')
+    parser.add_argument('-o', '--output', default=None, help='output file (default: stdout)')
+    parser.add_argument('--update', metavar='MARKDOWN_FILE',
+                        help='regenerate the marked block of a Markdown file in place')
+    parser.add_argument('--style', choices=['simple', 'professional'], default='professional',
+                        help='diagram style for raster/vector formats (default: professional)')
+    args = parser.parse_args()
+
+    topology = topology_from_args(args)
+    if args.update:
+        update_markdown(args.update, topology)
+    else:
+        fmt = args.format
+        if fmt is None:
+            ext = os.path.splitext(args.output or '')[1].lstrip('.').lower()
+            by_ext = {v: k for k, v in TEXT_FORMATS.items()}
+            fmt = by_ext.get(ext, ext or 'markdown')
+        try:
+            render(topology, fmt, args.output, args.style)
+        except ValueError as error:
+            parser.error(str(error))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Diagram Export
+Renders both diagram styles to any set of formats on a non-interactive
+backend, one worker process per output. Every output is stamped with a hash
+of the topology inputs, style, format and generator sources in a manifest
+next to it, so unchanged outputs are skipped without importing matplotlib.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from advnet import profiling
+from advnet.topology import DEFAULT_CACHE_DIR, inputs_hash, lab_topology, load_topology
+
+# Bump whenever the export options or manifest layout change
+EXPORT_VERSION = 1
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_DIR = os.path.join(REPO_DIR, 'advnet')
+
+# style -> (generator script, figure function, output basename)
+STYLES = {
+    'simple': ('architecture-diagram.py', 'create_architecture_diagram', 'architecture-diagram'),
+    'professional': ('professional-architecture-diagram.py', 'create_professional_diagram',
+                     'aws-architecture-professional'),
+}
+
+DEFAULT_FORMATS = ('png', 'svg', 'pdf')
+
+MANIFEST = '.advnet-export.json'
+
+# advnet imports in a generator script or module (outside its __main__ block)
+_IMPORT = re.compile(r'^\s*(?:from advnet(?:\.(\w+))? import ([\w, ()]+)|import advnet\.(\w+))', re.M)
+
+
+def file_digest(path, digest):
+    """Feed a file's contents into a hashlib digest"""
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(chunk)
+    digest.update(b'\0')
+
+
+_sources = {}
+
+
+def generator_sources(style):
+    """advnet modules (file names) a style's generator imports, directly or
+    through each other; their source affects the rendered output"""
+    if style not in _sources:
+        found, pending = set(), [os.path.join(REPO_DIR, STYLES[style][0])]
+        while pending:
+            with open(pending.pop()) as handle:
+                text = handle.read().split('\nif __name__ ==', 1)[0]
+            for module, names, imported in _IMPORT.findall(text):
+                if module or imported:
+                    candidates = [module or imported]
+                else:
+                    candidates = re.findall(r'\w+', names)  # from advnet import profiling
+                for name in candidates:
+                    path = os.path.join(PACKAGE_DIR, name + '.py')
+                    if name + '.py' not in found and os.path.exists(path):
+                        found.add(name + '.py')
+                        pending.append(path)
+        _sources[style] = tuple(sorted(found))
+    return _sources[style]
+
+
+def output_hash(topology_key, style, fmt, options):
+    """Hash identifying one rendered output; changes whenever it would"""
+    digest = hashlib.sha256(b'advnet-export-%d' % EXPORT_VERSION)
+    digest.update(('%s\0%s\0%s\0%s\0' % (topology_key, style, fmt,
+                                        json.dumps(options, sort_keys=True))).encode())
+    file_digest(os.path.join(REPO_DIR, STYLES[style][0]), digest)
+    for name in generator_sources(style):
+        file_digest(os.path.join(PACKAGE_DIR, name), digest)
+    return digest.hexdigest()
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST)) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST)
+    tmp = path + '.%d.tmp' % os.getpid()
+    with open(tmp, 'w') as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def use_agg():
+    """Select the non-interactive backend; must run before pyplot is
+    imported anywhere in the process"""
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+_generators = {}
+
+
+def load_generator(style):
+    """Figure function for a style, loaded once per worker process"""
+    if style not in _generators:
+        import runpy
+        script, function, _ = STYLES[style]
+        if REPO_DIR not in sys.path:
+            sys.path.insert(0, REPO_DIR)
+        _generators[style] = runpy.run_path(os.path.join(REPO_DIR, script))[function]
+    return _generators[style]
+
+
+def render_output(style, fmt, topology, path, options):
+    """Render one style to one file; runs inside a worker process"""
+    use_agg()
+    import matplotlib.pyplot as plt
+
+    start = time.perf_counter()
+    fig = load_generator(style)(topology, options.get('layout', 'auto'), options.get('batched'))
+    save = dict(format=fmt, bbox_inches='tight', facecolor='white', edgecolor='none')
+    if fmt in ('png', 'jpg', 'jpeg', 'tif', 'tiff', 'webp'):
+        save['dpi'] = options.get('dpi', 300)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with profiling.phase('savefig.%s' % fmt):
+        fig.savefig(tmp, **save)
+    plt.close(fig)
+    os.replace(tmp, path)
+    return path, time.perf_counter() - start
+
+
+def export_diagrams(paths=(), out_dir='.', formats=DEFAULT_FORMATS, styles=tuple(STYLES),
+                    layout='auto', batched=None, dpi=300, jobs=None, force=False,
+                    cache_dir=None, use_cache=True):
+    """Render every style x format into out_dir, skipping up-to-date outputs.
+    Returns a list of (path, status, seconds) with status 'written' or 'cached'."""
+    paths = list(paths)
+    os.makedirs(out_dir, exist_ok=True)
+    options = {'layout': layout, 'batched': batched, 'dpi': dpi}
+    topology_key = inputs_hash(paths) if paths else 'lab'
+
+    manifest = read_manifest(out_dir)
+    results, pending = [], []
+    for style in styles:
+        for fmt in formats:
+            name = '%s.%s' % (STYLES[style][2], fmt)
+            path = os.path.join(out_dir, name)
+            stamp = output_hash(topology_key, style, fmt, options)
+            if not force and manifest.get(name) == stamp and os.path.exists(path):
+                results.append((path, 'cached', 0.0))
+            else:
+                pending.append((style, fmt, name, path, stamp))
+    if not pending:
+        return results
+
+    topology = (load_topology(paths, cache_dir=cache_dir, use_cache=use_cache)
+                if paths else lab_topology())
+    jobs = min(jobs or os.cpu_count() or 1, len(pending))
+    stamps = {path: (name, stamp) for _, _, name, path, stamp in pending}
+
+    def done(path, seconds):
+        name, stamp = stamps[path]
+        manifest[name] = stamp
+        results.append((path, 'written', seconds))
+
+    try:
+        if jobs == 1:
+            for style, fmt, _, path, _ in pending:
+                done(*render_output(style, fmt, topology, path, options))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=use_agg) as pool:
+                futures = [pool.submit(render_output, style, fmt, topology, path, options)
+                           for style, fmt, _, path, _ in pending]
+                for future in as_completed(futures):
+                    done(*future.result())
+    finally:
+        # Record whatever finished, even if another output failed
+        write_manifest(out_dir, manifest)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export the lab architecture diagrams')
+    parser.add_argument('terraform', nargs='*', metavar='TF_FILE',
+                        help='tfplan archive, tfstate, or `terraform show/output -json` '
+                             'files (defaults to the lab topology)')
+    parser.add_argument('-o', '--out-dir', default='.',
+                        help='directory for the rendered diagrams (default: current directory)')
+    parser.add_argument('-f', '--formats', default=','.join(DEFAULT_FORMATS),
+                        help='comma-separated output formats (default: %(default)s)')
+    parser.add_argument('-s', '--styles', default=','.join(STYLES),
+                        help='comma-separated diagram styles (default: %(default)s)')
+    parser.add_argument('--layout', choices=['auto', 'grid', 'radial'], default='auto',
+                        help='VPC placement (default: grid, radial for large estates)')
+    parser.add_argument('--batched', action=argparse.BooleanOptionalAction, default=None,
+                        help='draw shapes as collections, or one artist per shape with --no-batched '
+                             '(default: collections for large estates)')
+    parser.add_argument('--dpi', type=int, default=300, help='raster resolution (default: 300)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes (default: one per output, up to the CPU count)')
+    parser.add_argument('--force', action='store_true',
+                        help='re-render outputs even if they are up to date')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always re-parse the Terraform inputs')
+    parser.add_argument('--cache-dir', default=None,
+                        help='topology cache directory (default: %s)' % DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    formats = [f.strip().lower().lstrip('.') for f in args.formats.split(',') if f.strip()]
+    styles = [s.strip() for s in args.styles.split(',') if s.strip()]
+    unknown = [s for s in styles if s not in STYLES]
+    if unknown:
+        parser.error('unknown style(s): %s (choose from %s)' % (', '.join(unknown), ', '.join(STYLES)))
+
+    start = time.perf_counter()
+    results = export_diagrams(args.terraform, args.out_dir, formats, styles, args.layout,
+                              args.batched, args.dpi, args.jobs, args.force,
+                              args.cache_dir, not args.no_cache)
+    for path, status, seconds in sorted(results):
+        if status == 'cached':
+            print("- %s (up to date)" % path)
+        else:
+            print("- %s (%.1fs)" % (path, seconds))
+    written = sum(1 for _, status, _ in results if status == 'written')
+    print("%d written, %d up to date in %.2fs" % (written, len(results) - written,
+                                                  time.perf_counter() - start))
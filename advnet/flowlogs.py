@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Flow Log Store
+Ingests exported VPC Flow Logs (default v2 format, plain or gzipped) into a
+columnar on-disk cache: one flat binary file per field, parsed in chunks with
+vectorised NumPy and memory-mapped for queries. Addresses are stored as
+uint32, ports as uint16, actions and log statuses as small enums and
+interface ids as codes into a per-store dictionary. Files are split into
+byte ranges (gzip files are taken whole) and parsed across processes; a
+store is keyed by the input paths, sizes and mtimes so repeat queries never
+touch the text again. Numbers are parsed eight digits at a time from 64-bit
+words (SWAR); a core still manages only some tens of MB/s, so throughput
+comes from the worker processes.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from advnet.topology import DEFAULT_CACHE_DIR, cidr_range, int_to_ip
+
+# Bump whenever the column layout or parser changes
+FLOWLOG_CACHE_VERSION = 2
+
+# Default (version 2) record format, in order
+V2_FIELDS = ('version', 'account-id', 'interface-id', 'srcaddr', 'dstaddr', 'srcport', 'dstport',
+             'protocol', 'packets', 'bytes', 'start', 'end', 'action', 'log-status')
+
+# Stored columns and their dtypes
+COLUMNS = {
+    'version': np.uint8,
+    'account_id': np.uint64,
+    'interface': np.uint32,
+    'srcaddr': np.uint32,
+    'dstaddr': np.uint32,
+    'srcport': np.uint16,
+    'dstport': np.uint16,
+    'protocol': np.uint8,
+    'packets': np.uint64,
+    'bytes': np.uint64,
+    'start': np.uint32,
+    'end': np.uint32,
+    'action': np.uint8,
+    'log_status': np.uint8,
+}
+
+# Enum codes; '-' (no data) is always 0
+ACTIONS = ('-', 'ACCEPT', 'REJECT')
+LOG_STATUSES = ('OK', 'NODATA', 'SKIPDATA')
+PROTOCOLS = {1: 'ICMP', 6: 'TCP', 17: 'UDP', 50: 'ESP', 58: 'ICMPv6'}
+
+# Bytes of text parsed per step; bounds each worker's memory
+CHUNK_SIZE = 32 << 20
+
+# Plain files larger than this are split across workers
+SPLIT_SIZE = 64 << 20
+
+_SPACE, _NEWLINE, _RETURN, _DOT, _ZERO = 32, 10, 13, 46, 48
+
+# Separators put around every chunk so an 8-byte word can start or end at any token
+_PAD = b' ' * 8
+
+# Per token length 0-8: the bytes of a little-endian word that belong to a
+# token ending (or starting) at the word's end (start)
+_DIGIT_MASKS = np.array([((1 << 8 * n) - 1) << 8 * (8 - n) for n in range(9)], dtype=np.uint64)
+_TOKEN_MASKS = np.array([(1 << 8 * n) - 1 for n in range(9)], dtype=np.uint64)
+# The same for the three bytes ending at an address octet
+_OCTET_MASKS = np.array([((1 << 8 * n) - 1) << 8 * (3 - n) for n in range(4)], dtype=np.uint64)
+_ZEROS = np.uint64(0x3030303030303030)
+_SIXES = np.uint64(0x0606060606060606)
+_HIGH_NIBBLES = np.uint64(0xF0F0F0F0F0F0F0F0)
+_PAIRS = np.uint64(0x000000FF000000FF)
+
+
+# --- Vectorised parser ---
+
+def _words(buf):
+    """Every (unaligned) little-endian 8-byte word of buf, without copying it"""
+    return np.ndarray((len(buf) - 7,), dtype='<u8', buffer=buf, strides=(1,))
+
+
+def _is_digits(word):
+    """Whether all eight bytes of each word are ASCII digits"""
+    return ((word & _HIGH_NIBBLES) == _ZEROS) & (((word + _SIXES) & _HIGH_NIBBLES) == _ZEROS)
+
+
+def _integers(words, starts, ends):
+    """Parse decimal tokens [starts:ends) as int64; returns (values, ok)
+    where ok is False for '-' and anything else that is not all digits"""
+    if not len(starts):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    lengths = ends - starts
+    value = np.zeros(len(starts), dtype=np.uint64)
+    ok = lengths > 0
+    for j in range(-(-int(lengths.max()) // 8)):
+        # Eight characters right-aligned at the token end, those before the
+        # token made '0', then combined pairwise with three multiplies (SWAR)
+        mask = _DIGIT_MASKS[np.clip(lengths - 8 * j, 0, 8)]
+        word = (words[np.maximum(ends - 8 * (j + 1), 0)] & mask) | (_ZEROS & ~mask)
+        ok &= _is_digits(word)
+        word -= _ZEROS
+        word = word * np.uint64(10) + (word >> np.uint64(8))
+        word = ((word & _PAIRS) * np.uint64(100 + (1000000 << 32))
+                + ((word >> np.uint64(16)) & _PAIRS) * np.uint64(1 + (10000 << 32))) >> np.uint64(32)
+        value += word * np.uint64(10 ** (8 * j) % (1 << 64))
+    value[~ok] = 0
+    # Wraps past 19 digits; the uint64 columns still get the value mod 2**64
+    return value.astype(np.int64), ok
+
+
+def _addresses(words, starts, ends, dots):
+    """Parse dotted-quad tokens, split at the chunk's dot positions, into
+    uint32 (0 for '-' and anything else that is not an address)"""
+    rows = len(starts)
+    if len(dots) < 3:
+        return np.zeros(rows, dtype=np.uint32)
+    k = np.searchsorted(dots, starts)
+    d = dots[np.minimum(k[:, None] + np.arange(4), len(dots) - 1)]
+    # Exactly three dots inside the token, one to three digits between them
+    ok = (k + 2 < len(dots)) & (d[:, 2] < ends) & ((k + 3 >= len(dots)) | (d[:, 3] >= ends))
+    first = np.column_stack([starts, d[:, :3] + 1])
+    last = np.column_stack([d[:, :3], ends])
+    lengths = last - first
+    ok &= ((lengths >= 1) & (lengths <= 3)).all(axis=1)
+    # An octet's digits are the top three bytes of the word ending at it
+    mask = _OCTET_MASKS[np.clip(lengths, 0, 3)]
+    word = ((words[np.maximum(last - 8, 0)] >> np.uint64(40)) & mask) | (_ZEROS & ~mask)
+    ok &= _is_digits(word).all(axis=1)
+    word -= _ZEROS
+    octets = (word >> np.uint64(16)) + ((word >> np.uint64(8)) & np.uint64(0xFF)) * np.uint64(10) \
+        + (word & np.uint64(0xFF)) * np.uint64(100)
+    ok &= (octets <= 255).all(axis=1)
+    packed = (octets[:, 0] << np.uint64(24)) | (octets[:, 1] << np.uint64(16)) \
+        | (octets[:, 2] << np.uint64(8)) | octets[:, 3]
+    return np.where(ok, packed, 0).astype(np.uint32)
+
+
+def _strings(words, starts, ends):
+    """Dictionary-encode tokens: (codes, values)"""
+    if not len(starts):
+        return np.zeros(0, dtype=np.uint32), []
+    lengths = ends - starts
+    # Each token as zero-padded 8-byte words, hashed to one uint64 so the
+    # dictionary is an integer unique; fall back to comparing the words
+    # themselves if two tokens collide
+    packed = np.column_stack([words[np.minimum(starts + 8 * i, len(words) - 1)]
+                              & _TOKEN_MASKS[np.clip(lengths - 8 * i, 0, 8)]
+                              for i in range(-(-int(lengths.max()) // 8))])
+    key = np.zeros(len(packed), dtype=np.uint64)
+    for i in range(packed.shape[1]):
+        key = (key * np.uint64(0x100000001B3)) ^ packed[:, i]
+    keys, first, codes = np.unique(key, return_index=True, return_inverse=True)
+    text = packed.view('S%d' % (8 * packed.shape[1])).ravel()
+    if not (packed == packed[first][codes.ravel()]).all():
+        values, codes = np.unique(text, return_inverse=True)
+        return codes.astype(np.uint32).ravel(), [v.decode('ascii', 'replace') for v in values]
+    return codes.astype(np.uint32).ravel(), [v.decode('ascii', 'replace') for v in text[first]]
+
+
+def parse_chunk(data):
+    """Parse whole lines of v2 flow-log text into (columns, interfaces).
+    Header lines and malformed records are skipped; a leading export
+    timestamp (CloudWatch Logs exports) is tolerated."""
+    data = _PAD + data + (_PAD if data.endswith(b'\n') else b'\n' + _PAD)
+    buf = np.frombuffer(data, dtype=np.uint8)
+    sep = buf <= _SPACE
+    edges = np.flatnonzero(sep[1:] != sep[:-1]) + 1
+    if not sep[0]:
+        edges = np.concatenate([[0], edges])
+    starts, ends = edges[0::2], edges[1::2]
+
+    # A token ends its line when the separators up to the next token hold a
+    # newline (so trailing spaces, tabs and CRLF are all fine)
+    last = np.searchsorted(ends, np.flatnonzero(buf == _NEWLINE), side='right')
+    line_ends = last[np.append(True, last[1:] != last[:-1]) & (last > 0)]
+    first = np.concatenate([[0], line_ends[:-1]])
+    counts = line_ends - first
+
+    fields = len(V2_FIELDS)
+    prefixed = counts == fields + 1
+    valid = (counts == fields) | prefixed
+    first = first[valid] + prefixed[valid]
+    # The version field must be numeric (skips the "version account-id ..." header)
+    version_char = buf[starts[np.minimum(first, len(starts) - 1)]] if len(starts) else first
+    first = first[(version_char >= _ZERO) & (version_char <= _ZERO + 9)]
+
+    token = first[:, None] + np.arange(fields)
+    s, e = starts[token], ends[token]
+    rows = len(token)
+    col = {name: i for i, name in enumerate(V2_FIELDS)}
+
+    # Parse fields of similar width together: short (version and protocol),
+    # ports, and the long counters/timestamps; addresses on their own
+    words = _words(buf)
+    dots = np.flatnonzero(buf == _DOT)
+    short = [col['version'], col['protocol']]
+    values = _integers(words, s[:, short].T.ravel(), e[:, short].T.ravel())[0].reshape(2, rows)
+    ports = [col['srcport'], col['dstport']]
+    port_values = _integers(words, s[:, ports].T.ravel(), e[:, ports].T.ravel())[0].reshape(2, rows)
+    wide = [col[name] for name in ('account-id', 'packets', 'bytes', 'start', 'end')]
+    wide_values = _integers(words, s[:, wide].T.ravel(), e[:, wide].T.ravel())[0].reshape(len(wide), rows)
+
+    interface, interfaces = _strings(words, s[:, col['interface-id']], e[:, col['interface-id']])
+    action_char = buf[s[:, col['action']]]
+    status_char = buf[s[:, col['log-status']]]
+    columns = {
+        'version': values[0].astype(np.uint8),
+        'account_id': wide_values[0].astype(np.uint64),
+        'interface': interface,
+        'srcaddr': _addresses(words, s[:, col['srcaddr']], e[:, col['srcaddr']], dots),
+        'dstaddr': _addresses(words, s[:, col['dstaddr']], e[:, col['dstaddr']], dots),
+        'srcport': port_values[0].astype(np.uint16),
+        'dstport': port_values[1].astype(np.uint16),
+        'protocol': values[1].astype(np.uint8),
+        'packets': wide_values[1].astype(np.uint64),
+        'bytes': wide_values[2].astype(np.uint64),
+        'start': wide_values[3].astype(np.uint32),
+        'end': wide_values[4].astype(np.uint32),
+        'action': np.select([action_char == ord('A'), action_char == ord('R')], [1, 2], 0).astype(np.uint8),
+        'log_status': np.select([status_char == ord('N'), status_char == ord('S')], [1, 2], 0).astype(np.uint8),
+    }
+    return columns, interfaces
+
+
+# --- Reading ---
+
+def _is_gzip(path):
+    with open(path, 'rb') as handle:
+        return handle.read(2) == b'\x1f\x8b'
+
+
+def read_chunks(path, offset=0, length=None, chunk_size=CHUNK_SIZE):
+    """Yield blocks of whole lines from a file or a byte range of it. A range
+    owns every line that starts inside it."""
+    if length is None:
+        opener = gzip.open if _is_gzip(path) else open
+        with opener(path, 'rb') as handle:
+            carry = b''
+            for block in iter(lambda: handle.read(chunk_size), b''):
+                block = carry + block
+                cut = block.rfind(b'\n') + 1
+                if cut:
+                    yield block[:cut]
+                carry = block[cut:]
+            if carry:
+                yield carry
+        return
+
+    with open(path, 'rb') as handle:
+        if offset:
+            handle.seek(offset - 1)
+            handle.readline()  # the line in progress belongs to the previous range
+        end = offset + length
+        while handle.tell() < end:
+            block = handle.read(min(chunk_size, end - handle.tell()))
+            if not block:
+                break
+            if not block.endswith(b'\n'):
+                block += handle.readline()
+            yield block
+
+
+def _tasks(paths, split_size=SPLIT_SIZE):
+    """Work units: byte ranges of large plain files, whole gzip files"""
+    tasks = []
+    for path in paths:
+        size = os.path.getsize(path)
+        if _is_gzip(path) or size <= split_size:
+            tasks.append((path, 0, None))
+        else:
+            tasks.extend((path, start, min(split_size, size - start))
+                         for start in range(0, size, split_size))
+    return tasks
+
+
+def _ingest_task(task, part_dir):
+    """Parse one work unit into column files under part_dir"""
+    path, offset, length = task
+    os.makedirs(part_dir, exist_ok=True)
+    handles = {name: open(os.path.join(part_dir, name + '.bin'), 'wb') for name in COLUMNS}
+    interfaces, rows = {}, 0
+    try:
+        for block in read_chunks(path, offset, length):
+            columns, names = parse_chunk(block)
+            # Re-code this chunk's interface ids into the task-wide dictionary
+            remap = np.array([interfaces.setdefault(n, len(interfaces)) for n in names], dtype=np.uint32)
+            if len(remap):
+                columns['interface'] = remap[columns['interface']]
+            for name, handle in handles.items():
+                handle.write(np.ascontiguousarray(columns[name], dtype=COLUMNS[name]).tobytes())
+            rows += len(columns['srcaddr'])
+    finally:
+        for handle in handles.values():
+            handle.close()
+    return rows, list(interfaces)
+
+
+# --- Store ---
+
+class FlowLogStore:
+    """Memory-mapped columns of an ingested set of flow-log files"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as handle:
+            self.meta = json.load(handle)
+        self.rows = self.meta['rows']
+        self.interfaces = self.meta['interfaces']
+        self._columns = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in COLUMNS:
+            raise AttributeError(name)
+        return self.column(name)
+
+    def column(self, name):
+        if name not in self._columns:
+            if self.rows:
+                self._columns[name] = np.memmap(os.path.join(self.path, name + '.bin'),
+                                                dtype=COLUMNS[name], mode='r', shape=(self.rows,))
+            else:
+                self._columns[name] = np.zeros(0, dtype=COLUMNS[name])
+        return self._columns[name]
+
+    def mask(self, src=None, dst=None, port=None, protocol=None, action=None, interface=None):
+        """Boolean row mask for the common filters (CIDRs, dst port, names)"""
+        keep = np.ones(self.rows, dtype=bool)
+        for column, cidr in (('srcaddr', src), ('dstaddr', dst)):
+            if cidr:
+                low, high = cidr_range(cidr)
+                values = self.column(column)
+                keep &= (values >= low) & (values <= high)
+        if port is not None:
+            keep &= self.dstport == port
+        if protocol is not None:
+            keep &= self.protocol == protocol
+        if action:
+            keep &= self.action == ACTIONS.index(action.upper())
+        if interface:
+            keep &= self.interface == self.interfaces.index(interface)
+        return keep
+
+
+def store_key(paths):
+    digest = hashlib.sha256(b'advnet-flowlogs-%d' % FLOWLOG_CACHE_VERSION)
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(('%s\0%d\0%d\0' % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)).encode())
+    return digest.hexdigest()
+
+
+def ingest(paths, cache_dir=None, jobs=None, use_cache=True):
+    """Return a FlowLogStore for the files, parsing them only if no store
+    exists for their current contents"""
+    paths = list(paths)
+    cache_dir = cache_dir or os.environ.get('ADVNET_CACHE_DIR', DEFAULT_CACHE_DIR)
+    store_dir = os.path.join(cache_dir, 'flowlogs-%s' % store_key(paths))
+    if use_cache and os.path.exists(os.path.join(store_dir, 'meta.json')):
+        return FlowLogStore(store_dir)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    work = tempfile.mkdtemp(prefix='flowlogs-', dir=cache_dir)
+    try:
+        tasks = _tasks(paths)
+        parts = [os.path.join(work, 'part-%05d' % i) for i in range(len(tasks))]
+        jobs = min(jobs or os.cpu_count() or 1, len(tasks)) or 1
+        if jobs == 1:
+            results = [_ingest_task(task, part) for task, part in zip(tasks, parts)]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                results = list(pool.map(_ingest_task, tasks, parts))
+
+        # Concatenate the parts in input order under one interface dictionary
+        interfaces = {}
+        for name in COLUMNS:
+            with open(os.path.join(work, name + '.bin'), 'wb') as target:
+                for part, (rows, names) in zip(parts, results):
+                    source = os.path.join(part, name + '.bin')
+                    if name == 'interface':
+                        remap = np.array([interfaces.setdefault(n, len(interfaces)) for n in names],
+                                         dtype=np.uint32)
+                        codes = np.fromfile(source, dtype=np.uint32)
+                        target.write(remap[codes].tobytes() if len(codes) else b'')
+                    else:
+                        with open(source, 'rb') as handle:
+                            shutil.copyfileobj(handle, target, 16 << 20)
+        for part in parts:
+            shutil.rmtree(part, ignore_errors=True)
+
+        meta = {'version': FLOWLOG_CACHE_VERSION, 'rows': sum(rows for rows, _ in results),
+                'interfaces': list(interfaces), 'sources': [os.path.abspath(p) for p in paths],
+                'columns': {name: np.dtype(dtype).name for name, dtype in COLUMNS.items()}}
+        with open(os.path.join(work, 'meta.json'), 'w') as handle:
+            json.dump(meta, handle, indent=2)
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.replace(work, store_dir)
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    return FlowLogStore(store_dir)
+
+
+def top(store, key_columns, keep=None, n=10, weight='bytes'):
+    """Top n key tuples by summed weight column (or record count)"""
+    keep = slice(None) if keep is None else keep
+    keys = np.stack([np.asarray(store.column(c)[keep], dtype=np.uint64) for c in key_columns], axis=1)
+    if not len(keys):
+        return []
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    weights = np.ones(len(keys)) if weight == 'records' else np.asarray(store.column(weight)[keep], dtype=np.float64)
+    totals = np.bincount(inverse.ravel(), weights=weights, minlength=len(unique))
+    order = np.argsort(totals)[::-1][:n]
+    return [(tuple(int(v) for v in unique[i]), int(totals[i])) for i in order]
+
+
+def _describe(column, value):
+    if column in ('srcaddr', 'dstaddr'):
+        return int_to_ip(value)
+    if column == 'protocol':
+        return PROTOCOLS.get(value, str(value))
+    if column == 'action':
+        return ACTIONS[value]
+    return str(value)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ingest and query exported VPC Flow Logs')
+    parser.add_argument('files', nargs='+', metavar='FLOW_LOG',
+                        help='flow-log exports (v2 default format, optionally gzipped)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='store directory (default: %s)' % DEFAULT_CACHE_DIR)
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='parser processes (default: CPU count)')
+    parser.add_argument('--reingest', action='store_true', help='ignore an existing store')
+    parser.add_argument('--src', help='source CIDR filter')
+    parser.add_argument('--dst', help='destination CIDR filter')
+    parser.add_argument('--port', type=int, help='destination port filter')
+    parser.add_argument('--action', choices=['ACCEPT', 'REJECT'], help='action filter')
+    parser.add_argument('--top', type=int, default=10, help='rows in each top-N table')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = ingest(args.files, args.cache_dir, args.jobs, use_cache=not args.reingest)
+    loaded = time.perf_counter() - start
+    size = sum(os.path.getsize(p) for p in args.files)
+    print("%d records from %.1f MB in %.2fs (%s)" % (len(store), size / 1e6, loaded, store.path),
+          file=sys.stderr)
+
+    keep = store.mask(args.src, args.dst, args.port, action=args.action)
+    print("Matching records: %d, bytes: %d, packets: %d" % (
+        int(keep.sum()), int(store.bytes[keep].sum()), int(store.packets[keep].sum())))
+    for title, key, sep in (('Top talkers (bytes)', ('srcaddr', 'dstaddr'), ' -> '),
+                            ('Top destination ports (bytes)', ('dstport', 'protocol'), '/'),
+                            ('Actions (records)', ('action',), '')):
+        print("\n%s:" % title)
+        for values, total in top(store, key, keep, args.top, 'records' if key == ('action',) else 'bytes'):
+            print("  %-40s %d" % (sep.join(_describe(c, v) for c, v in zip(key, values)), total))
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Streaming Flow Log Triage
+Answers "who is talking the most" and "what is suddenly being rejected"
+over a flow-log stream (a file, a gzipped export or `tail -F ... |` on
+stdin) without loading it first. Each time window is summarised with
+fixed-size structures: count-min sketches with heavy-hitter candidate sets
+for src/dst pairs and ports, HyperLogLog for distinct peers, and exact
+per-VPC totals. REJECT counts are compared against a decaying count-min
+baseline of earlier windows to flag spikes. Memory depends only on the
+sketch sizes and the read chunk size, never on the input volume.
+Parsing the text costs several times more than the sketch updates, so
+chunks of a file are parsed in worker processes while the sketches are
+updated in order in the main one.
+"""
+
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from advnet.flowlogs import ACTIONS, PROTOCOLS, read_chunks, parse_chunk
+from advnet.topology import cidr_range, int_to_ip
+
+# Text read per step; small enough to keep a tailed stream responsive
+CHUNK_SIZE = 4 << 20
+
+DEFAULT_WINDOW = 60
+
+_REJECT = ACTIONS.index('REJECT')
+
+# Columns the windows use; workers send back only these
+_USED = ('srcaddr', 'dstaddr', 'dstport', 'protocol', 'bytes', 'action', 'start')
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _mix(keys, seed):
+    """splitmix64 finaliser: a well-spread 64-bit hash of uint64 keys"""
+    x = keys + np.uint64((0x9E3779B97F4A7C15 * (seed + 1)) & 0xFFFFFFFFFFFFFFFF)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+# --- Sketches ---
+
+class CountMinSketch:
+    """Approximate per-key sums; estimates never undercount"""
+
+    def __init__(self, width=1 << 16, depth=4):
+        if width & (width - 1):
+            raise ValueError('count-min width must be a power of two')
+        self.width, self.depth = width, depth
+        self.table = np.zeros((depth, width))
+
+    def buckets(self, keys):
+        """Bucket of every key in each row; rows take disjoint bit slices of
+        as few 64-bit hashes as possible"""
+        bits = self.width.bit_length() - 1
+        per_hash = max(64 // max(bits, 1), 1)
+        mask = np.uint64(self.width - 1)
+        rows = []
+        for row in range(self.depth):
+            if row % per_hash == 0:
+                hashed = _mix(keys, row)
+            rows.append(((hashed >> np.uint64(row % per_hash * bits)) & mask).astype(np.intp))
+        return rows
+
+    def add(self, keys, weights=None, buckets=None):
+        for row, slots in enumerate(buckets or self.buckets(keys)):
+            self.table[row] += np.bincount(slots, weights, minlength=self.width)
+
+    def estimate(self, keys, buckets=None):
+        if not len(keys):
+            return np.zeros(0)
+        return np.min([self.table[row][slots] for row, slots in enumerate(buckets or self.buckets(keys))],
+                      axis=0)
+
+    def blend(self, other, weight):
+        """Exponential moving average towards another sketch of the same shape"""
+        self.table *= 1.0 - weight
+        self.table += weight * other.table
+
+
+class HeavyHitters:
+    """Top-k keys by weight: a count-min sketch plus k candidate keys. Only
+    keys whose running estimate beats the current k-th candidate are
+    considered, so an update costs one sketch pass over the chunk."""
+
+    def __init__(self, k=20, width=1 << 16, depth=4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.total = 0.0
+
+    def add(self, keys, weights=None):
+        if not len(keys):
+            return
+        buckets = self.sketch.buckets(keys)
+        self.sketch.add(keys, weights, buckets)
+        self.total += float(weights.sum()) if weights is not None else len(keys)
+        estimates = self.sketch.estimate(keys, buckets)
+        if len(self.keys) >= self.k:
+            floor = self.sketch.estimate(self.keys).min()
+            keys = keys[estimates > floor]
+        candidates = np.union1d(self.keys, keys)
+        if len(candidates) > self.k:
+            estimates = self.sketch.estimate(candidates)
+            candidates = candidates[np.argsort(estimates, kind='stable')[::-1][:self.k]]
+        self.keys = candidates
+
+    def top(self, n=None):
+        """[(key, estimate)] heaviest first"""
+        estimates = self.sketch.estimate(self.keys)
+        order = np.argsort(estimates, kind='stable')[::-1][:n]
+        return [(int(self.keys[i]), float(estimates[i])) for i in order]
+
+
+class HyperLogLog:
+    """Distinct-count estimates for one or more groups of keys (2**p
+    registers per group, ~1.04/sqrt(2**p) relative error)"""
+
+    def __init__(self, p=12, groups=1):
+        self.p = p
+        self.registers = np.zeros((groups, 1 << p), dtype=np.uint8)
+
+    def add(self, keys, groups=None):
+        if not len(keys):
+            return
+        hashed = _mix(keys.astype(np.uint64), 17)
+        index = (hashed >> np.uint64(64 - self.p)).astype(np.intp)
+        # Rank = leading zeros of the remaining bits + 1, taken from the top
+        # 52 bits so the float conversion is exact
+        rest = ((hashed << np.uint64(self.p)) & _MASK64) >> np.uint64(12)
+        _, exponent = np.frexp(rest.astype(np.float64))
+        rank = (53 - exponent).astype(np.uint8)
+        groups = np.zeros(len(keys), dtype=np.intp) if groups is None else groups
+        np.maximum.at(self.registers, (groups, index), rank)
+
+    def count(self):
+        """Estimated distinct keys per group"""
+        m = self.registers.shape[1]
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(2.0 ** -self.registers.astype(np.float64), axis=1)
+        zeros = np.count_nonzero(self.registers == 0, axis=1)
+        # Linear counting while many registers are still empty
+        small = (raw <= 2.5 * m) & (zeros > 0)
+        linear = m * np.log(m / np.maximum(zeros, 1))
+        return np.where(small, linear, raw)
+
+
+# --- Windows ---
+
+def _pair_keys(columns):
+    return (columns['srcaddr'].astype(np.uint64) << np.uint64(32)) | columns['dstaddr']
+
+
+def _port_keys(columns):
+    return (columns['dstport'].astype(np.uint64) << np.uint64(8)) | columns['protocol']
+
+
+def describe_pair(key):
+    return '%s -> %s' % (int_to_ip(key >> 32), int_to_ip(key & 0xFFFFFFFF))
+
+
+def describe_port(key):
+    protocol = key & 0xFF
+    return '%d/%s' % (key >> 8, PROTOCOLS.get(protocol, str(protocol)))
+
+
+class VpcIndex:
+    """Maps addresses to VPCs of the topology; the last index is 'external'"""
+
+    def __init__(self, topology=None):
+        vpcs = sorted(topology.vpcs if topology else [], key=lambda v: cidr_range(v.cidr)[0])
+        self.names = [v.name or v.key for v in vpcs] + ['external']
+        ranges = np.array([cidr_range(v.cidr) for v in vpcs], dtype=np.int64).reshape(-1, 2)
+        self.low, self.high = ranges[:, 0], ranges[:, 1]
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, addresses):
+        if not len(self.low):
+            return np.full(len(addresses), len(self.names) - 1, dtype=np.intp)
+        addresses = addresses.astype(np.int64)
+        slot = np.searchsorted(self.low, addresses, side='right') - 1
+        inside = (slot >= 0) & (addresses <= self.high[np.maximum(slot, 0)])
+        return np.where(inside, slot, len(self.names) - 1)
+
+
+class Window:
+    """Fixed-size summary of one time window of flow records"""
+
+    def __init__(self, start, length, vpcs, k=20, width=1 << 16, depth=4, p=12):
+        self.start, self.length, self.vpcs = start, length, vpcs
+        self.records = 0
+        self.bytes = 0
+        self.rejects = 0
+        self.pairs = HeavyHitters(k, width, depth)
+        self.ports = HeavyHitters(k, width, depth)
+        self.reject_pairs = HeavyHitters(k, width, depth)
+        self.reject_ports = HeavyHitters(k, width, depth)
+        self.sources = HyperLogLog(p)
+        self.destinations = HyperLogLog(p)
+        self.reject_sources = HyperLogLog(p)
+        self.peers = HyperLogLog(p, len(vpcs))
+        self.vpc_bytes = np.zeros(len(vpcs))
+
+    def add(self, columns):
+        size = columns['bytes'].astype(np.float64)
+        pairs, ports = _pair_keys(columns), _port_keys(columns)
+        self.records += len(size)
+        self.bytes += int(size.sum())
+        self.pairs.add(pairs, size)
+        self.ports.add(ports, size)
+        self.sources.add(columns['srcaddr'])
+        self.destinations.add(columns['dstaddr'])
+
+        # Traffic touching each VPC (counted once when it stays inside one)
+        src_vpc, dst_vpc = self.vpcs.lookup(columns['srcaddr']), self.vpcs.lookup(columns['dstaddr'])
+        self.vpc_bytes += np.bincount(src_vpc, size, minlength=len(self.vpcs))
+        crossing = src_vpc != dst_vpc
+        self.vpc_bytes += np.bincount(dst_vpc[crossing], size[crossing], minlength=len(self.vpcs))
+        self.peers.add(columns['dstaddr'], src_vpc)
+        self.peers.add(columns['srcaddr'], dst_vpc)
+
+        rejected = columns['action'] == _REJECT
+        if rejected.any():
+            self.rejects += int(rejected.sum())
+            self.reject_pairs.add(pairs[rejected])
+            self.reject_ports.add(ports[rejected])
+            self.reject_sources.add(columns['srcaddr'][rejected])
+
+
+class Baseline:
+    """Decaying per-key REJECT rates of earlier windows"""
+
+    def __init__(self, decay=0.3, width=1 << 16, depth=4):
+        self.decay = decay
+        self.windows = 0
+        self.pairs = CountMinSketch(width, depth)
+        self.ports = CountMinSketch(width, depth)
+
+    def spikes(self, window, factor=5.0, min_count=20, n=10):
+        """REJECT heavy hitters of a window well above their usual rate;
+        [(kind, key, count, baseline)]"""
+        if not self.windows:
+            return []
+        found = []
+        for kind, hitters, usual in (('pair', window.reject_pairs, self.pairs),
+                                     ('port', window.reject_ports, self.ports)):
+            top = hitters.top()
+            if not top:
+                continue
+            expected = usual.estimate(np.array([key for key, _ in top], dtype=np.uint64))
+            for (key, count), before in zip(top, expected):
+                if count >= min_count and count >= factor * (before + 1):
+                    found.append((kind, key, count, float(before)))
+        found.sort(key=lambda spike: spike[2] / (spike[3] + 1), reverse=True)
+        return found[:n]
+
+    def update(self, window):
+        weight = 1.0 if not self.windows else self.decay
+        self.pairs.blend(window.reject_pairs.sketch, weight)
+        self.ports.blend(window.reject_ports.sketch, weight)
+        self.windows += 1
+
+
+def report(window, baseline, n=10, factor=5.0, min_count=20):
+    """JSON-friendly summary of a closed window"""
+    peers = window.peers.count()
+    return {
+        'start': window.start,
+        'end': window.start + window.length,
+        'records': window.records,
+        'bytes': window.bytes,
+        'rejects': window.rejects,
+        'distinct_sources': round(float(window.sources.count()[0])),
+        'distinct_destinations': round(float(window.destinations.count()[0])),
+        'distinct_rejected_sources': round(float(window.reject_sources.count()[0])),
+        'top_talkers': [{'pair': describe_pair(k), 'bytes': round(v)} for k, v in window.pairs.top(n)],
+        'top_ports': [{'port': describe_port(k), 'bytes': round(v)} for k, v in window.ports.top(n)],
+        'vpcs': [{'vpc': name, 'bytes': int(window.vpc_bytes[i]), 'peers': round(float(peers[i]))}
+                 for i, name in enumerate(window.vpcs.names) if window.vpc_bytes[i]],
+        'top_rejects': [{'pair': describe_pair(k), 'records': round(v)}
+                        for k, v in window.reject_pairs.top(n)],
+        'reject_spikes': [{'kind': kind,
+                           'key': describe_pair(key) if kind == 'pair' else describe_port(key),
+                           'records': round(count), 'baseline': round(before, 1)}
+                          for kind, key, count, before in baseline.spikes(window, factor, min_count, n)],
+    }
+
+
+# --- Stream ---
+
+def parse_block(block):
+    """The used columns of a block's OK records"""
+    columns, _ = parse_chunk(block)
+    keep = columns['log_status'] == 0
+    return {name: columns[name] if keep.all() else columns[name][keep] for name in _USED}
+
+
+def parse_blocks(blocks, jobs=None):
+    """Parsed blocks in order; with more than one job, parsed ahead in
+    worker processes (at most two blocks per worker in flight)"""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        for block in blocks:
+            yield parse_block(block)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for block in blocks:
+            pending.append(pool.submit(parse_block, block))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_stream(handle, chunk_size=CHUNK_SIZE):
+    """Yield blocks of whole lines from a binary stream as soon as they arrive"""
+    read = getattr(handle, 'read1', handle.read)
+    try:
+        import select
+        fd = handle.fileno()
+        select.select([fd], [], [], 0)
+    except (ImportError, OSError, ValueError, AttributeError):
+        fd = None
+    carry, ended = b'', False
+    while not ended:
+        block = read(chunk_size)
+        if not block:
+            break
+        # Batch up whatever else is already waiting (pipes deliver 64 KB at a
+        # time) so a fast producer gets big chunks and a slow tail low latency
+        parts = [block]
+        size = len(block)
+        while fd is not None and size < chunk_size and select.select([fd], [], [], 0)[0]:
+            more = read(chunk_size - size)
+            if not more:
+                ended = True
+                break
+            parts.append(more)
+            size += len(more)
+        block = carry + b''.join(parts)
+        cut = block.rfind(b'\n') + 1
+        if cut:
+            yield block[:cut]
+        carry = block[cut:]
+    if carry:
+        yield carry
+
+
+class FlowStream:
+    """Feeds parsed chunks into event-time windows of `window` seconds. A
+    window is reported once a record from a later window arrives (or at the
+    end of the stream); late records count towards the open window."""
+
+    def __init__(self, topology=None, window=DEFAULT_WINDOW, top=10, factor=5.0, min_count=20,
+                 k=20, width=1 << 16, depth=4, p=12, decay=0.3):
+        self.length = window
+        self.top, self.factor, self.min_count = top, factor, min_count
+        self.sizes = dict(k=max(k, top), width=width, depth=depth, p=p)
+        self.vpcs = VpcIndex(topology)
+        self.baseline = Baseline(decay, width, depth)
+        self.window = None
+
+    def _close(self):
+        summary = report(self.window, self.baseline, self.top, self.factor, self.min_count)
+        self.baseline.update(self.window)
+        self.window = None
+        return summary
+
+    def feed(self, block):
+        """Parse a block of whole lines; returns reports of windows it closed"""
+        return self.add(parse_block(block))
+
+    def add(self, columns):
+        """Add parsed columns; returns reports of windows they closed"""
+        if not len(columns['start']):
+            return []
+
+        slot = columns['start'].astype(np.int64) // self.length * self.length
+        if self.window is not None:
+            slot = np.maximum(slot, self.window.start)
+        closed = []
+        for start in np.unique(slot):
+            if self.window is not None and self.window.start != start:
+                closed.append(self._close())
+            if self.window is None:
+                self.window = Window(int(start), self.length, self.vpcs, **self.sizes)
+            rows = slot == start
+            self.window.add(columns if rows.all() else {name: values[rows] for name, values in columns.items()})
+        return closed
+
+    def finish(self):
+        return [self._close()] if self.window is not None else []
+
+    def run(self, blocks, jobs=1):
+        for columns in parse_blocks(blocks, jobs):
+            yield from self.add(columns)
+        yield from self.finish()
+
+
+def _clock(seconds):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+
+def print_report(summary, out=sys.stdout):
+    print("== %s - %s UTC: %d records, %d bytes, %d rejected; ~%d sources, ~%d destinations" % (
+        _clock(summary['start']), _clock(summary['end'])[11:], summary['records'], summary['bytes'],
+        summary['rejects'], summary['distinct_sources'], summary['distinct_destinations']), file=out)
+    for title, rows, fields in (('Top talkers (bytes)', summary['top_talkers'], ('pair', 'bytes')),
+                                ('Top ports (bytes)', summary['top_ports'], ('port', 'bytes')),
+                                ('VPCs (bytes, ~distinct peers)', summary['vpcs'], ('vpc', 'bytes', 'peers')),
+                                ('Top rejected (records)', summary['top_rejects'], ('pair', 'records'))):
+        if rows:
+            print("%s:" % title, file=out)
+            for row in rows:
+                print("  %-40s %s" % (row[fields[0]], '  '.join(str(row[f]) for f in fields[1:])), file=out)
+    for spike in summary['reject_spikes']:
+        print("!! REJECT spike %-34s %d records (usually ~%.1f)" % (
+            spike['key'], spike['records'], spike['baseline']), file=out)
+    out.flush()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from advnet.topology import lab_topology, load_topology
+
+    parser = argparse.ArgumentParser(description='Windowed top-talker and REJECT-spike reports '
+                                                 'from a flow-log stream')
+    parser.add_argument('source', nargs='?', default='-', metavar='FLOW_LOG',
+                        help='flow-log file, plain or gzipped (default: stdin)')
+    parser.add_argument('-w', '--window', type=int, default=DEFAULT_WINDOW,
+                        help='window length in seconds of flow start time (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=10, help='rows in each top-N table')
+    parser.add_argument('--spike-factor', type=float, default=5.0,
+                        help='flag REJECT counts this many times the baseline (default: %(default)s)')
+    parser.add_argument('--spike-min', type=int, default=20,
+                        help='ignore REJECT counts below this (default: %(default)s)')
+    parser.add_argument('--width', type=int, default=1 << 16,
+                        help='count-min sketch width, a power of two (default: %(default)s)')
+    parser.add_argument('--terraform', action='append', default=[], metavar='TF_FILE',
+                        help='Terraform inputs naming the VPCs (default: the lab topology)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='processes parsing a file (default: every core; stdin is parsed in-process '
+                             'so a tail reports without waiting for read-ahead)')
+    parser.add_argument('--json', action='store_true', help='one JSON object per window')
+    args = parser.parse_args()
+
+    topology = load_topology(args.terraform) if args.terraform else lab_topology()
+    stream = FlowStream(topology, args.window, args.top, args.spike_factor, args.spike_min,
+                        width=args.width)
+    if args.source == '-':
+        blocks, jobs = read_stream(sys.stdin.buffer), 1
+    else:
+        blocks, jobs = read_chunks(args.source, chunk_size=CHUNK_SIZE), args.jobs
+
+    def emit(summaries):
+        count = 0
+        for summary in summaries:
+            count += summary['records']
+            if args.json:
+                print(json.dumps(summary), flush=True)
+            else:
+                print_report(summary)
+        return count
+
+    start, records = time.perf_counter(), 0
+    try:
+        records += emit(stream.run(blocks, jobs))
+    except KeyboardInterrupt:
+        # Report the window still open when a tail is stopped
+        records += emit(stream.finish())
+    elapsed = time.perf_counter() - start
+    print("%d records in %.2fs (%.0f records/s)" % (records, elapsed, records / max(elapsed, 1e-9)),
+          file=sys.stderr)
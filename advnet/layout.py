@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Layout Engine
+Computes diagram coordinates for any number of VPCs, subnets and attachments.
+Positions are produced in bulk with NumPy: a grid-packed layout with the
+Transit Gateway below the VPC rows, or a hub-and-spoke radial layout with
+the VPCs on rings around the Transit Gateway for large estates.
+"""
+
+import math
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# Above this many VPCs the automatic mode switches from grid to radial
+RADIAL_THRESHOLD = 48
+
+
+@dataclass(frozen=True)
+class Metrics:
+    """Diagram units (1 unit = 1 inch) for one diagram style"""
+    vpc_height: float
+    subnet_width: float
+    subnet_height: float
+    subnet_y: float
+    subnet_gap: float
+    vpc_pad: float
+    icon_y: float
+    min_vpc_width: float
+    hgap: float
+    vgap: float
+    margin_left: float
+    margin_right: float
+    band_height: float
+    top_margin: float
+    min_width: float
+    hub_y: float
+    hub_radius: float
+    vpn_offset: tuple
+    vpn_size: tuple
+    igw_offset: tuple
+    igw_size: tuple
+    internet_y: float
+    endpoint_spacing: float = 0.4
+    instance_spacing: float = 0.6
+
+
+STYLE_METRICS = {
+    'simple': Metrics(
+        vpc_height=3.5, subnet_width=1.8, subnet_height=1.0, subnet_y=2.0,
+        subnet_gap=0.2, vpc_pad=0.35, icon_y=1.3, min_vpc_width=3.5,
+        hgap=0.5, vgap=1.0, margin_left=1.0, margin_right=0.5,
+        band_height=7.0, top_margin=1.5, min_width=16.0,
+        hub_y=5.0, hub_radius=0.8, vpn_offset=(2.5, -0.8), vpn_size=(3.0, 1.6),
+        igw_offset=(-0.5, -4.0), igw_size=(1.0, 0.8), internet_y=0.3),
+    'professional': Metrics(
+        vpc_height=2.5, subnet_width=2.0, subnet_height=0.5, subnet_y=1.3,
+        subnet_gap=0.2, vpc_pad=0.4, icon_y=0.6, min_vpc_width=5.0,
+        hgap=1.0, vgap=1.0, margin_left=1.5, margin_right=1.0,
+        band_height=5.5, top_margin=3.25, min_width=20.0,
+        hub_y=3.5, hub_radius=0.8, vpn_offset=(2.5, -0.7), vpn_size=(3.0, 1.4),
+        igw_offset=(-0.8, -2.3), igw_size=(1.6, 0.6), internet_y=0.45),
+}
+
+
+@dataclass
+class Layout:
+    """Array-backed diagram geometry; boxes are (x, y, width, height)"""
+    style: str
+    mode: str
+    width: float
+    height: float
+    vpcs: list
+    vpc_boxes: np.ndarray
+    subnets: list
+    subnet_boxes: np.ndarray
+    subnet_vpc: np.ndarray
+    instances: list
+    instance_xy: np.ndarray
+    instance_vpc: np.ndarray
+    endpoints: list
+    endpoint_xy: np.ndarray
+    endpoint_vpc: np.ndarray
+    hub_xy: np.ndarray
+    hub_radius: float
+    vpns: list
+    vpn_boxes: np.ndarray
+    igw_box: np.ndarray
+    internet_xy: np.ndarray
+    band: np.ndarray
+    edges: dict = field(default_factory=dict)
+    # Per edge kind, the VPC (spoke) or VPN index each segment belongs to
+    edge_owners: dict = field(default_factory=dict)
+
+    def vpc_anchor(self, i):
+        x, y, w, h = self.vpc_boxes[i]
+        return x + w / 2, y
+
+
+def _vpc_contents(topology, metrics):
+    """Single pass over the model collecting per-VPC column/slot indices"""
+    subnets, subnet_vpc, subnet_col = [], [], []
+    instances, instance_vpc, instance_col, instance_slot = [], [], [], []
+    endpoints, endpoint_vpc, endpoint_col, endpoint_slot, endpoint_count = [], [], [], [], []
+    columns = np.ones(len(topology.vpcs), dtype=np.int64)
+
+    for v, vpc in enumerate(topology.vpcs):
+        ordered = sorted(vpc.subnets, key=lambda s: (s.az, s.tier != 'public'))
+        column_of = {s.id: c for c, s in enumerate(ordered)}
+        columns[v] = max(len(ordered), 1)
+        subnets.extend(ordered)
+        subnet_vpc.extend([v] * len(ordered))
+        subnet_col.extend(range(len(ordered)))
+
+        used = {}
+        for instance in vpc.instances:
+            col = column_of.get(instance.subnet_id, 0)
+            instances.append(instance)
+            instance_vpc.append(v)
+            instance_col.append(col)
+            instance_slot.append(used.get(col, 0))
+            used[col] = used.get(col, 0) + 1
+
+        # Endpoints share the first column that holds no instance
+        free = [c for c in range(columns[v]) if c not in used]
+        col = free[0] if free else columns[v] - 1
+        group = vpc.interface_endpoints
+        endpoints.extend(group)
+        endpoint_vpc.extend([v] * len(group))
+        endpoint_col.extend([col] * len(group))
+        endpoint_slot.extend(range(len(group)))
+        endpoint_count.extend([len(group)] * len(group))
+
+    as_int = lambda seq: np.asarray(seq, dtype=np.int64)
+    return (columns,
+            (subnets, as_int(subnet_vpc), as_int(subnet_col)),
+            (instances, as_int(instance_vpc), as_int(instance_col), as_int(instance_slot)),
+            (endpoints, as_int(endpoint_vpc), as_int(endpoint_col), as_int(endpoint_slot),
+             as_int(endpoint_count)))
+
+
+def _grid_positions(widths, metrics):
+    """Shelf-pack VPC boxes into rows, returning x, y, canvas size and row count"""
+    n = len(widths)
+    if n == 0:
+        return np.zeros(0), np.zeros(0), metrics.min_width, metrics.band_height + metrics.top_margin, 0
+
+    pitch = widths + metrics.hgap
+    # Aim for a canvas of roughly 16:9 once rows are stacked
+    row_height = metrics.vpc_height + metrics.vgap
+    per_row = max(1, math.ceil(math.sqrt(n * 16 / 9 * row_height / pitch.mean())))
+    if n <= 6:
+        per_row = n
+    target = per_row * pitch.mean()
+
+    starts = np.concatenate(([0.0], np.cumsum(pitch)[:-1]))
+    row = np.minimum((starts // target).astype(np.int64), n - 1)
+    row = np.maximum.accumulate(row)
+    rows = int(row[-1]) + 1
+    first = np.searchsorted(row, np.arange(rows))
+    offsets = starts - starts[first][row]
+    row_width = np.bincount(row, weights=pitch) - metrics.hgap
+
+    inner = max(metrics.min_width - metrics.margin_left - metrics.margin_right, row_width.max())
+    width = inner + metrics.margin_left + metrics.margin_right
+    if rows == 1 and n > 1:
+        # Single row: spread the spare room into the gaps
+        offsets = offsets + np.arange(n) * (inner - row_width[0]) / (n - 1)
+    else:
+        offsets = offsets + ((inner - row_width) / 2)[row]
+    x = metrics.margin_left + offsets
+
+    area = rows * row_height - metrics.vgap
+    height = metrics.band_height + area + metrics.top_margin
+    y = metrics.band_height + (rows - 1 - row) * row_height
+    return x, y, width, height, rows
+
+
+def _radial_positions(widths, metrics):
+    """Place VPC boxes on concentric rings; returns centers relative to the hub"""
+    n = len(widths)
+    box_w = widths.max() if n else metrics.min_vpc_width
+    diag = math.hypot(box_w, metrics.vpc_height)
+    pitch = diag + metrics.hgap
+
+    # Inner ring clears the hub, VPN and internet gateway drawn around it
+    reach = max(metrics.vpn_offset[0] + metrics.vpn_size[0], -metrics.igw_offset[1] + 1.0)
+    r0 = metrics.hub_radius + reach + diag / 2 + metrics.vgap
+
+    radii, counts, placed = [], [], 0
+    while placed < n:
+        r = r0 + len(radii) * pitch
+        capacity = max(1, int(2 * math.pi * r // pitch))
+        take = min(capacity, n - placed)
+        radii.append(r)
+        counts.append(take)
+        placed += take
+
+    counts = np.asarray(counts, dtype=np.int64)
+    ring = np.repeat(np.arange(len(counts)), counts)
+    slot = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts)
+    theta = np.pi / 2 - 2 * np.pi * (slot + 0.5 * (ring % 2)) / counts[ring]
+    r = np.asarray(radii)[ring] if n else np.zeros(0)
+    outer = (radii[-1] if radii else r0) + diag / 2
+    return r * np.cos(theta), r * np.sin(theta), outer
+
+
+def compute_layout(topology, style='simple', mode='auto'):
+    """Lay out a Topology for the given diagram style ('simple' or 'professional')"""
+    metrics = STYLE_METRICS[style]
+    n = len(topology.vpcs)
+    if mode == 'auto':
+        mode = 'radial' if n > RADIAL_THRESHOLD else 'grid'
+
+    columns, subnet_info, instance_info, endpoint_info = _vpc_contents(topology, metrics)
+    widths = np.maximum(2 * metrics.vpc_pad + columns * metrics.subnet_width +
+                        (columns - 1) * metrics.subnet_gap, metrics.min_vpc_width)
+
+    if mode == 'grid':
+        x, y, width, height, _ = _grid_positions(widths, metrics)
+        hub = np.array([width / 2, metrics.hub_y])
+    elif mode == 'radial':
+        dx, dy, outer = _radial_positions(widths, metrics)
+        width = max(metrics.min_width, 2 * outer + metrics.margin_left + metrics.margin_right)
+        height = metrics.band_height + 2 * outer + metrics.top_margin
+        hub = np.array([width / 2, metrics.band_height + outer])
+        x = hub[0] + dx - widths / 2
+        y = hub[1] + dy - metrics.vpc_height / 2
+    else:
+        raise ValueError('Unknown layout mode: %s' % mode)
+
+    vpc_boxes = np.column_stack([x, y, widths, np.full(n, metrics.vpc_height)]) if n \
+        else np.zeros((0, 4))
+    col_pitch = metrics.subnet_width + metrics.subnet_gap
+
+    # Subnets, instances and endpoints are offsets from their VPC box
+    subnets, subnet_vpc, subnet_col = subnet_info
+    subnet_boxes = np.column_stack([
+        vpc_boxes[subnet_vpc, 0] + metrics.vpc_pad + subnet_col * col_pitch,
+        vpc_boxes[subnet_vpc, 1] + metrics.subnet_y,
+        np.full(len(subnets), metrics.subnet_width),
+        np.full(len(subnets), metrics.subnet_height),
+    ]) if subnets else np.zeros((0, 4))
+
+    def column_center(vpc_idx, col):
+        return vpc_boxes[vpc_idx, 0] + metrics.vpc_pad + col * col_pitch + metrics.subnet_width / 2
+
+    instances, instance_vpc, instance_col, instance_slot = instance_info
+    instance_xy = np.column_stack([
+        column_center(instance_vpc, instance_col) + instance_slot * metrics.instance_spacing,
+        vpc_boxes[instance_vpc, 1] + metrics.icon_y,
+    ]) if instances else np.zeros((0, 2))
+
+    endpoints, endpoint_vpc, endpoint_col, endpoint_slot, endpoint_count = endpoint_info
+    endpoint_xy = np.column_stack([
+        column_center(endpoint_vpc, endpoint_col) +
+        (endpoint_slot - (endpoint_count - 1) / 2) * metrics.endpoint_spacing,
+        vpc_boxes[endpoint_vpc, 1] + metrics.icon_y,
+    ]) if endpoints else np.zeros((0, 2))
+
+    # Attachments around the hub: VPN boxes stacked right, IGW below
+    vpns = list(topology.vpn_connections)
+    vw, vh = metrics.vpn_size
+    vpn_boxes = np.column_stack([
+        np.full(len(vpns), hub[0] + metrics.vpn_offset[0]),
+        hub[1] + metrics.vpn_offset[1] - np.arange(len(vpns)) * (vh + 0.3),
+        np.full(len(vpns), vw), np.full(len(vpns), vh),
+    ]) if vpns else np.zeros((0, 4))
+    igw_box = np.array([hub[0] + metrics.igw_offset[0], hub[1] + metrics.igw_offset[1],
+                        metrics.igw_size[0], metrics.igw_size[1]])
+    if mode == 'grid':
+        internet_xy = np.array([hub[0], metrics.internet_y])
+    else:
+        internet_xy = np.array([hub[0], igw_box[1] - 0.6])
+
+    layout = Layout(
+        style=style, mode=mode, width=float(width), height=float(height),
+        vpcs=list(topology.vpcs), vpc_boxes=vpc_boxes,
+        subnets=subnets, subnet_boxes=subnet_boxes, subnet_vpc=subnet_vpc,
+        instances=instances, instance_xy=instance_xy, instance_vpc=instance_vpc,
+        endpoints=endpoints, endpoint_xy=endpoint_xy, endpoint_vpc=endpoint_vpc,
+        hub_xy=hub, hub_radius=metrics.hub_radius,
+        vpns=vpns, vpn_boxes=vpn_boxes, igw_box=igw_box, internet_xy=internet_xy,
+        band=np.array([0.0, 0.0, width, metrics.band_height]))
+    layout.edges, layout.edge_owners = _edges(layout, topology, mode)
+    return layout
+
+
+def _edges(layout, topology, mode):
+    """Connection segments as (n, 2, 2) arrays of [start, end] points, and
+    the owner index of each segment"""
+    hub, r = layout.hub_xy, layout.hub_radius
+    boxes = layout.vpc_boxes
+    edges = {}
+
+    if mode == 'grid':
+        start = np.column_stack([boxes[:, 0] + boxes[:, 2] / 2, boxes[:, 1]])
+    else:
+        # Closest point of each box to the hub
+        start = np.column_stack([np.clip(hub[0], boxes[:, 0], boxes[:, 0] + boxes[:, 2]),
+                                 np.clip(hub[1], boxes[:, 1], boxes[:, 1] + boxes[:, 3])])
+    vec = start - hub
+    dist = np.maximum(np.hypot(vec[:, 0], vec[:, 1]), 1e-9)[:, None]
+    end = hub + vec / dist * (r + 0.1)
+    edges['spoke'] = np.stack([start, end], axis=1) if len(boxes) else np.zeros((0, 2, 2))
+
+    vpn = layout.vpn_boxes
+    edges['vpn'] = np.stack([
+        np.column_stack([np.full(len(vpn), hub[0] + r), np.full(len(vpn), hub[1])]),
+        np.column_stack([vpn[:, 0], vpn[:, 1] + vpn[:, 3] / 2]),
+    ], axis=1) if len(vpn) else np.zeros((0, 2, 2))
+
+    # VPN box to the VPC hosting each customer gateway
+    cgw, cgw_owners = [], []
+    for v, connection in enumerate(layout.vpns):
+        for i, instance in enumerate(layout.instances):
+            if instance.public_ip and instance.public_ip == connection.customer_gateway_ip:
+                x = float(np.clip(layout.instance_xy[i, 0], vpn[v, 0], vpn[v, 0] + vpn[v, 2]))
+                target = boxes[layout.instance_vpc[i]]
+                cgw.append([[x, vpn[v, 1] + vpn[v, 3]], [x, target[1]]])
+                cgw_owners.append(v)
+    edges['customer_gateway'] = np.asarray(cgw, dtype=float).reshape(-1, 2, 2)
+
+    igw = layout.igw_box
+    igw_top = [igw[0] + igw[2] / 2, igw[1] + igw[3]]
+    edges['igw'] = np.array([[igw_top, [hub[0], hub[1] - r]]])
+    edges['internet'] = np.array([[[igw_top[0], igw[1]], layout.internet_xy + [0, 0.4]]])
+    owners = {'spoke': np.arange(len(boxes)), 'vpn': np.arange(len(vpn)),
+              'customer_gateway': np.array(cgw_owners, dtype=int), 'igw': np.zeros(1, dtype=int),
+              'internet': np.zeros(1, dtype=int)}
+    return edges, owners
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from advnet.topology import add_source_arguments, topology_from_args
+
+    parser = argparse.ArgumentParser(description='Time the layout engine on a topology')
+    add_source_arguments(parser)
+    parser.add_argument('--style', choices=sorted(STYLE_METRICS), default='simple')
+    parser.add_argument('--mode', choices=['auto', 'grid', 'radial'], default='auto')
+    args = parser.parse_args()
+    topology = topology_from_args(args)
+
+    start = time.perf_counter()
+    layout = compute_layout(topology, args.style, args.mode)
+    elapsed = time.perf_counter() - start
+    print("%d VPCs, %d subnets laid out (%s) on %.1f x %.1f in %.1f ms" % (
+        len(layout.vpcs), len(layout.subnets), layout.mode,
+        layout.width, layout.height, elapsed * 1000))
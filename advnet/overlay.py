@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Traffic Overlay
+Draws the diagram connections (VPC-TGW spokes, TGW-VPN, VPN-customer
+gateway, IGW and internet links) with width and colour scaled by flow-log
+bytes, packets or reject ratio. Counters come from the annotated flow-log
+store: every record is charged to the links its route crosses, per time
+window, in one bincount per chunk. A replay renders the diagram once as a
+background bitmap; each frame only restores it and redraws the edge
+collection and its caption.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from advnet.annotate import CHUNK_ROWS, annotate_store
+from advnet.flowlogs import ACTIONS, LOG_STATUSES
+
+# Connection kinds drawn by each diagram style
+STYLE_EDGES = {
+    'simple': ('spoke', 'vpn', 'igw', 'internet'),
+    'professional': ('spoke', 'vpn', 'customer_gateway', 'internet'),
+}
+
+# Counter carried by each connection kind: customer gateway links carry
+# their VPN's traffic, and the IGW and internet links share one counter
+COUNTER_OF = {'spoke': 'spoke', 'vpn': 'vpn', 'customer_gateway': 'vpn', 'igw': 'internet', 'internet': 'internet'}
+
+METRICS = ('bytes', 'packets', 'reject')
+
+COLORMAPS = {'bytes': 'YlOrRd', 'packets': 'YlOrRd', 'reject': 'RdYlGn_r'}
+
+DEFAULT_WINDOW = 300
+
+# Line widths (points) of idle and busiest edges
+MIN_WIDTH, MAX_WIDTH = 0.75, 8.0
+
+IDLE_COLOR = '#BDC3C7'
+
+# Last hop of a route that stops short of its destination
+_STOPS = ('dropped', 'no route', 'blackhole')
+
+_REJECT = ACTIONS.index('REJECT')
+_OK = LOG_STATUSES.index('OK')
+
+
+class EdgeCounters:
+    """Flow-log totals per time window (rows) and counter (columns): one per
+    VPC spoke, then one per VPN, then the internet link"""
+
+    def __init__(self, starts, length, vpcs, vpns, bytes, packets, records, rejects):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.length = length
+        self.vpcs, self.vpns = list(vpcs), list(vpns)
+        self.bytes, self.packets = bytes, packets
+        self.records, self.rejects = records, rejects
+
+    def __len__(self):
+        return len(self.starts)
+
+    def offsets(self):
+        return {'spoke': 0, 'vpn': len(self.vpcs), 'internet': len(self.vpcs) + len(self.vpns)}
+
+    def values(self, metric):
+        if metric == 'reject':
+            return self.rejects / np.maximum(self.records, 1)
+        return getattr(self, metric)
+
+    def total(self):
+        """All windows folded into one"""
+        if not len(self):
+            return self
+        return EdgeCounters(self.starts[:1], self.length * len(self), self.vpcs, self.vpns,
+                            *(getattr(self, name).sum(axis=0, keepdims=True)
+                              for name in ('bytes', 'packets', 'records', 'rejects')))
+
+
+def _route_links(routes, topology):
+    """Per route code: crosses a TGW, VPN index crossed (-1 if none), reaches
+    an internet gateway, reaches its destination"""
+    tgw_ids = {tgw.id for tgw in topology.transit_gateways}
+    vpns = topology.vpn_connections
+    tgw = np.zeros(len(routes), dtype=bool)
+    vpn = np.full(len(routes), -1, dtype=np.int64)
+    igw = np.zeros(len(routes), dtype=bool)
+    arrives = np.ones(len(routes), dtype=bool)
+    for code, route in enumerate(routes):
+        hops = route.split(' > ')
+        tgw[code] = any(hop in tgw_ids for hop in hops)
+        igw[code] = any(hop.startswith('igw-') or hop == 'internet gateway' for hop in hops)
+        arrives[code] = hops[-1] not in _STOPS
+        for k, connection in enumerate(vpns):
+            if any(hop == connection.attachment_id or hop.startswith(connection.id + ' ') for hop in hops):
+                vpn[code] = k
+    return tgw, vpn, igw, arrives
+
+
+def edge_counters(store, topology, window=DEFAULT_WINDOW, vpn_routes=None, chunk_rows=CHUNK_ROWS):
+    """Aggregate a FlowLogStore into EdgeCounters of `window` seconds"""
+    notes = annotate_store(store, topology, vpn_routes)
+    vpcs, vpns = topology.vpcs, topology.vpn_connections
+    edges = len(vpcs) + len(vpns) + 1
+    internet = edges - 1
+    tgw, vpn, igw, arrives = _route_links(notes.routes, topology)
+
+    starts = store.start
+    valid = (store.log_status == _OK) & (starts > 0)
+    if not valid.any():
+        empty = np.zeros((0, edges))
+        return EdgeCounters([], window, vpcs, vpns, empty, empty, empty, empty)
+    first = int(starts[valid].min()) // window * window
+    count = (int(starts[valid].max()) - first) // window + 1
+    totals = {name: np.zeros(count * edges) for name in ('bytes', 'packets', 'records', 'rejects')}
+
+    for begin in range(0, len(store), chunk_rows):
+        rows = slice(begin, min(begin + chunk_rows, len(store)))
+        keep = np.flatnonzero(valid[rows])
+        route = notes.route[rows][keep]
+        src_vpc = notes.src_vpc[rows][keep].astype(np.int64)
+        dst_vpc = notes.dst_vpc[rows][keep].astype(np.int64)
+        base = (starts[rows][keep].astype(np.int64) - first) // window * edges
+        # A record is charged to every link its route crosses
+        crossing = tgw[route]
+        src_spoke = np.flatnonzero(crossing & (src_vpc >= 0))
+        dst_spoke = np.flatnonzero(crossing & arrives[route] & (dst_vpc >= 0))
+        over_vpn = np.flatnonzero(vpn[route] >= 0)
+        over_igw = np.flatnonzero(igw[route])
+        hits = np.concatenate([src_spoke, dst_spoke, over_vpn, over_igw])
+        keys = np.concatenate([base[src_spoke] + src_vpc[src_spoke], base[dst_spoke] + dst_vpc[dst_spoke],
+                               base[over_vpn] + len(vpcs) + vpn[route[over_vpn]],
+                               base[over_igw] + internet])
+        weights = {
+            'bytes': store.bytes[rows][keep][hits],
+            'packets': store.packets[rows][keep][hits],
+            'records': None,
+            'rejects': (store.action[rows][keep][hits] == _REJECT),
+        }
+        for name, weight in weights.items():
+            totals[name] += np.bincount(keys, weight, minlength=count * edges)
+
+    shaped = {name: values.reshape(count, edges) for name, values in totals.items()}
+    return EdgeCounters(first + np.arange(count) * window, window, vpcs, vpns, **shaped)
+
+
+# --- Drawing ---
+
+def _human(value, metric):
+    if metric == 'reject':
+        return '%.0f%% rejected' % (value * 100)
+    for unit in ('', 'K', 'M', 'G', 'T'):
+        if abs(value) < 1000 or unit == 'T':
+            return '%.3g%s %s' % (value, unit, metric)
+        value /= 1000.0
+
+
+def _clock(seconds):
+    return time.strftime('%Y-%m-%d %H:%M', time.gmtime(seconds))
+
+
+class EdgeOverlay:
+    """A diagram's connections as one LineCollection plus a caption, restyled
+    per counter window by show()"""
+
+    def __init__(self, ax, layout, counters, metric='bytes', animated=False):
+        import matplotlib
+        from matplotlib.collections import LineCollection
+
+        offsets = counters.offsets()
+        kinds = [kind for kind in STYLE_EDGES[layout.style] if len(layout.edges[kind])]
+        segments = np.concatenate([layout.edges[kind] for kind in kinds]) if kinds else np.zeros((0, 2, 2))
+        columns = np.concatenate([offsets[COUNTER_OF[kind]] + layout.edge_owners[kind] for kind in kinds]
+                                 ) if kinds else np.zeros(0, dtype=int)
+
+        self.counters, self.metric = counters, metric
+        self.values = counters.values(metric)[:, columns] if len(counters) else np.zeros((0, len(columns)))
+        # Widths and colours use one scale across all windows so frames compare
+        if metric == 'reject':
+            self.levels = np.clip(self.values, 0, 1)
+        else:
+            peak = self.values.max() if self.values.size else 0
+            self.levels = np.sqrt(self.values / peak) if peak > 0 else np.zeros_like(self.values)
+        self.peak = self.values.max() if self.values.size else 0
+        self.cmap = matplotlib.colormaps[COLORMAPS[metric]]
+        self.idle = np.array(matplotlib.colors.to_rgba(IDLE_COLOR))
+
+        self.collection = LineCollection(segments, capstyle='round', zorder=2, animated=animated)
+        ax.add_collection(self.collection, autolim=False)
+        self.caption = ax.text(layout.width - 0.6, 0.15, '', fontsize=10, fontweight='bold', ha='right',
+                               zorder=4, animated=animated,
+                               bbox=dict(boxstyle='round,pad=0.3', facecolor='white', edgecolor=IDLE_COLOR))
+
+    def show(self, frame):
+        """Restyle the edges for one window; returns the changed artists"""
+        levels = self.levels[frame]
+        busy = self.values[frame] > 0
+        colors = self.cmap(0.25 + 0.75 * levels)
+        colors[~busy] = self.idle
+        self.collection.set_linewidths(np.where(busy, MIN_WIDTH + (MAX_WIDTH - MIN_WIDTH) * levels, MIN_WIDTH))
+        self.collection.set_colors(colors)
+        start = self.counters.starts[frame]
+        end = _clock(start + self.counters.length)
+        self.caption.set_text('%s - %s UTC   busiest link: %s (scale max %s)' % (
+            _clock(start), end[-5:] if end[:10] == _clock(start)[:10] else end,
+            _human(self.values[frame].max() if self.values.shape[1] else 0, self.metric),
+            _human(self.peak, self.metric)))
+        return self.collection, self.caption
+
+
+def _diagram(topology, style, mode, batched):
+    from advnet.export import load_generator, use_agg
+    from advnet.layout import compute_layout
+
+    use_agg()
+    fig = load_generator(style)(topology, mode, batched, connections=False)
+    return fig, compute_layout(topology, style, mode)
+
+
+def render_overlay(topology, counters, path, style='simple', metric='bytes', mode='auto', batched=None, dpi=150):
+    """One figure with the edges styled by all windows together"""
+    import matplotlib.pyplot as plt
+
+    fig, layout = _diagram(topology, style, mode, batched)
+    total = counters.total()
+    if len(total):
+        EdgeOverlay(fig.axes[0], layout, total, metric).show(0)
+    fig.savefig(path, dpi=dpi, bbox_inches='tight', facecolor='white', edgecolor='none')
+    plt.close(fig)
+
+
+def replay_frames(topology, counters, style='simple', metric='bytes', mode='auto', batched=None, dpi=80):
+    """Yield one RGBA array per counter window; the figure is drawn once and
+    only the edge collection and caption are redrawn per frame"""
+    import matplotlib.pyplot as plt
+
+    fig, layout = _diagram(topology, style, mode, batched)
+    fig.set_dpi(dpi)
+    ax = fig.axes[0]
+    overlay = EdgeOverlay(ax, layout, counters, metric, animated=True)
+    canvas = fig.canvas
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    try:
+        for frame in range(len(counters)):
+            canvas.restore_region(background)
+            for artist in overlay.show(frame):
+                ax.draw_artist(artist)
+            yield np.asarray(canvas.buffer_rgba())
+    finally:
+        plt.close(fig)
+
+
+def write_frames(frames, path, fps=10):
+    """Write frames as numbered PNGs (path is a directory), an animated GIF,
+    or any video format ffmpeg knows; returns the number of frames"""
+    from PIL import Image
+
+    ext = os.path.splitext(path)[1].lower()
+    count = 0
+    if not ext:
+        os.makedirs(path, exist_ok=True)
+        for count, frame in enumerate(frames, 1):
+            Image.fromarray(frame[..., :3]).save(os.path.join(path, 'frame-%05d.png' % count),
+                                              compress_level=1)
+    elif ext == '.gif':
+        images = []
+        for frame in frames:
+            image = Image.fromarray(frame[..., :3])
+            # One shared palette, no dithering and no inter-frame optimisation:
+            # the diagram is flat colour and this keeps encoding to a few ms
+            images.append(image.quantize(255) if not images else
+                          image.quantize(palette=images[0], dither=Image.Dither.NONE))
+        if images:
+            images[0].save(path, save_all=True, append_images=images[1:], duration=round(1000 / fps),
+                           loop=0, optimize=False)
+        count = len(images)
+    else:
+        if not shutil.which('ffmpeg'):
+            raise RuntimeError('ffmpeg is needed for %s output; write a .gif or a frame directory instead' % ext)
+        process = None
+        try:
+            for count, frame in enumerate(frames, 1):
+                if process is None:
+                    height, width = frame.shape[:2]
+                    process = subprocess.Popen(
+                        ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+                         '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-',
+                         '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', path],
+                        stdin=subprocess.PIPE)
+                process.stdin.write(frame.tobytes())
+        finally:
+            if process is not None:
+                process.stdin.close()
+                process.wait()
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from advnet.flowlogs import ingest
+    from advnet.topology import add_source_arguments, add_vpn_route_argument, topology_from_args, vpn_routes_from_args
+
+    parser = argparse.ArgumentParser(description='Diagram connections scaled by flow-log traffic')
+    parser.add_argument('files', nargs='+', metavar='FLOW_LOG',
+                        help='flow-log exports (v2 default format, optionally gzipped)')
+    add_source_arguments(parser, positional=False)
+    add_vpn_route_argument(parser)
+    parser.add_argument('--style', choices=sorted(STYLE_EDGES), default='simple')
+    parser.add_argument('--metric', choices=METRICS, default='bytes',
+                        help='what edge width and colour show (default: %(default)s)')
+    parser.add_argument('-w', '--window', type=int, default=DEFAULT_WINDOW,
+                        help='seconds per window (default: %(default)s)')
+    parser.add_argument('--replay', action='store_true',
+                        help='one frame per window instead of a single overlay')
+    parser.add_argument('-o', '--output', default=None,
+                        help='image file, or for --replay a .gif, a video (needs ffmpeg) or a frame '
+                             'directory (default: traffic-overlay.png / traffic-replay.gif)')
+    parser.add_argument('--fps', type=int, default=10, help='replay frame rate (default: %(default)s)')
+    parser.add_argument('--dpi', type=int, default=None,
+                        help='resolution (default: 150, or 80 for --replay)')
+    parser.add_argument('--layout', choices=['auto', 'grid', 'radial'], default='auto',
+                        help='VPC placement (default: grid, radial for large estates)')
+    parser.add_argument('--batched', action=argparse.BooleanOptionalAction, default=None,
+                        help='draw shapes as collections, or one artist per shape with --no-batched '
+                             '(default: collections for large estates)')
+    args = parser.parse_args()
+
+    topology = topology_from_args(args)
+    vpn_routes = vpn_routes_from_args(parser, args, topology)
+
+    start = time.perf_counter()
+    counters = edge_counters(ingest(args.files, args.cache_dir), topology, args.window, vpn_routes)
+    print("%d windows of %ds aggregated in %.2fs" % (len(counters), args.window, time.perf_counter() - start),
+          file=sys.stderr)
+
+    start = time.perf_counter()
+    if args.replay:
+        output = args.output or 'traffic-replay.gif'
+        frames = replay_frames(topology, counters, args.style, args.metric, args.layout, args.batched,
+                               args.dpi or 80)
+        count = write_frames(frames, output, args.fps)
+        print("%d frames written to %s in %.2fs" % (count, output, time.perf_counter() - start))
+    else:
+        output = args.output or 'traffic-overlay.png'
+        render_overlay(topology, counters, output, args.style, args.metric, args.layout, args.batched,
+                       args.dpi or 150)
+        print("Traffic overlay written to %s in %.2fs" % (output, time.perf_counter() - start))
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Plan Diff
+Compares two snapshots of the lab (a state and a plan, two states, or the
+prior and planned values of one `terraform show -json` plan). Each is loaded
+into a resource graph keyed by Terraform address, every resource linked to
+the VPC it belongs to, so added, changed and removed VPCs, subnets, routes,
+attachments and endpoints come out of one pass over each index. The diagram
+is then drawn for the affected VPCs only, with the Transit Gateway hub and
+VPN as context, and the changes outlined on it.
+"""
+
+import json
+import sys
+from collections import Counter
+from dataclasses import dataclass, field, replace
+
+from advnet.topology import Topology, base_address, build_topology, parse_resources, read_document
+
+# Resource types compared, and the kind of change each one reports
+KINDS = {
+    'aws_vpc': 'vpc',
+    'aws_internet_gateway': 'vpc',
+    'aws_subnet': 'subnet',
+    'aws_route_table': 'route',
+    'aws_route': 'route',
+    'aws_route_table_association': 'route',
+    'aws_ec2_transit_gateway_route': 'route',
+    'aws_ec2_transit_gateway_vpc_attachment': 'attachment',
+    'aws_ec2_transit_gateway_route_table_association': 'attachment',
+    'aws_ec2_transit_gateway_route_table_propagation': 'attachment',
+    'aws_vpc_endpoint': 'endpoint',
+    'aws_instance': 'instance',
+    'aws_security_group': 'security',
+    'aws_security_group_rule': 'security',
+    'aws_vpn_connection': 'vpn',
+    'aws_vpn_connection_route': 'vpn',
+    'aws_customer_gateway': 'vpn',
+    'aws_ec2_transit_gateway': 'transit',
+    'aws_ec2_transit_gateway_route_table': 'transit',
+}
+
+# Computed attributes that say nothing about the change being reviewed
+IGNORED = {'id', 'arn', 'owner_id', 'tags_all', 'timeouts'}
+
+# Reference attributes followed to find a resource's VPC, in order
+OWNER_REFS = ('vpc_id', 'route_table_id', 'subnet_id', 'transit_gateway_attachment_id', 'security_group_id')
+
+ACTIONS = ('added', 'changed', 'removed')
+SYMBOLS = {'added': '+', 'changed': '~', 'removed': '-'}
+COLORS = {'added': '#2E7D32', 'changed': '#F57C00', 'removed': '#C62828'}
+
+
+@dataclass
+class Node:
+    address: str
+    type: str
+    kind: str
+    id: str
+    # Address of the VPC the resource belongs to; '' for the hub and VPN
+    vpc: str
+    values: dict = field(default_factory=dict)
+
+
+class ResourceGraph:
+    """One snapshot: every compared resource keyed by address and linked
+    to its VPC; the topology model is built only when drawn"""
+
+    def __init__(self, documents):
+        builder, region, outputs = parse_resources(documents)
+        self._parsed = (builder, region, outputs)
+        self._topology = None
+        records = [r for r in builder.records if r['type'] in KINDS]
+        self._builder = builder
+        self._by_id = {r['id']: r for r in builder.records}
+        self._module_vpc = {r['module']: r for r in builder.records if r['type'] == 'aws_vpc' and r['module']}
+        self._owners = {}
+        self.nodes = {}
+        for record in records:
+            node = Node(record['address'], record['type'], KINDS[record['type']], record['id'],
+                        self._owner(record), self._comparable(record))
+            self.nodes[node.address] = node
+        # Model VPC id per VPC address
+        self.vpc_ids = {node.address: node.id for node in self.nodes.values() if node.type == 'aws_vpc'}
+        del self._builder, self._by_id, self._module_vpc, self._owners
+
+    @property
+    def topology(self):
+        if self._topology is None:
+            self._topology = build_topology(*self._parsed)
+        return self._topology
+
+    @classmethod
+    def from_paths(cls, paths):
+        return cls([read_document(path, require_plan=True) for path in paths])
+
+    def _address(self, value):
+        record = self._by_id.get(value)
+        return record['address'] if record else value
+
+    def _value(self, record, attr, refs):
+        # Builder.resolve, skipped for attributes with no config reference
+        if attr in refs:
+            return self._builder.resolve(record, attr)
+        return record['values'].get(attr)
+
+    def _comparable(self, record):
+        refs = self._builder.refs.get(base_address(record['address']), {})
+        values = {}
+        for attr, value in record['values'].items():
+            if attr in IGNORED:
+                continue
+            if attr.endswith('_id') and isinstance(value, str):
+                # Compared by address: IDs differ between a plan and a state
+                value = self._address(self._value(record, attr, refs))
+            elif attr.endswith('_ids') and isinstance(value, list):
+                value = sorted(self._address(v) for v in self._value(record, attr, refs) or [])
+            values[attr] = value
+        return values
+
+    def _owner(self, record, depth=0):
+        address = record['address']
+        if address in self._owners:
+            return self._owners[address]
+        if record['type'] == 'aws_vpc':
+            return address
+        owner = ''
+        if depth < 6:
+            refs = self._builder.refs.get(base_address(address), {})
+            for attr in OWNER_REFS:
+                value = self._value(record, attr, refs)
+                if isinstance(value, list):
+                    value = value[0] if value else None
+                target = self._by_id.get(value)
+                if target is not None and target is not record:
+                    owner = self._owner(target, depth + 1)
+                    if owner:
+                        break
+        if not owner and record['type'] not in ('aws_ec2_transit_gateway_route_table_association',
+                                                'aws_ec2_transit_gateway_route_table_propagation',
+                                                'aws_ec2_transit_gateway_route'):
+            vpc = self._module_vpc.get(record['module'])
+            owner = vpc['address'] if vpc else ''
+        self._owners[address] = owner
+        return owner
+
+
+def snapshots(paths):
+    """(before, after) ResourceGraphs: two files, or the prior state and
+    planned values of a single `terraform show -json` plan"""
+    if len(paths) == 2:
+        return ResourceGraph.from_paths(paths[:1]), ResourceGraph.from_paths(paths[1:])
+    kind, doc = read_document(paths[0], require_plan=True)
+    if kind != 'show' or 'planned_values' not in doc:
+        raise ValueError('%s is not a plan; give a before and an after snapshot' % paths[0])
+    prior = {'format_version': doc.get('format_version'), 'configuration': doc.get('configuration', {}),
+             'variables': doc.get('variables', {}),
+             'values': (doc.get('prior_state') or {}).get('values', {})}
+    return ResourceGraph([('show', prior)]), ResourceGraph([(kind, doc)])
+
+
+# --- Diff ---
+
+@dataclass
+class Change:
+    action: str
+    node: Node
+    # Attributes whose values differ, for changed resources
+    attributes: list = field(default_factory=list)
+
+
+class PlanDiff:
+    def __init__(self, before, after):
+        self.before = before
+        self.after = after
+        self.changes = []
+        # One lookup per address on each side
+        for address, node in after.nodes.items():
+            old = before.nodes.get(address)
+            if old is None:
+                self.changes.append(Change('added', node))
+            else:
+                differ = sorted(attr for attr in old.values.keys() & node.values.keys()
+                                if old.values[attr] != node.values[attr])
+                if differ:
+                    self.changes.append(Change('changed', node, differ))
+        self.changes += [Change('removed', node) for address, node in before.nodes.items()
+                         if address not in after.nodes]
+        self.by_vpc = {}
+        for change in self.changes:
+            self.by_vpc.setdefault(change.node.vpc, []).append(change)
+
+    def __bool__(self):
+        return bool(self.changes)
+
+    def counts(self):
+        return Counter((change.node.kind, change.action) for change in self.changes)
+
+    def vpc_action(self, address):
+        """How a VPC changed: added or removed with the VPC resource itself,
+        else changed when anything inside it did"""
+        for change in self.by_vpc.get(address, []):
+            if change.node.type == 'aws_vpc' and change.action != 'changed':
+                return change.action
+        return 'changed' if address in self.by_vpc else None
+
+    def hub_changes(self, kinds=('transit', 'attachment', 'route')):
+        return [c for c in self.by_vpc.get('', []) if c.node.kind in kinds]
+
+    def vpn_changes(self):
+        return [c for c in self.by_vpc.get('', []) if c.node.kind == 'vpn']
+
+
+def describe(changes):
+    """'+2 route, ~1 endpoint' for a list of changes"""
+    counts = Counter((c.node.kind, c.action) for c in changes)
+    return ', '.join('%s%d %s' % (SYMBOLS[action], count, kind)
+                     for (kind, action), count in sorted(counts.items(),
+                                                          key=lambda item: (item[0][0], ACTIONS.index(item[0][1]))))
+
+
+# --- Affected subgraph ---
+
+def _merge_removed(vpc, old_vpc, removed_ids):
+    """A copy of vpc that still shows the subnets, endpoints and instances
+    the plan removes from it"""
+    if old_vpc is None or not removed_ids:
+        return vpc
+    merged = replace(vpc, subnets=list(vpc.subnets), endpoints=list(vpc.endpoints),
+                     instances=list(vpc.instances))
+    for attr in ('subnets', 'endpoints', 'instances'):
+        getattr(merged, attr).extend(item for item in getattr(old_vpc, attr) if item.id in removed_ids)
+    return merged
+
+
+def affected_topology(diff):
+    """A Topology holding only the VPCs with changes (removed ones from the
+    before snapshot), the Transit Gateway with their attachments, the VPN,
+    and the VPC hosting its customer gateway"""
+    new, old = diff.after.topology, diff.before.topology
+    new_vpcs = {vpc.id: vpc for vpc in new.vpcs}
+    old_vpcs = {vpc.id: vpc for vpc in old.vpcs}
+    removed_ids = {c.node.id for c in diff.changes if c.action == 'removed'}
+
+    vpcs = []
+    for address in diff.by_vpc:
+        if not address:
+            continue
+        if diff.vpc_action(address) == 'removed':
+            vpc = old_vpcs.get(diff.before.vpc_ids.get(address))
+        else:
+            vpc = new_vpcs.get(diff.after.vpc_ids.get(address))
+            if vpc is not None:
+                vpc = _merge_removed(vpc, old_vpcs.get(diff.before.vpc_ids.get(address)), removed_ids)
+        if vpc is not None:
+            vpcs.append(vpc)
+
+    vpns = new.vpn_connections or old.vpn_connections
+    shown = {vpc.id for vpc in vpcs}
+    gateways = {vpn.customer_gateway_ip for vpn in vpns if vpn.customer_gateway_ip}
+    for vpc in new.vpcs:
+        if vpc.id not in shown and any(i.public_ip in gateways for i in vpc.instances):
+            vpcs.append(vpc)
+            shown.add(vpc.id)
+
+    transit_gateways = []
+    for tgw in new.transit_gateways or old.transit_gateways:
+        before = next((t for t in old.transit_gateways if t.id == tgw.id), None)
+        attachments = [a for a in tgw.attachments if a.type == 'vpn' or a.resource_id in shown]
+        seen = {a.id for a in attachments}
+        attachments += [a for a in (before.attachments if before else [])
+                        if a.resource_id in shown and a.id not in seen]
+        transit_gateways.append(replace(tgw, attachments=attachments))
+    # Keep the plan's VPC order
+    order = {vpc.id: n for n, vpc in enumerate(new.vpcs)}
+    vpcs.sort(key=lambda vpc: order.get(vpc.id, len(order)))
+    return Topology(region=new.region, project=new.project or old.project, vpcs=vpcs,
+                    transit_gateways=transit_gateways, vpn_connections=vpns,
+                    flow_log_group=new.flow_log_group, outputs=new.outputs)
+
+
+# --- Rendering ---
+
+def _highlight(ax, layout, diff, total_vpcs):
+    import numpy as np
+    from matplotlib.collections import PatchCollection
+    from matplotlib.patches import Circle, Rectangle
+
+    actions = {}
+    for change in diff.changes:
+        actions.setdefault(change.node.id, change.action)
+    addresses = {vpc_id: address for graph in (diff.before, diff.after) for address, vpc_id in graph.vpc_ids.items()}
+
+    shapes, colors, styles = [], [], []
+
+    def outline(patch, action):
+        shapes.append(patch)
+        colors.append(COLORS[action])
+        styles.append('--' if action == 'removed' else '-')
+
+    labels = []
+    for v, vpc in enumerate(layout.vpcs):
+        address = addresses.get(vpc.id)
+        action = diff.vpc_action(address) if address else None
+        x, y, w, h = layout.vpc_boxes[v]
+        if action:
+            outline(Rectangle((x - 0.08, y - 0.08), w + 0.16, h + 0.16), action)
+            changes = diff.by_vpc[address]
+            text = ('%s VPC (%d resources)' % (SYMBOLS[action], len(changes)) if action != 'changed'
+                    else describe(changes))
+            labels.append((x + w / 2, y + h + 0.18, text))
+    for subnet, (x, y, w, h) in zip(layout.subnets, layout.subnet_boxes):
+        if subnet.id in actions:
+            outline(Rectangle((x - 0.04, y - 0.04), w + 0.08, h + 0.08), actions[subnet.id])
+    for items, points in ((layout.endpoints, layout.endpoint_xy), (layout.instances, layout.instance_xy)):
+        for item, point in zip(items, points):
+            if item.id in actions:
+                outline(Circle(point, 0.22), actions[item.id])
+    hub = diff.hub_changes()
+    if hub:
+        outline(Circle(layout.hub_xy, layout.hub_radius + 0.15),
+                'changed' if len({c.action for c in hub}) > 1 else hub[0].action)
+    vpn = diff.vpn_changes()
+    for x, y, w, h in layout.vpn_boxes if vpn else []:
+        outline(Rectangle((x - 0.15, y - 0.15), w + 0.3, h + 0.3),
+                'changed' if len({c.action for c in vpn}) > 1 else vpn[0].action)
+
+    ax.add_collection(PatchCollection(shapes, facecolors='none', edgecolors=colors, linestyles=styles,
+                                      linewidths=3, zorder=20), autolim=False)
+    # Spokes of VPCs whose attachments change
+    spokes = [v for v, vpc in enumerate(layout.vpcs)
+              if any(c.node.kind == 'attachment' for c in diff.by_vpc.get(addresses.get(vpc.id), []))]
+    if spokes:
+        from matplotlib.collections import LineCollection
+        owners = layout.edge_owners['spoke']
+        picked = np.isin(owners, spokes)
+        ax.add_collection(LineCollection(
+            layout.edges['spoke'][picked], linewidths=4, alpha=0.6, zorder=19,
+            colors=[COLORS[diff.vpc_action(addresses[layout.vpcs[v].id])] for v in owners[picked]]),
+            autolim=False)
+    for x, y, text in labels:
+        ax.text(x, y, text, fontsize=8, ha='center', va='bottom', color='#333333', zorder=21)
+    counts = diff.counts()
+    ax.text(layout.width - 0.3, 0.15, 'Plan: %s   (%d of %d VPCs shown)' % (
+        ', '.join('%d to %s' % (sum(n for (_, a), n in counts.items() if a == action),
+                                {'added': 'add', 'changed': 'change', 'removed': 'remove'}[action])
+                  for action in ACTIONS), len(layout.vpcs), total_vpcs),
+        fontsize=10, fontweight='bold', ha='right', va='bottom', zorder=21)
+
+
+def render_diff(diff, path, style='simple', mode='auto', batched=None, dpi=150):
+    """Draw the affected subgraph with its changes outlined; returns the
+    subset topology drawn"""
+    from advnet.export import load_generator, use_agg
+    from advnet.layout import compute_layout
+
+    use_agg()
+    import matplotlib.pyplot as plt
+
+    topology = affected_topology(diff)
+    fig = load_generator(style)(topology, mode, batched)
+    layout = compute_layout(topology, style, mode)
+    total = len(diff.after.vpc_ids.keys() | diff.before.vpc_ids.keys())
+    _highlight(fig.axes[0], layout, diff, total)
+    fig.savefig(path, dpi=dpi, bbox_inches='tight', facecolor='white', edgecolor='none')
+    plt.close(fig)
+    return topology
+
+
+def print_changes(diff, file=sys.stdout):
+    for change in sorted(diff.changes, key=lambda c: (c.node.vpc, c.node.kind, c.node.address)):
+        detail = ' (%s)' % ', '.join(change.attributes) if change.attributes else ''
+        print("  %s %s%s" % (SYMBOLS[change.action], change.node.address, detail), file=file)
+    counts = diff.counts()
+    totals = [sum(n for (_, a), n in counts.items() if a == action) for action in ACTIONS]
+    print("Plan: %d to add, %d to change, %d to remove." % tuple(totals), file=file)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from advnet.export import STYLES
+
+    parser = argparse.ArgumentParser(description='Show what a plan changes on the lab diagram')
+    parser.add_argument('snapshots', nargs='+', metavar='TF_FILE',
+                        help='before and after snapshots (tfstate, tfplan archive or `terraform show -json` '
+                             'files), or a single plan, compared with its prior state')
+    parser.add_argument('-o', '--output', default=None,
+                        help='diagram of the affected VPCs (format from the extension, e.g. plan-diff.png)')
+    parser.add_argument('-s', '--style', choices=list(STYLES), default='simple',
+                        help='diagram style (default: %(default)s)')
+    parser.add_argument('--layout', choices=['auto', 'grid', 'radial'], default='auto',
+                        help='VPC placement (default: grid, radial for large estates)')
+    parser.add_argument('--batched', action=argparse.BooleanOptionalAction, default=None,
+                        help='draw shapes as collections, or one artist per shape with --no-batched '
+                             '(default: collections for large estates)')
+    parser.add_argument('--dpi', type=int, default=150, help='raster resolution (default: %(default)s)')
+    parser.add_argument('--json', action='store_true', help='print the changes as JSON')
+    parser.add_argument('--detailed-exitcode', action='store_true',
+                        help='exit 2 when there are changes, like `terraform plan -detailed-exitcode`')
+    args = parser.parse_args()
+    if len(args.snapshots) > 2:
+        parser.error('give one plan, or a before and an after snapshot')
+
+    start = time.perf_counter()
+    try:
+        diff = PlanDiff(*snapshots(args.snapshots))
+    except ValueError as error:
+        sys.exit(str(error))
+    compared = time.perf_counter()
+    if args.json:
+        print(json.dumps([{'action': c.action, 'address': c.node.address, 'kind': c.node.kind,
+                           'vpc': c.node.vpc, 'attributes': c.attributes} for c in diff.changes], indent=2))
+    else:
+        print_changes(diff)
+    if args.output and diff:
+        shown = render_diff(diff, args.output, args.style, args.layout, args.batched, args.dpi)
+        print("%s: %d VPCs drawn; compared in %.2fs, rendered in %.2fs" % (
+            args.output, len(shown.vpcs), compared - start, time.perf_counter() - compared), file=sys.stderr)
+    sys.exit(2 if diff and args.detailed_exitcode else 0)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Render Profiling
+Phase-level instrumentation for the diagram generators: wall time, RSS
+deltas and artist counts per named phase, written as a Chrome trace
+(chrome://tracing, Perfetto) that also carries a per-phase JSON summary.
+Enabled with ADVNET_PROFILE=<path> or --profile <path>; when off, phase()
+hands back one shared no-op context and nothing is measured. cProfile or
+tracemalloc can be wrapped around chosen phases.
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+ENV_VAR = 'ADVNET_PROFILE'
+ENV_CPROFILE = 'ADVNET_PROFILE_CPROFILE'
+ENV_TRACEMALLOC = 'ADVNET_PROFILE_TRACEMALLOC'
+
+# Lines of tracemalloc growth kept per traced phase
+TRACEMALLOC_TOP = 15
+
+_LOADED = time.perf_counter()
+_NULL = contextlib.nullcontext()
+_profiler = None
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+    except (OSError, ValueError, IndexError):
+        # No procfs: the high-water mark is the best available
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def artist_counts(fig):
+    """(artists, items): matplotlib artists on the figure, and the shapes
+    they draw once every collection is counted per element"""
+    artists = items = 0
+    for ax in fig.axes:
+        for artist in ax.patches + ax.texts + ax.lines + ax.artists:
+            artists += 1
+            items += 1
+        for collection in ax.collections:
+            artists += 1
+            items += max(len(collection.get_offsets()) if len(collection.get_paths()) <= 1
+                         else len(collection.get_paths()), 1)
+    artists += len(fig.texts)
+    items += len(fig.texts)
+    return artists, items
+
+
+class Profiler:
+    """Collects phase events for one process"""
+
+    def __init__(self, path, cprofile=(), tracemalloc=()):
+        self.path = path.replace('{pid}', str(os.getpid()))
+        self.cprofile = set(cprofile)
+        self.tracemalloc = set(tracemalloc)
+        self.events = []
+        self.stack = []
+        self.pid = os.getpid()
+        self.written = False
+        # Everything before profiling was switched on, mostly imports
+        self._complete('startup', _LOADED, time.perf_counter(), {'rss_mb': round(_rss_mb(), 1)})
+
+    def _complete(self, name, start, end, args):
+        self.events.append({'name': name, 'cat': 'advnet', 'ph': 'X', 'pid': self.pid,
+                            'tid': threading.get_ident(), 'ts': round((start - _LOADED) * 1e6, 1),
+                            'dur': round((end - start) * 1e6, 1), 'args': args})
+
+    @contextlib.contextmanager
+    def phase(self, name, args):
+        frame = {'name': name, 'args': dict(args), 'children': 0.0}
+        rss = _rss_mb()
+        profile = trace = None
+        if name in self.cprofile and not any(f.get('profile') for f in self.stack):
+            import cProfile
+            profile = frame['profile'] = cProfile.Profile()
+        if name in self.tracemalloc:
+            import tracemalloc
+            trace = (tracemalloc.is_tracing(), None)
+            if not trace[0]:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            trace = (trace[0], tracemalloc.take_snapshot())
+        self.stack.append(frame)
+        start = time.perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            yield frame['args']
+        finally:
+            if profile:
+                profile.disable()
+            end = time.perf_counter()
+            self.stack.pop()
+            args = frame['args']
+            after = _rss_mb()
+            args.update(rss_mb=round(after, 1), rss_delta_mb=round(after - rss, 1),
+                        self_ms=round((end - start - frame['children']) * 1e3, 3))
+            if profile:
+                stats = '%s.%s.pstats' % (os.path.splitext(self.path)[0], name)
+                profile.dump_stats(stats)
+                args['cprofile'] = stats
+            if trace:
+                args['tracemalloc'] = self._traced(*trace)
+            if self.stack:
+                self.stack[-1]['children'] += end - start
+            self._complete(name, start, end, args)
+            self.events.append({'name': 'rss_mb', 'ph': 'C', 'pid': self.pid,
+                                'ts': round((end - _LOADED) * 1e6, 1), 'args': {'rss_mb': round(after, 1)}})
+
+    @staticmethod
+    def _traced(was_tracing, before):
+        import tracemalloc
+        _, peak = tracemalloc.get_traced_memory()
+        growth = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+        if not was_tracing:
+            tracemalloc.stop()
+        return {'peak_kb': round(peak / 1024, 1),
+                'top': ['%s +%.1f KiB' % (stat.traceback[0], stat.size_diff / 1024)
+                        for stat in growth[:TRACEMALLOC_TOP] if stat.size_diff > 0]}
+
+    def summary(self):
+        """Per phase name: calls, total and self seconds, largest RSS growth"""
+        phases = {}
+        for event in self.events:
+            if event['ph'] != 'X':
+                continue
+            entry = phases.setdefault(event['name'], {'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0,
+                                                      'rss_delta_mb': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += event['dur'] / 1e6
+            entry['self_seconds'] += event['args'].get('self_ms', event['dur'] / 1e3) / 1e3
+            entry['rss_delta_mb'] = max(entry['rss_delta_mb'], event['args'].get('rss_delta_mb', 0.0))
+            for key in ('artists', 'items'):
+                if key in event['args']:
+                    entry[key] = event['args'][key]
+        for entry in phases.values():
+            entry['seconds'] = round(entry['seconds'], 4)
+            entry['self_seconds'] = round(entry['self_seconds'], 4)
+        return phases
+
+    def write(self):
+        if os.getpid() != self.pid:
+            # A forked worker inherited this profiler; the parent writes it
+            return
+        document = {'traceEvents': self.events, 'displayTimeUnit': 'ms',
+                    'otherData': {'argv': sys.argv, 'peak_rss_mb': round(
+                        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss /
+                        ((1 << 20) if sys.platform == 'darwin' else 1024), 1)},
+                    'phases': self.summary()}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as handle:
+            json.dump(document, handle, indent=1)
+        os.replace(tmp, self.path)
+        self.written = True
+
+
+# --- Public hooks ---
+
+def phase(name, **args):
+    """Context manager timing a named phase; yields a dict for extra args,
+    or None when profiling is off"""
+    if _profiler is None:
+        return _NULL
+    return _profiler.phase(name, args)
+
+
+def note(**values):
+    """Attach values to the innermost open phase"""
+    if _profiler is not None and _profiler.stack:
+        _profiler.stack[-1]['args'].update(values)
+
+
+def note_artists(fig):
+    """Record the figure's artist and item counts on the innermost phase"""
+    if _profiler is not None and _profiler.stack:
+        artists, items = artist_counts(fig)
+        note(artists=artists, items=items)
+
+
+def profiled(name=None):
+    """Decorator running a function as one phase"""
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.phase(label, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class _Instrumented:
+    """Proxy timing every public method call on the wrapped object"""
+
+    def __init__(self, target, prefix):
+        self._target = target
+        self._prefix = prefix
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if attr.startswith('_') or not callable(value):
+            return value
+        label = '%s.%s' % (self._prefix, attr)
+
+        @functools.wraps(value)
+        def wrapper(*args, **kwargs):
+            with phase(label):
+                return value(*args, **kwargs)
+        return wrapper
+
+
+def instrument(target, prefix):
+    """Time each method of target as '<prefix>.<method>'; target itself
+    when profiling is off"""
+    return target if _profiler is None else _Instrumented(target, prefix)
+
+
+def enabled():
+    return _profiler is not None
+
+
+def enable(path, cprofile=(), tracemalloc=()):
+    """Start collecting; the trace is written to path at exit ('{pid}' is
+    replaced by the process id)"""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(path, cprofile, tracemalloc)
+        atexit.register(_write_at_exit)
+    return _profiler
+
+
+def write():
+    """Write the trace now; returns its path, or None when profiling is off"""
+    if _profiler is None:
+        return None
+    _profiler.write()
+    return _profiler.path
+
+
+def _write_at_exit():
+    if not _profiler.written:
+        _profiler.write()
+
+
+def _names(value):
+    return [n.strip() for n in (value or '').split(',') if n.strip()]
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', metavar='PATH', default=None,
+                        help='write a per-phase Chrome trace with a JSON summary to PATH '
+                             '(also: %s)' % ENV_VAR)
+    parser.add_argument('--profile-cprofile', metavar='PHASE', default=None,
+                        help='comma-separated phases to run under cProfile (PATH.<phase>.pstats)')
+    parser.add_argument('--profile-tracemalloc', metavar='PHASE', default=None,
+                        help='comma-separated phases whose allocations are traced')
+
+
+def profile_from_args(args):
+    if args.profile:
+        enable(args.profile, _names(args.profile_cprofile), _names(args.profile_tracemalloc))
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR], _names(os.environ.get(ENV_CPROFILE)),
+           _names(os.environ.get(ENV_TRACEMALLOC)))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarise a profile written by --profile')
+    parser.add_argument('trace', help='trace file')
+    parser.add_argument('--sort', choices=['seconds', 'self_seconds', 'rss_delta_mb'], default='self_seconds')
+    args = parser.parse_args()
+
+    with open(args.trace) as handle:
+        phases = json.load(handle)['phases']
+    print("%-28s %6s %10s %10s %10s %9s" % ('phase', 'calls', 'total s', 'self s', 'rss +MB', 'artists'))
+    for name, entry in sorted(phases.items(), key=lambda item: -item[1][args.sort]):
+        print("%-28s %6d %10.3f %10.3f %10.1f %9s" % (
+            name, entry['calls'], entry['seconds'], entry['self_seconds'], entry['rss_delta_mb'],
+            entry.get('artists', '')))
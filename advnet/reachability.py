@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Static Reachability
+Computes which endpoints (instances, subnets without instances and VPN
+sites) can reach each other on a set of probes (icmp, tcp/22, ...) from the
+topology alone: VPC route tables, Transit Gateway associations,
+propagations and static routes (VPN included) and security groups. Route
+tables are turned into longest-prefix-match indexes (one sorted array per
+prefix length), each distinct route table or TGW attachment is evaluated
+once against every destination with NumPy, and the whole N x N x probes
+matrix comes out as denial codes that explain() turns into hop-by-hop
+reasons.
+"""
+
+import json
+import sys
+import time
+
+import numpy as np
+
+from advnet.topology import is_ipv4_cidr, sg_protocol
+
+DEFAULT_PROBES = ('icmp', 'tcp/22', 'tcp/80', 'tcp/443')
+
+# Verdict codes, in the order a packet meets them
+OK = 0
+NO_ROUTE = 1
+INTERNET_GATEWAY = 2
+UNSUPPORTED_TARGET = 3
+NOT_ATTACHED = 4
+NOT_ASSOCIATED = 5
+TGW_NO_ROUTE = 6
+TGW_BLACKHOLE = 7
+TGW_WRONG_ATTACHMENT = 8
+NO_RETURN_ROUTE = 9
+SG_EGRESS = 10
+SG_INGRESS = 11
+
+VERDICTS = {
+    OK: 'reachable',
+    NO_ROUTE: 'no route in source route table',
+    INTERNET_GATEWAY: 'routed to an internet gateway',
+    UNSUPPORTED_TARGET: 'route target not modelled',
+    NOT_ATTACHED: 'source VPC not attached to the transit gateway',
+    NOT_ASSOCIATED: 'TGW attachment has no route table association',
+    TGW_NO_ROUTE: 'no route in TGW route table',
+    TGW_BLACKHOLE: 'TGW blackhole route',
+    TGW_WRONG_ATTACHMENT: 'TGW routes to another attachment',
+    NO_RETURN_ROUTE: 'no return route',
+    SG_EGRESS: 'source security group egress',
+    SG_INGRESS: 'destination security group ingress',
+}
+
+# Route target kinds, as stored in route tables and returned by trace()
+TARGET_LOCAL, TARGET_TGW, TARGET_IGW, TARGET_OTHER, TARGET_BLACKHOLE = range(5)
+
+# Probe protocols; ICMP probes are echo requests (type 8)
+_ECHO = 8
+
+
+def _network(cidr):
+    """(first address, last address, prefix length) of an IPv4 CIDR"""
+    address, _, length = cidr.partition('/')
+    length = int(length) if length else 32
+    octets = address.split('.')
+    if len(octets) != 4 or not 0 <= length <= 32:
+        raise ValueError('not an IPv4 CIDR: %r' % cidr)
+    value = 0
+    for octet in octets:
+        value = (value << 8) | int(octet)
+    host = (1 << (32 - length)) - 1
+    return value & ~host, (value & ~host) | host, length
+
+
+def parse_probe(probe):
+    """'tcp/443' -> ('tcp', 443); 'icmp' -> ('icmp', 8)"""
+    protocol, _, port = probe.lower().partition('/')
+    protocol = sg_protocol(protocol)
+    if protocol in ('icmp', 'icmpv6'):
+        return protocol, int(port) if port else _ECHO
+    if not port:
+        raise ValueError('probe %r needs a port, e.g. %s/443' % (probe, protocol))
+    return protocol, int(port)
+
+
+def _matches(rule, protocol, port):
+    """Whether a rule's ports cover a probe; for ICMP, port is the type and
+    from_port the rule's type (-1 any), and the code (to_port) is ignored
+    since probes are not specific to one"""
+    if protocol in ('icmp', 'icmpv6') and rule.protocol != '-1':
+        return rule.from_port in (-1, port)
+    return rule.from_port <= port <= rule.to_port
+
+
+class PrefixIndex:
+    """Longest-prefix match over CIDRs: one sorted network array per prefix
+    length, probed from the longest length down"""
+
+    def __init__(self, cidrs):
+        self.lengths = []
+        by_length = {}
+        for position, cidr in enumerate(cidrs):
+            low, _, length = _network(cidr)
+            by_length.setdefault(length, {}).setdefault(low, position)  # first wins
+        for length in sorted(by_length, reverse=True):
+            networks = np.array(sorted(by_length[length]), dtype=np.int64)
+            positions = np.array([by_length[length][n] for n in networks.tolist()], dtype=np.int64)
+            mask = ((1 << 32) - 1) ^ ((1 << (32 - length)) - 1)
+            self.lengths.append((mask, networks, positions))
+
+    def lookup(self, addresses):
+        """Index into the CIDR list of the longest match per address, -1 if none"""
+        found = np.full(len(addresses), -1, dtype=np.int64)
+        for mask, networks, positions in self.lengths:
+            masked = addresses & mask
+            slot = np.minimum(np.searchsorted(networks, masked), len(networks) - 1)
+            hit = (networks[slot] == masked) & (found < 0)
+            found[hit] = positions[slot[hit]]
+        return found
+
+
+class _Table:
+    """A route table as a prefix index plus per-route target arrays; targets
+    are interned to integer codes so whole rows compare at once"""
+
+    def __init__(self, table_id, routes, codes):
+        self.id = table_id
+        # IPv6 and prefix-list routes never match an IPv4 probe
+        self.routes = [route for route in routes if is_ipv4_cidr(route[0])]
+        self.index = PrefixIndex([r[0] for r in self.routes])
+        self.kinds = np.array([r[1] for r in self.routes] + [-1], dtype=np.int64)
+        self.targets = np.array([codes.setdefault(r[2], len(codes)) for r in self.routes] + [-1], dtype=np.int64)
+
+    def lookup(self, addresses):
+        return self.index.lookup(addresses)
+
+
+class Endpoint:
+    """Something that sends and receives: an instance, a bare subnet or a VPN site"""
+
+    def __init__(self, name, kind, cidr, vpc=None, subnet=None, groups=(), attachment=None):
+        self.name, self.kind, self.cidr = name, kind, cidr
+        self.vpc, self.subnet = vpc, subnet
+        self.groups = list(groups)
+        self.attachment = attachment
+        self.low, self.high, _ = _network(cidr)
+
+    def __repr__(self):
+        return 'Endpoint(%r, %r, %r)' % (self.name, self.kind, self.cidr)
+
+
+class Reachability:
+    """Reachability of every endpoint pair on every probe. codes[p, i, j] is
+    the verdict for endpoint i sending to endpoint j on probes[p]."""
+
+    def __init__(self, topology, probes=DEFAULT_PROBES, vpn_routes=None, evaluate=True):
+        self.topology = topology
+        self.probes = list(probes)
+        self.vpn_routes = vpn_routes or {}
+        self._index_routing()
+        if not evaluate:
+            # Route indexes only, for trace()
+            return
+        self.endpoints = self._endpoints()
+        self.low = np.array([e.low for e in self.endpoints], dtype=np.int64)
+        self.high = np.array([e.high for e in self.endpoints], dtype=np.int64)
+        self.vpc_code = {vpc_id: n for n, vpc_id in enumerate(self.vpcs)}
+        self.vpc_codes = np.array([self.vpc_code[e.vpc.id] if e.vpc else -1 for e in self.endpoints],
+                                  dtype=np.int64)
+        self._arrivals = {}
+        self.codes = self._evaluate()
+
+    # --- Model ---
+
+    def _index_routing(self):
+        topo = self.topology
+        self.vpcs = {vpc.id: vpc for vpc in topo.vpcs}
+        self.groups = {g.id: g for vpc in topo.vpcs for g in vpc.security_groups}
+        self.subnet_tables = {}
+        self.tables = {}
+        self.codes_of = {}
+        for vpc in topo.vpcs:
+            for table in vpc.route_tables:
+                routes = []
+                for route in table.routes:
+                    kind = {'local': TARGET_LOCAL, 'transit_gateway': TARGET_TGW, 'gateway': TARGET_IGW}.get(
+                        route.target_type, TARGET_OTHER)
+                    routes.append((route.destination, kind, route.target_id or route.target_type))
+                self.tables[table.id] = _Table(table.id, routes, self.codes_of)
+                for subnet_id in table.subnet_ids:
+                    self.subnet_tables[subnet_id] = table.id
+            # Subnets without an association use the VPC main table (local only)
+            self.tables['main:' + vpc.id] = _Table('%s main route table' % vpc.id,
+                                                   [(vpc.cidr, TARGET_LOCAL, 'local')], self.codes_of)
+
+        # attachment id -> VPC id or VPN id; (tgw, vpc) -> attachment id
+        self.attached = {}
+        self.vpc_attachment = {}
+        self.tgw_tables = {}
+        self.associated = {}
+        vpn_prefixes = {vpn.id: list(vpn.routes) + list(self.vpn_routes.get(vpn.id, []))
+                        for vpn in topo.vpn_connections}
+        for tgw in topo.transit_gateways:
+            for attachment in tgw.attachments:
+                self.attached[attachment.id] = attachment.resource_id
+                if attachment.type == 'vpc':
+                    self.vpc_attachment[tgw.id, attachment.resource_id] = attachment.id
+            prefixes = {a.id: ([self.vpcs[a.resource_id].cidr] if a.resource_id in self.vpcs else
+                               vpn_prefixes.get(a.resource_id, []))
+                        for a in tgw.attachments}
+            for table in tgw.route_tables:
+                # Static routes win over propagated ones for the same prefix
+                routes = [(r.destination, TARGET_BLACKHOLE if r.target_type == 'blackhole' else TARGET_TGW,
+                           r.target_id) for r in table.routes]
+                routes += [(cidr, TARGET_TGW, attachment_id) for attachment_id in table.propagations
+                           for cidr in prefixes.get(attachment_id, [])]
+                self.tgw_tables[table.id] = _Table(table.id, routes, self.codes_of)
+                for attachment_id in table.associations:
+                    self.associated[attachment_id] = table.id
+
+    def _endpoints(self):
+        endpoints = []
+        for vpc in self.topology.vpcs:
+            hosted = {}
+            for instance in vpc.instances:
+                hosted.setdefault(instance.subnet_id, []).append(instance)
+            for subnet in vpc.subnets:
+                for instance in hosted.get(subnet.id, []):
+                    if instance.private_ip:
+                        endpoints.append(Endpoint(instance.name, 'instance', instance.private_ip + '/32',
+                                                  vpc, subnet, instance.security_group_ids))
+                if not hosted.get(subnet.id):
+                    endpoints.append(Endpoint(subnet.name or subnet.id, 'subnet', subnet.cidr, vpc, subnet))
+        for vpn in self.topology.vpn_connections:
+            for cidr in list(vpn.routes) + list(self.vpn_routes.get(vpn.id, [])):
+                endpoints.append(Endpoint('%s %s' % (vpn.id, cidr), 'vpn', cidr, attachment=vpn.attachment_id))
+        return endpoints
+
+    # --- Routing ---
+
+    def _origin(self, endpoint):
+        if endpoint.kind == 'vpn':
+            return ('tgw', self.vpn_tgw(endpoint.attachment), endpoint.attachment)
+        return ('vpc', endpoint.vpc.id, self.subnet_tables.get(endpoint.subnet.id, 'main:' + endpoint.vpc.id))
+
+    def vpn_tgw(self, attachment_id):
+        """Transit Gateway a VPN attachment belongs to"""
+        for tgw in self.topology.transit_gateways:
+            if any(a.id == attachment_id for a in tgw.attachments):
+                return tgw.id
+        return None
+
+    def _code(self, target):
+        return self.codes_of.get(target, -2)
+
+    def _arrival(self, tgw_id):
+        """Code of the attachment through which each endpoint is reached from a TGW"""
+        if tgw_id not in self._arrivals:
+            self._arrivals[tgw_id] = np.array(
+                [self._code(e.attachment if e.kind == 'vpn' else self.vpc_attachment.get((tgw_id, e.vpc.id)))
+                 for e in self.endpoints], dtype=np.int64)
+        return self._arrivals[tgw_id]
+
+    def _tgw_row(self, tgw_id, attachment_id, cache):
+        key = (tgw_id, attachment_id)
+        if key not in cache:
+            count = len(self.endpoints)
+            table = self.tgw_tables.get(self.associated.get(attachment_id))
+            if table is None:
+                row = np.full(count, NOT_ASSOCIATED, dtype=np.int8)
+            else:
+                match = table.lookup(self.low)
+                kinds = table.kinds[match]
+                row = np.full(count, TGW_WRONG_ATTACHMENT, dtype=np.int8)
+                targets = table.targets[match]
+                row[(targets == self._arrival(tgw_id)) & (targets != self._code(attachment_id))] = OK
+                row[kinds == TARGET_BLACKHOLE] = TGW_BLACKHOLE
+                row[match < 0] = TGW_NO_ROUTE
+            cache[key] = row
+        return cache[key]
+
+    def _vpc_row(self, vpc_id, table_id, cache):
+        table = self.tables[table_id]
+        match = table.lookup(self.low)
+        kinds, targets = table.kinds[match], table.targets[match]
+        same_vpc = self.vpc_codes == self.vpc_code[vpc_id]
+        row = np.full(len(self.endpoints), UNSUPPORTED_TARGET, dtype=np.int8)
+        row[(kinds == TARGET_LOCAL) & same_vpc] = OK
+        row[kinds == TARGET_IGW] = INTERNET_GATEWAY
+        row[match < 0] = NO_ROUTE
+        for code in np.unique(targets[kinds == TARGET_TGW]).tolist():
+            tgw_id = table.routes[int(np.flatnonzero(table.targets == code)[0])][2]
+            via = (kinds == TARGET_TGW) & (targets == code)
+            attachment_id = self.vpc_attachment.get((tgw_id, vpc_id))
+            if attachment_id is None:
+                row[via] = NOT_ATTACHED
+            else:
+                row[via] = self._tgw_row(tgw_id, attachment_id, cache)[via]
+        return row
+
+    def _routing(self):
+        """Forward routing verdicts for every pair, evaluated once per origin"""
+        count = len(self.endpoints)
+        rows, cache = {}, {}
+        routing = np.empty((count, count), dtype=np.int8)
+        for i, endpoint in enumerate(self.endpoints):
+            origin = self._origin(endpoint)
+            if origin not in rows:
+                kind, owner, table_id = origin
+                if kind == 'tgw':
+                    rows[origin] = (self._tgw_row(owner, table_id, cache) if owner
+                                    else np.full(count, NOT_ASSOCIATED, dtype=np.int8))
+                else:
+                    rows[origin] = self._vpc_row(owner, table_id, cache)
+            routing[i] = rows[origin]
+        np.fill_diagonal(routing, OK)
+        return routing
+
+    # --- Security groups ---
+
+    def _allowed(self, direction, probe):
+        """allowed[i, j]: endpoint i's groups let probe traffic out to (egress)
+        or in from (ingress) endpoint j"""
+        protocol, port = parse_probe(probe)
+        count = len(self.endpoints)
+        members = {}
+        for j, endpoint in enumerate(self.endpoints):
+            for group_id in endpoint.groups:
+                members.setdefault(group_id, np.zeros(count, dtype=bool))[j] = True
+        by_group = {}
+        for group_id in {g for e in self.endpoints for g in e.groups}:
+            allowed = np.zeros(count, dtype=bool)
+            group = self.groups.get(group_id)
+            for rule in group.rules_for(direction) if group else []:
+                if rule.protocol not in ('-1', protocol) or not _matches(rule, protocol, port):
+                    continue
+                for cidr in rule.cidr_blocks:
+                    low, high, _ = _network(cidr)
+                    allowed |= (self.low >= low) & (self.high <= high)
+                for source in rule.security_group_ids:
+                    if source in members:
+                        allowed |= members[source]
+            by_group[group_id] = allowed
+        result = np.ones((count, count), dtype=bool)
+        for i, endpoint in enumerate(self.endpoints):
+            if endpoint.groups:
+                result[i] = np.any([by_group[g] for g in endpoint.groups], axis=0)
+        return result
+
+    def _evaluate(self):
+        routing = self._routing()
+        # Replies need a route back; security groups are stateful
+        routing[(routing == OK) & (routing.T != OK)] = NO_RETURN_ROUTE
+        codes = np.empty((len(self.probes),) + routing.shape, dtype=np.int8)
+        for p, probe in enumerate(self.probes):
+            code = routing.copy()
+            egress, ingress = self._allowed('egress', probe), self._allowed('ingress', probe).T
+            code[(code == OK) & ~egress] = SG_EGRESS
+            code[(code == OK) & ~ingress] = SG_INGRESS
+            np.fill_diagonal(code, OK)
+            codes[p] = code
+        return codes
+
+    # --- Queries ---
+
+    def vpc_matrix(self, probe):
+        """{(src vpc key, dst vpc key): (reachable pairs, total pairs)}"""
+        code = self.codes[self.probes.index(probe)]
+        keys = [e.vpc.key if e.vpc else 'vpn' for e in self.endpoints]
+        matrix = {}
+        for i, src in enumerate(keys):
+            for j, dst in enumerate(keys):
+                if i != j:
+                    ok, total = matrix.get((src, dst), (0, 0))
+                    matrix[src, dst] = (ok + (code[i, j] == OK), total + 1)
+        return matrix
+
+    def denials(self, probe=None):
+        """(probe, i, j, code) for every denied pair"""
+        for p, name in enumerate(self.probes):
+            if probe in (None, name):
+                for i, j in zip(*np.nonzero(self.codes[p])):
+                    yield name, int(i), int(j), int(self.codes[p, i, j])
+
+    def explain(self, i, j, probe):
+        """Hop-by-hop account of endpoint i sending probe traffic to endpoint j"""
+        src, dst = self.endpoints[i], self.endpoints[j]
+        code = int(self.codes[self.probes.index(probe), i, j])
+        hops = self._path(src, dst)
+        if code == NO_RETURN_ROUTE:
+            hops.append('return path:')
+            hops.extend('  ' + hop for hop in self._path(dst, src))
+        elif code in (SG_EGRESS, SG_INGRESS):
+            endpoint = src if code == SG_EGRESS else dst
+            peer = dst if code == SG_EGRESS else src
+            names = ', '.join(self.groups[g].name if g in self.groups else g for g in endpoint.groups)
+            hops.append('%s (%s) has no %s rule for %s %s %s' % (
+                endpoint.name, names, 'egress' if code == SG_EGRESS else 'ingress', probe,
+                'to' if code == SG_EGRESS else 'from', peer.cidr))
+        return VERDICTS[code], hops
+
+    def trace(self, origin, address):
+        """Route lookups met by traffic from an origin, ('vpc', VPC id, route
+        table id) or ('tgw', TGW id, attachment id), to an address: [(table
+        id, matched CIDR or None, target, target kind)]; a None table id
+        marks a missing TGW attachment or association"""
+        hops = []
+        addresses = np.array([address], dtype=np.int64)
+        kind, owner, table_id = origin
+        if kind == 'vpc':
+            table = self.tables[table_id]
+            match = int(table.lookup(addresses)[0])
+            if match < 0:
+                return [(table.id, None, None, None)]
+            cidr, target_kind, target = table.routes[match]
+            hops.append((table.id, cidr, target, target_kind))
+            if target_kind != TARGET_TGW:
+                return hops
+            owner, table_id = target, self.vpc_attachment.get((target, owner))
+            if table_id is None:
+                return hops + [(None, None, owner, NOT_ATTACHED)]
+        tgw_table = self.tgw_tables.get(self.associated.get(table_id))
+        if tgw_table is None:
+            return hops + [(None, None, table_id, NOT_ASSOCIATED)]
+        match = int(tgw_table.lookup(addresses)[0])
+        if match < 0:
+            return hops + [(tgw_table.id, None, None, None)]
+        cidr, target_kind, target = tgw_table.routes[match]
+        return hops + [(tgw_table.id, cidr, target, target_kind)]
+
+    def _path(self, src, dst):
+        hops = []
+        for table_id, cidr, target, kind in self.trace(self._origin(src), dst.low):
+            if table_id is None and kind == NOT_ATTACHED:
+                hops.append('%s has no attachment for %s' % (target, src.vpc.id))
+            elif table_id is None:
+                hops.append('%s is not associated with a TGW route table' % target)
+            elif cidr is None:
+                hops.append('%s: no route to %s' % (table_id, dst.cidr))
+            elif kind == TARGET_IGW:
+                hops.append('%s: %s matches %s -> %s' % (table_id, dst.cidr, cidr,
+                                                         target if target.startswith('igw-') else 'internet gateway'))
+                hops.append('private address sent to an internet gateway is dropped')
+            elif kind == TARGET_BLACKHOLE:
+                hops.append('%s: %s matches %s -> blackhole' % (table_id, dst.cidr, cidr))
+            elif table_id in self.tgw_tables:
+                hops.append('%s: %s matches %s -> %s (%s)' % (table_id, dst.cidr, cidr, target,
+                                                             self.attached.get(target, '?')))
+            else:
+                hops.append('%s: %s matches %s -> %s' % (table_id, dst.cidr, cidr, target))
+        return hops
+
+
+def format_matrix(reach, probe):
+    matrix = reach.vpc_matrix(probe)
+    keys = list(dict.fromkeys(k for k, _ in matrix))
+    width = max([len(k) for k in keys] + [6])
+    lines = ['%-*s  %s' % (width, probe, '  '.join('%-*s' % (width, k) for k in keys))]
+    for src in keys:
+        cells = []
+        for dst in keys:
+            ok, total = matrix.get((src, dst), (0, 0))
+            cells.append('-' if not total else 'yes' if ok == total else 'no' if not ok else '%d/%d' % (ok, total))
+        lines.append('%-*s  %s' % (width, src, '  '.join('%-*s' % (width, c) for c in cells)))
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from advnet.topology import (add_source_arguments, add_vpn_route_argument, topology_from_args,
+                                 vpn_routes_from_args)
+
+    parser = argparse.ArgumentParser(description='Static reachability matrix from route tables, '
+                                                 'TGW associations/propagations and security groups')
+    add_source_arguments(parser)
+    parser.add_argument('-p', '--probe', action='append', default=None,
+                        help='protocol/port to test, e.g. tcp/443 or icmp (default: %s)'
+                             % ', '.join(DEFAULT_PROBES))
+    add_vpn_route_argument(parser, 'prefix a VPN advertises over BGP (static VPN routes are read from Terraform)')
+    parser.add_argument('--limit', type=int, default=50, help='denials to explain (default: %(default)s)')
+    parser.add_argument('--json', action='store_true', help='write the full matrix as JSON')
+    args = parser.parse_args()
+
+    topology = topology_from_args(args)
+    vpn_routes = vpn_routes_from_args(parser, args, topology)
+
+    start = time.perf_counter()
+    reach = Reachability(topology, args.probe or DEFAULT_PROBES, vpn_routes)
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        json.dump({
+            'probes': reach.probes,
+            'endpoints': [{'name': e.name, 'kind': e.kind, 'cidr': e.cidr,
+                           'vpc': e.vpc.key if e.vpc else None} for e in reach.endpoints],
+            'verdicts': {str(code): text for code, text in VERDICTS.items()},
+            'codes': {probe: reach.codes[p].tolist() for p, probe in enumerate(reach.probes)},
+        }, sys.stdout)
+        print()
+    else:
+        for probe in reach.probes:
+            print('\n'.join(format_matrix(reach, probe)) + '\n')
+        denied = list(reach.denials())
+        for probe, i, j, _ in denied[:args.limit]:
+            verdict, hops = reach.explain(i, j, probe)
+            print("%s -> %s %s: %s" % (reach.endpoints[i].name, reach.endpoints[j].name, probe, verdict))
+            for hop in hops:
+                print("    " + hop)
+        if len(denied) > args.limit:
+            print("... %d more denials (--limit)" % (len(denied) - args.limit))
+    print("%d endpoints x %d probes evaluated in %.1f ms" % (
+        len(reach.endpoints), len(reach.probes), elapsed * 1000), file=sys.stderr)
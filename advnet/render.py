@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Diagram Drawing Backends
+The diagram generators describe each kind of shape once, as arrays taken
+from the layout. ArtistDrawer turns them into one matplotlib artist per
+shape (the original behaviour); BatchDrawer emits a single collection per
+call, built from array-backed geometry, and draws labels as one glyph-path
+collection so thousands of VPCs cost a handful of artists. RetainedFigure
+keeps one figure across renders and redraws only the calls that changed.
+"""
+
+import hashlib
+from functools import lru_cache
+
+import matplotlib.patches as patches
+import numpy as np
+from matplotlib.collections import (EllipseCollection, LineCollection, PathCollection,
+                                    PolyCollection)
+from matplotlib.font_manager import FontProperties
+from matplotlib.path import Path
+from matplotlib.patches import ConnectionPatch, FancyBboxPatch
+from matplotlib.textpath import TextPath
+
+from advnet import profiling
+
+# Above this many VPCs the generators switch to batched rendering by default
+BATCH_THRESHOLD = 20
+
+# Points per corner arc when approximating rounded boxes
+CORNER_POINTS = 6
+
+# zorder added per drawing call in a retained figure, so calls keep their
+# original stacking however often they are redrawn
+CALL_ZORDER_STEP = 1e-5
+
+
+def _per_item(value, n):
+    """Broadcast a scalar style value (or a per-item sequence) to n items"""
+    if isinstance(value, (list, np.ndarray)) and len(value) == n:
+        return list(value)
+    return [value] * n
+
+
+def _item_styles(style, n):
+    """Split a style dict whose values may be per-item lists into n dicts"""
+    columns = {key: _per_item(value, n) for key, value in style.items()}
+    return [{key: values[i] for key, values in columns.items()} for i in range(n)]
+
+
+class ArtistDrawer:
+    """Adds one matplotlib artist per shape"""
+
+    batched = False
+
+    def __init__(self, ax):
+        self.ax = ax
+
+    def rects(self, boxes, **style):
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        for (x, y, w, h), item in zip(boxes, _item_styles(style, len(boxes))):
+            self.ax.add_patch(patches.Rectangle((x, y), w, h, **item))
+
+    def round_boxes(self, boxes, pad=0.1, **style):
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        for (x, y, w, h), item in zip(boxes, _item_styles(style, len(boxes))):
+            self.ax.add_patch(FancyBboxPatch((x, y), w, h, boxstyle="round,pad=%g" % pad, **item))
+
+    def circles(self, centers, radius, **style):
+        centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+        for (x, y), item in zip(centers, _item_styles(style, len(centers))):
+            self.ax.add_patch(patches.Circle((x, y), radius, **item))
+
+    def ellipses(self, centers, width, height, **style):
+        centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+        for (x, y), item in zip(centers, _item_styles(style, len(centers))):
+            self.ax.add_patch(patches.Ellipse((x, y), width, height, **item))
+
+    def polygon(self, points, **style):
+        self.ax.add_patch(patches.Polygon(np.asarray(points, dtype=float), **style))
+
+    def lines(self, segments, color='black', linewidth=1, linestyle='-', alpha=None):
+        for (x0, y0), (x1, y1) in np.asarray(segments, dtype=float).reshape(-1, 2, 2):
+            self.ax.plot([x0, x1], [y0, y1], color=color, linewidth=linewidth,
+                         linestyle=linestyle, alpha=alpha)
+
+    def double_arrows(self, segments, color='black', linewidth=2, mutation_scale=20, shrink=5):
+        """Connections with arrow heads at both ends ("<->")"""
+        for start, end in np.asarray(segments, dtype=float).reshape(-1, 2, 2):
+            self.ax.add_patch(ConnectionPatch(start, end, "data", "data",
+                                              arrowstyle="<->", shrinkA=shrink, shrinkB=shrink,
+                                              mutation_scale=mutation_scale, fc=color, lw=linewidth))
+
+    def mid_arrows(self, segments, color='black', linewidth=2, mutation_scale=15, half_length=0.2):
+        """Direction markers ("->") at the middle of each segment"""
+        for start, end in np.asarray(segments, dtype=float).reshape(-1, 2, 2):
+            mid = (start + end) / 2
+            step = (end - start) / np.hypot(*(end - start)) * half_length
+            self.ax.add_patch(patches.FancyArrowPatch(tuple(mid - step), tuple(mid + step),
+                                                      arrowstyle='->', mutation_scale=mutation_scale,
+                                                      color=color, linewidth=linewidth))
+
+    def texts(self, xy, labels, **style):
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        for (x, y), label, item in zip(xy, labels, _item_styles(style, len(xy))):
+            self.ax.text(x, y, label, **item)
+
+    def finish(self):
+        pass
+
+
+class BatchDrawer(ArtistDrawer):
+    """Emits one collection per call; coordinates are data units (1 unit = 1 inch)"""
+
+    batched = True
+
+    def __init__(self, ax):
+        super().__init__(ax)
+        # Point-sized features (fonts, arrow heads) assume the axes fills the
+        # figure, which the generators arrange with subplots_adjust in this mode
+        fig = ax.figure
+        x0, x1 = ax.get_xlim()
+        self.units_per_point = (x1 - x0) / fig.get_figwidth() / 72.0
+
+    def _add(self, collection, zorder):
+        collection.set_zorder(zorder)
+        self.ax.add_collection(collection, autolim=False)
+        return collection
+
+    @staticmethod
+    def _patch_style(style):
+        return dict(facecolors=style.get('facecolor', 'none'),
+                    edgecolors=style.get('edgecolor', 'black'),
+                    linewidths=style.get('linewidth', 1.0),
+                    alpha=style.get('alpha'))
+
+    def rects(self, boxes, **style):
+        b = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        x, y, w, h = b.T
+        verts = np.stack([np.column_stack([x, y]), np.column_stack([x + w, y]),
+                          np.column_stack([x + w, y + h]), np.column_stack([x, y + h])], axis=1)
+        self._add(PolyCollection(verts, **self._patch_style(style)), 1)
+
+    def round_boxes(self, boxes, pad=0.1, **style):
+        b = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        x0, y0 = b[:, 0] - pad, b[:, 1] - pad
+        x1, y1 = b[:, 0] + b[:, 2] + pad, b[:, 1] + b[:, 3] + pad
+        # Corner arcs (radius = pad, as for boxstyle "round") in CCW order
+        t = np.linspace(0, np.pi / 2, CORNER_POINTS)
+        arc = np.column_stack([np.cos(t), np.sin(t)]) * pad
+        corners = [(x1 - pad, y1 - pad, 0), (x0 + pad, y1 - pad, 1),
+                   (x0 + pad, y0 + pad, 2), (x1 - pad, y0 + pad, 3)]
+        pieces = []
+        for cx, cy, quadrant in corners:
+            rotated = _rotate(arc, quadrant)
+            pieces.append(np.stack([cx[:, None] + rotated[:, 0], cy[:, None] + rotated[:, 1]], axis=2))
+        verts = np.concatenate(pieces, axis=1)
+        self._add(PolyCollection(verts, **self._patch_style(style)), 1)
+
+    def circles(self, centers, radius, **style):
+        c = np.asarray(centers, dtype=float).reshape(-1, 2)
+        self.ellipses(c, 2 * radius, 2 * radius, **style)
+
+    def ellipses(self, centers, width, height, **style):
+        c = np.asarray(centers, dtype=float).reshape(-1, 2)
+        n = len(c)
+        collection = EllipseCollection(np.full(n, width), np.full(n, height), np.zeros(n),
+                                       units='xy', offsets=c, offset_transform=self.ax.transData,
+                                       **self._patch_style(style))
+        self._add(collection, 1)
+
+    def polygon(self, points, **style):
+        self._add(PolyCollection([np.asarray(points, dtype=float)], **self._patch_style(style)), 1)
+
+    def lines(self, segments, color='black', linewidth=1, linestyle='-', alpha=None):
+        s = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+        self._add(LineCollection(s, colors=color, linewidths=linewidth,
+                                 linestyles=linestyle, alpha=alpha), 2)
+
+    def _heads(self, tips, directions, length, half_width):
+        # Open "V" arrow heads as pairs of line segments ending at each tip
+        normal = np.column_stack([-directions[:, 1], directions[:, 0]])
+        base = tips - directions * length
+        left = np.stack([base + normal * half_width, tips], axis=1)
+        right = np.stack([base - normal * half_width, tips], axis=1)
+        return np.concatenate([left, right])
+
+    def double_arrows(self, segments, color='black', linewidth=2, mutation_scale=20, shrink=5):
+        s = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+        if not len(s):
+            return
+        vec = s[:, 1] - s[:, 0]
+        unit = vec / np.maximum(np.hypot(vec[:, 0], vec[:, 1]), 1e-9)[:, None]
+        gap = shrink * self.units_per_point
+        start, end = s[:, 0] + unit * gap, s[:, 1] - unit * gap
+        length = 0.4 * mutation_scale * self.units_per_point
+        half_width = 0.2 * mutation_scale * self.units_per_point
+        shafts = np.stack([start, end], axis=1)
+        heads = np.concatenate([self._heads(end, unit, length, half_width),
+                                self._heads(start, -unit, length, half_width)])
+        self._add(LineCollection(np.concatenate([shafts, heads]), colors=color,
+                                 linewidths=linewidth, capstyle='round'), 1)
+
+    def mid_arrows(self, segments, color='black', linewidth=2, mutation_scale=15, half_length=0.2):
+        s = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+        if not len(s):
+            return
+        vec = s[:, 1] - s[:, 0]
+        unit = vec / np.maximum(np.hypot(vec[:, 0], vec[:, 1]), 1e-9)[:, None]
+        mid = s.mean(axis=1)
+        tips = mid + unit * half_length
+        heads = self._heads(tips, unit, 0.4 * mutation_scale * self.units_per_point,
+                            0.2 * mutation_scale * self.units_per_point)
+        shafts = np.stack([mid - unit * half_length, tips], axis=1)
+        self._add(LineCollection(np.concatenate([shafts, heads]), colors=color,
+                                 linewidths=linewidth, capstyle='round'), 1)
+
+    def texts(self, xy, labels, **style):
+        if 'bbox' in style or 'rotation' in style:
+            return super().texts(xy, labels, **style)
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        fontsize = style.get('fontsize', 10)
+        weight = style.get('fontweight', 'normal')
+        ha = style.get('ha', 'left')
+        va = style.get('va', 'baseline')
+        colors = _per_item(style.get('color', 'black'), len(xy))
+        scale = self.units_per_point
+        ascent, descent, spacing = _font_metrics(fontsize, weight)
+
+        paths = []
+        for (x, y), label in zip(xy, labels):
+            lines = str(label).split('\n')
+            n = len(lines)
+            if va == 'top':
+                baseline = y - ascent * scale
+            elif va == 'bottom':
+                baseline = y + ((n - 1) * spacing + descent) * scale
+            elif va == 'center':
+                baseline = y + ((n - 1) * spacing + descent - ascent) * scale / 2
+            else:
+                baseline = y
+            verts, codes = [], []
+            for i, line in enumerate(lines):
+                line_verts, line_codes, width = _glyphs(line, fontsize, weight)
+                if not len(line_verts):
+                    continue
+                shift = {'center': -width / 2, 'right': -width}.get(ha, 0.0)
+                verts.append(np.column_stack([x + (line_verts[:, 0] + shift) * scale,
+                                              baseline + (line_verts[:, 1] - i * spacing) * scale]))
+                codes.append(line_codes)
+            if verts:
+                paths.append(Path(np.concatenate(verts), np.concatenate(codes)))
+            else:
+                paths.append(Path(np.zeros((1, 2)), [Path.MOVETO]))
+        collection = PathCollection(paths, facecolors=colors, edgecolors='none',
+                                    alpha=style.get('alpha'))
+        self._add(collection, 3)
+
+
+def _rotate(arc, quadrant):
+    # Rotate a first-quadrant arc by quadrant * 90 degrees
+    c, s = [(1, 0), (0, 1), (-1, 0), (0, -1)][quadrant]
+    return arc @ np.array([[c, s], [-s, c]])
+
+
+@lru_cache(maxsize=None)
+def _font_metrics(fontsize, weight):
+    extents = TextPath((0, 0), 'lp', size=fontsize, prop=FontProperties(weight=weight)).get_extents()
+    ascent, descent = extents.y1, -extents.y0
+    return ascent, descent, 1.2 * (ascent + descent)
+
+
+@lru_cache(maxsize=None)
+def _char(char, fontsize, weight):
+    """Outline and advance width of one character, in points"""
+    prop = FontProperties(weight=weight)
+    # The advance is how far a following glyph moves, measured between two
+    # reference glyphs so that blanks (which have no outline) work as well
+    bracket = TextPath((0, 0), 'l' + char + 'l', size=fontsize, prop=prop).get_extents().x1
+    advance = bracket - TextPath((0, 0), 'll', size=fontsize, prop=prop).get_extents().x1
+    if not char.strip():
+        return np.zeros((0, 2)), np.zeros(0, dtype=np.uint8), advance
+    path = TextPath((0, 0), char, size=fontsize, prop=prop)
+    codes = path.codes if path.codes is not None else np.full(len(path.vertices), Path.LINETO, dtype=np.uint8)
+    return path.vertices, codes, advance
+
+
+@lru_cache(maxsize=65536)
+def _glyphs(line, fontsize, weight):
+    """Glyph outlines for one line of text, in points relative to its origin"""
+    verts, codes, x = [], [], 0.0
+    for char in line:
+        char_verts, char_codes, advance = _char(char, fontsize, weight)
+        if len(char_verts):
+            verts.append(char_verts + [x, 0])
+            codes.append(char_codes)
+        x += advance
+    if not verts:
+        return np.zeros((0, 2)), np.zeros(0, dtype=np.uint8), x
+    return np.concatenate(verts), np.concatenate(codes), x
+
+
+def make_drawer(ax, batched, retained=None):
+    drawer = BatchDrawer(ax) if batched else ArtistDrawer(ax)
+    if retained is not None:
+        drawer = retained.drawer(drawer)
+    # Each drawing call is its own phase when profiling is on
+    return profiling.instrument(drawer, 'draw')
+
+
+# --- Retained rendering ---
+
+def _fingerprint(value, digest):
+    if isinstance(value, np.ndarray):
+        digest.update(b'a%s%s' % (value.dtype.str.encode(), str(value.shape).encode()))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'l%d' % len(value))
+        for item in value:
+            _fingerprint(item, digest)
+    elif isinstance(value, dict):
+        digest.update(b'd%d' % len(value))
+        for key in sorted(value):
+            digest.update(repr(key).encode())
+            _fingerprint(value[key], digest)
+    else:
+        digest.update(b'v' + repr(value).encode())
+
+
+class RetainedFigure:
+    """One figure reused across renders of a diagram. Every drawing call is
+    fingerprinted by its position and arguments; calls identical to the last
+    render keep their artists, the others are removed and drawn again."""
+
+    def __init__(self):
+        self.fig = self.ax = None
+        self.calls = []
+        self.position = 0
+        self.reused = self.redrawn = 0
+
+    def figure(self, width, height):
+        """(fig, ax) for the next render, sized to the new layout"""
+        if self.fig is None:
+            import matplotlib.pyplot as plt
+            self.fig, self.ax = plt.subplots(1, 1, figsize=(width, height))
+        else:
+            self.fig.set_size_inches(width, height)
+        self.position = 0
+        self.reused = self.redrawn = 0
+        return self.fig, self.ax
+
+    def drawer(self, drawer):
+        return _RetainedDrawer(self, drawer)
+
+    def call(self, drawer, name, args, kwargs):
+        digest = hashlib.blake2b(digest_size=16)
+        _fingerprint((name, drawer.batched, getattr(drawer, 'units_per_point', None), args, kwargs), digest)
+        key = digest.digest()
+        index = self.position
+        self.position += 1
+        if index < len(self.calls):
+            if self.calls[index][0] == key:
+                self.reused += 1
+                return
+            for artist in self.calls[index][1]:
+                artist.remove()
+        before = {id(artist) for artist in self.ax.get_children()}
+        getattr(drawer, name)(*args, **kwargs)
+        added = [artist for artist in self.ax.get_children() if id(artist) not in before]
+        for artist in added:
+            artist.set_zorder(artist.get_zorder() + index * CALL_ZORDER_STEP)
+        if index < len(self.calls):
+            self.calls[index] = (key, added)
+        else:
+            self.calls.append((key, added))
+        self.redrawn += 1
+
+    def trim(self):
+        """Drop the artists of calls the last render no longer made"""
+        for _, artists in self.calls[self.position:]:
+            for artist in artists:
+                artist.remove()
+        del self.calls[self.position:]
+
+
+class _RetainedDrawer:
+    """Routes a drawer's calls through a RetainedFigure"""
+
+    def __init__(self, retained, drawer):
+        self._retained = retained
+        self._drawer = drawer
+
+    def __getattr__(self, attr):
+        value = getattr(self._drawer, attr)
+        if attr.startswith('_') or not callable(value):
+            return value
+        if attr == 'finish':
+            def finish():
+                value()
+                self._retained.trim()
+            return finish
+        return lambda *args, **kwargs: self._retained.call(self._drawer, attr, args, kwargs)
+
+
+def use_batched(topology, batched=None):
+    """Resolve the rendering mode: explicit flag, else batch large estates"""
+    if batched is None:
+        return len(topology.vpcs) > BATCH_THRESHOLD
+    return batched
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Tiled Diagram Export
+Renders a diagram as a multi-resolution pyramid of 256-pixel PNG tiles
+(<out>/<zoom>/<x>/<y>.png) plus a static index.html that pans and zooms
+over them. Each worker process builds the vector figure once and renders
+tiles by moving the viewport: artists outside a tile are hidden and
+collections are cut down to the items that intersect it, so the raster
+never exceeds one tile. Every tile is stamped with a hash of the topology
+items it shows; unchanged tiles are skipped on the next export.
+"""
+
+import dataclasses
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from advnet.export import PACKAGE_DIR, REPO_DIR, STYLES, file_digest, generator_sources, load_generator, use_agg
+
+# Bump whenever the tile layout or manifest changes
+TILES_VERSION = 1
+
+TILE_SIZE = 256
+
+# Pixels per inch at the deepest zoom level (the scripts save at 300 dpi)
+DEFAULT_MAX_DPI = 300
+
+MANIFEST = '.advnet-tiles.json'
+
+# Margin (inches) around item bounds for strokes, rounded corners and labels
+ITEM_PAD = 0.15
+VPC_PAD = 0.6
+
+# Text rendered smaller than this many pixels is left out of a tile
+MIN_TEXT_PIXELS = 1.5
+
+
+def pyramid(width, height, tile=TILE_SIZE, max_dpi=DEFAULT_MAX_DPI):
+    """Zoom levels and (zoom, x, y, region) of every tile; level 0 is one
+    tile covering the whole diagram, regions are (x0, y0, side) in inches
+    and rows count down from the top"""
+    extent = max(width, height)
+    levels = max(0, math.ceil(math.log2(max_dpi * extent / tile)))
+    tiles = []
+    for z in range(levels + 1):
+        side = extent / 2 ** z
+        for x in range(math.ceil(width / side - 1e-9)):
+            for y in range(math.ceil(height / side - 1e-9)):
+                tiles.append((z, x, y, (x * side, height - (y + 1) * side, side)))
+    return levels, tiles
+
+
+# --- Change tracking ---
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def tile_items(topology, layout):
+    """Bounds (x0, y0, x1, y1) and content digests of the pieces of a
+    diagram a tile can depend on"""
+    bounds, digests = [], []
+    for vpc, box in zip(layout.vpcs, layout.vpc_boxes):
+        x, y, w, h = box
+        bounds.append((x - VPC_PAD, y - VPC_PAD, x + w + VPC_PAD, y + h + VPC_PAD))
+        digests.append(_digest('vpc', repr(vpc), box.tobytes()))
+    for kind, segments in sorted(layout.edges.items()):
+        for segment in segments:
+            low, high = segment.min(axis=0), segment.max(axis=0)
+            bounds.append((low[0] - ITEM_PAD, low[1] - ITEM_PAD, high[0] + ITEM_PAD, high[1] + ITEM_PAD))
+            digests.append(_digest('edge', kind, segment.tobytes()))
+    # Everything not drawn inside a VPC: the hub band, and the frame (title,
+    # region box, availability zones) which spans the whole diagram
+    rest = dataclasses.replace(topology, vpcs=[])
+    x, y, w, h = layout.band
+    bounds.append((x, y, x + w, y + h))
+    digests.append(_digest('band', repr(rest), layout.vpn_boxes.tobytes(), layout.igw_box.tobytes()))
+    azs = sorted({s.az for vpc in topology.vpcs for s in vpc.subnets if s.az})
+    bounds.append((0, 0, layout.width, layout.height))
+    digests.append(_digest('frame', topology.region, topology.flow_log_group, azs, layout.width, layout.height))
+    return np.array(bounds, dtype=float), digests
+
+
+def _overlaps(bounds, region):
+    x0, y0, side = region
+    return ((bounds[:, 0] < x0 + side) & (bounds[:, 2] > x0) &
+            (bounds[:, 1] < y0 + side) & (bounds[:, 3] > y0))
+
+
+def tile_hashes(topology, layout, tiles, style, options):
+    """Hash per tile key 'z/x/y' that changes whenever the tile would"""
+    code = hashlib.sha256(b'advnet-tiles-%d' % TILES_VERSION)
+    file_digest(os.path.join(REPO_DIR, STYLES[style][0]), code)
+    for name in generator_sources(style) + ('tiles.py',):
+        file_digest(os.path.join(PACKAGE_DIR, name), code)
+    base = _digest(code.hexdigest(), style, json.dumps(options, sort_keys=True))
+    bounds, digests = tile_items(topology, layout)
+    hashes = {}
+    for z, x, y, region in tiles:
+        hit = np.flatnonzero(_overlaps(bounds, region)) if len(bounds) else []
+        hashes['%d/%d/%d' % (z, x, y)] = _digest(base, z, x, y, *[digests[i] for i in hit])
+    return hashes
+
+
+# --- Rendering ---
+
+class Scene:
+    """A figure prepared for viewport rendering: data-space bounds of every
+    artist, and per item for collections, so a tile draws only what it shows"""
+
+    def __init__(self, fig):
+        from matplotlib.backends.backend_agg import RendererAgg
+        from matplotlib.collections import EllipseCollection, LineCollection, PolyCollection
+        from matplotlib.patches import ConnectionPatch
+
+        self.fig = fig
+        self.ax = ax = fig.axes[0]
+        # One data unit is one inch once the axes fills the figure
+        ax.set_position([0, 0, 1, 1])
+        # Extents only need text metrics at the figure dpi; the canvas renderer
+        # would allocate a pixel buffer for the whole diagram
+        renderer = RendererAgg(1, 1, fig.dpi)
+        to_data = ax.transData.inverted()
+        self.artists, self.collections = [], []
+        for artist in ax.patches + ax.texts + ax.lines + ax.artists:
+            if isinstance(artist, ConnectionPatch) and artist.coords1 == artist.coords2 == 'data':
+                # Its path only exists in display space once drawn, and it
+                # skips drawing when an end lies outside the (tile) axes
+                corners = np.array([artist.xy1, artist.xy2], dtype=float)
+                artist.set_annotation_clip(False)
+            else:
+                corners = to_data.transform(artist.get_window_extent(renderer).get_points())
+            self.artists.append((artist, np.concatenate([corners.min(axis=0) - ITEM_PAD,
+                                                         corners.max(axis=0) + ITEM_PAD])))
+        for collection in ax.collections:
+            if isinstance(collection, EllipseCollection):
+                offsets = collection.get_offsets()
+                radius = np.column_stack([collection.get_widths(), collection.get_heights()]) / 2
+                radius = np.broadcast_to(radius, offsets.shape)
+                bounds = np.column_stack([offsets - radius - ITEM_PAD, offsets + radius + ITEM_PAD])
+                state = {'offsets': offsets, 'widths': collection.get_widths(),
+                         'heights': collection.get_heights(), 'angles': collection.get_angles()}
+            else:
+                paths = collection.get_paths()
+                bounds = np.array([np.concatenate([p.vertices.min(axis=0) - ITEM_PAD,
+                                                   p.vertices.max(axis=0) + ITEM_PAD]) for p in paths]
+                                  ).reshape(-1, 4)
+                state = {'paths': paths}
+            state.update(facecolors=collection.get_facecolor(), edgecolors=collection.get_edgecolor(),
+                         linewidths=collection.get_linewidths())
+            kind = ('ellipses' if isinstance(collection, EllipseCollection) else
+                    'lines' if isinstance(collection, LineCollection) else
+                    'polygons' if isinstance(collection, PolyCollection) else 'paths')
+            self.collections.append((collection, kind, bounds, state))
+
+    def _cut(self, collection, kind, bounds, state, region):
+        keep = np.flatnonzero(_overlaps(bounds, region))
+        collection.set_visible(bool(len(keep)))
+        if not len(keep):
+            return
+
+        def pick(values):
+            values = np.asarray(values)
+            return values[keep] if len(values) == len(bounds) and len(values) > 1 else values
+
+        if kind == 'ellipses':
+            collection.set_offsets(state['offsets'][keep])
+            collection.set_widths(pick(state['widths']))
+            collection.set_heights(pick(state['heights']))
+            collection.set_angles(pick(state['angles']))
+        else:
+            paths = [state['paths'][i] for i in keep]
+            if kind == 'lines':
+                collection.set_segments([p.vertices for p in paths])
+            elif kind == 'polygons':
+                collection.set_verts_and_codes([p.vertices for p in paths], [p.codes for p in paths])
+            else:
+                collection.set_paths(paths)
+        collection.set_facecolor(pick(state['facecolors']))
+        collection.set_edgecolor(pick(state['edgecolors']))
+        collection.set_linewidths(pick(state['linewidths']))
+
+    def render(self, region, path, tile=TILE_SIZE):
+        x0, y0, side = region
+        dpi = tile / side
+        from matplotlib.text import Text
+
+        for artist, bounds in self.artists:
+            # Text under a pixel high is unreadable, and FreeType rejects it
+            legible = not isinstance(artist, Text) or artist.get_fontsize() * dpi / 72 >= MIN_TEXT_PIXELS
+            artist.set_visible(legible and bool(_overlaps(bounds[None], region)[0]))
+        for entry in self.collections:
+            self._cut(*entry, region)
+        self.ax.set_xlim(x0, x0 + side)
+        self.ax.set_ylim(y0, y0 + side)
+        self.fig.set_size_inches(side, side)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        self.fig.savefig(tmp, format='png', dpi=dpi, facecolor='white', edgecolor='none')
+        os.replace(tmp, path)
+
+
+_scene = None
+
+
+def _init_worker(topology, style, mode, batched):
+    global _scene
+    use_agg()
+    _scene = Scene(load_generator(style)(topology, mode, batched))
+
+
+def _render_tiles(batch, out_dir):
+    for key, region in batch:
+        path = os.path.join(out_dir, key + '.png')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _scene.render(region, path)
+    return [key for key, _ in batch]
+
+
+VIEWER = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+<style>
+html, body { margin: 0; height: 100%%; overflow: hidden; background: #fff; }
+#map { position: absolute; inset: 0; cursor: grab; touch-action: none; }
+#map img { position: absolute; left: 0; top: 0; transform-origin: 0 0; user-select: none; }
+#info { position: absolute; right: 8px; bottom: 8px; font: 12px sans-serif; background: #fffc; padding: 2px 6px; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="info"></div>
+<script>
+// Scroll to zoom, drag to pan, 0 to fit
+const P = %(config)s;
+const map = document.getElementById('map'), info = document.getElementById('info');
+const tiles = new Map();
+let scale, ox, oy;
+
+function fit() {
+  scale = Math.min(innerWidth / P.width, innerHeight / P.height);
+  ox = (innerWidth - P.width * scale) / 2;
+  oy = (innerHeight - P.height * scale) / 2;
+}
+
+function draw() {
+  const z = Math.max(0, Math.min(P.levels, Math.ceil(Math.log2(scale * P.extent / P.tile))));
+  const side = P.extent / 2 ** z, size = side * scale;
+  const cols = Math.ceil(P.width / side - 1e-9), rows = Math.ceil(P.height / side - 1e-9);
+  const shown = new Set();
+  for (let x = Math.max(0, Math.floor(-ox / size)); x < Math.min(cols, Math.ceil((innerWidth - ox) / size)); x++) {
+    for (let y = Math.max(0, Math.floor(-oy / size)); y < Math.min(rows, Math.ceil((innerHeight - oy) / size)); y++) {
+      const key = z + '/' + x + '/' + y;
+      let img = tiles.get(key);
+      if (!img) {
+        img = new Image(P.tile, P.tile);
+        img.draggable = false;
+        img.src = key + '.png';
+        tiles.set(key, img);
+      }
+      img.style.transform = 'translate(' + (ox + x * size) + 'px,' + (oy + y * size) + 'px) scale(' + size / P.tile + ')';
+      if (img.parentNode !== map) map.appendChild(img);
+      shown.add(img);
+    }
+  }
+  for (const img of Array.from(map.children)) if (!shown.has(img)) map.removeChild(img);
+  info.textContent = 'zoom ' + z + '/' + P.levels;
+}
+
+map.addEventListener('wheel', e => {
+  e.preventDefault();
+  const f = Math.exp(-e.deltaY * 0.002);
+  ox = e.clientX - (e.clientX - ox) * f;
+  oy = e.clientY - (e.clientY - oy) * f;
+  scale *= f;
+  draw();
+}, {passive: false});
+
+let drag = null;
+map.addEventListener('pointerdown', e => { drag = [e.clientX - ox, e.clientY - oy]; map.setPointerCapture(e.pointerId); });
+map.addEventListener('pointermove', e => { if (drag) { ox = e.clientX - drag[0]; oy = e.clientY - drag[1]; draw(); } });
+map.addEventListener('pointerup', () => { drag = null; });
+addEventListener('keydown', e => { if (e.key === '0') { fit(); draw(); } });
+addEventListener('resize', draw);
+fit();
+draw();
+</script>
+</body>
+</html>
+"""
+
+
+def write_viewer(out_dir, title, width, height, levels, tile=TILE_SIZE):
+    config = json.dumps({'width': width, 'height': height, 'extent': max(width, height),
+                         'levels': levels, 'tile': tile})
+    path = os.path.join(out_dir, 'index.html')
+    with open(path + '.tmp', 'w') as handle:
+        handle.write(VIEWER % {'title': title, 'config': config})
+    os.replace(path + '.tmp', path)
+
+
+def export_tiles(topology, out_dir, style='simple', mode='auto', batched=None, max_dpi=DEFAULT_MAX_DPI,
+                 jobs=None, force=False):
+    """Render the tile pyramid and viewer into out_dir, skipping tiles whose
+    content is unchanged; returns (written, cached, removed) tile counts"""
+    from advnet.layout import compute_layout
+    from advnet.render import use_batched
+
+    os.makedirs(out_dir, exist_ok=True)
+    layout = compute_layout(topology, style, mode)
+    levels, tiles = pyramid(layout.width, layout.height, TILE_SIZE, max_dpi)
+    options = {'layout': mode, 'batched': use_batched(topology, batched), 'max_dpi': max_dpi}
+    hashes = tile_hashes(topology, layout, tiles, style, options)
+
+    try:
+        with open(os.path.join(out_dir, MANIFEST)) as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        manifest = {}
+    pending = [('%d/%d/%d' % (z, x, y), region) for z, x, y, region in tiles
+               if force or manifest.get('%d/%d/%d' % (z, x, y)) != hashes['%d/%d/%d' % (z, x, y)]
+               or not os.path.exists(os.path.join(out_dir, '%d/%d/%d.png' % (z, x, y)))]
+
+    # Tiles that fell out of the pyramid
+    removed = [key for key in manifest if key not in hashes]
+    for key in removed:
+        try:
+            os.remove(os.path.join(out_dir, key + '.png'))
+        except OSError:
+            pass
+        del manifest[key]
+
+    def done(keys):
+        for key in keys:
+            manifest[key] = hashes[key]
+
+    try:
+        jobs = max(1, min(jobs or os.cpu_count() or 1, len(pending)))
+        # Runs of neighbouring tiles per batch; each worker builds the figure once
+        step = max(1, math.ceil(len(pending) / (jobs * 4)))
+        batches = [pending[i:i + step] for i in range(0, len(pending), step)]
+        if jobs == 1:
+            if pending:
+                _init_worker(topology, style, mode, options['batched'])
+            for batch in batches:
+                done(_render_tiles(batch, out_dir))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                     initargs=(topology, style, mode, options['batched'])) as pool:
+                futures = [pool.submit(_render_tiles, batch, out_dir) for batch in batches if batch]
+                for future in as_completed(futures):
+                    done(future.result())
+    finally:
+        path = os.path.join(out_dir, MANIFEST)
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(manifest, handle, indent=0, sort_keys=True)
+        os.replace(path + '.tmp', path)
+    write_viewer(out_dir, 'AWS Advanced Networking Lab - %s' % STYLES[style][2],
+                 layout.width, layout.height, levels)
+    return len(pending), len(tiles) - len(pending), len(removed)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from advnet.topology import add_source_arguments, topology_from_args
+
+    parser = argparse.ArgumentParser(description='Export a diagram as a zoomable tile pyramid with an HTML viewer')
+    add_source_arguments(parser)
+    parser.add_argument('-o', '--out-dir', default='tiles', help='output directory (default: %(default)s)')
+    parser.add_argument('--style', choices=sorted(STYLES), default='simple')
+    parser.add_argument('--layout', choices=['auto', 'grid', 'radial'], default='auto',
+                        help='VPC placement (default: grid, radial for large estates)')
+    parser.add_argument('--batched', action=argparse.BooleanOptionalAction, default=None,
+                        help='draw shapes as collections, or one artist per shape with --no-batched '
+                             '(default: collections for large estates)')
+    parser.add_argument('--max-dpi', type=int, default=DEFAULT_MAX_DPI,
+                        help='resolution of the deepest zoom level (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes (default: CPU count)')
+    parser.add_argument('--force', action='store_true', help='re-render every tile')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    written, cached, removed = export_tiles(topology_from_args(args), args.out_dir, args.style, args.layout,
+                                            args.batched, args.max_dpi, args.jobs, args.force)
+    print("%d tiles written, %d up to date, %d removed in %.2fs; open %s" % (
+        written, cached, removed, time.perf_counter() - start, os.path.join(args.out_dir, 'index.html')),
+          file=sys.stderr)
@@ -0,0 +1,1011 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Topology Model
+Builds an in-memory model of the lab from Terraform documents:
+`terraform show -json` (state or plan), `terraform output -json`,
+raw tfstate files and the zipped tfplan archive written by deploy.sh.
+Parsed models are cached on disk under a content hash of the inputs.
+"""
+
+import hashlib
+import ipaddress
+import json
+import os
+import pickle
+import sys
+from dataclasses import dataclass, field
+
+# Bump whenever the model or the parser changes so stale caches are ignored
+CACHE_VERSION = 6
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'advnet')
+
+# Short labels used on the diagrams for VPC endpoint services
+ENDPOINT_LABELS = {
+    'ssm': 'SSM',
+    'ssmmessages': 'SSM-Msg',
+    'ec2messages': 'EC2-Msg',
+    's3': 'S3',
+}
+
+
+@dataclass
+class Subnet:
+    id: str
+    vpc_id: str
+    cidr: str
+    az: str = ''
+    tier: str = 'private'
+    name: str = ''
+    route_table_id: str = None
+
+
+@dataclass
+class Instance:
+    id: str
+    key: str
+    name: str
+    subnet_id: str = None
+    private_ip: str = None
+    public_ip: str = None
+    security_group_ids: list = field(default_factory=list)
+    instance_type: str = None
+
+
+@dataclass
+class Endpoint:
+    id: str
+    vpc_id: str
+    service: str
+    type: str = 'Interface'
+    subnet_ids: list = field(default_factory=list)
+
+    @property
+    def label(self):
+        short = self.service.rsplit('.', 1)[-1]
+        return ENDPOINT_LABELS.get(short, short.upper())
+
+
+@dataclass
+class Route:
+    destination: str
+    target_type: str
+    target_id: str = None
+
+
+@dataclass
+class RouteTable:
+    id: str
+    vpc_id: str
+    name: str = ''
+    routes: list = field(default_factory=list)
+    subnet_ids: list = field(default_factory=list)
+
+
+@dataclass
+class SecurityGroupRule:
+    direction: str
+    protocol: str = '-1'
+    # Port range; for ICMP the type and code, -1 meaning any
+    from_port: int = 0
+    to_port: int = 0
+    cidr_blocks: list = field(default_factory=list)
+    security_group_ids: list = field(default_factory=list)
+    description: str = ''
+
+
+@dataclass
+class SecurityGroup:
+    id: str
+    vpc_id: str
+    name: str = ''
+    rules: list = field(default_factory=list)
+
+    def rules_for(self, direction):
+        return [r for r in self.rules if r.direction == direction]
+
+
+@dataclass
+class Vpc:
+    id: str
+    key: str
+    name: str
+    cidr: str
+    subnets: list = field(default_factory=list)
+    instances: list = field(default_factory=list)
+    endpoints: list = field(default_factory=list)
+    route_tables: list = field(default_factory=list)
+    security_groups: list = field(default_factory=list)
+    internet_gateway_id: str = None
+
+    def subnets_in(self, tier):
+        return [s for s in self.subnets if s.tier == tier]
+
+    @property
+    def interface_endpoints(self):
+        return [e for e in self.endpoints if e.type == 'Interface']
+
+
+@dataclass
+class TgwAttachment:
+    id: str
+    type: str
+    resource_id: str
+    name: str = ''
+    subnet_ids: list = field(default_factory=list)
+
+
+@dataclass
+class TgwRouteTable:
+    id: str
+    name: str = ''
+    associations: list = field(default_factory=list)
+    propagations: list = field(default_factory=list)
+    routes: list = field(default_factory=list)
+
+
+@dataclass
+class TransitGateway:
+    id: str
+    name: str = ''
+    attachments: list = field(default_factory=list)
+    route_tables: list = field(default_factory=list)
+
+
+@dataclass
+class VpnConnection:
+    id: str
+    transit_gateway_id: str = None
+    attachment_id: str = None
+    customer_gateway_id: str = None
+    customer_gateway_ip: str = None
+    tunnel_addresses: list = field(default_factory=list)
+    static_routes_only: bool = False
+    routes: list = field(default_factory=list)
+
+
+@dataclass
+class Topology:
+    region: str = 'us-east-1'
+    project: str = ''
+    vpcs: list = field(default_factory=list)
+    transit_gateways: list = field(default_factory=list)
+    vpn_connections: list = field(default_factory=list)
+    flow_log_group: str = None
+    outputs: dict = field(default_factory=dict)
+    # True for the built-in lab model rather than one parsed from Terraform
+    lab: bool = False
+
+    def vpc(self, key_or_id):
+        for vpc in self.vpcs:
+            if key_or_id in (vpc.key, vpc.id):
+                return vpc
+        raise KeyError(key_or_id)
+
+    def subnet(self, subnet_id):
+        for vpc in self.vpcs:
+            for subnet in vpc.subnets:
+                if subnet.id == subnet_id:
+                    return subnet
+        raise KeyError(subnet_id)
+
+    @property
+    def transit_gateway(self):
+        return self.transit_gateways[0] if self.transit_gateways else None
+
+    @property
+    def vpn(self):
+        return self.vpn_connections[0] if self.vpn_connections else None
+
+
+def cidrsubnet(prefix, newbits, netnum):
+    """Python equivalent of Terraform's cidrsubnet()"""
+    network = ipaddress.ip_network(prefix)
+    new_prefix = network.prefixlen + newbits
+    size = 1 << (network.max_prefixlen - new_prefix)
+    base = int(network.network_address) + netnum * size
+    return str(ipaddress.ip_network((base, new_prefix)))
+
+
+def ip_to_int(address):
+    return int(ipaddress.IPv4Address(address))
+
+
+def int_to_ip(value):
+    value = int(value)
+    return '%d.%d.%d.%d' % (value >> 24, (value >> 16) & 255, (value >> 8) & 255, value & 255)
+
+
+def cidr_range(cidr):
+    """Inclusive (low, high) integer bounds of an IPv4 CIDR block"""
+    network = ipaddress.IPv4Network(cidr, strict=False)
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def is_ipv4_cidr(cidr):
+    """Whether a destination is an IPv4 CIDR block, not an IPv6 one or a prefix list"""
+    try:
+        ipaddress.IPv4Network(cidr, strict=False)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
+# Security group protocol names by IANA number
+PROTOCOL_NAMES = {'6': 'tcp', '17': 'udp', '1': 'icmp', '58': 'icmpv6', 'all': '-1'}
+
+
+def sg_protocol(protocol):
+    """Normalise a security group protocol to 'tcp', 'udp', 'icmp', '-1', ..."""
+    protocol = str(protocol if protocol not in (None, '') else '-1').lower()
+    return PROTOCOL_NAMES.get(protocol, protocol)
+
+
+# --- Terraform document readers ---
+
+def _walk_module(module, records):
+    for res in module.get('resources', []):
+        if res.get('mode', 'managed') != 'managed':
+            continue
+        records.append({
+            'address': res['address'],
+            'module': _module_of(res['address']),
+            'type': res['type'],
+            'name': res['name'],
+            'index': res.get('index'),
+            'values': res.get('values') or {},
+        })
+    for child in module.get('child_modules', []):
+        _walk_module(child, records)
+
+
+def _module_of(address):
+    parts = address.split('.')
+    return parts[1] if parts[0] == 'module' else ''
+
+
+def _records_from_state_v4(doc):
+    records = []
+    for res in doc.get('resources', []):
+        if res.get('mode') != 'managed':
+            continue
+        module = res.get('module', '')
+        prefix = module + '.' if module else ''
+        for inst in res.get('instances', []):
+            index = inst.get('index_key')
+            address = '%s%s.%s' % (prefix, res['type'], res['name'])
+            if isinstance(index, int):
+                address += '[%d]' % index
+            elif index is not None:
+                address += '[%s]' % json.dumps(index)
+            records.append({
+                'address': address,
+                'module': module.split('.')[1] if module else '',
+                'type': res['type'],
+                'name': res['name'],
+                'index': index,
+                'values': inst.get('attributes') or {},
+            })
+    return records
+
+
+def _config_outputs(module_config, prefix, outputs):
+    # Map "module.x.output" and "module.x.var.y" to the references their
+    # expressions use, so values can be followed across module boundaries
+    for name, output in module_config.get('outputs', {}).items():
+        refs = output.get('expression', {}).get('references', [])
+        outputs[prefix + name] = [_qualify(prefix, r) for r in refs]
+    for name, call in module_config.get('module_calls', {}).items():
+        child = '%smodule.%s.' % (prefix, name)
+        for var, expr in call.get('expressions', {}).items():
+            if isinstance(expr, dict) and expr.get('references'):
+                outputs[child + 'var.' + var] = [_qualify(prefix, r) for r in expr['references']]
+        _config_outputs(call.get('module', {}), child, outputs)
+
+
+def _config_references(module_config, prefix, refs):
+    # Map resource addresses to {attribute: [referenced addresses]}
+    for res in module_config.get('resources', []):
+        address = prefix + res['address']
+        attrs = refs.setdefault(address, {})
+        for attr, expr in res.get('expressions', {}).items():
+            if isinstance(expr, dict) and expr.get('references'):
+                attrs[attr] = [_qualify(prefix, r) for r in expr['references']]
+    for name, call in module_config.get('module_calls', {}).items():
+        _config_references(call.get('module', {}), '%smodule.%s.' % (prefix, name), refs)
+
+
+def _qualify(prefix, ref):
+    if ref.startswith(('local.', 'each.', 'count.', 'data.')):
+        return ref
+    if ref.startswith('var.') and not prefix:
+        return ref
+    return prefix + ref
+
+
+def _records_from_show_json(doc):
+    records = []
+    if 'planned_values' in doc:
+        _walk_module(doc['planned_values'].get('root_module', {}), records)
+        prior = []
+        _walk_module(doc.get('prior_state', {}).get('values', {}).get('root_module', {}), prior)
+        known = {r['address']: r['values'] for r in prior}
+        for record in records:
+            for key, value in known.get(record['address'], {}).items():
+                record['values'].setdefault(key, value)
+    else:
+        _walk_module(doc.get('values', {}).get('root_module', {}), records)
+
+    refs, outputs = {}, {}
+    config = doc.get('configuration', {}).get('root_module', {})
+    _config_references(config, '', refs)
+    _config_outputs(config, '', outputs)
+    return records, refs, outputs
+
+
+class PlanUnavailable(ValueError):
+    """A tfplan archive whose planned values cannot be read"""
+
+
+def _terraform_error(stderr):
+    """First line of a terraform error, without the box drawing"""
+    lines = [line.strip('\u2502\u2577\u2575 \t') for line in stderr.splitlines()]
+    return next((line for line in lines if line), '')
+
+
+def _read_plan_archive(path, require_plan=False):
+    """Read a zipped tfplan with `terraform show -json`. Without terraform,
+    or when it fails, raise PlanUnavailable if require_plan, else warn and
+    return the prior state embedded in the archive: (document, whether the
+    planned values were read)"""
+    # Imported here to keep start-up fast for the JSON-only and text paths
+    import shutil
+    import subprocess
+    import zipfile
+
+    terraform = shutil.which('terraform')
+    if not terraform:
+        reason = 'terraform is not installed'
+    else:
+        try:
+            result = subprocess.run(
+                [terraform, 'show', '-json', os.path.basename(path)],
+                cwd=os.path.dirname(os.path.abspath(path)),
+                capture_output=True, text=True, check=True)
+            return json.loads(result.stdout), True
+        except subprocess.CalledProcessError as error:
+            reason = '`terraform show -json` failed: %s' % (
+                _terraform_error(error.stderr) or 'exit status %d' % error.returncode)
+        except ValueError as error:
+            reason = '`terraform show -json` printed invalid JSON (%s)' % error
+    if require_plan:
+        raise PlanUnavailable('%s: cannot read the planned values: %s' % (path, reason))
+    print("warning: %s: %s; using the prior state stored in the plan, without the planned changes"
+          % (path, reason), file=sys.stderr)
+    with zipfile.ZipFile(path) as archive:
+        return json.loads(archive.read('tfstate')), False
+
+
+def read_document(path, require_plan=False):
+    """Return (kind, document) for any supported Terraform input file.
+    require_plan makes a tfplan archive whose planned values cannot be read
+    an error (PlanUnavailable) rather than a warning."""
+    return _read_document(path, require_plan)[:2]
+
+
+def _read_document(path, require_plan=False):
+    # (kind, document, complete); complete is False for a tfplan read
+    # without its planned values
+    complete = True
+    with open(path, 'rb') as handle:
+        magic = handle.read(2)
+    if magic == b'PK':
+        doc, complete = _read_plan_archive(path, require_plan)
+    else:
+        with open(path) as handle:
+            doc = json.load(handle)
+
+    if 'format_version' in doc and ('values' in doc or 'planned_values' in doc):
+        return 'show', doc, complete
+    if 'version' in doc and 'resources' in doc:
+        return 'state', doc, complete
+    if all(isinstance(v, dict) and 'value' in v for v in doc.values()):
+        return 'outputs', doc, complete
+    raise ValueError('Unrecognised Terraform document: %s' % path)
+
+
+# --- Model builder ---
+
+def _route_destination(values):
+    """An aws_route's destination: IPv4 or IPv6 CIDR, or prefix list id"""
+    return (values.get('destination_cidr_block') or values.get('destination_ipv6_cidr_block')
+            or values.get('destination_prefix_list_id') or '')
+
+
+class ModelBuilder:
+    """Resource records plus config references; resolves attributes a plan
+    leaves unknown and builds the Topology"""
+
+    def __init__(self, records, refs=None, module_outputs=None):
+        self.records = records
+        self.refs = refs or {}
+        self.module_outputs = module_outputs or {}
+        for record in records:
+            # Unknown (planned) IDs fall back to the resource address
+            record['id'] = record['values'].get('id') or record['address']
+        self.by_base = {}
+        for record in records:
+            self.by_base.setdefault(base_address(record['address']), []).append(record)
+
+    def of_type(self, *types):
+        return [r for r in self.records if r['type'] in types]
+
+    def resolve(self, record, attr):
+        """Return attribute value, following config references if unknown"""
+        value = record['values'].get(attr)
+        if value not in (None, '', []):
+            return value
+        ids = []
+        for ref in self.refs.get(base_address(record['address']), {}).get(attr, []):
+            ids.extend(self._resolve_ref(ref))
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return value
+        return ids if isinstance(value, list) or attr.endswith('_ids') else ids[0]
+
+    def _resolve_ref(self, ref, depth=0):
+        if depth > 8 or ref.startswith(('var.', 'local.', 'each.', 'count.', 'data.')):
+            return []
+        if ref in self.module_outputs:
+            found = []
+            for inner in self.module_outputs[ref]:
+                found.extend(self._resolve_ref(inner, depth + 1))
+            return found
+        address, _, attr = ref.rpartition('.')
+        for candidate, want in ((ref, 'id'), (address, attr)):
+            matches = self.by_base.get(candidate)
+            if matches:
+                return [self._attribute(m, want) for m in matches]
+        return []
+
+    @staticmethod
+    def _attribute(record, attr):
+        if attr == 'id':
+            return record['id']
+        value = record['values'].get(attr)
+        if value:
+            return value
+        if attr == 'transit_gateway_attachment_id':
+            return record['address'] + '#attachment'
+        return '%s.%s' % (record['address'], attr)
+
+    @staticmethod
+    def _sg_rule(direction, values, source_groups, self_reference, group_id):
+        protocol = sg_protocol(values.get('protocol'))
+        from_port, to_port = values.get('from_port'), values.get('to_port')
+        if protocol in ('icmp', 'icmpv6'):
+            # ICMP type and code, -1 for any
+            from_port, to_port = (-1 if from_port is None else from_port), (-1 if to_port is None else to_port)
+        elif protocol == '-1' or from_port in (None, -1):
+            from_port, to_port = 0, 65535
+        return SecurityGroupRule(direction=direction, protocol=protocol,
+                                 from_port=int(from_port), to_port=int(to_port if to_port is not None else from_port),
+                                 cidr_blocks=list(values.get('cidr_blocks') or []),
+                                 security_group_ids=list(source_groups or []) + ([group_id] if self_reference else []),
+                                 description=values.get('description') or '')
+
+    def module_record(self, module, rtype):
+        for record in self.records:
+            if record['module'] == module and record['type'] == rtype:
+                return record
+        return None
+
+    def vpc_id_for(self, record):
+        vpc_id = self.resolve(record, 'vpc_id')
+        if vpc_id:
+            return vpc_id
+        vpc = self.module_record(record['module'], 'aws_vpc')
+        return vpc['id'] if vpc else None
+
+    def build(self):
+        topo = Topology()
+        vpcs = {}
+        for rec in self.of_type('aws_vpc'):
+            v = rec['values']
+            key = rec['module'][:-4] if rec['module'].endswith('_vpc') else rec['name']
+            vpc = Vpc(id=rec['id'], key=key, name=(v.get('tags') or {}).get('Name', key),
+                      cidr=v.get('cidr_block', ''))
+            vpcs[vpc.id] = vpc
+            topo.vpcs.append(vpc)
+
+        subnets = {}
+        for rec in self.of_type('aws_subnet'):
+            v = rec['values']
+            vpc_id = self.vpc_id_for(rec)
+            subnet = Subnet(id=rec['id'], vpc_id=vpc_id, cidr=v.get('cidr_block', ''),
+                            az=v.get('availability_zone', ''),
+                            tier='public' if v.get('map_public_ip_on_launch') or
+                            rec['name'] == 'public' else 'private',
+                            name=(v.get('tags') or {}).get('Name', rec['name']))
+            subnets[subnet.id] = subnet
+            if vpc_id in vpcs:
+                vpcs[vpc_id].subnets.append(subnet)
+        for vpc in topo.vpcs:
+            vpc.subnets.sort(key=lambda s: (s.tier != 'public', _cidr_key(s.cidr)))
+
+        for rec in self.of_type('aws_internet_gateway'):
+            vpc_id = self.vpc_id_for(rec)
+            if vpc_id in vpcs:
+                vpcs[vpc_id].internet_gateway_id = rec['id']
+
+        tables = {}
+        for rec in self.of_type('aws_route_table'):
+            vpc_id = self.vpc_id_for(rec)
+            table = RouteTable(id=rec['id'], vpc_id=vpc_id,
+                               name=(rec['values'].get('tags') or {}).get('Name', rec['name']))
+            tables[table.id] = table
+            if vpc_id in vpcs:
+                vpcs[vpc_id].route_tables.append(table)
+                table.routes.append(Route(vpcs[vpc_id].cidr, 'local', 'local'))
+        for rec in self.of_type('aws_route_table_association'):
+            table = tables.get(self.resolve(rec, 'route_table_id'))
+            subnet_id = self.resolve(rec, 'subnet_id')
+            if table and subnet_id:
+                table.subnet_ids.append(subnet_id)
+                if subnet_id in subnets:
+                    subnets[subnet_id].route_table_id = table.id
+        for rec in self.of_type('aws_route'):
+            table = tables.get(self.resolve(rec, 'route_table_id'))
+            if not table:
+                continue
+            for target_type in ('transit_gateway_id', 'gateway_id', 'nat_gateway_id',
+                                'vpc_endpoint_id', 'network_interface_id',
+                                'vpc_peering_connection_id'):
+                target = self.resolve(rec, target_type)
+                if target:
+                    table.routes.append(Route(_route_destination(rec['values']), target_type[:-3], target))
+                    break
+
+        for rec in self.of_type('aws_vpc_endpoint'):
+            v = rec['values']
+            vpc_id = self.vpc_id_for(rec)
+            if vpc_id in vpcs:
+                vpcs[vpc_id].endpoints.append(Endpoint(
+                    id=rec['id'], vpc_id=vpc_id, service=v.get('service_name', rec['name']),
+                    type=v.get('vpc_endpoint_type', 'Gateway'),
+                    subnet_ids=list(self.resolve(rec, 'subnet_ids') or [])))
+
+        groups = {}
+        for rec in self.of_type('aws_security_group'):
+            v = rec['values']
+            vpc_id = self.vpc_id_for(rec)
+            group = SecurityGroup(id=rec['id'], vpc_id=vpc_id, name=v.get('name') or rec['name'])
+            for direction in ('ingress', 'egress'):
+                for rule in v.get(direction) or []:
+                    group.rules.append(self._sg_rule(direction, rule, rule.get('security_groups'),
+                                                     rule.get('self'), group.id))
+            groups[group.id] = group
+            if vpc_id in vpcs:
+                vpcs[vpc_id].security_groups.append(group)
+        for rec in self.of_type('aws_security_group_rule'):
+            v = rec['values']
+            group = groups.get(self.resolve(rec, 'security_group_id'))
+            if group:
+                source = self.resolve(rec, 'source_security_group_id')
+                group.rules.append(self._sg_rule(v.get('type', 'ingress'), v, [source] if source else [],
+                                                 v.get('self'), group.id))
+        for rtype, direction in (('aws_vpc_security_group_ingress_rule', 'ingress'),
+                                 ('aws_vpc_security_group_egress_rule', 'egress')):
+            for rec in self.of_type(rtype):
+                v = rec['values']
+                group = groups.get(self.resolve(rec, 'security_group_id'))
+                if group:
+                    source = self.resolve(rec, 'referenced_security_group_id')
+                    rule = dict(v, protocol=v.get('ip_protocol'),
+                                cidr_blocks=[v['cidr_ipv4']] if v.get('cidr_ipv4') else [])
+                    group.rules.append(self._sg_rule(direction, rule, [source] if source else [],
+                                                     False, group.id))
+
+        for rec in self.of_type('aws_instance'):
+            v = rec['values']
+            subnet_id = self.resolve(rec, 'subnet_id')
+            instance = Instance(id=rec['id'], key=rec['name'],
+                                name=(v.get('tags') or {}).get('Name', rec['name']),
+                                subnet_id=subnet_id, private_ip=v.get('private_ip'),
+                                public_ip=v.get('public_ip'),
+                                security_group_ids=list(self.resolve(rec, 'vpc_security_group_ids') or []),
+                                instance_type=v.get('instance_type'))
+            subnet = subnets.get(subnet_id)
+            if subnet and subnet.vpc_id in vpcs:
+                vpcs[subnet.vpc_id].instances.append(instance)
+
+        tgws = {}
+        for rec in self.of_type('aws_ec2_transit_gateway'):
+            tgw = TransitGateway(id=rec['id'],
+                                 name=(rec['values'].get('tags') or {}).get('Name', rec['name']))
+            tgws[tgw.id] = tgw
+            topo.transit_gateways.append(tgw)
+
+        attachments = {}
+        for rec in self.of_type('aws_ec2_transit_gateway_vpc_attachment'):
+            v = rec['values']
+            attachment = TgwAttachment(id=rec['id'], type='vpc', resource_id=self.vpc_id_for(rec),
+                                       name=(v.get('tags') or {}).get('Name', rec['name']),
+                                       subnet_ids=list(self.resolve(rec, 'subnet_ids') or []))
+            attachments[attachment.id] = attachment
+            tgw = tgws.get(self.resolve(rec, 'transit_gateway_id'))
+            if tgw:
+                tgw.attachments.append(attachment)
+
+        customer_gateways = {r['id']: r['values'] for r in self.of_type('aws_customer_gateway')}
+        for rec in self.of_type('aws_vpn_connection'):
+            v = rec['values']
+            cgw_id = self.resolve(rec, 'customer_gateway_id')
+            vpn = VpnConnection(
+                id=rec['id'],
+                transit_gateway_id=self.resolve(rec, 'transit_gateway_id'),
+                attachment_id=v.get('transit_gateway_attachment_id') or rec['address'] + '#attachment',
+                customer_gateway_id=cgw_id,
+                customer_gateway_ip=customer_gateways.get(cgw_id, {}).get('ip_address'),
+                tunnel_addresses=[a for a in (v.get('tunnel1_address'), v.get('tunnel2_address')) if a],
+                static_routes_only=bool(v.get('static_routes_only')))
+            topo.vpn_connections.append(vpn)
+            attachment = TgwAttachment(id=vpn.attachment_id, type='vpn', resource_id=vpn.id,
+                                       name=(v.get('tags') or {}).get('Name', rec['name']))
+            attachments[attachment.id] = attachment
+            tgw = tgws.get(vpn.transit_gateway_id)
+            if tgw:
+                tgw.attachments.append(attachment)
+
+        vpns = {vpn.id: vpn for vpn in topo.vpn_connections}
+        for rec in self.of_type('aws_vpn_connection_route'):
+            vpn = vpns.get(self.resolve(rec, 'vpn_connection_id'))
+            # VPN prefixes are site address ranges; IPv6 ones are not modelled
+            if vpn and is_ipv4_cidr(rec['values'].get('destination_cidr_block')):
+                vpn.routes.append(rec['values']['destination_cidr_block'])
+
+        tgw_tables = {}
+        for rec in self.of_type('aws_ec2_transit_gateway_route_table'):
+            table = TgwRouteTable(id=rec['id'],
+                                  name=(rec['values'].get('tags') or {}).get('Name', rec['name']))
+            tgw_tables[table.id] = table
+            tgw = tgws.get(self.resolve(rec, 'transit_gateway_id'))
+            if tgw:
+                tgw.route_tables.append(table)
+        for rtype, attr in (('aws_ec2_transit_gateway_route_table_association', 'associations'),
+                            ('aws_ec2_transit_gateway_route_table_propagation', 'propagations')):
+            for rec in self.of_type(rtype):
+                table = tgw_tables.get(self.resolve(rec, 'transit_gateway_route_table_id'))
+                attachment_id = self.resolve(rec, 'transit_gateway_attachment_id')
+                if table and attachment_id:
+                    getattr(table, attr).append(attachment_id)
+        for rec in self.of_type('aws_ec2_transit_gateway_route'):
+            table = tgw_tables.get(self.resolve(rec, 'transit_gateway_route_table_id'))
+            if table:
+                table.routes.append(Route(_route_destination(rec['values']),
+                                          'blackhole' if rec['values'].get('blackhole')
+                                          else 'transit_gateway_attachment',
+                                          self.resolve(rec, 'transit_gateway_attachment_id')))
+
+        for rec in self.of_type('aws_cloudwatch_log_group'):
+            name = rec['values'].get('name', '')
+            if 'flow-logs' in name:
+                topo.flow_log_group = name
+        return topo
+
+
+def base_address(address):
+    """Resource address without its count/for_each index"""
+    return address.split('[', 1)[0]
+
+
+def _cidr_key(cidr):
+    try:
+        return int(ipaddress.ip_network(cidr).network_address)
+    except ValueError:
+        return 0
+
+
+def _apply_outputs(topo, outputs):
+    """Fill in IDs from `terraform output -json` where the state had none"""
+    values = {k: v.get('value') for k, v in outputs.items()}
+    topo.outputs.update(values)
+    renames = {}
+
+    for key, vpc_id in (values.get('vpc_ids') or {}).items():
+        for vpc in topo.vpcs:
+            if vpc.key == key:
+                renames[vpc.id] = vpc_id
+    for vpc in topo.vpcs:
+        for instance in vpc.instances:
+            if values.get('%s_instance_id' % instance.key):
+                renames[instance.id] = values['%s_instance_id' % instance.key]
+            instance.private_ip = values.get('%s_private_ip' % instance.key, instance.private_ip)
+            instance.public_ip = values.get('%s_public_ip' % instance.key, instance.public_ip)
+
+    tgw_id = values.get('transit_gateway_id') or values.get('tgw_id')
+    if tgw_id:
+        if topo.transit_gateways:
+            renames[topo.transit_gateways[0].id] = tgw_id
+        else:
+            topo.transit_gateways.append(TransitGateway(id=tgw_id))
+    vpn_id = values.get('vpn_connection_id')
+    if vpn_id:
+        if topo.vpn_connections:
+            renames[topo.vpn_connections[0].id] = vpn_id
+        else:
+            topo.vpn_connections.append(VpnConnection(id=vpn_id))
+    if values.get('cloudwatch_log_group_name'):
+        topo.flow_log_group = values['cloudwatch_log_group_name']
+
+    renames = {old: new for old, new in renames.items() if old != new}
+    if renames:
+        _substitute_ids(topo, renames)
+
+
+def _substitute_ids(obj, renames):
+    # Walk the model replacing placeholder IDs wherever they are referenced
+    for name, value in vars(obj).items():
+        if isinstance(value, str):
+            if value in renames:
+                setattr(obj, name, renames[value])
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                if isinstance(item, str):
+                    value[i] = renames.get(item, item)
+                elif hasattr(item, '__dataclass_fields__'):
+                    _substitute_ids(item, renames)
+
+
+def parse_documents(documents):
+    """Build a Topology from a list of (kind, document) pairs"""
+    return build_topology(*parse_resources(documents))
+
+
+def parse_resources(documents):
+    """Index the resources of (kind, document) pairs without building the
+    model: (builder, region, outputs), where the builder holds the records
+    and config references. build_topology() turns them into a Topology."""
+    records, refs, module_outputs, outputs = [], {}, {}, {}
+    region = None
+    for kind, doc in documents:
+        if kind == 'outputs':
+            outputs.update(doc)
+            continue
+        if kind == 'show':
+            recs, r, o = _records_from_show_json(doc)
+            refs.update(r)
+            module_outputs.update(o)
+            state_outputs = (doc.get('planned_values') or doc.get('values') or {}).get('outputs', {})
+        else:
+            recs = _records_from_state_v4(doc)
+            state_outputs = doc.get('outputs', {})
+            for res in doc.get('resources', []):
+                if res.get('type') == 'aws_availability_zones' and res.get('instances'):
+                    region = res['instances'][0]['attributes'].get('id') or region
+        records.extend(recs)
+        outputs.update({k: v for k, v in state_outputs.items() if isinstance(v, dict)})
+        if kind == 'show':
+            variables = doc.get('variables', {})
+            region = (variables.get('region') or {}).get('value', region)
+
+    return ModelBuilder(records, refs, module_outputs), region, outputs
+
+
+def build_topology(builder, region, outputs):
+    """Topology from what parse_resources() returned"""
+    topo = builder.build()
+    if region:
+        topo.region = region
+    _apply_outputs(topo, outputs)
+    if topo.flow_log_group and not topo.project:
+        topo.project = topo.flow_log_group.rstrip('/').rsplit('/', 1)[-1]
+    return topo
+
+
+# --- Cached loading ---
+
+def inputs_hash(paths):
+    digest = hashlib.sha256(b'advnet-topology-%d' % CACHE_VERSION)
+    for path in paths:
+        with open(path, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def load_topology(paths, cache_dir=None, use_cache=True):
+    """Load and merge Terraform documents, reusing a cached model when the
+    input contents are unchanged"""
+    paths = list(paths)
+    cache_dir = cache_dir or os.environ.get('ADVNET_CACHE_DIR', DEFAULT_CACHE_DIR)
+    cache_file = os.path.join(cache_dir, 'topology-%s.pickle' % inputs_hash(paths))
+
+    if use_cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as handle:
+                return pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+
+    documents = [_read_document(p) for p in paths]
+    topo = parse_documents([(kind, doc) for kind, doc, _ in documents])
+
+    # A plan read without terraform is not cached, so the model is complete
+    # (and the warning repeated) once terraform can read it
+    if use_cache and all(complete for _, _, complete in documents):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = cache_file + '.%d.tmp' % os.getpid()
+        with open(tmp, 'wb') as handle:
+            pickle.dump(topo, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    return topo
+
+
+def lab_topology():
+    """The three-VPC lab as last deployed, used when no Terraform input is given"""
+    topo = Topology(region='us-east-1', project='adv-net-lowcost',
+                    flow_log_group='/aws/vpc/flow-logs/adv-net-lowcost', lab=True)
+    instances = {
+        'shared': Instance('i-0473725c94f4d2b0d', 'bastion', 'Bastion', private_ip='10.10.0.10',
+                           instance_type='t2.micro'),
+        'app': Instance('i-0fb0ec22102a92543', 'app_server', 'App Server', private_ip='10.20.100.24',
+                        instance_type='t2.micro'),
+        'onprem': Instance('i-004feea49a7f493f1', 'strongswan', 'StrongSwan',
+                           private_ip='10.30.0.10', public_ip='54.84.220.170', instance_type='t2.micro'),
+    }
+    names = {'shared': 'Shared VPC', 'app': 'App VPC', 'onprem': 'OnPrem VPC'}
+    cidrs = {key: '10.%d.0.0/16' % (10 * (n + 1)) for n, key in enumerate(names)}
+    everywhere = ['0.0.0.0/0']
+    egress = SecurityGroupRule('egress', '-1', 0, 65535, everywhere)
+    # Security groups as declared in main.tf and modules/vpn
+    groups = {
+        'shared': [
+            SecurityGroup('sg-test-instance', 'vpc-shared', 'adv-net-lowcost-test-instance-sg', [
+                SecurityGroupRule('ingress', 'tcp', 22, 22, everywhere, description='SSH'),
+                SecurityGroupRule('ingress', 'tcp', 80, 80, [cidrs['shared'], cidrs['onprem']],
+                                  description='HTTP'),
+                SecurityGroupRule('ingress', 'icmp', -1, -1, list(cidrs.values()), description='ICMP'),
+                egress]),
+            SecurityGroup('sg-shared-vpc-endpoint', 'vpc-shared', 'adv-net-lowcost-shared-vpc-endpoint-sg', [
+                SecurityGroupRule('ingress', 'tcp', 443, 443, [cidrs['shared']], description='HTTPS'),
+                egress]),
+        ],
+        'app': [
+            SecurityGroup('sg-app-server', 'vpc-app', 'adv-net-lowcost-app-server-sg', [
+                SecurityGroupRule('ingress', 'tcp', 80, 80, [cidrs['shared'], cidrs['onprem']],
+                                  description='HTTP from other VPCs'),
+                SecurityGroupRule('ingress', 'icmp', -1, -1, [cidrs['shared'], cidrs['onprem']],
+                                  description='ICMP for testing'),
+                egress]),
+            SecurityGroup('sg-app-vpc-endpoint', 'vpc-app', 'adv-net-lowcost-app-vpc-endpoint-sg', [
+                SecurityGroupRule('ingress', 'tcp', 443, 443, [cidrs['app']], description='HTTPS'),
+                egress]),
+        ],
+        'onprem': [
+            SecurityGroup('sg-strongswan', 'vpc-onprem', 'adv-net-lowcost-strongswan-sg', [
+                SecurityGroupRule('ingress', 'udp', 500, 500, everywhere, description='IKE'),
+                SecurityGroupRule('ingress', 'udp', 4500, 4500, everywhere, description='IPSec NAT-T'),
+                SecurityGroupRule('ingress', 'icmp', -1, -1, everywhere, description='ICMP'),
+                SecurityGroupRule('ingress', 'tcp', 22, 22, everywhere, description='SSH'),
+                egress]),
+        ],
+    }
+    tgw = TransitGateway(id='tgw-02c7208c8a5442572', name='adv-net-lowcost-tgw')
+    core = TgwRouteTable(id='tgw-rtb-core', name='tgw-core-rt')
+    tgw.route_tables.append(core)
+
+    for key, cidr in cidrs.items():
+        vpc = Vpc(id='vpc-%s' % key, key=key, name=names[key], cidr=cidr, security_groups=groups[key])
+        public = Subnet('subnet-%s-public-0' % key, vpc.id, cidrsubnet(cidr, 8, 0), 'us-east-1a', 'public')
+        private = Subnet('subnet-%s-private-0' % key, vpc.id, cidrsubnet(cidr, 8, 100), 'us-east-1a', 'private')
+        vpc.subnets = [public, private]
+        instance = instances[key]
+        instance.subnet_id = private.id if key == 'app' else public.id
+        instance.security_group_ids = [groups[key][0].id]
+        vpc.instances.append(instance)
+        if key != 'onprem':
+            for service in ('ssm', 'ssmmessages', 'ec2messages'):
+                vpc.endpoints.append(Endpoint('vpce-%s-%s' % (key, service), vpc.id,
+                                              'com.amazonaws.us-east-1.%s' % service, 'Interface',
+                                              [private.id]))
+        # Public subnets only route to the internet gateway; the TGW routes
+        # below go into the private tables
+        vpc.route_tables.append(RouteTable('rtb-%s-public' % key, vpc.id, subnet_ids=[public.id],
+                                           routes=[Route(cidr, 'local', 'local'),
+                                                   Route('0.0.0.0/0', 'gateway')]))
+        public.route_table_id = 'rtb-%s-public' % key
+        rt = RouteTable('rtb-%s-private' % key, vpc.id, subnet_ids=[private.id],
+                        routes=[Route(cidr, 'local', 'local')])
+        private.route_table_id = rt.id
+        vpc.route_tables.append(rt)
+        topo.vpcs.append(vpc)
+
+        attachment = TgwAttachment('tgw-attach-%s' % key, 'vpc', vpc.id, '%s-attach' % key, [private.id])
+        tgw.attachments.append(attachment)
+        core.associations.append(attachment.id)
+        core.propagations.append(attachment.id)
+
+    for vpc in topo.vpcs:
+        for other in topo.vpcs:
+            if other is not vpc:
+                vpc.route_tables[-1].routes.append(Route(other.cidr, 'transit_gateway', tgw.id))
+
+    vpn = VpnConnection('vpn-03b4be9fbe7724aa2', tgw.id, 'tgw-attach-vpn',
+                        customer_gateway_ip='54.84.220.170')
+    tgw.attachments.append(TgwAttachment(vpn.attachment_id, 'vpn', vpn.id, 'vpn-attach'))
+    core.associations.append(vpn.attachment_id)
+    core.propagations.append(vpn.attachment_id)
+    topo.transit_gateways.append(tgw)
+    topo.vpn_connections.append(vpn)
+    return topo
+
+
+def add_source_arguments(parser, positional=True):
+    """Terraform input arguments; positional=False takes them as repeated
+    --terraform options, for tools whose positional arguments are other files"""
+    help = 'tfplan archive, tfstate, or `terraform show/output -json` files (defaults to the lab topology)'
+    if positional:
+        parser.add_argument('terraform', nargs='*', metavar='TF_FILE', help=help)
+    else:
+        parser.add_argument('--terraform', action='append', default=[], metavar='TF_FILE', help=help)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always re-parse the Terraform inputs')
+    parser.add_argument('--cache-dir', default=None,
+                        help='cache directory (default: %s)' % DEFAULT_CACHE_DIR)
+
+
+def add_vpn_route_argument(parser, help='prefix a VPN advertises over BGP'):
+    parser.add_argument('--vpn-route', action='append', default=[], metavar='[VPN_ID=]CIDR',
+                        help=help + '; without VPN_ID, the first VPN connection')
+
+
+def vpn_routes_from_args(parser, args, topology):
+    """--vpn-route values as {VPN id: [CIDR, ...]}, or a parser error"""
+    vpn_routes = {}
+    known = [vpn.id for vpn in topology.vpn_connections]
+    for item in args.vpn_route:
+        vpn_id, _, cidr = item.rpartition('=')
+        if not is_ipv4_cidr(cidr) or '/' not in cidr:
+            parser.error('--vpn-route %s: expected [VPN_ID=]CIDR' % item)
+        if not known:
+            parser.error('--vpn-route %s: the topology has no VPN connection' % item)
+        if vpn_id and vpn_id not in known:
+            parser.error('--vpn-route %s: no VPN connection %s (the topology has %s)' % (
+                item, vpn_id, ', '.join(known)))
+        vpn_routes.setdefault(vpn_id or known[0], []).append(cidr)
+    return vpn_routes
+
+
+def topology_from_args(args):
+    if not args.terraform:
+        return lab_topology()
+    topo = load_topology(args.terraform, cache_dir=args.cache_dir, use_cache=not args.no_cache)
+    if not topo.vpcs and topo.outputs:
+        # A bare `terraform output -json` names IDs but no resources: overlay
+        # them on the lab layout
+        print("warning: no resources in %s; using the built-in lab model with its outputs"
+              % ', '.join(args.terraform), file=sys.stderr)
+        lab = lab_topology()
+        _apply_outputs(lab, {name: {'value': value} for name, value in topo.outputs.items()})
+        return lab
+    return topo
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarise the lab topology')
+    add_source_arguments(parser)
+    topo = topology_from_args(parser.parse_args())
+
+    print("Region: %s" % topo.region)
+    for vpc in topo.vpcs:
+        print("VPC %-8s %-22s %s" % (vpc.key, vpc.id, vpc.cidr))
+        for subnet in vpc.subnets:
+            print("  %-7s %-18s %s" % (subnet.tier, subnet.cidr, subnet.az))
+    for tgw in topo.transit_gateways:
+        print("TGW %s (%d attachments)" % (tgw.id, len(tgw.attachments)))
+    for vpn in topo.vpn_connections:
+        print("VPN %s" % vpn.id)
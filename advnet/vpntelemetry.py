@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - VPN Tunnel Telemetry
+Polls the tunnel status of every Site-to-Site VPN connection on a fixed
+interval, one DescribeVpnConnections call per batch of connections, and
+keeps the samples in a ring buffer persisted to a memory-mapped file: a
+fixed number of tunnel slots, each a fixed-size array of (time, status,
+last change, accepted routes) records. The file is allocated once at its
+full size, so memory and disk use stay the same however long the collector
+runs. Uptime per tunnel, and the sparklines drawn into the VPN box of the
+professional diagram, are computed from the stored samples.
+"""
+
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from advnet.topology import DEFAULT_CACHE_DIR
+
+STORE_NAME = 'vpn-telemetry.ring'
+MAGIC = b'ADVNVPN1'
+
+DEFAULT_INTERVAL = 60.0
+# Four weeks of one-minute samples per tunnel (473 KiB per tunnel slot)
+DEFAULT_CAPACITY = 28 * 24 * 60
+# Two tunnels for each of eight VPN connections
+DEFAULT_SLOTS = 16
+# VPN connection ids per DescribeVpnConnections call when ids are given
+BATCH_SIZE = 100
+
+# Sample status codes; 0 when a connection reports no telemetry yet
+# (pending connections, local stand-ins such as moto)
+STATUS_CODES = {'UP': 1, 'DOWN': 2}
+STATUS_NAMES = {0: 'n/a', 1: 'UP', 2: 'DOWN'}
+
+HEADER = np.dtype([('magic', 'S8'), ('slots', '<u4'), ('capacity', '<u4'), ('interval', '<f8'),
+                   ('polls', '<u8'), ('last', '<f8'), ('reserved', 'V24')])
+SLOT = np.dtype([('vpn_id', 'S32'), ('address', 'S48'), ('tunnel', '<u4'), ('reserved', 'V4'),
+                 ('written', '<u8')])
+SAMPLE = np.dtype([('time', '<u4'), ('changed', '<u4'), ('routes', '<u2'), ('status', 'u1'),
+                   ('reserved', 'u1')])
+
+
+def store_path(cache_dir=None):
+    cache_dir = cache_dir or os.environ.get('ADVNET_CACHE_DIR', DEFAULT_CACHE_DIR)
+    return os.path.join(cache_dir, STORE_NAME)
+
+
+# --- Ring buffer ---
+
+class TelemetryRing:
+    """Fixed-size sample store. Each slot holds one tunnel, identified by
+    VPN connection id and outside address; its samples are written at
+    written % capacity, so the oldest are overwritten once it is full"""
+
+    def __init__(self, path, slots=DEFAULT_SLOTS, capacity=DEFAULT_CAPACITY, readonly=False):
+        self.path = path
+        if not os.path.exists(path):
+            if readonly:
+                raise FileNotFoundError('no telemetry store at %s' % path)
+            self._create(path, slots, capacity)
+        self._raw = np.memmap(path, dtype=np.uint8, mode='r' if readonly else 'r+')
+        self.header = self._raw[:HEADER.itemsize].view(HEADER)
+        if self.header['magic'][0] != MAGIC:
+            raise ValueError('%s is not a VPN telemetry store' % path)
+        # The geometry is fixed when the file is created
+        self.slots = int(self.header['slots'][0])
+        self.capacity = int(self.header['capacity'][0])
+        table_end = HEADER.itemsize + self.slots * SLOT.itemsize
+        self.table = self._raw[HEADER.itemsize:table_end].view(SLOT)
+        self.samples = self._raw[table_end:].view(SAMPLE).reshape(self.slots, self.capacity)
+        self.readonly = readonly
+        self._index = {(vpn_id, address): slot for slot, vpn_id, address, _ in self.tunnels()}
+
+    @staticmethod
+    def _create(path, slots, capacity):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        size = HEADER.itemsize + slots * (SLOT.itemsize + capacity * SAMPLE.itemsize)
+        header = np.zeros(1, HEADER)
+        header['magic'], header['slots'], header['capacity'] = MAGIC, slots, capacity
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as handle:
+            handle.write(header.tobytes())
+            handle.truncate(size)
+            try:
+                # Reserve the blocks now so the store never grows on disk
+                os.posix_fallocate(handle.fileno(), 0, size)
+            except (AttributeError, OSError):
+                pass
+        os.replace(tmp, path)
+
+    def __len__(self):
+        return len(self._index)
+
+    def tunnels(self):
+        """(slot, vpn_id, address, tunnel number) for every slot in use"""
+        used = np.flatnonzero(self.table['vpn_id'] != b'')
+        return [(int(slot), self.table['vpn_id'][slot].decode(), self.table['address'][slot].decode(),
+                 int(self.table['tunnel'][slot])) for slot in used]
+
+    def slot(self, vpn_id, address, tunnel=0):
+        """The tunnel's slot, allocated on first sight. With every slot taken,
+        the one whose tunnel has gone longest without a sample is reused if
+        it missed the last poll; otherwise None"""
+        key = (vpn_id, address)
+        if key in self._index:
+            return self._index[key]
+        free = np.flatnonzero(self.table['vpn_id'] == b'')
+        if len(free):
+            slot = int(free[0])
+        else:
+            latest = self._latest_times()
+            slot = int(np.argmin(latest))
+            if latest[slot] >= int(self.header['last'][0]):
+                return None
+            del self._index[(self.table['vpn_id'][slot].decode(), self.table['address'][slot].decode())]
+        self.table['written'][slot] = 0
+        self.table['tunnel'][slot] = tunnel
+        self.table['address'][slot] = address.encode()
+        self.table['vpn_id'][slot] = vpn_id.encode()
+        self._index[key] = slot
+        return slot
+
+    def _latest_times(self):
+        written = self.table['written'].astype(np.int64)
+        rows = (written - 1) % self.capacity
+        # Slots taken in the current poll have no sample yet and are kept
+        latest = self.samples['time'][np.arange(self.slots), rows].astype(np.int64)
+        return np.where(written > 0, latest, np.iinfo(np.int64).max)
+
+    def append(self, slots, when, status, changed, routes):
+        """Write one sample to each of slots (distinct) and count a poll"""
+        slots = np.asarray(slots, dtype=np.int64)
+        if len(slots):
+            rows = self.table['written'][slots] % self.capacity
+            record = self.samples[slots, rows]
+            record['time'] = int(when)
+            record['status'] = status
+            record['changed'] = changed
+            record['routes'] = np.minimum(routes, 0xFFFF)
+            self.samples[slots, rows] = record
+            # Bumped after the record so readers never see an unwritten row
+            self.table['written'][slots] += 1
+        self.header['polls'] += 1
+        self.header['last'] = when
+
+    def read(self, slot):
+        """The slot's samples, oldest first"""
+        written = int(self.table['written'][slot])
+        if written <= self.capacity:
+            return self.samples[slot, :written].copy()
+        start = written % self.capacity
+        return np.concatenate([self.samples[slot, start:], self.samples[slot, :start]])
+
+    def flush(self):
+        if not self.readonly:
+            self._raw.flush()
+
+    def close(self):
+        self.flush()
+        del self.header, self.table, self.samples, self._raw
+
+
+# --- Collector ---
+
+def _epoch(value):
+    return int(value.timestamp()) if hasattr(value, 'timestamp') else 0
+
+
+def connection_tunnels(connection):
+    """(address, tunnel number, status code, last change, accepted routes)
+    per tunnel of one DescribeVpnConnections entry"""
+    telemetry = connection.get('VgwTelemetry') or []
+    if telemetry:
+        return [(t.get('OutsideIpAddress', ''), number, STATUS_CODES.get(t.get('Status'), 0),
+                 _epoch(t.get('LastStatusChange')), t.get('AcceptedRouteCount', 0))
+                for number, t in enumerate(telemetry, 1)]
+    # No telemetry yet: both tunnels are recorded with an unknown status
+    options = connection.get('Options', {}).get('TunnelOptions') or [{}, {}]
+    return [(t.get('OutsideIpAddress') or 'tunnel%d' % number, number, 0, 0, 0)
+            for number, t in enumerate(options, 1)]
+
+
+class Collector:
+    """Polls tunnel telemetry into a TelemetryRing"""
+
+    def __init__(self, ring, region=None, endpoint_url=None, session=None, vpn_ids=None, log=None):
+        import boto3
+        from botocore.config import Config
+
+        session = session or boto3.session.Session(region_name=region)
+        config = Config(retries={'mode': 'adaptive', 'max_attempts': 8})
+        self.ec2 = session.client('ec2', region_name=region, endpoint_url=endpoint_url, config=config)
+        self.ring = ring
+        self.vpn_ids = list(vpn_ids or [])
+        self.log = log or (lambda message: print(message, file=sys.stderr))
+        self.last = {}
+        self.dropped = set()
+
+    def describe(self):
+        """Every live VPN connection: one call, or one per batch of ids"""
+        live = [{'Name': 'state', 'Values': ['pending', 'available']}]
+        if not self.vpn_ids:
+            return self.ec2.describe_vpn_connections(Filters=live).get('VpnConnections', [])
+        connections = []
+        for start in range(0, len(self.vpn_ids), BATCH_SIZE):
+            response = self.ec2.describe_vpn_connections(
+                VpnConnectionIds=self.vpn_ids[start:start + BATCH_SIZE], Filters=live)
+            connections += response.get('VpnConnections', [])
+        return connections
+
+    def poll(self, now=None):
+        """Take one sample of every tunnel; returns the number recorded"""
+        connections = self.describe()
+        now = time.time() if now is None else now
+        slots, status, changed, routes = [], [], [], []
+        for connection in connections:
+            vpn_id = connection['VpnConnectionId']
+            for address, number, code, change, accepted in connection_tunnels(connection):
+                slot = self.ring.slot(vpn_id, address, number)
+                key = (vpn_id, address)
+                if slot is None:
+                    if key not in self.dropped:
+                        self.log('no free slot for %s %s (store holds %d tunnels)' % (
+                            vpn_id, address, self.ring.slots))
+                        self.dropped.add(key)
+                    continue
+                if self.last.get(key, code) != code:
+                    self.log('%s  %s %s %s -> %s' % (time.strftime('%H:%M:%S', time.localtime(now)), vpn_id,
+                                                     address, STATUS_NAMES[self.last[key]], STATUS_NAMES[code]))
+                self.last[key] = code
+                slots.append(slot)
+                status.append(code)
+                changed.append(change)
+                routes.append(accepted)
+        self.ring.append(slots, now, status, changed, routes)
+        self.ring.flush()
+        return len(slots)
+
+    def run(self, interval=DEFAULT_INTERVAL, stop=None, count=None):
+        """Poll every interval seconds until stop is set (or count polls).
+        Ticks stay on a fixed schedule; ticks missed while a call was slow
+        are skipped rather than made up in a burst"""
+        stop = stop or threading.Event()
+        self.ring.header['interval'] = interval
+        start = time.monotonic()
+        tick = polls = 0
+        while not stop.is_set() and (count is None or polls < count):
+            try:
+                self.poll()
+            except Exception as error:
+                # Throttling or a network blip: keep polling
+                self.log('%s  poll failed: %s' % (time.strftime('%H:%M:%S'), error))
+            polls += 1
+            tick = max(tick + 1, int((time.monotonic() - start) / interval) + 1)
+            if count is not None and polls >= count:
+                break
+            stop.wait(max(start + tick * interval - time.monotonic(), 0))
+
+
+# --- Uptime ---
+
+@dataclass
+class TunnelUptime:
+    vpn_id: str
+    address: str
+    tunnel: int
+    samples: int
+    # Fraction of samples with a known status that were UP; None without any
+    uptime: float
+    status: str
+    flaps: int
+    # Uptime per equal time bin over the window, NaN where nothing is known
+    bins: np.ndarray
+
+    @property
+    def label(self):
+        return 'T%d %s' % (self.tunnel, 'n/a' if self.uptime is None else '%.1f%%' % (self.uptime * 100))
+
+
+def tunnel_uptime(ring, window=None, bins=48, now=None):
+    """TunnelUptime per stored tunnel over the last window seconds (all
+    stored samples by default), ordered by VPN id and tunnel number"""
+    now = int(ring.header['last'][0] if now is None else now)
+    window = None if window is None else int(window)
+    result = []
+    for slot, vpn_id, address, number in sorted(ring.tunnels(), key=lambda t: (t[1], t[3], t[2])):
+        samples = ring.read(slot)
+        if window is not None:
+            samples = samples[samples['time'] > now - window]
+        times = samples['time'].astype(np.int64)
+        status = samples['status']
+        known = status != 0
+        first = now - window if window is not None else (int(times[0]) if len(times) else now)
+        span = max(now - first, 1)
+        index = np.clip((times - first) * bins // span, 0, bins - 1)
+        counted = np.bincount(index[known], minlength=bins)
+        up = np.bincount(index[known], weights=status[known] == 1, minlength=bins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = np.where(counted > 0, up / counted, np.nan)
+        # A status change between polls shows up as a newer last-change time
+        changes = (status[1:] != status[:-1]) | (samples['changed'][1:] > samples['changed'][:-1])
+        result.append(TunnelUptime(
+            vpn_id, address, number, len(samples),
+            float(up.sum() / counted.sum()) if counted.sum() else None,
+            STATUS_NAMES[int(status[-1])] if len(status) else 'n/a', int(changes.sum()), values))
+    return result
+
+
+def uptime_by_vpn(uptimes):
+    by_vpn = {}
+    for uptime in uptimes:
+        by_vpn.setdefault(uptime.vpn_id, []).append(uptime)
+    return by_vpn
+
+
+def sparkline_segments(values, x, y, width, height):
+    """Line segments tracing values (0-1, NaN for gaps) left to right across
+    the width x height box whose lower left corner is (x, y); returns the
+    segments at full uptime and those dipping below it separately"""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        empty = np.zeros((0, 2, 2))
+        return empty, empty
+    xs = x + np.linspace(0, width, len(values))
+    points = np.column_stack([xs, y + np.nan_to_num(values) * height])
+    segments = np.stack([points[:-1], points[1:]], axis=1)
+    present = ~np.isnan(values[:-1]) & ~np.isnan(values[1:])
+    degraded = (values[:-1] < 1) | (values[1:] < 1)
+    return segments[present & ~degraded], segments[present & degraded]
+
+
+def print_report(uptimes, file=sys.stdout):
+    print("%-22s %-17s %-3s %8s %6s %6s %8s" % ('vpn', 'outside ip', 'tun', 'samples', 'status', 'flaps',
+                                               'uptime'), file=file)
+    for u in uptimes:
+        print("%-22s %-17s %-3d %8d %6s %6d %8s" % (
+            u.vpn_id, u.address, u.tunnel, u.samples, u.status, u.flaps,
+            'n/a' if u.uptime is None else '%.2f%%' % (u.uptime * 100)), file=file)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from advnet.topology import add_source_arguments, topology_from_args
+
+    parser = argparse.ArgumentParser(description='Collect VPN tunnel telemetry into a fixed-size ring buffer')
+    add_source_arguments(parser)
+    parser.add_argument('--store', default=None,
+                        help='ring buffer file (default: %s in the cache directory)' % STORE_NAME)
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help='seconds between polls (default: %(default)s)')
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY,
+                        help='samples kept per tunnel when the store is created (default: %(default)s)')
+    parser.add_argument('--slots', type=int, default=DEFAULT_SLOTS,
+                        help='tunnels the store holds when it is created (default: %(default)s)')
+    parser.add_argument('--vpn-id', action='append', default=[],
+                        help='poll only these VPN connections (default: all in the region)')
+    parser.add_argument('--count', type=int, default=None, help='stop after this many polls')
+    parser.add_argument('--once', action='store_true', help='poll once and print the report')
+    parser.add_argument('--report', action='store_true', help='print tunnel uptime from the store and exit')
+    parser.add_argument('--render', metavar='DIR', default=None,
+                        help='write the professional diagram with tunnel uptime sparklines to DIR and exit')
+    parser.add_argument('--window', type=float, default=None,
+                        help='hours of history in the report and sparklines (default: all stored)')
+    parser.add_argument('--region', default=None, help='AWS region (default: the topology region)')
+    parser.add_argument('--endpoint-url', default=None, help='AWS API endpoint, e.g. a local moto server')
+    args = parser.parse_args()
+
+    path = args.store or store_path(args.cache_dir)
+    window = args.window * 3600 if args.window else None
+
+    if args.report or args.render:
+        ring = TelemetryRing(path, readonly=True)
+        uptimes = tunnel_uptime(ring, window)
+        if args.report:
+            print_report(uptimes)
+        if args.render:
+            from advnet.export import load_generator, use_agg
+
+            use_agg()
+            fig = load_generator('professional')(topology_from_args(args), vpn_tunnels=uptime_by_vpn(uptimes))
+            out = os.path.join(args.render, 'aws-architecture-professional.png')
+            os.makedirs(args.render, exist_ok=True)
+            fig.savefig(out, dpi=150, bbox_inches='tight', facecolor='white', edgecolor='none')
+            print(out)
+        sys.exit(0)
+
+    topology = topology_from_args(args)
+    ring = TelemetryRing(path, args.slots, args.capacity)
+    try:
+        collector = Collector(ring, region=args.region or topology.region, endpoint_url=args.endpoint_url,
+                              vpn_ids=args.vpn_id)
+    except ImportError:
+        sys.exit('boto3 is required: pip3 install boto3')
+    if args.once:
+        collector.poll()
+        print_report(tunnel_uptime(ring, window))
+        sys.exit(0)
+    print("Polling every %gs into %s (%d tunnel slots x %d samples, %.1f MiB; Ctrl-C to stop)" % (
+        args.interval, path, ring.slots, ring.capacity, os.path.getsize(path) / (1 << 20)), file=sys.stderr)
+    try:
+        collector.run(args.interval, count=args.count)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
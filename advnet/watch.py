@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+AWS Advanced Networking Lab - Diagram Watch Mode
+Long-running renderer: watches the Terraform plan/state files, and when one
+changes re-parses it, diffs the topology model against the last render and
+re-exports the diagrams from figures kept in memory, redrawing only the
+shapes that changed. Optionally serves the latest SVGs on a local port with
+a page that refreshes itself.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+from advnet.export import STYLES, load_generator, use_agg
+from advnet.topology import DEFAULT_CACHE_DIR, load_topology
+
+DEFAULT_INTERVAL = 0.2
+DEFAULT_FORMATS = ('svg',)
+
+
+# --- Change detection ---
+
+def _stamp(paths):
+    stamps = {}
+    for path in paths:
+        try:
+            info = os.stat(path)
+            stamps[path] = (info.st_mtime_ns, info.st_size)
+        except OSError:
+            stamps[path] = None
+    return stamps
+
+
+def diff_topologies(old, new):
+    """What changed between two models: VPCs added, removed or changed (by
+    id), and whether the Transit Gateway, VPN or region-level settings did"""
+    changes = {'added': [], 'removed': [], 'changed': []}
+    before = {vpc.id: vpc for vpc in (old.vpcs if old else [])}
+    after = {vpc.id: vpc for vpc in new.vpcs}
+    for vpc_id, vpc in after.items():
+        if vpc_id not in before:
+            changes['added'].append(vpc_id)
+        elif before[vpc_id] != vpc:
+            changes['changed'].append(vpc_id)
+    changes['removed'] = [vpc_id for vpc_id in before if vpc_id not in after]
+    if old is None:
+        return dict(changes, transit=True, vpn=True, other=True)
+    changes['transit'] = old.transit_gateways != new.transit_gateways
+    changes['vpn'] = old.vpn_connections != new.vpn_connections
+    changes['other'] = (old.region, old.flow_log_group, old.outputs) != (new.region, new.flow_log_group,
+                                                                         new.outputs)
+    return changes
+
+
+def describe_changes(changes):
+    parts = ['%d %s' % (len(changes[kind]), kind) for kind in ('added', 'removed', 'changed')
+             if changes[kind]]
+    parts += [name for name in ('transit', 'vpn', 'other') if changes[name]]
+    return ', '.join(parts) or 'no model changes'
+
+
+# --- Rendering ---
+
+class Watcher:
+    """Keeps one retained figure per style and re-exports on every change"""
+
+    def __init__(self, paths, out_dir='.', styles=tuple(STYLES), formats=DEFAULT_FORMATS, layout='auto',
+                 batched=None, dpi=100, cache_dir=None, use_cache=True, log=None):
+        use_agg()
+        from advnet.render import RetainedFigure
+
+        self.paths = list(paths)
+        self.out_dir = out_dir
+        self.styles = list(styles)
+        self.formats = list(formats)
+        self.layout = layout
+        self.batched = batched
+        self.dpi = dpi
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self.log = log or (lambda message: print(message, file=sys.stderr))
+        self.retained = {style: RetainedFigure() for style in self.styles}
+        self.topology = None
+        self.version = 0
+        os.makedirs(out_dir, exist_ok=True)
+        # Load the generators (and matplotlib, fonts) before the first change
+        for style in self.styles:
+            load_generator(style)
+
+    def render(self, force=False):
+        """Re-parse the inputs and re-export; returns False if nothing changed"""
+        start = time.perf_counter()
+        present = [path for path in self.paths if os.path.exists(path)]
+        if not present:
+            return False
+        topology = load_topology(present, cache_dir=self.cache_dir, use_cache=self.use_cache)
+        changes = diff_topologies(self.topology, topology)
+        if not force and self.topology is not None and describe_changes(changes) == 'no model changes':
+            self.log("%s  inputs changed, %s" % (time.strftime('%H:%M:%S'), describe_changes(changes)))
+            return False
+        parsed = time.perf_counter()
+        self.topology = topology
+
+        report = []
+        for style in self.styles:
+            retained = self.retained[style]
+            fig = load_generator(style)(topology, self.layout, self.batched, retained=retained)
+            for fmt in self.formats:
+                save = dict(format=fmt, bbox_inches='tight', facecolor='white', edgecolor='none')
+                if fmt in ('png', 'jpg', 'jpeg', 'tif', 'tiff', 'webp'):
+                    save['dpi'] = self.dpi
+                path = os.path.join(self.out_dir, '%s.%s' % (STYLES[style][2], fmt))
+                tmp = '%s.%d.tmp' % (path, os.getpid())
+                fig.savefig(tmp, **save)
+                os.replace(tmp, path)
+            report.append('%s %d/%d calls redrawn' % (style, retained.redrawn,
+                                                      retained.redrawn + retained.reused))
+        self.version += 1
+        self.log("%s  %s; parse %.2fs, render %.2fs (%s)" % (
+            time.strftime('%H:%M:%S'), describe_changes(changes), parsed - start,
+            time.perf_counter() - parsed, ', '.join(report)))
+        return True
+
+    def run(self, interval=DEFAULT_INTERVAL, stop=None):
+        """Poll the inputs until stop is set; a change is rendered once the
+        files have stopped changing for one interval (Terraform writes in
+        several steps)"""
+        stop = stop or threading.Event()
+        rendered = _stamp(self.paths)
+        self.render(force=True)
+        pending = None
+        while not stop.wait(interval):
+            current = _stamp(self.paths)
+            if current == rendered:
+                pending = None
+            elif current == pending:
+                rendered, pending = current, None
+                try:
+                    self.render()
+                except Exception as error:
+                    # A half-written or invalid plan: keep the last diagrams
+                    self.log("%s  render failed: %s" % (time.strftime('%H:%M:%S'), error))
+            else:
+                pending = current
+
+
+# --- Local preview server ---
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Lab diagrams</title>
+<style>
+body { margin: 0; font: 13px sans-serif; background: #fff; }
+figure { margin: 8px; }
+img { max-width: 100%%; border: 1px solid #ddd; }
+</style>
+</head>
+<body>
+%(figures)s
+<script>
+let version = %(version)d;
+setInterval(async () => {
+  try {
+    const latest = (await (await fetch('version', {cache: 'no-store'})).json()).version;
+    if (latest !== version) {
+      version = latest;
+      for (const img of document.images) img.src = img.dataset.src + '?v=' + version;
+    }
+  } catch (e) {}
+}, 500);
+</script>
+</body>
+</html>
+"""
+
+
+def serve(watcher, port, host='127.0.0.1'):
+    """Serve the output directory, a live page at / and the render version
+    at /version from a daemon thread; returns the server"""
+    from functools import partial
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] in ('/', '/version'):
+                if self.path.startswith('/version'):
+                    body, kind = json.dumps({'version': watcher.version}).encode(), 'application/json'
+                else:
+                    names = ['%s.svg' % STYLES[style][2] for style in watcher.styles]
+                    figures = '\n'.join('<figure><img data-src="%s" src="%s?v=%d"><figcaption>%s</figcaption>'
+                                        '</figure>' % (name, name, watcher.version, name) for name in names)
+                    body = (PAGE % {'figures': figures, 'version': watcher.version}).encode()
+                    kind = 'text/html; charset=utf-8'
+                self.send_response(200)
+                self.send_header('Content-Type', kind)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), partial(Handler, directory=watcher.out_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Re-render the lab diagrams whenever the Terraform inputs change')
+    parser.add_argument('terraform', nargs='+', metavar='TF_FILE',
+                        help='tfplan archive, tfstate, or `terraform show/output -json` files to watch '
+                             '(they may not exist yet)')
+    parser.add_argument('-o', '--out-dir', default='.',
+                        help='directory for the rendered diagrams (default: current directory)')
+    parser.add_argument('-f', '--formats', default=','.join(DEFAULT_FORMATS),
+                        help='comma-separated output formats (default: %(default)s)')
+    parser.add_argument('-s', '--styles', default=','.join(STYLES),
+                        help='comma-separated diagram styles (default: %(default)s)')
+    parser.add_argument('--layout', choices=['auto', 'grid', 'radial'], default='auto',
+                        help='VPC placement (default: grid, radial for large estates)')
+    parser.add_argument('--batched', action=argparse.BooleanOptionalAction, default=None,
+                        help='draw shapes as collections, or one artist per shape with --no-batched '
+                             '(default: collections for large estates)')
+    parser.add_argument('--dpi', type=int, default=100, help='raster resolution (default: 100)')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help='seconds between checks of the inputs (default: %(default)s)')
+    parser.add_argument('--serve', type=int, metavar='PORT', default=None,
+                        help='serve the latest SVGs on http://127.0.0.1:PORT/')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always re-parse the Terraform inputs')
+    parser.add_argument('--cache-dir', default=None,
+                        help='topology cache directory (default: %s)' % DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    formats = [f.strip().lower().lstrip('.') for f in args.formats.split(',') if f.strip()]
+    styles = [s.strip() for s in args.styles.split(',') if s.strip()]
+    unknown = [s for s in styles if s not in STYLES]
+    if unknown:
+        parser.error('unknown style(s): %s (choose from %s)' % (', '.join(unknown), ', '.join(STYLES)))
+    if args.serve is not None and 'svg' not in formats:
+        formats.append('svg')
+
+    watcher = Watcher(args.terraform, args.out_dir, styles, formats, args.layout, args.batched, args.dpi,
+                      args.cache_dir, not args.no_cache)
+    if args.serve is not None:
+        serve(watcher, args.serve)
+        print("Serving http://127.0.0.1:%d/" % args.serve, file=sys.stderr)
+    print("Watching %s (Ctrl-C to stop)" % ', '.join(args.terraform), file=sys.stderr)
+    try:
+        watcher.run(args.interval)
+    except KeyboardInterrupt:
+        pass
@@ -4,17 +4,43 @@ AWS Advanced Networking Lab - Architecture Diagram Generator
 Creates a visual representation of the deployed infrastructure
 """
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.patches import FancyBboxPatch, ConnectionPatch
-import numpy as np
-
-def create_architecture_diagram():
-    fig, ax = plt.subplots(1, 1, figsize=(16, 12))
-    ax.set_xlim(0, 16)
-    ax.set_ylim(0, 12)
+import os
+
+from advnet import profiling
+
+with profiling.phase('import'):
+    import matplotlib
+    matplotlib.use('Agg')  # headless: the diagrams are only ever written to files
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    from advnet.layout import compute_layout
+    from advnet.render import make_drawer, use_batched
+    from advnet.topology import add_source_arguments, lab_topology, topology_from_args
+
+# Diagram titles for the lab VPCs; other VPCs use their Name tag
+VPC_TITLES = {'shared': 'Shared VPC', 'app': 'App VPC', 'onprem': 'OnPrem VPC'}
+
+
+@profiling.profiled()
+def create_architecture_diagram(topology=None, mode='auto', batched=None, connections=True, retained=None):
+    if topology is None:
+        topology = lab_topology()
+    with profiling.phase('layout'):
+        layout = compute_layout(topology, 'simple', mode)
+    width, height = layout.width, layout.height
+
+    with profiling.phase('figure'):
+        if retained is None:
+            fig, ax = plt.subplots(1, 1, figsize=(width, height))
+        else:
+            # Kept between renders (watch mode); unchanged shapes are not redrawn
+            fig, ax = retained.figure(width, height)
+    ax.set_xlim(0, width)
+    ax.set_ylim(0, height)
     ax.axis('off')
-    
+    draw = make_drawer(ax, use_batched(topology, batched), retained)
+
     # Colors
     vpc_color = '#E8F4FD'
     subnet_color = '#D4E6F1'
@@ -22,160 +48,86 @@ def create_architecture_diagram():
     vpn_color = '#F1948A'
     instance_color = '#A9DFBF'
     endpoint_color = '#D2B4DE'
-    
+
     # Title
-    ax.text(8, 11.5, 'AWS Advanced Networking Lab Architecture', 
-            fontsize=18, fontweight='bold', ha='center')
-    
+    draw.texts([(width / 2, height - 0.5)], ['AWS Advanced Networking Lab Architecture'],
+               fontsize=18, fontweight='bold', ha='center')
+
     # Region box
-    region_box = FancyBboxPatch((0.5, 0.5), 15, 10.5, 
-                               boxstyle="round,pad=0.1", 
-                               facecolor='#F8F9FA', 
-                               edgecolor='#2C3E50', 
-                               linewidth=2)
-    ax.add_patch(region_box)
-    ax.text(1, 10.8, 'AWS Region: us-east-1', fontsize=12, fontweight='bold')
-    
-    # Shared VPC
-    shared_vpc = FancyBboxPatch((1, 7), 4.5, 3.5, 
-                               boxstyle="round,pad=0.1", 
-                               facecolor=vpc_color, 
-                               edgecolor='#3498DB', 
-                               linewidth=2)
-    ax.add_patch(shared_vpc)
-    ax.text(3.25, 10.2, 'Shared VPC', fontsize=12, fontweight='bold', ha='center')
-    ax.text(3.25, 9.9, '10.10.0.0/16', fontsize=10, ha='center')
-    
-    # Shared VPC subnets
-    shared_public = patches.Rectangle((1.2, 9), 1.8, 1, facecolor=subnet_color, edgecolor='#2980B9')
-    shared_private = patches.Rectangle((3.2, 9), 1.8, 1, facecolor=subnet_color, edgecolor='#2980B9')
-    ax.add_patch(shared_public)
-    ax.add_patch(shared_private)
-    ax.text(2.1, 9.5, 'Public\n10.10.0.0/24', fontsize=9, ha='center', va='center')
-    ax.text(4.1, 9.5, 'Private\n10.10.100.0/24', fontsize=9, ha='center', va='center')
-    
-    # Bastion instance
-    bastion = patches.Circle((2.1, 8.3), 0.2, facecolor=instance_color, edgecolor='#27AE60')
-    ax.add_patch(bastion)
-    ax.text(2.1, 7.9, 'Bastion\ni-0473725c94f4d2b0d', fontsize=8, ha='center')
-    
-    # VPC Endpoints in shared VPC
-    endpoints = [(3.5, 8.3), (3.9, 8.3), (4.3, 8.3)]
-    endpoint_labels = ['SSM', 'SSM-Msg', 'EC2-Msg']
-    for i, (x, y) in enumerate(endpoints):
-        ep = patches.Rectangle((x-0.1, y-0.1), 0.2, 0.2, facecolor=endpoint_color, edgecolor='#8E44AD')
-        ax.add_patch(ep)
-        ax.text(x, y-0.4, endpoint_labels[i], fontsize=7, ha='center')
-    
-    # App VPC
-    app_vpc = FancyBboxPatch((6, 7), 4.5, 3.5, 
-                            boxstyle="round,pad=0.1", 
-                            facecolor=vpc_color, 
-                            edgecolor='#3498DB', 
-                            linewidth=2)
-    ax.add_patch(app_vpc)
-    ax.text(8.25, 10.2, 'App VPC', fontsize=12, fontweight='bold', ha='center')
-    ax.text(8.25, 9.9, '10.20.0.0/16', fontsize=10, ha='center')
-    
-    # App VPC subnets
-    app_public = patches.Rectangle((6.2, 9), 1.8, 1, facecolor=subnet_color, edgecolor='#2980B9')
-    app_private = patches.Rectangle((8.2, 9), 1.8, 1, facecolor=subnet_color, edgecolor='#2980B9')
-    ax.add_patch(app_public)
-    ax.add_patch(app_private)
-    ax.text(7.1, 9.5, 'Public\n10.20.0.0/24', fontsize=9, ha='center', va='center')
-    ax.text(9.1, 9.5, 'Private\n10.20.100.0/24', fontsize=9, ha='center', va='center')
-    
-    # App server instance
-    app_server = patches.Circle((9.1, 8.3), 0.2, facecolor=instance_color, edgecolor='#27AE60')
-    ax.add_patch(app_server)
-    ax.text(9.1, 7.9, 'App Server\ni-0fb0ec22102a92543', fontsize=8, ha='center')
-    
-    # VPC Endpoints in app VPC
-    app_endpoints = [(7.5, 8.3), (7.9, 8.3), (8.3, 8.3)]
-    for i, (x, y) in enumerate(app_endpoints):
-        ep = patches.Rectangle((x-0.1, y-0.1), 0.2, 0.2, facecolor=endpoint_color, edgecolor='#8E44AD')
-        ax.add_patch(ep)
-        ax.text(x, y-0.4, endpoint_labels[i], fontsize=7, ha='center')
-    
-    # OnPrem VPC
-    onprem_vpc = FancyBboxPatch((11.5, 7), 4, 3.5, 
-                               boxstyle="round,pad=0.1", 
-                               facecolor=vpc_color, 
-                               edgecolor='#3498DB', 
-                               linewidth=2)
-    ax.add_patch(onprem_vpc)
-    ax.text(13.5, 10.2, 'OnPrem VPC', fontsize=12, fontweight='bold', ha='center')
-    ax.text(13.5, 9.9, '10.30.0.0/16', fontsize=10, ha='center')
-    
-    # OnPrem VPC subnets
-    onprem_public = patches.Rectangle((11.7, 9), 1.5, 1, facecolor=subnet_color, edgecolor='#2980B9')
-    onprem_private = patches.Rectangle((13.5, 9), 1.5, 1, facecolor=subnet_color, edgecolor='#2980B9')
-    ax.add_patch(onprem_public)
-    ax.add_patch(onprem_private)
-    ax.text(12.45, 9.5, 'Public\n10.30.0.0/24', fontsize=9, ha='center', va='center')
-    ax.text(14.25, 9.5, 'Private\n10.30.100.0/24', fontsize=9, ha='center', va='center')
-    
-    # StrongSwan instance
-    strongswan = patches.Circle((12.45, 8.3), 0.2, facecolor=instance_color, edgecolor='#27AE60')
-    ax.add_patch(strongswan)
-    ax.text(12.45, 7.9, 'StrongSwan\ni-004feea49a7f493f1', fontsize=8, ha='center')
-    ax.text(12.45, 7.6, 'Public IP:\n54.84.220.170', fontsize=7, ha='center')
-    
+    draw.round_boxes([(0.5, 0.5, width - 1, height - 1.5)],
+                     facecolor='#F8F9FA', edgecolor='#2C3E50', linewidth=2)
+    draw.texts([(1, height - 1.2)], ['AWS Region: %s' % topology.region], fontsize=12, fontweight='bold')
+
+    # VPCs
+    boxes = layout.vpc_boxes
+    draw.round_boxes(boxes, facecolor=vpc_color, edgecolor='#3498DB', linewidth=2)
+    centers = boxes[:, 0] + boxes[:, 2] / 2
+    tops = boxes[:, 1] + boxes[:, 3]
+    draw.texts(np.column_stack([centers, tops - 0.3]),
+               [VPC_TITLES.get(vpc.key, vpc.name) for vpc in layout.vpcs],
+               fontsize=12, fontweight='bold', ha='center')
+    draw.texts(np.column_stack([centers, tops - 0.6]), [vpc.cidr for vpc in layout.vpcs],
+               fontsize=10, ha='center')
+
+    # Subnets
+    boxes = layout.subnet_boxes
+    draw.rects(boxes, facecolor=subnet_color, edgecolor='#2980B9')
+    draw.texts(boxes[:, :2] + boxes[:, 2:] / 2,
+               ['%s\n%s' % (subnet.tier.capitalize(), subnet.cidr) for subnet in layout.subnets],
+               fontsize=9, ha='center', va='center')
+
+    # EC2 instances
+    xy = layout.instance_xy
+    draw.circles(xy, 0.2, facecolor=instance_color, edgecolor='#27AE60')
+    draw.texts(xy - [0, 0.4], ['%s\n%s' % (i.name, i.id) for i in layout.instances],
+               fontsize=8, ha='center')
+    public = [n for n, i in enumerate(layout.instances) if i.public_ip]
+    draw.texts(xy[public] - [0, 0.7], ['Public IP:\n%s' % layout.instances[n].public_ip for n in public],
+               fontsize=7, ha='center')
+
+    # VPC Endpoints
+    xy = layout.endpoint_xy
+    draw.rects(np.column_stack([xy - 0.1, np.full((len(xy), 2), 0.2)]),
+               facecolor=endpoint_color, edgecolor='#8E44AD')
+    draw.texts(xy - [0, 0.4], [e.label for e in layout.endpoints], fontsize=7, ha='center')
+
     # Transit Gateway
-    tgw = patches.Circle((8, 5), 0.8, facecolor=tgw_color, edgecolor='#F39C12', linewidth=2)
-    ax.add_patch(tgw)
-    ax.text(8, 5, 'Transit\nGateway\ntgw-02c7208c8a5442572', fontsize=9, ha='center', va='center', fontweight='bold')
-    
-    # VPN Connection
-    vpn_box = FancyBboxPatch((10.5, 4.2), 3, 1.6, 
-                            boxstyle="round,pad=0.1", 
-                            facecolor=vpn_color, 
-                            edgecolor='#E74C3C', 
-                            linewidth=2)
-    ax.add_patch(vpn_box)
-    ax.text(12, 5, 'Site-to-Site VPN\nvpn-03b4be9fbe7724aa2', fontsize=10, ha='center', va='center', fontweight='bold')
-    
+    tgw_id = topology.transit_gateway.id if topology.transit_gateway else ''
+    draw.circles([layout.hub_xy], layout.hub_radius, facecolor=tgw_color, edgecolor='#F39C12', linewidth=2)
+    draw.texts([layout.hub_xy], ['Transit\nGateway\n%s' % tgw_id],
+               fontsize=9, ha='center', va='center', fontweight='bold')
+
+    # VPN Connections
+    boxes = layout.vpn_boxes
+    draw.round_boxes(boxes, facecolor=vpn_color, edgecolor='#E74C3C', linewidth=2)
+    draw.texts(boxes[:, :2] + boxes[:, 2:] / 2, ['Site-to-Site VPN\n%s' % vpn.id for vpn in layout.vpns],
+               fontsize=10, ha='center', va='center', fontweight='bold')
+
     # Internet Gateway
-    igw = patches.Rectangle((7.5, 1), 1, 0.8, facecolor='#AED6F1', edgecolor='#3498DB')
-    ax.add_patch(igw)
-    ax.text(8, 1.4, 'Internet\nGateway', fontsize=9, ha='center', va='center')
-    
+    igw = layout.igw_box
+    draw.rects([igw], facecolor='#AED6F1', edgecolor='#3498DB')
+    draw.texts([igw[:2] + igw[2:] / 2], ['Internet\nGateway'], fontsize=9, ha='center', va='center')
+
     # Internet cloud
-    internet = patches.Ellipse((8, 0.3), 2, 0.4, facecolor='#E8F8F5', edgecolor='#1ABC9C')
-    ax.add_patch(internet)
-    ax.text(8, 0.3, 'Internet', fontsize=10, ha='center', va='center', fontweight='bold')
-    
-    # Connections
-    # TGW to VPCs
-    connections = [
-        ((3.25, 7), (6.5, 5.5)),  # Shared to TGW
-        ((8.25, 7), (8, 5.8)),    # App to TGW
-        ((13.5, 7), (9.5, 5.5)),  # OnPrem to TGW
-        ((8.8, 5), (10.5, 5)),    # TGW to VPN
-        ((8, 1.8), (8, 4.2)),     # IGW to TGW area
-        ((8, 0.7), (8, 1))        # Internet to IGW
-    ]
-    
-    for start, end in connections:
-        line = ConnectionPatch(start, end, "data", "data", 
-                             arrowstyle="<->", shrinkA=5, shrinkB=5, 
-                             mutation_scale=20, fc="black", lw=2)
-        ax.add_patch(line)
-    
+    draw.ellipses([layout.internet_xy], 2, 0.4, facecolor='#E8F8F5', edgecolor='#1ABC9C')
+    draw.texts([layout.internet_xy], ['Internet'], fontsize=10, ha='center', va='center', fontweight='bold')
+
+    # Connections: VPCs to TGW, TGW to VPN, IGW to TGW area, Internet to IGW
+    # (left to the caller when it draws them itself, e.g. as a traffic overlay)
+    if connections:
+        segments = np.concatenate([layout.edges[kind] for kind in ('spoke', 'vpn', 'igw', 'internet')])
+        draw.double_arrows(segments, color='black', linewidth=2)
+
     # Flow Logs indicator
-    flow_logs = FancyBboxPatch((1, 2), 3, 1.5, 
-                              boxstyle="round,pad=0.1", 
-                              facecolor='#FADBD8', 
-                              edgecolor='#E74C3C', 
-                              linewidth=1)
-    ax.add_patch(flow_logs)
-    ax.text(2.5, 2.75, 'VPC Flow Logs\nCloudWatch\n/aws/vpc/flow-logs/\nadv-net-lowcost', 
-            fontsize=9, ha='center', va='center')
-    
+    draw.round_boxes([(1, 2, 3, 1.5)], facecolor='#FADBD8', edgecolor='#E74C3C', linewidth=1)
+    log_group = (topology.flow_log_group or '').replace('/flow-logs/', '/flow-logs/\n')
+    draw.texts([(2.5, 2.75)], ['VPC Flow Logs\nCloudWatch\n%s' % log_group],
+               fontsize=9, ha='center', va='center')
+
     # Legend
-    legend_y = 3.5
-    ax.text(12, legend_y + 0.5, 'Legend:', fontsize=12, fontweight='bold')
-    
+    legend_x, legend_y = width - 4, 3.5
+    draw.texts([(legend_x, legend_y + 0.5)], ['Legend:'], fontsize=12, fontweight='bold')
+
     legend_items = [
         (vpc_color, 'VPC', '#3498DB'),
         (subnet_color, 'Subnet', '#2980B9'),
@@ -184,14 +136,14 @@ def create_architecture_diagram():
         (vpn_color, 'VPN Connection', '#E74C3C'),
         (endpoint_color, 'VPC Endpoint', '#8E44AD')
     ]
-    
-    for i, (color, label, edge_color) in enumerate(legend_items):
-        y_pos = legend_y - (i * 0.3)
-        legend_box = patches.Rectangle((12, y_pos - 0.1), 0.3, 0.2, 
-                                     facecolor=color, edgecolor=edge_color)
-        ax.add_patch(legend_box)
-        ax.text(12.5, y_pos, label, fontsize=9, va='center')
-    
+    colors, labels, edge_colors = zip(*legend_items)
+    y_pos = legend_y - np.arange(len(legend_items)) * 0.3
+    draw.rects(np.column_stack([np.full(len(y_pos), legend_x), y_pos - 0.1,
+                                np.full(len(y_pos), 0.3), np.full(len(y_pos), 0.2)]),
+               facecolor=list(colors), edgecolor=list(edge_colors))
+    draw.texts(np.column_stack([np.full(len(y_pos), legend_x + 0.5), y_pos]), labels,
+               fontsize=9, va='center')
+
     # Key Features text
     features_text = """Key Features:
 • Hub-and-spoke architecture via Transit Gateway
@@ -200,26 +152,53 @@ def create_architecture_diagram():
 • VPC Endpoints for SSM access
 • VPC Flow Logs for troubleshooting
 • Cross-VPC connectivity testing"""
-    
-    ax.text(1, 5.5, features_text, fontsize=10, va='top', 
-            bbox=dict(boxstyle="round,pad=0.3", facecolor='#F8F9FA', edgecolor='#BDC3C7'))
-    
-    plt.tight_layout()
+
+    draw.texts([(1, 5.5)], [features_text], fontsize=10, va='top',
+               bbox=dict(boxstyle="round,pad=0.3", facecolor='#F8F9FA', edgecolor='#BDC3C7'))
+
+    draw.finish()
+    if draw.batched:
+        # Keep 1 data unit = 1 inch so point-sized glyphs and heads line up
+        fig.subplots_adjust(left=0, right=1, bottom=0, top=1)
+    else:
+        # Measures every text artist; the slow step for large per-artist diagrams
+        with profiling.phase('tight_layout'):
+            fig.tight_layout()
+    profiling.note_artists(fig)
     return fig
 
+
 if __name__ == "__main__":
-    fig = create_architecture_diagram()
-    
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate the lab architecture diagram')
+    add_source_arguments(parser)
+    parser.add_argument('--layout', choices=['auto', 'grid', 'radial'], default='auto',
+                        help='VPC placement (default: grid, radial for large estates)')
+    parser.add_argument('--batched', action=argparse.BooleanOptionalAction, default=None,
+                        help='draw shapes as collections, or one artist per shape with --no-batched '
+                             '(default: collections for large estates)')
+    parser.add_argument('-o', '--out-dir', default='.',
+                        help='directory for the rendered diagrams (default: current directory)')
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args()
+    profiling.profile_from_args(args)
+    with profiling.phase('topology'):
+        topology = topology_from_args(args)
+    fig = create_architecture_diagram(topology, args.layout, args.batched)
+
     # Save as PNG
-    plt.savefig('/home/nana/aws-adv-net-project/architecture-diagram.png', 
-                dpi=300, bbox_inches='tight', facecolor='white')
-    
+    with profiling.phase('savefig.png'):
+        plt.savefig(os.path.join(args.out_dir, 'architecture-diagram.png'),
+                    dpi=300, bbox_inches='tight', facecolor='white')
+
     # Save as SVG for scalability
-    plt.savefig('/home/nana/aws-adv-net-project/architecture-diagram.svg', 
-                format='svg', bbox_inches='tight', facecolor='white')
-    
+    with profiling.phase('savefig.svg'):
+        plt.savefig(os.path.join(args.out_dir, 'architecture-diagram.svg'),
+                    format='svg', bbox_inches='tight', facecolor='white')
+
     print("Architecture diagrams generated:")
     print("- architecture-diagram.png (high-resolution)")
     print("- architecture-diagram.svg (scalable vector)")
-    
-    plt.show()
\ No newline at end of file
+    if profiling.enabled():
+        print("- %s (profile)" % profiling.write())
@@ -28,14 +28,20 @@ print_error() {
 
 # Function to estimate costs
 estimate_costs() {
-    print_status "Estimated monthly costs (us-east-1):"
-    echo "  - Transit Gateway: ~$36/month (24/7)"
-    echo "  - VPN Connection: ~$36/month (24/7)"
-    echo "  - 3x t2.micro instances: ~$5.40/month (if running 24/7)"
-    echo "  - VPC Interface Endpoints (6): ~$64.80/month (24/7)"
-    echo "  - VPC Flow Logs: ~$1-5/month (depending on traffic)"
-    echo ""
-    print_warning "Total estimated: ~$142-147/month if running 24/7"
+    # Priced from the plan when there is one; the static figures otherwise
+    if command -v python3 >/dev/null 2>&1 && [[ -f tfplan ]] && python3 -m advnet.costs tfplan; then
+        echo ""
+        print_warning "Compare schedules, endpoint and AZ counts with: python3 -m advnet.costs tfplan --vary ..."
+    else
+        print_status "Estimated monthly costs (us-east-1):"
+        echo "  - Transit Gateway: ~$36/month (24/7)"
+        echo "  - VPN Connection: ~$36/month (24/7)"
+        echo "  - 3x t2.micro instances: ~$5.40/month (if running 24/7)"
+        echo "  - VPC Interface Endpoints (6): ~$64.80/month (24/7)"
+        echo "  - VPC Flow Logs: ~$1-5/month (depending on traffic)"
+        echo ""
+        print_warning "Total estimated: ~$142-147/month if running 24/7"
+    fi
     print_warning "To minimize costs:"
     echo "  1. Stop EC2 instances when not testing"
     echo "  2. Delete TGW and VPN when done practicing"
@@ -50,9 +56,35 @@ deploy() {
     print_status "Initializing Terraform..."
     terraform init
     
+    # Catch overlapping address space before Terraform does
+    if command -v python3 >/dev/null 2>&1; then
+        print_status "Checking address plan..."
+        plan_status=0
+        python3 -m advnet.cidrplan --config . || plan_status=$?
+        case $plan_status in
+            0) ;;
+            3)
+                print_error "Overlapping CIDR blocks; fix variables.tf / terraform.tfvars first"
+                exit 1
+                ;;
+            *) print_warning "Could not check the address plan; continuing" ;;
+        esac
+    fi
+
     # Plan deployment
     print_status "Planning deployment..."
     terraform plan -out=tfplan
+
+    # Highlight what the plan changes on the diagram
+    if command -v python3 >/dev/null 2>&1; then
+        diff_status=0
+        python3 -m advnet.plandiff tfplan -o tfplan-diff.png --detailed-exitcode || diff_status=$?
+        case $diff_status in
+            0) ;;
+            2) print_status "Changed resources highlighted in tfplan-diff.png" ;;
+            *) print_warning "Could not diagram the plan changes" ;;
+        esac
+    fi
     
     # Ask for confirmation
     echo ""
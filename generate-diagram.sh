@@ -31,31 +31,28 @@ fi
 
 echo "✅ Dependencies installed"
 
-# Generate professional diagram
-echo "🎯 Generating professional architecture diagram..."
-if python3 professional-architecture-diagram.py; then
-    echo "✅ Professional diagrams generated:"
-    echo "   - aws-architecture-professional.png (300 DPI)"
-    echo "   - aws-architecture-professional.pdf (vector)"
+# Output directory and formats can be overridden from the environment;
+# any arguments are passed through as Terraform inputs (e.g. tfplan)
+OUT_DIR="${OUT_DIR:-.}"
+FORMATS="${FORMATS:-png,svg,pdf}"
+
+# Render both styles in every format in parallel; unchanged outputs are skipped
+echo "🎯 Generating architecture diagrams ($FORMATS) in $OUT_DIR..."
+if python3 -m advnet.export --out-dir "$OUT_DIR" --formats "$FORMATS" "$@"; then
+    echo "✅ Diagrams generated:"
+    echo "   - aws-architecture-professional.* (professional, 300 DPI)"
+    echo "   - architecture-diagram.* (simple)"
 else
     echo "⚠️  Graphical diagram generation failed, but text diagram is available:"
     echo "   - architecture-diagram.md (detailed text diagram)"
 fi
 
-# Generate simple diagram as fallback
-echo "🎯 Generating simple architecture diagram..."
-if python3 architecture-diagram.py 2>/dev/null; then
-    echo "✅ Simple diagrams generated:"
-    echo "   - architecture-diagram.png"
-    echo "   - architecture-diagram.svg"
-fi
-
 echo ""
 echo "📋 Available Architecture Documentation:"
 echo "   - architecture-diagram.md (comprehensive text diagram)"
 echo "   - README.md (full project documentation)"
 
-if [ -f "aws-architecture-professional.png" ]; then
+if [ -f "$OUT_DIR/aws-architecture-professional.png" ]; then
     echo "   - aws-architecture-professional.png (presentation ready)"
     echo "   - aws-architecture-professional.pdf (vector format)"
 fi
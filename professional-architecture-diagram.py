@@ -4,267 +4,267 @@ AWS Advanced Networking Lab - Professional Architecture Diagram
 Uses AWS-style colors and layout for presentations
 """
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.patches import FancyBboxPatch, Rectangle, Circle, Polygon
-import numpy as np
-
-def create_professional_diagram():
-    # Create figure with presentation-friendly size (16:9 aspect ratio)
-    fig, ax = plt.subplots(1, 1, figsize=(20, 11.25))
-    ax.set_xlim(0, 20)
-    ax.set_ylim(0, 11.25)
+import os
+
+from advnet import profiling
+
+with profiling.phase('import'):
+    import matplotlib
+    matplotlib.use('Agg')  # headless: the diagrams are only ever written to files
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    from advnet.layout import compute_layout
+    from advnet.render import make_drawer, use_batched
+    from advnet.topology import add_source_arguments, lab_topology, topology_from_args
+    from advnet.vpntelemetry import TelemetryRing, sparkline_segments, store_path, tunnel_uptime, uptime_by_vpn
+
+# AWS Official Colors
+aws_orange = '#FF9900'
+aws_blue = '#232F3E'
+aws_light_blue = '#4B92DB'
+aws_gray = '#F2F3F3'
+vpc_blue = '#E1F5FE'
+subnet_blue = '#B3E5FC'
+
+# Diagram titles for the lab VPCs and instances; others use their Name tag
+VPC_TITLES = {
+    'shared': 'Shared Services VPC',
+    'app': 'Application VPC',
+    'onprem': 'On-Premises Simulation VPC',
+}
+INSTANCE_TITLES = {'bastion': 'Bastion Host', 'app_server': 'App Server', 'strongswan': 'StrongSwan'}
+
+# Internet cloud outline relative to its center
+INTERNET_OUTLINE = np.array([[-1.5, 0.05], [-0.5, 0.35], [0.5, 0.35], [1.5, 0.05],
+                             [1, -0.25], [0, -0.35], [-1, -0.25]])
+
+
+def is_customer_gateway(instance, vpns):
+    return bool(instance.public_ip and
+                any(instance.public_ip == vpn.customer_gateway_ip for vpn in vpns))
+
+
+@profiling.profiled()
+def create_professional_diagram(topology=None, mode='auto', batched=None, connections=True, retained=None,
+                                vpn_tunnels=None):
+    if topology is None:
+        topology = lab_topology()
+    with profiling.phase('layout'):
+        layout = compute_layout(topology, 'professional', mode)
+    width, height = layout.width, layout.height
+
+    # Create figure with presentation-friendly size (16:9 aspect ratio for the lab)
+    with profiling.phase('figure'):
+        if retained is None:
+            fig, ax = plt.subplots(1, 1, figsize=(width, height))
+        else:
+            # Kept between renders (watch mode); unchanged shapes are not redrawn
+            fig, ax = retained.figure(width, height)
+    ax.set_xlim(0, width)
+    ax.set_ylim(0, height)
     ax.axis('off')
-    
-    # AWS Official Colors
-    aws_orange = '#FF9900'
-    aws_blue = '#232F3E'
-    aws_light_blue = '#4B92DB'
-    aws_gray = '#F2F3F3'
-    vpc_blue = '#E1F5FE'
-    subnet_blue = '#B3E5FC'
-    
+    draw = make_drawer(ax, use_batched(topology, batched), retained)
+
     # Background
     fig.patch.set_facecolor('white')
-    
+
     # Title Section
-    title_box = Rectangle((0, 10), 20, 1.25, facecolor=aws_blue, edgecolor='none')
-    ax.add_patch(title_box)
-    ax.text(10, 10.6, 'AWS Advanced Networking Lab Architecture', 
-            fontsize=24, fontweight='bold', ha='center', color='white')
-    ax.text(10, 10.2, 'Hub-and-Spoke with Transit Gateway and Site-to-Site VPN', 
-            fontsize=14, ha='center', color=aws_gray)
-    
+    draw.rects([(0, height - 1.25, width, 1.25)], facecolor=aws_blue, edgecolor='none')
+    draw.texts([(width / 2, height - 0.65)], ['AWS Advanced Networking Lab Architecture'],
+               fontsize=24, fontweight='bold', ha='center', color='white')
+    draw.texts([(width / 2, height - 1.05)], ['Hub-and-Spoke with Transit Gateway and Site-to-Site VPN'],
+               fontsize=14, ha='center', color=aws_gray)
+
     # AWS Region Container
-    region_box = FancyBboxPatch((0.5, 0.5), 19, 9, 
-                               boxstyle="round,pad=0.1", 
-                               facecolor='#FAFAFA', 
-                               edgecolor=aws_blue, 
-                               linewidth=2)
-    ax.add_patch(region_box)
-    ax.text(1, 9.2, 'AWS Region: us-east-1', fontsize=14, fontweight='bold', color=aws_blue)
-    
+    draw.round_boxes([(0.5, 0.5, width - 1, height - 2.25)],
+                     facecolor='#FAFAFA', edgecolor=aws_blue, linewidth=2)
+    draw.texts([(1, height - 2.05)], ['AWS Region: %s' % topology.region],
+               fontsize=14, fontweight='bold', color=aws_blue)
+
     # Availability Zone indicator
-    az_box = Rectangle((1, 8.5), 18, 0.4, facecolor=aws_gray, edgecolor=aws_blue, alpha=0.3)
-    ax.add_patch(az_box)
-    ax.text(10, 8.7, 'Availability Zone: us-east-1a', fontsize=12, ha='center', color=aws_blue)
-    
-    # VPC 1: Shared Services VPC
-    shared_vpc = FancyBboxPatch((1.5, 5.5), 5, 2.5, 
-                               boxstyle="round,pad=0.1", 
-                               facecolor=vpc_blue, 
-                               edgecolor=aws_light_blue, 
-                               linewidth=2)
-    ax.add_patch(shared_vpc)
-    
-    # VPC Icon (simplified AWS VPC representation)
-    vpc_icon1 = Circle((2, 7.5), 0.15, facecolor=aws_light_blue, edgecolor=aws_blue, linewidth=2)
-    ax.add_patch(vpc_icon1)
-    ax.text(2.3, 7.7, 'Shared Services VPC', fontsize=12, fontweight='bold', color=aws_blue)
-    ax.text(2.3, 7.4, '10.10.0.0/16', fontsize=10, color=aws_blue)
-    
-    # Subnets in Shared VPC
-    shared_public = Rectangle((2, 6.8), 2, 0.5, facecolor=subnet_blue, edgecolor=aws_light_blue, linewidth=1)
-    shared_private = Rectangle((4.2, 6.8), 2, 0.5, facecolor=subnet_blue, edgecolor=aws_light_blue, linewidth=1)
-    ax.add_patch(shared_public)
-    ax.add_patch(shared_private)
-    ax.text(3, 7.05, 'Public Subnet\n10.10.0.0/24', fontsize=9, ha='center', va='center')
-    ax.text(5.2, 7.05, 'Private Subnet\n10.10.100.0/24', fontsize=9, ha='center', va='center')
-    
-    # Bastion Host (EC2 Icon)
-    bastion_box = Rectangle((2.8, 6.1), 0.4, 0.3, facecolor=aws_orange, edgecolor=aws_blue, linewidth=1)
-    ax.add_patch(bastion_box)
-    ax.text(3, 6.25, 'EC2', fontsize=8, ha='center', va='center', color='white', fontweight='bold')
-    ax.text(3, 5.9, 'Bastion Host', fontsize=9, ha='center', fontweight='bold')
-    
+    draw.rects([(1, height - 2.75, width - 2, 0.4)], facecolor=aws_gray, edgecolor=aws_blue, alpha=0.3)
+    azs = sorted({s.az for vpc in topology.vpcs for s in vpc.subnets if s.az}) or [topology.region + 'a']
+    draw.texts([(width / 2, height - 2.55)],
+               ['Availability Zone%s: %s' % ('s' if len(azs) > 1 else '', ', '.join(azs))],
+               fontsize=12, ha='center', color=aws_blue)
+
+    # VPCs with a simplified AWS VPC icon
+    boxes = layout.vpc_boxes
+    corners = boxes[:, :2] + np.column_stack([np.zeros(len(boxes)), boxes[:, 3]])
+    draw.round_boxes(boxes, facecolor=vpc_blue, edgecolor=aws_light_blue, linewidth=2)
+    draw.circles(corners + [0.5, -0.5], 0.15, facecolor=aws_light_blue, edgecolor=aws_blue, linewidth=2)
+    draw.texts(corners + [0.8, -0.3], [VPC_TITLES.get(vpc.key, vpc.name) for vpc in layout.vpcs],
+               fontsize=12, fontweight='bold', color=aws_blue)
+    draw.texts(corners + [0.8, -0.6], [vpc.cidr for vpc in layout.vpcs], fontsize=10, color=aws_blue)
+
+    # Subnets
+    boxes = layout.subnet_boxes
+    draw.rects(boxes, facecolor=subnet_blue, edgecolor=aws_light_blue, linewidth=1)
+    draw.texts(boxes[:, :2] + boxes[:, 2:] / 2,
+               ['%s Subnet\n%s' % (subnet.tier.capitalize(), subnet.cidr) for subnet in layout.subnets],
+               fontsize=9, ha='center', va='center')
+
+    # EC2 instances; the customer gateway host is drawn as CGW
+    xy = layout.instance_xy
+    cgw = np.array([is_customer_gateway(i, layout.vpns) for i in layout.instances], dtype=bool)
+    draw.rects(np.column_stack([xy - [0.2, 0], np.tile([0.4, 0.3], (len(xy), 1))]),
+               facecolor=list(np.where(cgw, '#E91E63', aws_orange)), edgecolor=aws_blue, linewidth=1)
+    draw.texts(xy[~cgw] + [0, 0.15], ['EC2'] * int((~cgw).sum()),
+               fontsize=8, ha='center', va='center', color='white', fontweight='bold')
+    draw.texts(xy[cgw] + [0, 0.15], ['CGW'] * int(cgw.sum()),
+               fontsize=7, ha='center', va='center', color='white', fontweight='bold')
+    draw.texts(xy - [0, 0.2], [INSTANCE_TITLES.get(i.key, i.name) for i in layout.instances],
+               fontsize=9, ha='center', fontweight='bold')
+    draw.texts(xy[cgw] - [0, 0.4], [i.public_ip for i, c in zip(layout.instances, cgw) if c],
+               fontsize=8, ha='center')
+
     # VPC Endpoints
-    endpoint_positions = [(4.5, 6.1), (4.9, 6.1), (5.3, 6.1)]
-    endpoint_labels = ['SSM', 'SSM-Msg', 'EC2-Msg']
-    for i, (x, y) in enumerate(endpoint_positions):
-        ep_box = Rectangle((x-0.1, y), 0.2, 0.2, facecolor='#9C27B0', edgecolor=aws_blue, linewidth=1)
-        ax.add_patch(ep_box)
-        ax.text(x, y+0.1, 'VE', fontsize=6, ha='center', va='center', color='white', fontweight='bold')
-        ax.text(x, y-0.3, endpoint_labels[i], fontsize=7, ha='center')
-    
-    # VPC 2: Application VPC
-    app_vpc = FancyBboxPatch((7.5, 5.5), 5, 2.5, 
-                            boxstyle="round,pad=0.1", 
-                            facecolor=vpc_blue, 
-                            edgecolor=aws_light_blue, 
-                            linewidth=2)
-    ax.add_patch(app_vpc)
-    
-    vpc_icon2 = Circle((8, 7.5), 0.15, facecolor=aws_light_blue, edgecolor=aws_blue, linewidth=2)
-    ax.add_patch(vpc_icon2)
-    ax.text(8.3, 7.7, 'Application VPC', fontsize=12, fontweight='bold', color=aws_blue)
-    ax.text(8.3, 7.4, '10.20.0.0/16', fontsize=10, color=aws_blue)
-    
-    # Subnets in App VPC
-    app_public = Rectangle((8, 6.8), 2, 0.5, facecolor=subnet_blue, edgecolor=aws_light_blue, linewidth=1)
-    app_private = Rectangle((10.2, 6.8), 2, 0.5, facecolor=subnet_blue, edgecolor=aws_light_blue, linewidth=1)
-    ax.add_patch(app_public)
-    ax.add_patch(app_private)
-    ax.text(9, 7.05, 'Public Subnet\n10.20.0.0/24', fontsize=9, ha='center', va='center')
-    ax.text(11.2, 7.05, 'Private Subnet\n10.20.100.0/24', fontsize=9, ha='center', va='center')
-    
-    # App Server (EC2 Icon)
-    app_server_box = Rectangle((10.8, 6.1), 0.4, 0.3, facecolor=aws_orange, edgecolor=aws_blue, linewidth=1)
-    ax.add_patch(app_server_box)
-    ax.text(11, 6.25, 'EC2', fontsize=8, ha='center', va='center', color='white', fontweight='bold')
-    ax.text(11, 5.9, 'App Server', fontsize=9, ha='center', fontweight='bold')
-    
-    # VPC Endpoints in App VPC
-    for i, (x, y) in enumerate([(8.5, 6.1), (8.9, 6.1), (9.3, 6.1)]):
-        ep_box = Rectangle((x-0.1, y), 0.2, 0.2, facecolor='#9C27B0', edgecolor=aws_blue, linewidth=1)
-        ax.add_patch(ep_box)
-        ax.text(x, y+0.1, 'VE', fontsize=6, ha='center', va='center', color='white', fontweight='bold')
-        ax.text(x, y-0.3, endpoint_labels[i], fontsize=7, ha='center')
-    
-    # VPC 3: On-Premises Simulation VPC
-    onprem_vpc = FancyBboxPatch((14, 5.5), 5, 2.5, 
-                               boxstyle="round,pad=0.1", 
-                               facecolor=vpc_blue, 
-                               edgecolor=aws_light_blue, 
-                               linewidth=2)
-    ax.add_patch(onprem_vpc)
-    
-    vpc_icon3 = Circle((14.5, 7.5), 0.15, facecolor=aws_light_blue, edgecolor=aws_blue, linewidth=2)
-    ax.add_patch(vpc_icon3)
-    ax.text(14.8, 7.7, 'On-Premises Simulation VPC', fontsize=12, fontweight='bold', color=aws_blue)
-    ax.text(14.8, 7.4, '10.30.0.0/16', fontsize=10, color=aws_blue)
-    
-    # Subnets in OnPrem VPC
-    onprem_public = Rectangle((14.5, 6.8), 2, 0.5, facecolor=subnet_blue, edgecolor=aws_light_blue, linewidth=1)
-    onprem_private = Rectangle((16.7, 6.8), 2, 0.5, facecolor=subnet_blue, edgecolor=aws_light_blue, linewidth=1)
-    ax.add_patch(onprem_public)
-    ax.add_patch(onprem_private)
-    ax.text(15.5, 7.05, 'Public Subnet\n10.30.0.0/24', fontsize=9, ha='center', va='center')
-    ax.text(17.7, 7.05, 'Private Subnet\n10.30.100.0/24', fontsize=9, ha='center', va='center')
-    
-    # StrongSwan (Customer Gateway)
-    strongswan_box = Rectangle((15.3, 6.1), 0.4, 0.3, facecolor='#E91E63', edgecolor=aws_blue, linewidth=1)
-    ax.add_patch(strongswan_box)
-    ax.text(15.5, 6.25, 'CGW', fontsize=7, ha='center', va='center', color='white', fontweight='bold')
-    ax.text(15.5, 5.9, 'StrongSwan', fontsize=9, ha='center', fontweight='bold')
-    ax.text(15.5, 5.7, '54.84.220.170', fontsize=8, ha='center')
-    
+    xy = layout.endpoint_xy
+    draw.rects(np.column_stack([xy - [0.1, 0], np.full((len(xy), 2), 0.2)]),
+               facecolor='#9C27B0', edgecolor=aws_blue, linewidth=1)
+    draw.texts(xy + [0, 0.1], ['VE'] * len(xy), fontsize=6, ha='center', va='center',
+               color='white', fontweight='bold')
+    draw.texts(xy - [0, 0.3], [e.label for e in layout.endpoints], fontsize=7, ha='center')
+
     # Transit Gateway (Center Hub)
-    tgw_circle = Circle((10, 3.5), 0.8, facecolor=aws_orange, edgecolor=aws_blue, linewidth=3)
-    ax.add_patch(tgw_circle)
-    ax.text(10, 3.7, 'Transit', fontsize=12, ha='center', va='center', color='white', fontweight='bold')
-    ax.text(10, 3.3, 'Gateway', fontsize=12, ha='center', va='center', color='white', fontweight='bold')
-    ax.text(10, 2.5, 'tgw-02c7208c8a5442572', fontsize=10, ha='center', fontweight='bold')
-    
-    # Site-to-Site VPN Connection
-    vpn_box = FancyBboxPatch((12.5, 2.8), 3, 1.4, 
-                            boxstyle="round,pad=0.1", 
-                            facecolor='#FF5722', 
-                            edgecolor=aws_blue, 
-                            linewidth=2)
-    ax.add_patch(vpn_box)
-    ax.text(14, 3.7, 'Site-to-Site VPN', fontsize=12, ha='center', va='center', color='white', fontweight='bold')
-    ax.text(14, 3.3, 'vpn-03b4be9fbe7724aa2', fontsize=10, ha='center', va='center', color='white')
-    ax.text(14, 3.0, 'Tunnel 1 & 2', fontsize=9, ha='center', va='center', color='white')
-    
+    hub = np.asarray(layout.hub_xy, dtype=float)
+    draw.circles([hub], layout.hub_radius, facecolor=aws_orange, edgecolor=aws_blue, linewidth=3)
+    draw.texts([hub + [0, 0.2], hub - [0, 0.2]], ['Transit', 'Gateway'], fontsize=12,
+               ha='center', va='center', color='white', fontweight='bold')
+    tgw_id = topology.transit_gateway.id if topology.transit_gateway else ''
+    draw.texts([hub - [0, 1.0]], [tgw_id], fontsize=10, ha='center', fontweight='bold')
+
+    # Site-to-Site VPN Connections
+    boxes = layout.vpn_boxes
+    centers = boxes[:, :2] + boxes[:, 2:] / 2
+    draw.round_boxes(boxes, facecolor='#FF5722', edgecolor=aws_blue, linewidth=2)
+    if vpn_tunnels is None:
+        draw.texts(centers + [0, 0.2], ['Site-to-Site VPN'] * len(boxes), fontsize=12,
+                   ha='center', va='center', color='white', fontweight='bold')
+        draw.texts(centers - [0, 0.2], [vpn.id for vpn in layout.vpns], fontsize=10,
+                   ha='center', va='center', color='white')
+        draw.texts(centers - [0, 0.5], ['Tunnel 1 & 2'] * len(boxes), fontsize=9,
+                   ha='center', va='center', color='white')
+    else:
+        # Collected tunnel telemetry: one uptime sparkline per tunnel
+        draw.texts(centers + [0, 0.45], ['Site-to-Site VPN'] * len(boxes), fontsize=11,
+                   ha='center', va='center', color='white', fontweight='bold')
+        draw.texts(centers + [0, 0.15], [vpn.id for vpn in layout.vpns], fontsize=9,
+                   ha='center', va='center', color='white')
+        rows, labels, full, degraded = [], [], [], []
+        for center, vpn in zip(centers, layout.vpns):
+            if not vpn_tunnels.get(vpn.id):
+                rows.append((center[0] - 0.65, center[1] - 0.3))
+                labels.append('Tunnel 1 & 2: no telemetry')
+            for row, tunnel in enumerate(vpn_tunnels.get(vpn.id, [])[:2]):
+                y = center[1] - 0.17 - row * 0.3
+                rows.append((center[0] - 1.35, y))
+                labels.append(tunnel.label)
+                up, down = sparkline_segments(tunnel.bins, center[0] - 0.6, y - 0.1, 1.9, 0.2)
+                full.append(up)
+                degraded.append(down)
+        draw.texts(rows, labels, fontsize=7, ha='left', va='center', color='white')
+        if full:
+            draw.lines(np.concatenate(full), color='white', linewidth=1.2)
+            draw.lines(np.concatenate(degraded), color='#FFEB3B', linewidth=1.2)
+
     # Internet Gateway
-    igw_box = Rectangle((9.2, 1.2), 1.6, 0.6, facecolor=aws_light_blue, edgecolor=aws_blue, linewidth=2)
-    ax.add_patch(igw_box)
-    ax.text(10, 1.5, 'Internet Gateway', fontsize=10, ha='center', va='center', color='white', fontweight='bold')
-    
+    igw = layout.igw_box
+    draw.rects([igw], facecolor=aws_light_blue, edgecolor=aws_blue, linewidth=2)
+    draw.texts([igw[:2] + igw[2:] / 2], ['Internet Gateway'], fontsize=10, ha='center', va='center',
+               color='white', fontweight='bold')
+
     # Internet (Cloud)
-    internet_points = np.array([[8.5, 0.5], [9.5, 0.8], [10.5, 0.8], [11.5, 0.5], 
-                               [11, 0.2], [10, 0.1], [9, 0.2]])
-    internet_cloud = Polygon(internet_points, facecolor='#E3F2FD', edgecolor=aws_light_blue, linewidth=2)
-    ax.add_patch(internet_cloud)
-    ax.text(10, 0.45, 'Internet', fontsize=12, ha='center', va='center', fontweight='bold', color=aws_blue)
-    
+    draw.polygon(layout.internet_xy + INTERNET_OUTLINE, facecolor='#E3F2FD',
+                 edgecolor=aws_light_blue, linewidth=2)
+    draw.texts([layout.internet_xy], ['Internet'], fontsize=12, ha='center', va='center',
+               fontweight='bold', color=aws_blue)
+
     # CloudWatch Logs
-    logs_box = FancyBboxPatch((1.5, 1.5), 4, 1.5, 
-                             boxstyle="round,pad=0.1", 
-                             facecolor='#FFF3E0', 
-                             edgecolor='#FF9800', 
-                             linewidth=2)
-    ax.add_patch(logs_box)
-    ax.text(3.5, 2.6, 'CloudWatch Logs', fontsize=12, ha='center', fontweight='bold', color='#E65100')
-    ax.text(3.5, 2.2, 'VPC Flow Logs', fontsize=10, ha='center', color='#E65100')
-    ax.text(3.5, 1.9, '/aws/vpc/flow-logs/', fontsize=9, ha='center', color='#E65100')
-    ax.text(3.5, 1.7, 'adv-net-lowcost', fontsize=9, ha='center', color='#E65100')
-    
+    draw.round_boxes([(1.5, 1.5, 4, 1.5)], facecolor='#FFF3E0', edgecolor='#FF9800', linewidth=2)
+    log_prefix, _, log_name = (topology.flow_log_group or '').rpartition('/')
+    draw.texts([(3.5, 2.6)], ['CloudWatch Logs'], fontsize=12, ha='center', fontweight='bold', color='#E65100')
+    draw.texts([(3.5, 2.2)], ['VPC Flow Logs'], fontsize=10, ha='center', color='#E65100')
+    draw.texts([(3.5, 1.9), (3.5, 1.7)], [log_prefix + '/', log_name], fontsize=9, ha='center', color='#E65100')
+
     # Connection Lines (Professional style)
     connection_color = aws_blue
     connection_width = 2
-    
-    # VPC to TGW connections
-    connections = [
-        # Shared VPC to TGW
-        ([4, 5.5], [8.5, 4.2]),
-        # App VPC to TGW  
-        ([10, 5.5], [10, 4.3]),
-        # OnPrem VPC to TGW
-        ([16.5, 5.5], [11.5, 4.2]),
-        # TGW to VPN
-        ([10.8, 3.5], [12.5, 3.5]),
-        # VPN to StrongSwan
-        ([15.5, 4.2], [15.5, 5.5]),
-        # IGW to Internet
-        ([10, 1.8], [10, 0.8]),
-        # Flow logs connections (dashed)
-        ([3.5, 3], [4, 5.5]),  # To Shared VPC
-        ([3.5, 3], [10, 5.5]), # To App VPC
-        ([3.5, 3], [16.5, 5.5]) # To OnPrem VPC
-    ]
-    
-    for i, (start, end) in enumerate(connections):
-        if i >= len(connections) - 3:  # Last 3 are flow log connections
-            ax.plot([start[0], end[0]], [start[1], end[1]], 
-                   color='#FF9800', linewidth=1.5, linestyle='--', alpha=0.7)
-        else:
-            ax.plot([start[0], end[0]], [start[1], end[1]], 
-                   color=connection_color, linewidth=connection_width)
-            
-            # Add arrows for main connections
-            if i < 4:
-                mid_x = (start[0] + end[0]) / 2
-                mid_y = (start[1] + end[1]) / 2
-                dx = end[0] - start[0]
-                dy = end[1] - start[1]
-                length = np.sqrt(dx**2 + dy**2)
-                dx_norm = dx / length * 0.2
-                dy_norm = dy / length * 0.2
-                
-                arrow = patches.FancyArrowPatch((mid_x - dx_norm, mid_y - dy_norm),
-                                              (mid_x + dx_norm, mid_y + dy_norm),
-                                              arrowstyle='->', mutation_scale=15,
-                                              color=connection_color, linewidth=2)
-                ax.add_patch(arrow)
-    
+
+    # Flow logs connections (dashed), one per VPC
+    spokes = layout.edges['spoke']
+    draw.lines(np.stack([np.broadcast_to([3.5, 3], spokes[:, 0].shape), spokes[:, 0]], axis=1),
+               color='#FF9800', linewidth=1.5, linestyle='--', alpha=0.7)
+
+    # VPC to TGW, TGW to VPN (arrowed), VPN to StrongSwan, IGW to Internet;
+    # left to the caller when it draws them itself, e.g. as a traffic overlay
+    if connections:
+        arrowed = np.concatenate([layout.edges['spoke'], layout.edges['vpn']])
+        plain = np.concatenate([layout.edges['customer_gateway'], layout.edges['internet']])
+        draw.lines(np.concatenate([arrowed, plain]), color=connection_color, linewidth=connection_width)
+        draw.mid_arrows(arrowed, color=connection_color, linewidth=2, mutation_scale=15)
+
     # Cost Optimization Callout
-    cost_box = FancyBboxPatch((16, 1.5), 3.5, 1.5, 
-                             boxstyle="round,pad=0.1", 
-                             facecolor='#E8F5E8', 
-                             edgecolor='#4CAF50', 
-                             linewidth=2)
-    ax.add_patch(cost_box)
-    ax.text(17.75, 2.6, 'Cost Optimized', fontsize=12, ha='center', fontweight='bold', color='#2E7D32')
-    ax.text(17.75, 2.2, '• No NAT Gateways', fontsize=9, ha='center', color='#2E7D32')
-    ax.text(17.75, 2.0, '• VPC Endpoints Only', fontsize=9, ha='center', color='#2E7D32')
-    ax.text(17.75, 1.8, '• t2.micro Instances', fontsize=9, ha='center', color='#2E7D32')
-    
-    plt.tight_layout()
+    cost_x = width - 4
+    draw.round_boxes([(cost_x, 1.5, 3.5, 1.5)], facecolor='#E8F5E8', edgecolor='#4CAF50', linewidth=2)
+    draw.texts([(cost_x + 1.75, 2.6)], ['Cost Optimized'], fontsize=12, ha='center',
+               fontweight='bold', color='#2E7D32')
+    draw.texts([(cost_x + 1.75, 2.2), (cost_x + 1.75, 2.0), (cost_x + 1.75, 1.8)],
+               ['• No NAT Gateways', '• VPC Endpoints Only', '• t2.micro Instances'],
+               fontsize=9, ha='center', color='#2E7D32')
+
+    draw.finish()
+    if draw.batched:
+        # Keep 1 data unit = 1 inch so point-sized glyphs and heads line up
+        fig.subplots_adjust(left=0, right=1, bottom=0, top=1)
+    else:
+        # Measures every text artist; the slow step for large per-artist diagrams
+        with profiling.phase('tight_layout'):
+            fig.tight_layout()
+    profiling.note_artists(fig)
     return fig
 
+
 if __name__ == "__main__":
-    fig = create_professional_diagram()
-    
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate the professional lab architecture diagram')
+    add_source_arguments(parser)
+    parser.add_argument('--layout', choices=['auto', 'grid', 'radial'], default='auto',
+                        help='VPC placement (default: grid, radial for large estates)')
+    parser.add_argument('--batched', action=argparse.BooleanOptionalAction, default=None,
+                        help='draw shapes as collections, or one artist per shape with --no-batched '
+                             '(default: collections for large estates)')
+    parser.add_argument('-o', '--out-dir', default='.',
+                        help='directory for the rendered diagrams (default: current directory)')
+    parser.add_argument('--vpn-telemetry', nargs='?', const=store_path(), default=None, metavar='STORE',
+                        help='draw tunnel uptime sparklines from a telemetry store written by '
+                             'advnet.vpntelemetry (default store: %(const)s)')
+    parser.add_argument('--vpn-window', type=float, default=None, metavar='HOURS',
+                        help='hours of telemetry in the sparklines (default: all stored)')
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args()
+    profiling.profile_from_args(args)
+    with profiling.phase('topology'):
+        topology = topology_from_args(args)
+    vpn_tunnels = None
+    if args.vpn_telemetry:
+        ring = TelemetryRing(args.vpn_telemetry, readonly=True)
+        vpn_tunnels = uptime_by_vpn(tunnel_uptime(ring, args.vpn_window and args.vpn_window * 3600))
+    fig = create_professional_diagram(topology, args.layout, args.batched, vpn_tunnels=vpn_tunnels)
+
     # Save high-resolution versions for presentations
-    plt.savefig('/home/nana/aws-adv-net-project/aws-architecture-professional.png', 
-                dpi=300, bbox_inches='tight', facecolor='white', edgecolor='none')
-    
-    plt.savefig('/home/nana/aws-adv-net-project/aws-architecture-professional.pdf', 
-                format='pdf', bbox_inches='tight', facecolor='white', edgecolor='none')
-    
+    with profiling.phase('savefig.png'):
+        plt.savefig(os.path.join(args.out_dir, 'aws-architecture-professional.png'),
+                    dpi=300, bbox_inches='tight', facecolor='white', edgecolor='none')
+
+    with profiling.phase('savefig.pdf'):
+        plt.savefig(os.path.join(args.out_dir, 'aws-architecture-professional.pdf'),
+                    format='pdf', bbox_inches='tight', facecolor='white', edgecolor='none')
+
     print("Professional architecture diagrams generated:")
     print("- aws-architecture-professional.png (300 DPI for presentations)")
     print("- aws-architecture-professional.pdf (vector format)")
-    
-    plt.show()
\ No newline at end of file
+    if profiling.enabled():
+        print("- %s (profile)" % profiling.write())
@@ -207,18 +207,28 @@ main() {
     echo "  StrongSwan ID: $STRONGSWAN_ID (IP: $STRONGSWAN_PRIVATE_IP)"
     echo ""
     
-    # Run tests
-    test_bastion_to_app
-    echo ""
-    
-    test_bastion_to_strongswan
-    echo ""
-    
-    test_vpn_status
-    echo ""
-    
-    check_tgw_routes
-    echo ""
+    # Run tests: concurrently through the Python runner when boto3 is
+    # available (results also written to $RESULTS_XML), else one by one
+    if python3 -c "import boto3" 2>/dev/null; then
+        OUTPUTS_JSON=$(mktemp)
+        terraform output -json > "$OUTPUTS_JSON"
+        python3 -m advnet.conntest "$OUTPUTS_JSON" --no-cache --region "$REGION" \
+            --junit "${RESULTS_XML:-connectivity-results.xml}" || print_warning "Some checks failed"
+        rm -f "$OUTPUTS_JSON"
+        echo ""
+    else
+        test_bastion_to_app
+        echo ""
+        
+        test_bastion_to_strongswan
+        echo ""
+        
+        test_vpn_status
+        echo ""
+        
+        check_tgw_routes
+        echo ""
+    fi
     
     run_reachability_test
     
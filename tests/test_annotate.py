@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+import advnet.annotate
+from advnet.annotate import Annotator, annotate_store
+from advnet.flowlogs import ingest
+from advnet.topology import (Route, RouteTable, Subnet, TgwAttachment, TgwRouteTable, Topology, TransitGateway, Vpc,
+                             VpnConnection, ip_to_int)
+
+
+def estate():
+    """VPC a with a public and a private subnet and an internet gateway, VPC
+    b without one, and a VPN advertising a summary and a more specific
+    prefix inside it; everything on one TGW route table"""
+    a = Vpc('vpc-a', 'a', 'A', '10.1.0.0/16', internet_gateway_id='igw-a')
+    a.subnets += [Subnet('subnet-pub', 'vpc-a', '10.1.0.0/24', name='public'),
+                  Subnet('subnet-priv', 'vpc-a', '10.1.1.0/24', name='private')]
+    a.route_tables += [
+        RouteTable('rtb-pub', 'vpc-a', routes=[Route('10.1.0.0/16', 'local', 'local'),
+                                               Route('0.0.0.0/0', 'gateway', 'igw-a')],
+                   subnet_ids=['subnet-pub']),
+        RouteTable('rtb-priv', 'vpc-a', routes=[Route('10.1.0.0/16', 'local', 'local'),
+                                                Route('172.16.0.0/12', 'transit_gateway', 'tgw-1'),
+                                                Route('10.0.0.0/8', 'transit_gateway', 'tgw-1')],
+                   subnet_ids=['subnet-priv'])]
+    b = Vpc('vpc-b', 'b', 'B', '10.2.0.0/16')
+    b.subnets.append(Subnet('subnet-b', 'vpc-b', '10.2.1.0/24', name='b'))
+    b.route_tables.append(RouteTable('rtb-b', 'vpc-b', routes=[Route('10.2.0.0/16', 'local', 'local'),
+                                                               Route('10.0.0.0/8', 'transit_gateway', 'tgw-1')],
+                                     subnet_ids=['subnet-b']))
+    attachments = ['tgw-attach-a', 'tgw-attach-b', 'tgw-attach-vpn']
+    tgw = TransitGateway('tgw-1', attachments=[TgwAttachment('tgw-attach-a', 'vpc', 'vpc-a'),
+                                               TgwAttachment('tgw-attach-b', 'vpc', 'vpc-b'),
+                                               TgwAttachment('tgw-attach-vpn', 'vpn', 'vpn-1')])
+    tgw.route_tables.append(TgwRouteTable('tgw-rtb', associations=list(attachments),
+                                          propagations=list(attachments)))
+    vpn = VpnConnection('vpn-1', 'tgw-1', 'tgw-attach-vpn', routes=['172.16.0.0/12', '172.16.5.0/24'])
+    return Topology(vpcs=[a, b], transit_gateways=[tgw], vpn_connections=[vpn])
+
+
+def addresses(*ips):
+    return np.array([ip_to_int(ip) for ip in ips], dtype=np.int64)
+
+
+def test_locate_places():
+    annotator = Annotator(estate())
+    labels = [annotator.labels[p] for p in annotator.locate(addresses(
+        '10.1.0.5', '10.1.1.9', '10.1.200.1', '10.2.1.1', '172.20.0.1', '172.16.5.9', '172.16.6.1', '8.8.8.8'))]
+    assert labels == ['public', 'private', 'A', 'b', 'vpn-1 172.16.0.0/12', 'vpn-1 172.16.5.0/24',
+                      'vpn-1 172.16.0.0/12', 'internet']
+
+
+def route(annotator, src, dst):
+    codes = annotator.annotate(addresses(src), addresses(dst))['route']
+    return annotator.routes[int(codes[0])]
+
+
+def test_routes_between_places():
+    annotator = Annotator(estate())
+    assert route(annotator, '10.1.1.9', '10.2.1.1') == 'private > rtb-priv > tgw-1 > tgw-rtb > tgw-attach-b > b'
+    assert route(annotator, '10.1.1.9', '172.16.5.9') == (
+        'private > rtb-priv > tgw-1 > tgw-rtb > tgw-attach-vpn > vpn-1 172.16.5.0/24')
+    assert route(annotator, '10.1.0.5', '8.8.8.8') == 'public > rtb-pub > igw-a > internet'
+    assert route(annotator, '10.2.1.1', '8.8.8.8') == 'b > rtb-b > no route'
+
+
+def test_routes_from_the_internet():
+    annotator = Annotator(estate())
+    assert route(annotator, '8.8.8.8', '10.1.0.5') == 'internet > igw-a > public'
+    # The private subnet has no route back out through the gateway
+    assert route(annotator, '8.8.8.8', '10.1.1.9') == 'internet > igw-a > dropped'
+    # No gateway in VPC b, and nothing in the topology between outside addresses
+    assert route(annotator, '8.8.8.8', '10.2.1.1') == 'internet > no route'
+    assert route(annotator, '8.8.8.8', '1.1.1.1') == 'internet > no route'
+    assert route(annotator, '8.8.8.8', '172.16.5.9') == 'internet > no route'
+
+
+@pytest.mark.parametrize('dense', [True, False])
+def test_route_codes_are_memoised(monkeypatch, dense):
+    if not dense:
+        monkeypatch.setattr(advnet.annotate, 'DENSE_LIMIT', 0)
+    annotator = Annotator(estate())
+    src = addresses('10.1.1.9', '10.1.0.5', '8.8.8.8', '10.1.1.10')
+    dst = addresses('10.2.1.1', '8.8.8.8', '10.1.0.5', '10.2.1.7')
+    first = annotator.route_codes(annotator.locate(src), annotator.locate(dst))
+    # Both private -> b records share one route
+    assert first[0] == first[3]
+    assert len(annotator.routes) == 3
+
+    def fail(src, dst):
+        raise AssertionError('resolved a pair twice')
+    monkeypatch.setattr(annotator, 'resolve', fail)
+    again = annotator.route_codes(annotator.locate(src[::-1]), annotator.locate(dst[::-1]))
+    assert again.tolist() == first[::-1].tolist()
+
+
+def test_annotate_store_is_cached_per_topology(tmp_path, monkeypatch):
+    lines = ['2 1 eni-1 10.1.1.9 10.2.1.1 49152 443 6 1 100 1700000000 1700000060 ACCEPT OK',
+             '2 1 eni-1 8.8.8.8 10.1.0.5 443 49152 6 1 200 1700000000 1700000060 ACCEPT OK',
+             '2 1 eni-1 10.2.1.1 172.20.0.1 0 0 1 1 300 1700000000 1700000060 REJECT OK']
+    path = tmp_path / 'flows.log'
+    path.write_text('\n'.join(lines) + '\n')
+    store = ingest([str(path)], cache_dir=str(tmp_path / 'cache'), jobs=1)
+
+    notes = annotate_store(store, estate(), chunk_rows=2)
+    assert len(notes) == 3
+    assert [notes.routes[code] for code in notes.route] == [
+        'private > rtb-priv > tgw-1 > tgw-rtb > tgw-attach-b > b', 'internet > igw-a > public',
+        'b > rtb-b > no route']
+    assert [notes.vpc_name(code) for code in notes.src_vpc] == ['A', 'external', 'B']
+    assert [notes.subnet_name(code) for code in notes.dst_subnet] == ['b', 'public', '-']
+
+    # A second run memory-maps the columns; a different topology does not
+    class Refuse(Annotator):
+        def __init__(self, *args, **kwargs):
+            raise AssertionError('annotated again')
+    monkeypatch.setattr(advnet.annotate, 'Annotator', Refuse)
+    cached = annotate_store(store, estate())
+    assert cached.path == notes.path
+    assert isinstance(cached.route, np.memmap)
+    with pytest.raises(AssertionError):
+        annotate_store(store, estate(), vpn_routes={'vpn-1': ['192.168.0.0/16']})
+    with pytest.raises(AssertionError):
+        annotate_store(store, estate(), use_cache=False)
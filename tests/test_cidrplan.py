@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+
+from advnet.cidrplan import EXIT_CONFLICTS, Prefix, PrefixIndex, config_prefixes, plan_report
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def conflicts(prefixes):
+    return sorted((c.severity, c.outer.cidr, c.inner.cidr) for c in PrefixIndex(prefixes).conflicts())
+
+
+def test_conflict_sweep():
+    prefixes = [
+        Prefix('10.1.0.0/16', 'vpc', 'a'), Prefix('10.1.1.0/24', 'subnet', 'a'),
+        Prefix('10.1.2.0/24', 'subnet', 'a'),
+        # b duplicates a: one error for the VPCs, none for their subnets
+        Prefix('10.1.0.0/16', 'vpc', 'b'), Prefix('10.1.1.0/24', 'subnet', 'b'),
+        Prefix('10.2.0.0/16', 'vpc', 'c'), Prefix('10.9.0.0/24', 'subnet', 'c'),
+        Prefix('10.0.0.0/12', 'reserved', '', 'spokes'),
+        Prefix('172.16.0.0/16', 'vpn', 'vpn-1'), Prefix('172.16.4.0/22', 'vpn', 'vpn-2'),
+    ]
+    assert conflicts(prefixes) == [
+        ('error', '10.1.0.0/16', '10.1.0.0/16'),
+        ('error', '10.1.1.0/24', '10.1.1.0/24'),
+        ('error', '10.9.0.0/24', '10.9.0.0/24'),
+        ('warning', '10.0.0.0/12', '10.1.0.0/16'),
+        ('warning', '10.0.0.0/12', '10.1.0.0/16'),
+        ('warning', '10.0.0.0/12', '10.1.1.0/24'),
+        ('warning', '10.0.0.0/12', '10.1.1.0/24'),
+        ('warning', '10.0.0.0/12', '10.1.2.0/24'),
+        ('warning', '10.0.0.0/12', '10.2.0.0/16'),
+        ('warning', '10.0.0.0/12', '10.9.0.0/24'),
+        ('warning', '172.16.0.0/16', '172.16.4.0/22'),
+    ]
+    reasons = {c.reason for c in PrefixIndex(prefixes).conflicts() if c.severity == 'error'}
+    assert 'subnet lies outside its VPC c' in reasons
+    assert 'vpc 10.1.0.0/16 (a) duplicates vpc 10.1.0.0/16 (b)' in reasons
+
+
+def test_simulated_on_premises_is_a_note():
+    prefixes = [Prefix('10.30.0.0/16', 'vpc', 'onprem'), Prefix('10.30.1.0/24', 'subnet', 'onprem'),
+                Prefix('10.30.0.0/16', 'vpn', 'vpn-1', 'on-premises', 'onprem'),
+                Prefix('10.30.0.0/16', 'vpn', 'vpn-2', 'on-premises')]
+    # Only the range nobody simulates clashes with the VPC and its subnet
+    found = sorted((c.severity, c.reason) for c in PrefixIndex(prefixes).conflicts())
+    assert found == [
+        ('error', 'vpc 10.30.0.0/16 (onprem) duplicates vpn 10.30.0.0/16 (on-premises)'),
+        ('error', 'vpn 10.30.0.0/16 (on-premises) contains subnet 10.30.1.0/24 (onprem)'),
+        ('note', 'on-premises range 10.30.0.0/16 is simulated by VPC onprem'),
+        ('warning', 'vpn 10.30.0.0/16 (on-premises) duplicates vpn 10.30.0.0/16 (on-premises)')]
+
+
+def test_free_blocks_and_utilization():
+    index = PrefixIndex([Prefix('10.0.0.0/16', 'vpc', 'a'), Prefix('10.1.0.0/17', 'vpc', 'b'),
+                         Prefix('10.2.0.0/16', 'vpn', 'vpn-1'), Prefix('10.0.0.0/24', 'subnet', 'a'),
+                         Prefix('10.0.2.0/23', 'subnet', 'a')])
+    assert index.free_blocks('10.0.0.0/8', 16, 3) == ['10.3.0.0/16', '10.4.0.0/16', '10.5.0.0/16']
+    assert index.free_blocks('10.0.0.0/8', 17, 2) == ['10.1.128.0/17', '10.3.0.0/17']
+    assert index.free_blocks('10.0.0.0/16', 24, 3, kinds={'subnet'}) == [
+        '10.0.1.0/24', '10.0.4.0/24', '10.0.5.0/24']
+    assert index.free_blocks('10.0.0.0/16', 22, kinds={'subnet'}) == ['10.0.4.0/22']
+    assert index.free_blocks('10.0.0.0/22', 23, kinds={'subnet'}) == []
+    assert index.utilization('10.0.0.0/16', kinds={'subnet'}) == (768, 65536, 17)
+
+    report = plan_report(index, '10.0.0.0/8', next_bits=[16, 24], count=1, inside='10.0.0.0/16')
+    assert report['suggestions'] == {'/16': {'within': '10.0.0.0/8', 'blocks': ['10.3.0.0/16']},
+                                     '/24': {'within': '10.0.0.0/16', 'blocks': ['10.0.1.0/24']}}
+    assert report['pool']['used'] == 65536 * 2 + 32768
+
+
+def test_literal_resources_in_configuration(tmp_path):
+    (tmp_path / 'main.tf').write_text('''
+variable "base" {
+  default = "10.5.0.0/16"
+}
+
+resource "aws_vpc" "edge" {
+  cidr_block = var.base
+  tags = {
+    Name = "edge"
+  }
+}
+
+resource "aws_subnet" "edge_a" {
+  vpc_id     = aws_vpc.edge.id
+  cidr_block = "10.5.1.0/24"
+}
+
+resource "aws_subnet" "computed" {
+  vpc_id     = aws_vpc.edge.id
+  cidr_block = cidrsubnet(var.base, 8, 2)
+}
+''')
+    prefixes = [(p.cidr, p.kind, p.owner) for p in config_prefixes(str(tmp_path))]
+    assert prefixes == [('10.5.0.0/16', 'vpc', 'edge'), ('10.5.1.0/24', 'subnet', 'edge')]
+    overridden = [(p.cidr, p.kind) for p in config_prefixes(str(tmp_path), {'base': '10.6.0.0/16'})]
+    assert overridden == [('10.6.0.0/16', 'vpc'), ('10.5.1.0/24', 'subnet')]
+
+
+def cidrplan(*args):
+    return subprocess.run([sys.executable, '-m', 'advnet.cidrplan'] + list(args), cwd=ROOT,
+                          capture_output=True, text=True, env=dict(os.environ, TF_VAR_app_cidr='10.20.0.0/16'))
+
+
+def test_exit_status_gates_deploys():
+    clean = cidrplan('--config', '.')
+    assert clean.returncode == 0, clean.stderr
+    # The app VPC moved onto the shared one
+    overlapping = cidrplan('--config', '.', '--var', 'app_cidr=10.10.0.0/16')
+    assert overlapping.returncode == EXIT_CONFLICTS
+    assert 'ERROR   vpc 10.10.0.0/16 (' in overlapping.stdout
+    # A reserved block only warns
+    reserved = cidrplan('--config', '.', '--reserve', '10.0.0.0/9=spokes')
+    assert reserved.returncode == 0
+    assert 'WARNING' in reserved.stdout
+
+    malformed = cidrplan('--config', '.', '--var', 'app_cidr')
+    assert malformed.returncode == 2
+    assert '--var app_cidr: expected NAME=VALUE' in malformed.stderr
@@ -0,0 +1,160 @@
+import asyncio
+import json
+from xml.etree import ElementTree
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from advnet.conntest import (Check, Result, Runner, _split, fan_out_check, json_report, junit_xml, ping_check,
+                             run_checks, tgw_routes_check, vpn_check)
+from advnet.topology import Instance
+
+REGION = 'us-east-1'
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'):
+        monkeypatch.setenv(name, 'testing')
+    with mock_aws():
+        yield
+
+
+class Recording(Runner):
+    """Counts API calls; optionally answers get_command_invocation with
+    canned output per instance"""
+
+    def __init__(self, outputs=None, **options):
+        super().__init__(region=REGION, poll=0.01, max_poll=0.05, **options)
+        self.calls = []
+        self.outputs = outputs
+
+    async def call(self, client, method, **kwargs):
+        self.calls.append(method)
+        if method == 'get_command_invocation' and self.outputs is not None:
+            return {'Status': 'Success', 'StatusDetails': 'Success',
+                    'StandardOutputContent': self.outputs.get(kwargs['InstanceId'], '')}
+        return await super().call(client, method, **kwargs)
+
+
+def collect(runner, checks):
+    async def main():
+        try:
+            return [result async for result in runner.run(checks)]
+        finally:
+            runner.close()
+    return {result.name: result for result in asyncio.run(main())}
+
+
+def fan_out(source='i-src', targets=('10.0.0.1', '10.0.0.2', '10.0.0.3')):
+    return fan_out_check(Instance(source, 'src', 'src', 'subnet-1', '10.0.0.9'),
+                         {address: 'host%d' % n for n, address in enumerate(targets)})
+
+
+def test_commands_are_sent_together_and_tracked_in_batches(aws):
+    runner = Recording()
+    checks = [ping_check('ping %d' % n, 'i-%d' % n, '10.0.0.%d' % n) for n in range(6)]
+    results = collect(runner, checks)
+    assert sorted(results) == ['ping %d' % n for n in range(6)]
+    assert all(result.ok for result in results.values())
+    assert runner.calls.count('send_command') == 6
+    # One listing per polling round covers every command; output once each
+    assert runner.calls.count('list_commands') < 6
+    assert runner.calls.count('get_command_invocation') == 6
+
+
+def test_fan_out_results_per_target(aws):
+    outputs = {'i-src': 'advnet-check 10.0.0.1 ok\nnoise\nadvnet-check 10.0.0.2 fail\n'}
+    results = collect(Recording(outputs), [fan_out()])
+    assert results['src -> host0 icmp'].status == 'passed'
+    assert results['src -> host1 icmp'].status == 'failed'
+    assert results['src -> host1 icmp'].message == '10.0.0.2 unreachable from i-src'
+    # The command succeeded but printed nothing for the third target
+    assert results['src -> host2 icmp'].status == 'error'
+
+
+def test_deadline_times_out_outstanding_commands(aws):
+    async def api(runner):
+        return 'passed', 'fine'
+    runner = Recording(deadline=0)
+    results = collect(runner, [ping_check('slow', 'i-1', '10.0.0.1'), fan_out(),
+                               Check('api', api=api)])
+    assert results['slow'].status == 'timeout'
+    assert results['slow'].message == 'no result within 0s'
+    assert {results['src -> host%d icmp' % n].status for n in range(3)} == {'timeout'}
+    assert results['api'].ok
+    # Cancelled on the way out (moto does not implement it; that is tolerated)
+    assert runner.calls.count('cancel_command') == 2
+    assert 'list_commands' not in runner.calls
+
+
+def test_send_failure_is_the_checks_result(aws):
+    class Unreachable:
+        def send_command(self, **kwargs):
+            raise ConnectionError('endpoint unreachable')
+    runner = Recording()
+    runner.ssm = Unreachable()
+    results = collect(runner, [ping_check('unsent', 'i-1', '10.0.0.1')])
+    assert results['unsent'].status == 'error'
+    assert results['unsent'].message == 'send-command failed: endpoint unreachable'
+
+
+def test_api_checks_against_moto(aws):
+    ec2 = boto3.client('ec2', region_name=REGION)
+    tgw = ec2.create_transit_gateway()['TransitGateway']['TransitGatewayId']
+    table = ec2.describe_transit_gateway_route_tables(
+        Filters=[{'Name': 'transit-gateway-id', 'Values': [tgw]}])['TransitGatewayRouteTables'][0]
+    vpc = ec2.create_vpc(CidrBlock='10.1.0.0/16')['Vpc']['VpcId']
+    subnet = ec2.create_subnet(VpcId=vpc, CidrBlock='10.1.1.0/24')['Subnet']['SubnetId']
+    attachment = ec2.create_transit_gateway_vpc_attachment(TransitGatewayId=tgw, VpcId=vpc, SubnetIds=[subnet])
+    ec2.create_transit_gateway_route(
+        DestinationCidrBlock='10.1.0.0/16', TransitGatewayRouteTableId=table['TransitGatewayRouteTableId'],
+        TransitGatewayAttachmentId=attachment['TransitGatewayVpcAttachment']['TransitGatewayAttachmentId'])
+    gateway = ec2.create_customer_gateway(BgpAsn=65000, PublicIp='198.51.100.1', Type='ipsec.1')
+    vpn = ec2.create_vpn_connection(CustomerGatewayId=gateway['CustomerGateway']['CustomerGatewayId'],
+                                    Type='ipsec.1', TransitGatewayId=tgw)['VpnConnection']['VpnConnectionId']
+
+    results, seconds = run_checks([tgw_routes_check(tgw, ['10.1.0.0/16']),
+                                   tgw_routes_check(tgw, ['10.1.0.0/16', '10.2.0.0/16']),
+                                   vpn_check(vpn), vpn_check('vpn-missing')], region=REGION)
+    statuses = [(result.status, result.message) for result in results]
+    assert ('passed', '1 active routes') in statuses
+    assert ('failed', 'no active route for 10.2.0.0/16') in statuses
+    # moto reports no tunnel telemetry, so no tunnel is up
+    assert ('failed', '0/0 tunnels up ()') in statuses
+    assert any(status == 'error' for status, _ in statuses)
+    assert seconds >= 0
+
+
+def test_split_reads_marker_lines():
+    check = fan_out()
+    output = ('advnet-check 10.0.0.1 ok\n'
+              'advnet-check 10.0.0.2 fail\n'
+              'advnet-check\n'
+              'other 10.0.0.3 ok\n')
+    results = {r.name: r for r in _split(check, 'passed', '', output, 1.5)}
+    assert [(r.status, r.seconds) for r in results.values()] == [('passed', 1.5), ('failed', 1.5), ('error', 1.5)]
+    assert results['src -> host2 icmp'].message == 'no result for 10.0.0.3 (passed)'
+    assert results['src -> host2 icmp'].output == output
+    # A target without a verdict takes the command's own failure
+    assert [r.status for r in _split(check, 'timeout', 'late', '', 2.0)] == ['timeout'] * 3
+
+
+def test_reports():
+    results = [Result('a', 'passed', 0.5, output='up'), Result('b', 'failed', 1.0, 'down', 'ping: 100% loss'),
+               Result('c', 'timeout', 2.0, 'late'), Result('d', 'error', 0.1)]
+    root = ElementTree.fromstring(junit_xml(results, 3.25))
+    assert (root.get('tests'), root.get('failures'), root.get('errors'), root.get('time')) == ('4', '1', '2', '3.250')
+    cases = root.findall('testcase')
+    assert [case.get('name') for case in cases] == ['a', 'b', 'c', 'd']
+    assert cases[0].find('system-out').text == 'up'
+    failure = cases[1].find('failure')
+    assert (failure.get('message'), failure.get('type'), failure.text) == ('down', 'failed', 'ping: 100% loss')
+    assert cases[2].find('error').get('type') == 'timeout'
+    assert cases[3].find('error').get('message') == 'error'
+
+    document = json.loads(json_report(results, 3.25))
+    assert document['seconds'] == 3.25
+    assert document['results'][1] == {'name': 'b', 'status': 'failed', 'seconds': 1.0, 'message': 'down',
+                                      'output': 'ping: 100% loss'}
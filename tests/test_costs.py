@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from advnet.costs import COMPONENTS, Inventory, evaluate, inventory, rank, scenario_grid
+from advnet.topology import lab_topology
+
+# The lab: three VPC attachments and one VPN on the TGW, six single-AZ
+# interface endpoints, three t2.micro instances, one public IP
+LAB = Inventory(vpc_attachments=3, vpns=1, tgw_vpns=1, endpoints=6, az_count=1, instances=3,
+                instance_rate=3 * 0.0116, public_ips=1, flow_log_gb=2.0)
+
+# Hand-computed monthly costs at 730 hours/month
+TGW = 4 * 0.05 * 730        # 146.00
+VPN = 0.05 * 730            # 36.50
+ENDPOINTS = 6 * 0.01 * 730  # 43.80
+INSTANCES = 3 * 0.0116 * 730  # 25.404
+PUBLIC_IP = 0.005 * 730     # 3.65
+FLOW_LOGS = 2 * 0.50        # 1.00
+TOTAL = TGW + VPN + ENDPOINTS + INSTANCES + PUBLIC_IP + FLOW_LOGS  # 256.354
+
+
+def totals(scenarios, inv=LAB):
+    return evaluate(inv, scenarios).sum(axis=1)
+
+
+def test_lab_inventory():
+    inv = inventory(lab_topology())
+    assert (inv.vpc_attachments, inv.vpns, inv.tgw_vpns, inv.attachments) == (3, 1, 1, 4)
+    assert (inv.endpoints, inv.instances, inv.public_ips) == (6, 3, 1)
+
+
+def test_baseline_components():
+    costs = evaluate(LAB, {})
+    assert costs.shape == (1, len(COMPONENTS))
+    assert costs[0] == pytest.approx([TGW, VPN, ENDPOINTS, INSTANCES, PUBLIC_IP, FLOW_LOGS])
+
+
+def test_removing_the_vpn_drops_its_attachment():
+    assert totals({'vpns': np.array([0.0, 2.0])}) == pytest.approx([TOTAL - 2 * VPN, TOTAL + 2 * VPN])
+
+
+def test_vpn_without_tgw_brings_no_attachment():
+    inv = Inventory(vpc_attachments=3, vpns=1, tgw_vpns=0)
+    costs = evaluate(inv, {'vpns': np.array([1.0, 3.0])})
+    assert costs[:, 0] == pytest.approx([3 * 36.5, 3 * 36.5])
+    assert costs[:, 1] == pytest.approx([VPN, 3 * VPN])
+
+
+def test_public_ips_capped_at_instances():
+    assert totals({'instances': np.array([0.0, 1.0])}) == pytest.approx(
+        [TOTAL - INSTANCES - PUBLIC_IP, TOTAL - INSTANCES * 2 / 3])
+    # More IPs than instances is not a thing either
+    assert totals({'public_ips': np.array([5.0])}) == pytest.approx([TOTAL + 2 * PUBLIC_IP])
+
+
+def test_schedule_scales_instances_and_ips():
+    duty = 12 / 24 * 5 / 7
+    assert totals({'instance_hours': np.array([12.0]), 'days': np.array([5.0])}) == pytest.approx(
+        [TOTAL - (INSTANCES + PUBLIC_IP) * (1 - duty)])
+
+
+def test_grid_and_rank():
+    scenarios = scenario_grid({'az_count': [1, 2, 3], 'endpoints': [0, 6]})
+    costs = evaluate(LAB, scenarios)
+    base = TOTAL - ENDPOINTS
+    expected = [base + 0.01 * 730 * e * az for az, e in zip(scenarios['az_count'], scenarios['endpoints'])]
+    assert costs.sum(axis=1) == pytest.approx(expected)
+    assert costs.sum(axis=1)[rank(costs, top=2)] == pytest.approx([base, base])
+    assert rank(costs, top=2, descending=True).tolist() == [5, 3]
+    # Ranking everything keeps grid order between ties
+    assert rank(costs, top=10).tolist() == [0, 2, 4, 1, 3, 5]
@@ -0,0 +1,68 @@
+import os
+import shutil
+
+import pytest
+
+import advnet.export
+from advnet.export import MANIFEST, PACKAGE_DIR, REPO_DIR, STYLES, export_diagrams, generator_sources, read_manifest
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    """A copy of the generator scripts and advnet modules that the export
+    hashes, so a test can edit them"""
+    repo = tmp_path / 'repo'
+    shutil.copytree(PACKAGE_DIR, str(repo / 'advnet'), ignore=shutil.ignore_patterns('__pycache__'))
+    for script, _, _ in STYLES.values():
+        shutil.copy(os.path.join(REPO_DIR, script), str(repo / script))
+    monkeypatch.setattr(advnet.export, 'REPO_DIR', str(repo))
+    monkeypatch.setattr(advnet.export, 'PACKAGE_DIR', str(repo / 'advnet'))
+    monkeypatch.setattr(advnet.export, '_sources', {})
+    return repo
+
+
+def export(out_dir, **options):
+    options = dict(dict(formats=('png',), styles=('simple',), dpi=20, jobs=1), **options)
+    return {os.path.basename(path): status for path, status, _ in export_diagrams(out_dir=str(out_dir), **options)}
+
+
+def test_second_export_is_fully_cached(sources, tmp_path, monkeypatch):
+    out = tmp_path / 'out'
+    assert export(out, formats=('png', 'svg')) == {'architecture-diagram.png': 'written',
+                                                   'architecture-diagram.svg': 'written'}
+    assert set(read_manifest(str(out))) == {'architecture-diagram.png', 'architecture-diagram.svg'}
+
+    def refuse(*args):
+        raise AssertionError('rendered an up-to-date output')
+    monkeypatch.setattr(advnet.export, 'render_output', refuse)
+    monkeypatch.setattr(advnet.export, 'lab_topology', refuse)
+    assert export(out, formats=('png', 'svg')) == {'architecture-diagram.png': 'cached',
+                                                   'architecture-diagram.svg': 'cached'}
+    # A new mtime alone does not count as a change
+    module = sources / 'advnet' / generator_sources('simple')[0]
+    os.utime(str(module), (1, 1))
+    assert set(export(out, formats=('png', 'svg')).values()) == {'cached'}
+
+
+def test_changed_module_or_options_invalidate(sources, tmp_path):
+    out = tmp_path / 'out'
+    export(out)
+    stamp = read_manifest(str(out))['architecture-diagram.png']
+
+    assert 'layout.py' in generator_sources('simple')
+    with open(str(sources / 'advnet' / 'layout.py'), 'a') as handle:
+        handle.write('\n# edited\n')
+    assert export(out) == {'architecture-diagram.png': 'written'}
+    assert read_manifest(str(out))['architecture-diagram.png'] != stamp
+
+    # A module the generator does not import leaves it alone
+    assert 'costs.py' not in generator_sources('simple')
+    with open(str(sources / 'advnet' / 'costs.py'), 'a') as handle:
+        handle.write('\n# edited\n')
+    assert export(out) == {'architecture-diagram.png': 'cached'}
+
+    assert export(out, dpi=30) == {'architecture-diagram.png': 'written'}
+    os.remove(str(out / 'architecture-diagram.png'))
+    assert export(out, dpi=30) == {'architecture-diagram.png': 'written'}
+    assert export(out, dpi=30, force=True) == {'architecture-diagram.png': 'written'}
+    assert os.path.exists(str(out / MANIFEST))
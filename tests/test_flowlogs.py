@@ -0,0 +1,132 @@
+import gzip
+
+import numpy as np
+import pytest
+
+from advnet.flowlogs import ACTIONS, COLUMNS, LOG_STATUSES, FlowLogStore, ingest, parse_chunk
+from advnet.topology import ip_to_int
+
+HEADER = 'version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes start end action log-status'
+
+RECORDS = [
+    '2 123456789012 eni-0a1b2c3d 10.20.1.15 10.10.1.20 49152 443 6 10 8400 1700000000 1700000060 ACCEPT OK',
+    '2 123456789012 eni-0a1b2c3d 10.10.1.20 10.20.1.15 443 49152 6 12 96000 1700000000 1700000060 ACCEPT OK',
+    '2 123456789012 eni-99ff00aa 203.0.113.7 10.20.1.15 51515 22 6 1 60 1700000030 1700000090 REJECT OK',
+    '2 123456789012 eni-99ff00aa 10.30.0.4 10.20.1.15 0 0 1 4 336 1700000030 1700000090 ACCEPT OK',
+    '2 123456789012 eni-0a1b2c3d - - - - - - - 1700000060 1700000120 - NODATA',
+    '2 123456789012 eni-77 - - - - - - - 1700000060 1700000120 - SKIPDATA',
+    '2 210987654321 eni-77 255.255.255.255 0.0.0.0 65535 1 17 18446744073709551 4294967295 1700000090 1700000150 REJECT OK',
+]
+
+
+def naive(lines):
+    """Reference parse with str.split, one record at a time"""
+    rows = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) != 14 or not parts[0].isdigit():
+            continue
+        number = [int(p) if p != '-' else 0 for p in parts[5:12]]
+        rows.append({
+            'version': int(parts[0]),
+            'account_id': int(parts[1]),
+            'interface': parts[2],
+            'srcaddr': ip_to_int(parts[3]) if parts[3] != '-' else 0,
+            'dstaddr': ip_to_int(parts[4]) if parts[4] != '-' else 0,
+            'srcport': number[0],
+            'dstport': number[1],
+            'protocol': number[2],
+            'packets': number[3],
+            'bytes': number[4],
+            'start': number[5],
+            'end': number[6],
+            'action': ACTIONS.index(parts[12]),
+            'log_status': LOG_STATUSES.index(parts[13]),
+        })
+    return rows
+
+
+def assert_matches(columns, interfaces, expected):
+    assert len(columns['srcaddr']) == len(expected)
+    for name in COLUMNS:
+        if name == 'interface':
+            got = [interfaces[code] for code in columns[name]]
+        else:
+            got = [int(value) for value in columns[name]]
+        assert got == [row[name] for row in expected], name
+
+
+def test_parse_chunk_matches_split():
+    lines = [HEADER] + RECORDS
+    columns, interfaces = parse_chunk(('\n'.join(lines) + '\n').encode())
+    assert_matches(columns, interfaces, naive(lines))
+
+
+def test_parse_chunk_nodata_rows_are_zero():
+    columns, interfaces = parse_chunk('\n'.join(RECORDS[4:6]).encode())
+    assert list(columns['log_status']) == [LOG_STATUSES.index('NODATA'), LOG_STATUSES.index('SKIPDATA')]
+    for name in ('srcaddr', 'dstaddr', 'srcport', 'dstport', 'protocol', 'packets', 'bytes', 'action'):
+        assert not columns[name].any(), name
+    assert list(columns['start']) == [1700000060, 1700000060]
+
+
+def test_parse_chunk_skips_malformed_and_tolerates_crlf_and_timestamps():
+    lines = ['garbage line', RECORDS[0] + '\r', '2023-11-14T22:13:20.000Z ' + RECORDS[1], RECORDS[2] + ' extra x']
+    columns, interfaces = parse_chunk('\n'.join(lines).encode())
+    assert_matches(columns, interfaces, naive(RECORDS[:2]))
+
+
+@pytest.mark.parametrize('ending', [' \n', '\t\n', ' \t \r\n', '\r\n\n', ' \n \n'])
+def test_parse_chunk_tolerates_trailing_whitespace(ending):
+    lines = [HEADER] + RECORDS
+    columns, interfaces = parse_chunk(ending.join(lines).encode() + ending.encode())
+    assert_matches(columns, interfaces, naive(lines))
+
+
+def test_parse_chunk_edge_values():
+    lines = [
+        '2 1 eni-a 0.0.0.0 255.255.255.255 0 65535 6 18446744073709551615 99999999 100000000 4294967295 ACCEPT OK',
+        '2 1 eni-b 256.1.1.1 1.2.3 0 0 6 1 1 1 1 ACCEPT OK',
+        '2 1 eni-c 1.2.3.4.5 1..3.4 0 0 6 1 1 1 1 ACCEPT OK',
+        '2 1 eni-d 1234.1.1.1 001.02.3.4 0 0 6 12a 1 1 1 ACCEPT OK',
+        '2 1 eni-0123456789abcdef0123 10.1.2.3 10.4.5.6 0 0 6 1 1 1 1 REJECT OK',
+    ]
+    columns, interfaces = parse_chunk('\n'.join(lines).encode())
+    assert list(columns['srcaddr']) == [0, 0, 0, 0, 0x0A010203]
+    assert list(columns['dstaddr']) == [0xFFFFFFFF, 0, 0, 0x01020304, 0x0A040506]
+    assert list(columns['packets']) == [18446744073709551615, 1, 1, 0, 1]
+    assert list(columns['bytes'][:1]) == [99999999]
+    assert list(columns['start'][:1]) == [100000000]
+    assert list(columns['end'][:1]) == [4294967295]
+    assert [interfaces[code] for code in columns['interface']] == [
+        'eni-a', 'eni-b', 'eni-c', 'eni-d', 'eni-0123456789abcdef0123']
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_ingest_round_trips_through_memmap(tmp_path, compress):
+    text = ('\n'.join([HEADER] + RECORDS * 50) + '\n').encode()
+    path = tmp_path / ('flows.log.gz' if compress else 'flows.log')
+    path.write_bytes(gzip.compress(text) if compress else text)
+    cache = tmp_path / 'cache'
+
+    store = ingest([str(path)], cache_dir=str(cache), jobs=1)
+    expected = naive(RECORDS * 50)
+    assert len(store) == len(expected)
+    assert isinstance(store.srcaddr, np.memmap)
+    assert_matches({name: store.column(name) for name in COLUMNS}, store.interfaces, expected)
+
+    reopened = FlowLogStore(store.path)
+    for name in COLUMNS:
+        assert np.array_equal(reopened.column(name), store.column(name))
+        assert reopened.column(name).dtype == COLUMNS[name]
+    # The second ingest is served from the store, not the text
+    assert ingest([str(path)], cache_dir=str(cache), jobs=1).path == store.path
+
+
+def test_store_mask(tmp_path):
+    path = tmp_path / 'flows.log'
+    path.write_text('\n'.join(RECORDS) + '\n')
+    store = ingest([str(path)], cache_dir=str(tmp_path / 'cache'), jobs=1)
+    assert int(store.mask(src='10.0.0.0/8').sum()) == 3
+    assert int(store.mask(action='reject').sum()) == 2
+    assert int(store.mask(dst='10.20.0.0/16', port=22).sum()) == 1
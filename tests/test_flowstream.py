@@ -0,0 +1,71 @@
+import numpy as np
+
+from advnet.flowstream import FlowStream, HeavyHitters, HyperLogLog, VpcIndex, describe_pair
+from advnet.topology import ip_to_int, lab_topology
+
+
+def record(src, dst, port, size, start, action='ACCEPT'):
+    return '2 123456789012 eni-1 %s %s 49152 %d 6 1 %d %d %d %s OK' % (src, dst, port, size, start, start + 60,
+                                                                    action)
+
+
+def flows(windows=3, start=1699999980):
+    """Per 60 s window: a heavy 10.1.1.10 -> 10.2.1.10 pair, background
+    traffic from 200 external hosts and, in the last window, a burst of
+    rejected SSH from one scanner"""
+    lines = []
+    for w in range(windows):
+        t = start + 60 * w
+        lines += [record('10.1.1.10', '10.2.1.10', 443, 50000, t + i % 60) for i in range(100)]
+        lines += [record('198.51.100.%d' % (i % 200), '10.1.1.10', 80, 100, t + i % 60) for i in range(1000)]
+        lines += [record('203.0.113.9', '10.1.1.10', 22, 60, t + 1, 'REJECT') for _ in range(2)]
+        if w == windows - 1:
+            lines += [record('203.0.113.9', '10.1.1.10', 22, 60, t + 5, 'REJECT') for _ in range(300)]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def test_heavy_hitters_keep_the_top_keys():
+    rng = np.random.default_rng(0)
+    keys = np.concatenate([rng.integers(1000, 1 << 40, 50000), np.repeat(np.arange(5), 2000)]).astype(np.uint64)
+    rng.shuffle(keys)
+    hitters = HeavyHitters(k=10, width=1 << 12)
+    for chunk in np.array_split(keys, 7):
+        hitters.add(chunk)
+    top = hitters.top(5)
+    assert sorted(key for key, _ in top) == [0, 1, 2, 3, 4]
+    # Count-min never undercounts
+    assert all(count >= 2000 for _, count in top)
+
+
+def test_hyperloglog_counts_within_a_few_percent():
+    hll = HyperLogLog(p=12, groups=2)
+    keys = np.arange(100000, dtype=np.uint64)
+    hll.add(keys, (keys % 2).astype(np.intp))
+    hll.add(keys[:1000], np.zeros(1000, dtype=np.intp))
+    assert np.allclose(hll.count(), [50000, 50000], rtol=0.05)
+
+
+def test_vpc_index_without_topology_is_all_external():
+    index = VpcIndex()
+    assert index.names == ['external']
+    assert index.lookup(np.array([ip_to_int('10.1.1.1')], dtype=np.uint32)).tolist() == [0]
+
+
+def test_stream_reports_windows_and_reject_spikes():
+    reports = list(FlowStream(lab_topology(), min_count=20).run([flows()]))
+    assert [r['records'] for r in reports] == [1102, 1102, 1402]
+    assert [r['start'] for r in reports] == [1699999980, 1700000040, 1700000100]
+    first = reports[0]
+    assert first['top_talkers'][0] == {'pair': '10.1.1.10 -> 10.2.1.10', 'bytes': 5000000}
+    assert abs(first['distinct_sources'] - 201) <= 5
+    assert not any(r['reject_spikes'] for r in reports[:2])
+    spikes = {s['key']: s['records'] for s in reports[2]['reject_spikes']}
+    assert spikes[describe_pair((ip_to_int('203.0.113.9') << 32) | ip_to_int('10.1.1.10'))] == 302
+    assert spikes['22/TCP'] == 302
+
+
+def test_parallel_parse_gives_the_same_reports():
+    data = flows(windows=4)
+    lines = data.splitlines(keepends=True)
+    blocks = [b''.join(lines[i:i + 500]) for i in range(0, len(lines), 500)]
+    assert list(FlowStream().run(blocks, jobs=2)) == list(FlowStream().run(blocks))
@@ -0,0 +1,128 @@
+import json
+import zipfile
+
+import pytest
+
+from advnet.plandiff import PlanDiff, affected_topology, describe, snapshots
+from advnet.topology import PlanUnavailable
+
+
+def resource(rtype, name, index, attributes):
+    return {'mode': 'managed', 'type': rtype, 'name': name,
+            'instances': [{'index_key': index, 'attributes': attributes}]}
+
+
+def state(vpcs, route_cidr=None, subnet_names=None, extra_endpoint=None, id_suffix=''):
+    """A TGW and a VPN, and per VPC: a subnet, a route table with a route to
+    the TGW, an instance, an SSM endpoint and a TGW attachment. id_suffix
+    changes every ID, as a replaced resource or a plan would."""
+    route_cidr, subnet_names = route_cidr or {}, subnet_names or {}
+    s = id_suffix
+    resources = [
+        resource('aws_ec2_transit_gateway', 'hub', None, {'id': 'tgw-1' + s}),
+        resource('aws_customer_gateway', 'cgw', None, {'id': 'cgw-1' + s, 'ip_address': '198.51.100.1'}),
+        resource('aws_vpn_connection', 'vpn', None, {'id': 'vpn-1' + s, 'customer_gateway_id': 'cgw-1' + s,
+                                                     'transit_gateway_id': 'tgw-1' + s}),
+    ]
+    for i in vpcs:
+        vpc, subnet, table = 'vpc-%d%s' % (i, s), 'subnet-%d%s' % (i, s), 'rtb-%d%s' % (i, s)
+        resources += [
+            resource('aws_vpc', 'spoke', i, {'id': vpc, 'cidr_block': '10.%d.0.0/16' % i,
+                                             'tags': {'Name': 'VPC %d' % i}}),
+            resource('aws_subnet', 'private', i, {'id': subnet, 'vpc_id': vpc, 'cidr_block': '10.%d.1.0/24' % i,
+                                                  'availability_zone': 'us-east-1a',
+                                                  'tags': {'Name': subnet_names.get(i, 'private %d' % i)}}),
+            resource('aws_route_table', 'private', i, {'id': table, 'vpc_id': vpc}),
+            resource('aws_route', 'to_tgw', i, {'id': 'r-%d%s' % (i, s), 'route_table_id': table,
+                                                'destination_cidr_block': route_cidr.get(i, '10.0.0.0/8'),
+                                                'transit_gateway_id': 'tgw-1' + s}),
+            resource('aws_instance', 'app', i, {'id': 'i-%d%s' % (i, s), 'subnet_id': subnet,
+                                                'private_ip': '10.%d.1.10' % i, 'instance_type': 't3.micro'}),
+            resource('aws_vpc_endpoint', 'ssm', i, {'id': 'vpce-%d%s' % (i, s), 'vpc_id': vpc,
+                                                    'service_name': 'com.amazonaws.us-east-1.ssm',
+                                                    'vpc_endpoint_type': 'Interface', 'subnet_ids': [subnet]}),
+            resource('aws_ec2_transit_gateway_vpc_attachment', 'spoke', i, {
+                'id': 'tgw-attach-%d%s' % (i, s), 'vpc_id': vpc, 'transit_gateway_id': 'tgw-1' + s,
+                'subnet_ids': [subnet]}),
+        ]
+    if extra_endpoint is not None:
+        i = extra_endpoint
+        resources.append(resource('aws_vpc_endpoint', 'ec2messages', i, {
+            'id': 'vpce-x%d%s' % (i, s), 'vpc_id': 'vpc-%d%s' % (i, s),
+            'service_name': 'com.amazonaws.us-east-1.ec2messages', 'vpc_endpoint_type': 'Interface',
+            'subnet_ids': ['subnet-%d%s' % (i, s)]}))
+    return {'version': 4, 'resources': resources, 'outputs': {}}
+
+
+def diff_of(tmp_path, before, after):
+    paths = []
+    for name, doc in (('before.tfstate', before), ('after.tfstate', after)):
+        path = tmp_path / name
+        path.write_text(json.dumps(doc))
+        paths.append(str(path))
+    return PlanDiff(*snapshots(paths))
+
+
+def actions(diff):
+    return {(c.action, c.node.address) for c in diff.changes}
+
+
+def test_identical_snapshots_have_no_changes(tmp_path):
+    diff = diff_of(tmp_path, state(range(4)), state(range(4)))
+    assert not diff
+    assert diff.changes == []
+
+
+def test_ids_are_compared_by_address(tmp_path):
+    # Every ID differs, every reference still points at the same address
+    assert not diff_of(tmp_path, state(range(4)), state(range(4), id_suffix='-new'))
+
+
+def test_added_changed_removed(tmp_path):
+    before = state([0, 1, 2, 3])
+    after = state([0, 1, 2, 4], route_cidr={1: '10.0.0.0/9'}, subnet_names={2: 'renamed'}, extra_endpoint=0)
+    diff = diff_of(tmp_path, before, after)
+
+    found = actions(diff)
+    assert ('changed', 'aws_route.to_tgw[1]') in found
+    assert ('changed', 'aws_subnet.private[2]') in found
+    assert ('added', 'aws_vpc_endpoint.ec2messages[0]') in found
+    assert ('added', 'aws_vpc.spoke[4]') in found
+    assert ('removed', 'aws_vpc.spoke[3]') in found
+    # Nothing else in VPCs 0-2 moved
+    assert {address for _, address in found if address.endswith(('[0]', '[1]', '[2]'))} == {
+        'aws_route.to_tgw[1]', 'aws_subnet.private[2]', 'aws_vpc_endpoint.ec2messages[0]'}
+    assert len(found) == 3 + 7 + 7
+
+    route = next(c for c in diff.changes if c.node.address == 'aws_route.to_tgw[1]')
+    assert route.attributes == ['destination_cidr_block']
+    assert route.node.vpc == 'aws_vpc.spoke[1]'
+
+    counts = diff.counts()
+    assert counts['vpc', 'added'] == counts['vpc', 'removed'] == 1
+    assert counts['attachment', 'added'] == counts['attachment', 'removed'] == 1
+    assert counts['route', 'changed'] == 1
+
+    assert diff.vpc_action('aws_vpc.spoke[4]') == 'added'
+    assert diff.vpc_action('aws_vpc.spoke[3]') == 'removed'
+    assert diff.vpc_action('aws_vpc.spoke[1]') == 'changed'
+    assert diff.vpc_action('aws_vpc.spoke[0]') == 'changed'
+    assert diff.vpc_action('aws_vpc.spoke[5]') is None
+    assert describe(diff.by_vpc['aws_vpc.spoke[1]']) == '~1 route'
+
+
+def test_affected_topology_keeps_changed_vpcs_only(tmp_path):
+    after = state([0, 1, 2, 4], route_cidr={1: '10.0.0.0/9'})
+    diff = diff_of(tmp_path, state([0, 1, 2, 3]), after)
+    shown = affected_topology(diff)
+    # The changed, added and removed VPCs; the removed one from the old snapshot
+    assert sorted(vpc.cidr for vpc in shown.vpcs) == ['10.1.0.0/16', '10.3.0.0/16', '10.4.0.0/16']
+
+
+def test_single_plan_without_terraform_is_refused(tmp_path, monkeypatch):
+    path = tmp_path / 'tfplan'
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('tfstate', json.dumps(state(range(2))))
+    monkeypatch.setenv('PATH', str(tmp_path))
+    with pytest.raises(PlanUnavailable):
+        snapshots([str(path)])
@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+
+from advnet.reachability import (NO_RETURN_ROUTE, NOT_ASSOCIATED, OK, SG_INGRESS, TGW_BLACKHOLE, TGW_NO_ROUTE,
+                                 PrefixIndex, Reachability)
+from advnet.topology import (Instance, Route, RouteTable, SecurityGroup, SecurityGroupRule, Subnet, TgwAttachment,
+                             TgwRouteTable, Topology, TransitGateway, Vpc, parse_documents)
+
+EGRESS = SecurityGroupRule('egress', '-1', 0, 65535, ['0.0.0.0/0'])
+
+
+def spoke(key, octet, ingress):
+    """A VPC with one subnet, one instance and a 10/8 route to the TGW"""
+    vpc_id = 'vpc-' + key
+    cidr = '10.%d.0.0/16' % octet
+    vpc = Vpc(vpc_id, key, key, cidr)
+    vpc.subnets.append(Subnet('subnet-' + key, vpc_id, '10.%d.1.0/24' % octet))
+    vpc.security_groups.append(SecurityGroup('sg-' + key, vpc_id, key, list(ingress) + [EGRESS]))
+    vpc.instances.append(Instance('i-' + key, key, key, 'subnet-' + key, '10.%d.1.10' % octet,
+                                  security_group_ids=['sg-' + key]))
+    vpc.route_tables.append(RouteTable('rtb-' + key, vpc_id, routes=[
+        Route(cidr, 'local'), Route('10.0.0.0/8', 'transit_gateway', 'tgw-1')], subnet_ids=['subnet-' + key]))
+    return vpc
+
+
+def hub(ingress=(), routes=(), associate=('tgw-attach-a', 'tgw-attach-b')):
+    """Two spokes on one TGW route table that both attachments propagate to"""
+    allow = [SecurityGroupRule('ingress', '-1', 0, 65535, ['10.0.0.0/8'])]
+    vpcs = [spoke('a', 1, ingress or allow), spoke('b', 2, ingress or allow)]
+    tgw = TransitGateway('tgw-1', attachments=[TgwAttachment('tgw-attach-a', 'vpc', 'vpc-a'),
+                                               TgwAttachment('tgw-attach-b', 'vpc', 'vpc-b')])
+    tgw.route_tables.append(TgwRouteTable('tgw-rtb-1', associations=list(associate),
+                                          propagations=['tgw-attach-a', 'tgw-attach-b'], routes=list(routes)))
+    return Topology(vpcs=vpcs, transit_gateways=[tgw])
+
+
+def verdict(reach, src, dst, probe='icmp'):
+    names = [e.name for e in reach.endpoints]
+    return int(reach.codes[reach.probes.index(probe), names.index(src), names.index(dst)])
+
+
+def test_prefix_index_longest_match_first():
+    index = PrefixIndex(['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '0.0.0.0/0', '10.1.0.0/16'])
+    addresses = np.array([0x0A010203, 0x0A010303, 0x0A020001, 0xC0A80101], dtype=np.int64)
+    # /24 beats /16 beats /8 beats the default route; a duplicate keeps the first entry
+    assert index.lookup(addresses).tolist() == [2, 1, 0, 3]
+    assert PrefixIndex(['10.1.0.0/16']).lookup(addresses).tolist() == [0, 0, -1, -1]
+
+
+def test_vpc_route_table_longest_match():
+    reach = Reachability(hub(), evaluate=False)
+    origin = ('vpc', 'vpc-a', 'rtb-a')
+    assert reach.trace(origin, 0x0A010105)[0][1:3] == ('10.1.0.0/16', 'local')
+    assert reach.trace(origin, 0x0A020105)[0][1:3] == ('10.0.0.0/8', 'tgw-1')
+    assert reach.trace(origin, 0xC0A80101) == [('rtb-a', None, None, None)]
+
+
+def test_reachable_through_tgw():
+    reach = Reachability(hub(), probes=['icmp', 'tcp/22'])
+    assert verdict(reach, 'a', 'b') == OK
+    assert verdict(reach, 'b', 'a', 'tcp/22') == OK
+
+
+def test_static_blackhole_beats_propagated_route():
+    reach = Reachability(hub(routes=[Route('10.2.0.0/16', 'blackhole')]))
+    assert verdict(reach, 'a', 'b') == TGW_BLACKHOLE
+    assert verdict(reach, 'b', 'a') == NO_RETURN_ROUTE
+    reason, hops = reach.explain(0, 1, 'icmp')
+    assert reason == 'TGW blackhole route'
+    assert hops[-1] == 'tgw-rtb-1: 10.2.1.10/32 matches 10.2.0.0/16 -> blackhole'
+
+
+def test_missing_tgw_route():
+    # c routes to the TGW but is not attached, so nothing propagates its CIDR
+    topology = hub()
+    topology.vpcs.append(spoke('c', 3, []))
+    reach = Reachability(topology)
+    assert verdict(reach, 'a', 'c') == TGW_NO_ROUTE
+    assert reach.trace(('tgw', 'tgw-1', 'tgw-attach-a'), 0x0A030101) == [('tgw-rtb-1', None, None, None)]
+
+
+def test_attachment_without_association():
+    reach = Reachability(hub(associate=['tgw-attach-a']))
+    assert verdict(reach, 'b', 'a') == NOT_ASSOCIATED
+    # Forward traffic gets there, the reply cannot leave b
+    assert verdict(reach, 'a', 'b') == NO_RETURN_ROUTE
+    assert reach.explain(1, 0, 'icmp')[1][-1] == 'tgw-attach-b is not associated with a TGW route table'
+
+
+@pytest.mark.parametrize('from_port, to_port, expected', [
+    (8, 0, OK),            # echo request, code 0
+    (-1, -1, OK),          # any type
+    (8, -1, OK),           # echo request, any code
+    (0, -1, SG_INGRESS),   # echo reply only
+    (3, 4, SG_INGRESS),    # destination unreachable
+])
+def test_icmp_rule_matches_type(from_port, to_port, expected):
+    rule = SecurityGroupRule('ingress', 'icmp', from_port, to_port, ['10.0.0.0/8'])
+    reach = Reachability(hub(ingress=[rule]), probes=['icmp', 'tcp/22'])
+    assert verdict(reach, 'a', 'b') == expected
+    # An ICMP rule never opens TCP
+    assert verdict(reach, 'a', 'b', 'tcp/22') == SG_INGRESS
+
+
+def test_parsed_icmp_rules_keep_type_and_code():
+    rules = [{'protocol': 'icmp', 'from_port': -1, 'to_port': -1, 'cidr_blocks': ['0.0.0.0/0']},
+             {'protocol': 'icmp', 'from_port': 8, 'to_port': 0, 'cidr_blocks': ['0.0.0.0/0']},
+             {'protocol': '-1', 'from_port': 0, 'to_port': 0, 'cidr_blocks': ['0.0.0.0/0']}]
+    state = {'version': 4, 'resources': [
+        {'mode': 'managed', 'type': 'aws_vpc', 'name': 'v',
+         'instances': [{'attributes': {'id': 'vpc-1', 'cidr_block': '10.1.0.0/16'}}]},
+        {'mode': 'managed', 'type': 'aws_security_group', 'name': 'sg',
+         'instances': [{'attributes': {'id': 'sg-1', 'vpc_id': 'vpc-1', 'ingress': rules, 'egress': []}}]}]}
+    group = parse_documents([('state', state)]).vpcs[0].security_groups[0]
+    assert [(r.protocol, r.from_port, r.to_port) for r in group.rules] == [
+        ('icmp', -1, -1), ('icmp', 8, 0), ('-1', 0, 65535)]
+
+
+def test_ipv6_and_prefix_list_routes_are_skipped():
+    def res(rtype, name, attributes):
+        return {'mode': 'managed', 'type': rtype, 'name': name, 'instances': [{'attributes': attributes}]}
+    state = {'version': 4, 'resources': [
+        res('aws_vpc', 'v', {'id': 'vpc-1', 'cidr_block': '10.1.0.0/16'}),
+        res('aws_subnet', 's', {'id': 'subnet-1', 'vpc_id': 'vpc-1', 'cidr_block': '10.1.1.0/24'}),
+        res('aws_internet_gateway', 'igw', {'id': 'igw-1', 'vpc_id': 'vpc-1'}),
+        res('aws_route_table', 'rt', {'id': 'rtb-1', 'vpc_id': 'vpc-1'}),
+        res('aws_route_table_association', 'a', {'id': 'rtbassoc-1', 'route_table_id': 'rtb-1',
+                                                 'subnet_id': 'subnet-1'}),
+        res('aws_route', 'v6', {'id': 'r-1', 'route_table_id': 'rtb-1', 'gateway_id': 'igw-1',
+                                'destination_ipv6_cidr_block': '::/0'}),
+        res('aws_route', 'pl', {'id': 'r-2', 'route_table_id': 'rtb-1', 'gateway_id': 'igw-1',
+                                'destination_prefix_list_id': 'pl-123'}),
+        res('aws_route', 'v4', {'id': 'r-3', 'route_table_id': 'rtb-1', 'gateway_id': 'igw-1',
+                                'destination_cidr_block': '0.0.0.0/0'}),
+    ]}
+    topology = parse_documents([('state', state)])
+    table = topology.vpcs[0].route_tables[0]
+    # The topology keeps every destination for diagrams
+    assert [r.destination for r in table.routes] == ['10.1.0.0/16', '::/0', 'pl-123', '0.0.0.0/0']
+    reach = Reachability(topology)
+    assert reach.trace(('vpc', 'vpc-1', 'rtb-1'), 0x08080808)[0][1:3] == ('0.0.0.0/0', 'igw-1')
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import shutil
+import stat
+import zipfile
+
+import pytest
+
+import advnet.topology
+from advnet.topology import (PlanUnavailable, Topology, VpnConnection, add_source_arguments, add_vpn_route_argument,
+                             inputs_hash, lab_topology, load_topology, read_document, vpn_routes_from_args)
+
+# (module, type, name, attributes) of a VPC module with one subnet and a
+# route table sending 10.0.0.0/8 to the transit gateway
+RESOURCES = [
+    ('', 'aws_ec2_transit_gateway', 'hub', {'id': 'tgw-1'}),
+    ('module.app_vpc', 'aws_vpc', 'this', {'id': 'vpc-1', 'cidr_block': '10.20.0.0/16', 'tags': {'Name': 'App'}}),
+    ('module.app_vpc', 'aws_subnet', 'private', {'id': 'subnet-1', 'vpc_id': 'vpc-1', 'cidr_block': '10.20.1.0/24',
+                                                 'availability_zone': 'us-east-1a'}),
+    ('module.app_vpc', 'aws_route_table', 'private', {'id': 'rtb-1', 'vpc_id': 'vpc-1'}),
+    ('module.app_vpc', 'aws_route', 'to_tgw', {'id': 'r-1', 'route_table_id': 'rtb-1',
+                                               'destination_cidr_block': '10.0.0.0/8', 'transit_gateway_id': 'tgw-1'}),
+]
+
+
+def tfstate(resources=RESOURCES):
+    return {'version': 4, 'outputs': {}, 'resources': [
+        {'mode': 'managed', 'module': module, 'type': rtype, 'name': name,
+         'instances': [{'attributes': dict(attributes)}]} if module else
+        {'mode': 'managed', 'type': rtype, 'name': name, 'instances': [{'attributes': dict(attributes)}]}
+        for module, rtype, name, attributes in resources]}
+
+
+def module_json(resources, drop=()):
+    """root_module of `terraform show -json`, leaving out the drop attributes
+    as a plan does for values known only after apply"""
+    root, children = {'resources': []}, {}
+    for module, rtype, name, attributes in resources:
+        address = '%s%s.%s' % (module + '.' if module else '', rtype, name)
+        entry = {'address': address, 'mode': 'managed', 'type': rtype, 'name': name,
+                 'values': {k: v for k, v in attributes.items() if k not in drop}}
+        if module:
+            children.setdefault(module, {'address': module, 'resources': []})['resources'].append(entry)
+        else:
+            root['resources'].append(entry)
+    root['child_modules'] = list(children.values())
+    return root
+
+
+def show_json(planned=False):
+    references = {'module_calls': {'app_vpc': {'module': {'resources': [
+        {'address': 'aws_subnet.private', 'expressions': {'vpc_id': {'references': ['aws_vpc.this.id']}}},
+        {'address': 'aws_route_table.private', 'expressions': {'vpc_id': {'references': ['aws_vpc.this.id']}}},
+        {'address': 'aws_route.to_tgw', 'expressions': {
+            'route_table_id': {'references': ['aws_route_table.private.id']}}}]}}}}
+    doc = {'format_version': '1.2', 'configuration': {'root_module': references},
+           'variables': {'region': {'value': 'eu-west-1'}}}
+    if planned:
+        # The subnet is new: its ID and the IDs it refers to are unknown
+        doc['planned_values'] = {'root_module': module_json(RESOURCES, drop=('id', 'vpc_id', 'route_table_id'))}
+        doc['prior_state'] = {'values': {'root_module': module_json(
+            [r for r in RESOURCES if r[1] != 'aws_subnet'])}}
+    else:
+        doc['values'] = {'root_module': module_json(RESOURCES)}
+    return doc
+
+
+def write(path, doc):
+    path.write_text(json.dumps(doc))
+    return str(path)
+
+
+def summary(topology):
+    vpc, = topology.vpcs
+    table, = vpc.route_tables
+    return (vpc.id, vpc.key, vpc.name, vpc.cidr, [(s.id, s.cidr) for s in vpc.subnets],
+            [(r.destination, r.target_type, r.target_id) for r in table.routes],
+            [tgw.id for tgw in topology.transit_gateways])
+
+
+def test_state_and_show_json_give_the_same_model(tmp_path):
+    state = write(tmp_path / 'terraform.tfstate', tfstate())
+    shown = write(tmp_path / 'show.json', show_json())
+    assert read_document(state)[0] == 'state'
+    assert read_document(shown)[0] == 'show'
+    from_state = load_topology([state], use_cache=False)
+    from_show = load_topology([shown], use_cache=False)
+    assert summary(from_state) == summary(from_show) == (
+        'vpc-1', 'app', 'App', '10.20.0.0/16', [('subnet-1', '10.20.1.0/24')],
+        [('10.20.0.0/16', 'local', 'local'), ('10.0.0.0/8', 'transit_gateway', 'tgw-1')], ['tgw-1'])
+    assert from_show.region == 'eu-west-1'
+
+
+def test_plan_resolves_unknown_ids_through_the_configuration(tmp_path):
+    topology = load_topology([write(tmp_path / 'plan.json', show_json(planned=True))], use_cache=False)
+    vpc, = topology.vpcs
+    # Known IDs come from the prior state, the new subnet is named by address
+    assert vpc.id == 'vpc-1'
+    assert [s.id for s in vpc.subnets] == ['module.app_vpc.aws_subnet.private']
+    assert [t.id for t in vpc.route_tables] == ['rtb-1']
+
+
+def test_unrecognised_documents(tmp_path):
+    outputs = write(tmp_path / 'outputs.json', {'vpc_id': {'value': 'vpc-1', 'type': 'string'}})
+    assert read_document(outputs) == ('outputs', {'vpc_id': {'value': 'vpc-1', 'type': 'string'}})
+    with pytest.raises(ValueError):
+        read_document(write(tmp_path / 'other.json', {'hello': 'world'}))
+
+
+def test_cache_hit_and_invalidation(tmp_path, monkeypatch):
+    cache = str(tmp_path / 'cache')
+    path = tmp_path / 'terraform.tfstate'
+    write(path, tfstate())
+    first = load_topology([str(path)], cache_dir=cache)
+    assert os.listdir(cache) == ['topology-%s.pickle' % inputs_hash([str(path)])]
+
+    parsed = []
+    parse = advnet.topology.parse_documents
+    monkeypatch.setattr(advnet.topology, 'parse_documents', lambda documents: parsed.append(1) or parse(documents))
+    assert summary(load_topology([str(path)], cache_dir=cache)) == summary(first)
+    assert parsed == []
+    # Parsed again without the cache, and after the contents change
+    load_topology([str(path)], cache_dir=cache, use_cache=False)
+    assert parsed == [1]
+    before = inputs_hash([str(path)])
+    module, rtype, name, attributes = RESOURCES[1]
+    write(path, tfstate(RESOURCES[:1] + [(module, rtype, name, dict(attributes, cidr_block='10.21.0.0/16'))]))
+    assert inputs_hash([str(path)]) != before
+    assert load_topology([str(path)], cache_dir=cache).vpcs[0].cidr == '10.21.0.0/16'
+    assert parsed == [1, 1]
+    assert len(os.listdir(cache)) == 2
+
+
+def test_inputs_hash_follows_contents_and_order(tmp_path):
+    a = write(tmp_path / 'a.json', tfstate())
+    b = write(tmp_path / 'b.json', {'vpc_id': {'value': 'vpc-1'}})
+    copy = write(tmp_path / 'copy.json', tfstate())
+    assert inputs_hash([a, b]) == inputs_hash([copy, b])
+    assert inputs_hash([a, b]) != inputs_hash([b, a])
+    assert inputs_hash([a]) != inputs_hash([a, b])
+
+
+def plan_archive(tmp_path):
+    path = tmp_path / 'tfplan'
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('tfstate', json.dumps(tfstate()))
+    return str(path)
+
+
+def fake_terraform(bin_dir, script):
+    bin_dir.mkdir()
+    terraform = bin_dir / 'terraform'
+    terraform.write_text('#!/bin/sh\n' + script)
+    terraform.chmod(terraform.stat().st_mode | stat.S_IEXEC)
+    return str(bin_dir)
+
+
+def test_plan_without_terraform_falls_back_uncached(tmp_path, monkeypatch, capsys):
+    plan, cache = plan_archive(tmp_path), str(tmp_path / 'cache')
+    monkeypatch.setenv('PATH', str(tmp_path / 'nowhere'))
+    with pytest.raises(PlanUnavailable, match='terraform is not installed'):
+        read_document(plan, require_plan=True)
+
+    # The prior state embedded in the archive, with a warning, and not cached
+    for _ in range(2):
+        topology = load_topology([plan], cache_dir=cache)
+        assert summary(topology)[0] == 'vpc-1'
+        assert 'using the prior state stored in the plan' in capsys.readouterr().err
+    assert not os.path.exists(cache) or os.listdir(cache) == []
+
+
+def test_plan_read_by_terraform_is_cached(tmp_path, monkeypatch, capsys):
+    plan, cache = plan_archive(tmp_path), str(tmp_path / 'cache')
+    write(tmp_path / 'shown.json', show_json())
+    script = '%s "%s"\n' % (shutil.which('cat'), tmp_path / 'shown.json')
+    monkeypatch.setenv('PATH', fake_terraform(tmp_path / 'bin', script))
+    assert load_topology([plan], cache_dir=cache).region == 'eu-west-1'
+    assert capsys.readouterr().err == ''
+    assert len(os.listdir(cache)) == 1
+
+
+def test_failing_terraform_show(tmp_path, monkeypatch):
+    plan = plan_archive(tmp_path)
+    monkeypatch.setenv('PATH', fake_terraform(
+        tmp_path / 'bin', "printf '\\342\\225\\267\\n\\342\\224\\202 Error: Failed to load plugin schemas\\n' >&2\n"
+                          "exit 1\n"))
+    with pytest.raises(PlanUnavailable, match='Error: Failed to load plugin schemas'):
+        read_document(plan, require_plan=True)
+    kind, doc = read_document(plan)
+    assert kind == 'state' and doc['version'] == 4
+
+
+def vpn_routes(topology, *argv):
+    parser = argparse.ArgumentParser()
+    add_source_arguments(parser, positional=False)
+    add_vpn_route_argument(parser)
+    return vpn_routes_from_args(parser, parser.parse_args(list(argv)), topology)
+
+
+def test_vpn_route_arguments(capsys):
+    topology = Topology(vpn_connections=[VpnConnection('vpn-1'), VpnConnection('vpn-2')])
+    assert vpn_routes(topology, '--vpn-route', '172.16.0.0/12', '--vpn-route', 'vpn-2=192.168.0.0/16',
+                      '--vpn-route', 'vpn-1=172.31.0.0/16') == {
+        'vpn-1': ['172.16.0.0/12', '172.31.0.0/16'], 'vpn-2': ['192.168.0.0/16']}
+    for topology, argv, error in (
+            (topology, ['--vpn-route', 'vpn-1'], 'expected [VPN_ID=]CIDR'),
+            (topology, ['--vpn-route', 'vpn-1=10.0.0.1'], 'expected [VPN_ID=]CIDR'),
+            (topology, ['--vpn-route', 'vpn-3=10.0.0.0/8'], 'no VPN connection vpn-3 (the topology has vpn-1, vpn-2)'),
+            (Topology(), ['--vpn-route', '10.0.0.0/8'], 'the topology has no VPN connection')):
+        with pytest.raises(SystemExit):
+            vpn_routes(topology, *argv)
+        assert error in capsys.readouterr().err
+    # The lab model's own VPN takes bare prefixes
+    lab = lab_topology()
+    assert vpn_routes(lab, '--terraform', 'x', '--vpn-route', '10.99.0.0/16') == {lab.vpn.id: ['10.99.0.0/16']}
@@ -0,0 +1,160 @@
+from datetime import datetime, timezone
+
+import boto3
+import numpy as np
+import pytest
+from moto import mock_aws
+
+import advnet.vpntelemetry
+from advnet.vpntelemetry import Collector, TelemetryRing, tunnel_uptime
+
+REGION = 'us-east-1'
+UP, DOWN = 1, 2
+
+
+def ring_at(tmp_path, slots=4, capacity=5):
+    return TelemetryRing(str(tmp_path / 'telemetry.ring'), slots, capacity)
+
+
+def test_ring_wraps_oldest_first(tmp_path):
+    ring = ring_at(tmp_path)
+    slot = ring.slot('vpn-1', '203.0.113.1', 1)
+    for when in range(1, 9):
+        ring.append([slot], when, [UP], [0], [when])
+    assert ring.table['written'][slot] == 8
+    assert ring.read(slot)['time'].tolist() == [4, 5, 6, 7, 8]
+    assert ring.read(slot)['routes'].tolist() == [4, 5, 6, 7, 8]
+    assert int(ring.header['polls'][0]) == 8
+    ring.close()
+
+    # The file keeps its geometry and contents; the size never grows
+    size = (tmp_path / 'telemetry.ring').stat().st_size
+    reopened = TelemetryRing(str(tmp_path / 'telemetry.ring'), slots=99, capacity=99, readonly=True)
+    assert (reopened.slots, reopened.capacity) == (4, 5)
+    assert reopened.tunnels() == [(slot, 'vpn-1', '203.0.113.1', 1)]
+    assert reopened.read(slot)['time'].tolist() == [4, 5, 6, 7, 8]
+    assert (tmp_path / 'telemetry.ring').stat().st_size == size
+    with pytest.raises(FileNotFoundError):
+        TelemetryRing(str(tmp_path / 'missing.ring'), readonly=True)
+
+
+def test_ring_partially_filled(tmp_path):
+    ring = ring_at(tmp_path)
+    slot = ring.slot('vpn-1', '203.0.113.1')
+    assert len(ring.read(slot)) == 0
+    ring.append([slot], 10, [DOWN], [0], [0])
+    assert ring.read(slot)['status'].tolist() == [DOWN]
+
+
+def test_slot_reuse_when_full(tmp_path):
+    ring = ring_at(tmp_path, slots=2)
+    a = ring.slot('vpn-1', 'a')
+    b = ring.slot('vpn-1', 'b')
+    assert ring.slot('vpn-1', 'a') == a and a != b
+    ring.append([a, b], 100, [UP, UP], [0, 0], [1, 1])
+    # Both tunnels answered the last poll, so a new one gets no slot
+    assert ring.slot('vpn-2', 'c') is None
+
+    ring.append([a], 200, [UP], [0], [1])
+    # b missed the poll at 200: its slot goes to c, starting empty
+    c = ring.slot('vpn-2', 'c', 2)
+    assert c == b
+    assert len(ring.read(c)) == 0
+    assert [t[1:] for t in ring.tunnels()] == [('vpn-1', 'a', 0), ('vpn-2', 'c', 2)]
+    assert len(ring) == 2
+    # c has no sample yet, a answered the last poll: nothing to give away
+    assert ring.slot('vpn-1', 'b') is None
+
+
+def test_tunnel_uptime_bins_and_flaps(tmp_path):
+    ring = ring_at(tmp_path, capacity=16)
+    one = ring.slot('vpn-1', '203.0.113.1', 1)
+    two = ring.slot('vpn-1', '203.0.113.2', 2)
+    statuses = [UP, UP, DOWN, DOWN, UP, UP, UP, UP]
+    for n, status in enumerate(statuses):
+        # Tunnel 2 reports nothing for the first half, then a status change
+        # between two UP polls (newer last-change time)
+        ring.append([one, two], 1000 + 60 * n, [status, 0 if n < 4 else UP], [0, 0 if n < 6 else 5000], [0, 0])
+
+    first, second = tunnel_uptime(ring, bins=4)
+    assert (first.tunnel, first.samples, first.status, first.flaps) == (1, 8, 'UP', 2)
+    assert first.uptime == pytest.approx(6 / 8)
+    assert first.bins.tolist() == [1.0, 0.0, 1.0, 1.0]
+    assert first.label == 'T1 75.0%'
+    assert (second.status, second.flaps, second.uptime) == ('UP', 2, 1.0)
+    assert np.isnan(second.bins[:2]).all() and second.bins[2:].tolist() == [1.0, 1.0]
+
+    # The last three minutes only
+    recent = tunnel_uptime(ring, window=180, bins=3)[0]
+    assert (recent.samples, recent.uptime, recent.flaps) == (3, 1.0, 0)
+
+
+def test_tunnel_uptime_without_samples(tmp_path):
+    ring = ring_at(tmp_path)
+    ring.slot('vpn-1', 'a', 1)
+    uptime, = tunnel_uptime(ring, bins=4)
+    assert (uptime.samples, uptime.uptime, uptime.status, uptime.label) == (0, None, 'n/a', 'T1 n/a')
+    assert np.isnan(uptime.bins).all()
+
+
+@pytest.fixture
+def ec2(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'):
+        monkeypatch.setenv(name, 'testing')
+    with mock_aws():
+        yield boto3.client('ec2', region_name=REGION)
+
+
+def vpn_connection(ec2, address):
+    gateway = ec2.create_customer_gateway(BgpAsn=65000, PublicIp=address, Type='ipsec.1')
+    tgw = ec2.create_transit_gateway()['TransitGateway']['TransitGatewayId']
+    return ec2.create_vpn_connection(CustomerGatewayId=gateway['CustomerGateway']['CustomerGatewayId'],
+                                     Type='ipsec.1', TransitGatewayId=tgw)['VpnConnection']['VpnConnectionId']
+
+
+def test_collector_polls_moto(ec2, tmp_path, monkeypatch):
+    first, second = vpn_connection(ec2, '198.51.100.1'), vpn_connection(ec2, '198.51.100.2')
+    ring = ring_at(tmp_path, slots=16)
+    collector = Collector(ring, region=REGION, log=lambda message: None)
+    # moto reports no tunnel telemetry: both tunnels of each connection are
+    # recorded with an unknown status
+    listed = sorted(c['VpnConnectionId'] for c in ec2.describe_vpn_connections()['VpnConnections']
+                    if c['State'] in ('pending', 'available'))
+    assert {first, second} <= set(listed)
+    assert collector.poll(now=1000) == 2 * len(listed)
+    assert sorted((t[1], t[3]) for t in ring.tunnels()) == [(vpn_id, n) for vpn_id in listed for n in (1, 2)]
+    assert {int(ring.read(slot)['status'][0]) for slot, _, _, _ in ring.tunnels()} == {0}
+    assert int(ring.header['last'][0]) == 1000
+
+    # Only the given ids, one call per batch
+    monkeypatch.setattr(advnet.vpntelemetry, 'BATCH_SIZE', 1)
+    calls = []
+    only = Collector(ring, region=REGION, vpn_ids=[second], log=lambda message: None)
+    only.ec2.meta.events.register('before-call.ec2.DescribeVpnConnections', lambda **kwargs: calls.append(1))
+    assert only.poll(now=1060) == 2
+    assert len(calls) == 1
+    assert [len(ring.read(slot)) for slot, vpn_id, _, _ in sorted(ring.tunnels()) if vpn_id == second] == [2, 2]
+
+
+def test_collector_logs_changes_and_full_store(ec2, tmp_path):
+    messages = []
+    ring = ring_at(tmp_path, slots=2)
+    collector = Collector(ring, region=REGION, log=messages.append)
+    changed = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def telemetry(*statuses):
+        return [{'VpnConnectionId': 'vpn-1', 'VgwTelemetry': [
+            {'OutsideIpAddress': '203.0.113.%d' % n, 'Status': status, 'LastStatusChange': changed,
+             'AcceptedRouteCount': 3} for n, status in enumerate(statuses, 1)]}]
+
+    collector.describe = lambda: telemetry('UP', 'UP')
+    assert collector.poll(now=1000) == 2
+    collector.describe = lambda: telemetry('UP', 'DOWN', 'UP')
+    assert collector.poll(now=1060) == 2
+    collector.poll(now=1120)
+    assert [m.split('  ', 1)[-1] for m in messages] == [
+        'vpn-1 203.0.113.2 UP -> DOWN', 'no free slot for vpn-1 203.0.113.3 (store holds 2 tunnels)']
+    samples = ring.read(ring.slot('vpn-1', '203.0.113.2'))
+    assert samples['status'].tolist() == [UP, DOWN, DOWN]
+    assert samples['changed'].tolist() == [int(changed.timestamp())] * 3
+    assert samples['routes'].tolist() == [3, 3, 3]